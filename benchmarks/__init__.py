@@ -0,0 +1 @@
+"""Benchmarks for the httpkit proxy."""
@@ -0,0 +1,123 @@
+"""Benchmark the raw ASGI fast path against the FastAPI proxy routes.
+
+Both applications are driven in-process with synthetic ASGI messages, and the
+upstream is an ``httpx.MockTransport``, so the numbers isolate the per-request
+cost of routing, request parsing and response handling inside the proxy.
+
+Usage:
+    python benchmarks/bench_fast_path.py [--requests 20000] [--concurrency 32]
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from httpkit.tools import asgi_proxy, proxy
+from httpkit.tools.limits import ConcurrencyLimiter
+
+UPSTREAM_BODY = b'{"status": "healthy"}'
+
+
+def upstream_handler(request: httpx.Request) -> httpx.Response:
+    """Answer every upstream request with a small JSON body."""
+    return httpx.Response(200, headers={"content-type": "application/json"}, content=UPSTREAM_BODY)
+
+
+def make_scope(path: str) -> dict:
+    """Build the ASGI scope uvicorn would produce for ``GET path``."""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"param=value",
+        "root_path": "",
+        "headers": [
+            (b"host", b"localhost:8000"),
+            (b"user-agent", b"bench/1.0"),
+            (b"accept", b"application/json"),
+            (b"x-request-id", b"0123456789abcdef"),
+        ],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+
+
+async def call(app, path: str) -> int:
+    """Run one request through ``app`` and return the response status."""
+    status = 0
+    request_sent = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif not message.get("more_body", False):
+            finished.set()
+
+    await app(make_scope(path), receive, send)
+    return status
+
+
+async def run(app, path: str, total: int, concurrency: int) -> float:
+    """Send ``total`` requests with ``concurrency`` workers and return requests/sec."""
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            assert await call(app, path) == 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return total / (time.perf_counter() - start)
+
+
+async def main_async(args):
+    proxy.http_client = httpx.AsyncClient(transport=httpx.MockTransport(upstream_handler))
+    proxy.request_limiter = ConcurrencyLimiter(proxy.MAX_CONCURRENT_REQUESTS)
+
+    targets = [
+        ("fastapi routes", proxy.app, "/proxy/upstream.local:80/api/health"),
+        ("fast path", asgi_proxy.app, "/proxy/upstream.local:80/api/health"),
+        ("fastapi routes (scheme)", proxy.app, "/proxy/http://upstream.local:80/api/health"),
+        ("fast path (scheme)", asgi_proxy.app, "/proxy/http://upstream.local:80/api/health"),
+    ]
+    results = {}
+    for name, app, path in targets:
+        # Warm up code paths and the connection pool before measuring
+        await run(app, path, min(1000, args.requests), args.concurrency)
+        results[name] = await run(app, path, args.requests, args.concurrency)
+        print(f"{name:<26} {results[name]:>10.0f} req/s")
+
+    for variant in ("", " (scheme)"):
+        speedup = results[f"fast path{variant}"] / results[f"fastapi routes{variant}"]
+        print(f"speedup{variant}: {speedup:.2f}x")
+
+    await proxy.http_client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000, help="Requests per target (default: 20000)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent in-flight requests (default: 32)")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
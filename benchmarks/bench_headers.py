@@ -0,0 +1,114 @@
+"""Benchmark the per-request cost of filtering request and response headers.
+
+Compares the raw byte-pair pipeline (:func:`proxy.filter_request_headers` and
+:func:`proxy.filter_response_headers`) against the previous one, which decoded
+every header into a dict and matched lowercased names against lists. The
+headers are those of a typical browser request and API response; the
+response carries three ``Set-Cookie`` headers, which the dict pipeline merged
+into one.
+
+Usage:
+    python benchmarks/bench_headers.py [--iterations 100000]
+"""
+
+import argparse
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+
+from httpkit.tools import proxy
+
+REQUEST_HEADERS: List[Tuple[bytes, bytes]] = [
+    (b"host", b"localhost:8000"),
+    (b"connection", b"keep-alive"),
+    (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"),
+    (b"accept", b"text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"),
+    (b"accept-encoding", b"gzip, deflate, br"),
+    (b"accept-language", b"en-US,en;q=0.9"),
+    (b"cache-control", b"no-cache"),
+    (b"cookie", b"session=0123456789abcdef; theme=dark; consent=yes"),
+    (b"referer", b"https://example.com/dashboard"),
+    (b"sec-fetch-dest", b"document"),
+    (b"sec-fetch-mode", b"navigate"),
+    (b"sec-fetch-site", b"same-origin"),
+    (b"x-request-id", b"0123456789abcdef0123456789abcdef"),
+    (b"x-forwarded-for", b"203.0.113.7"),
+]
+
+RESPONSE_HEADERS: List[Tuple[bytes, bytes]] = [
+    (b"Date", b"Mon, 02 Jan 2026 10:00:00 GMT"),
+    (b"Server", b"nginx/1.25.3"),
+    (b"Content-Type", b"application/json; charset=utf-8"),
+    (b"Content-Length", b"1234"),
+    (b"Connection", b"keep-alive"),
+    (b"Keep-Alive", b"timeout=5"),
+    (b"Cache-Control", b"private, max-age=0"),
+    (b"ETag", b'"33a64df551425fcc55e4d42a148795d9f25f89d4"'),
+    (b"Vary", b"Accept-Encoding, Cookie"),
+    (b"Set-Cookie", b"session=0123456789abcdef; Path=/; HttpOnly; Secure"),
+    (b"Set-Cookie", b"theme=dark; Path=/; Max-Age=31536000"),
+    (b"Set-Cookie", b"consent=yes; Path=/; Max-Age=31536000"),
+    (b"X-Request-Id", b"0123456789abcdef0123456789abcdef"),
+    (b"Strict-Transport-Security", b"max-age=63072000; includeSubDomains"),
+]
+
+# The header lists and functions the dict pipeline used
+LEGACY_HOP_BY_HOP_HEADERS = [
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host",
+]
+LEGACY_UNSAFE_RESPONSE_HEADERS = ["content-length", "content-encoding", "transfer-encoding", "connection", "server"]
+
+
+def legacy_filter_request_headers(raw_headers: List[Tuple[bytes, bytes]]) -> Dict[str, str]:
+    headers = {}
+    for name, value in raw_headers:
+        key = name.decode("latin-1")
+        if key.lower() not in LEGACY_HOP_BY_HOP_HEADERS:
+            headers[key] = value.decode("latin-1")
+    return headers
+
+
+def legacy_filter_response_headers(response: httpx.Response) -> Dict[str, str]:
+    return {k: v for k, v in response.headers.items() if k.lower() not in LEGACY_UNSAFE_RESPONSE_HEADERS}
+
+
+def legacy_request(response: httpx.Response):
+    legacy_filter_request_headers(REQUEST_HEADERS)
+    headers = legacy_filter_response_headers(response)
+    # starlette re-encoded the dict into raw headers
+    return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
+
+
+def raw_request(response: httpx.Response):
+    proxy.filter_request_headers(REQUEST_HEADERS)
+    return proxy.filter_response_headers(response)
+
+
+def measure(function, response: httpx.Response, iterations: int) -> float:
+    """Return the nanoseconds ``function`` takes per request."""
+    for _ in range(min(1000, iterations)):
+        function(response)
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        function(response)
+    return (time.perf_counter_ns() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100000, help="Requests per variant (default: 100000)")
+    args = parser.parse_args()
+
+    response = httpx.Response(200, headers=RESPONSE_HEADERS)
+    results = {}
+    for name, function in (("dict headers", legacy_request), ("raw headers", raw_request)):
+        results[name] = measure(function, response, args.iterations)
+        set_cookies = sum(1 for key, _ in function(response) if key == b"set-cookie")
+        print(f"{name:<14} {results[name]:>8.0f} ns/request  ({set_cookies} Set-Cookie forwarded)")
+    print(f"speedup: {results['dict headers'] / results['raw headers']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
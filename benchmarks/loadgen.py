@@ -0,0 +1,149 @@
+"""Async HTTP/1.1 load generator for the benchmark suite.
+
+A fixed number of keep-alive connections each send requests back to back, so
+the offered concurrency stays constant for the whole run. Requests are written
+and responses parsed directly on asyncio streams, which keeps the client's own
+overhead far below the proxy's and makes the numbers repeatable.
+"""
+
+import asyncio
+import time
+from typing import List, Optional, Tuple
+
+
+class LoadResult:
+    """Latencies and counters collected by :func:`run_load`."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.bytes_received = 0
+        self.elapsed = 0.0
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def rps(self) -> float:
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, q: float) -> float:
+        """Return the ``q`` quantile (0-1) of the latencies in seconds, nearest-rank."""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.5) - 1))
+        return ordered[index]
+
+
+class Connection:
+    """A keep-alive HTTP/1.1 client connection that reconnects when the server closes it."""
+
+    def __init__(self, host: str, port: int, uds: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.uds = uds
+        self.authority = "localhost" if uds else f"{host}:{port}"
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: bytes = b"") -> Tuple[int, int]:
+        """Send one request and read the whole response; return its status and body size."""
+        if self.writer is None:
+            if self.uds:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.uds)
+            else:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        head = (
+            f"{method} {path} HTTP/1.1\r\nHost: {self.authority}\r\n"
+            "User-Agent: httpkit-bench\r\nAccept-Encoding: gzip\r\n"
+        )
+        if body or method in ("POST", "PUT", "PATCH"):
+            head += f"Content-Length: {len(body)}\r\n"
+        self.writer.write(head.encode("latin-1") + b"\r\n" + body)
+
+        header_block = await self.reader.readuntil(b"\r\n\r\n")
+        lines = header_block.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        received = 0
+        if "content-length" in headers:
+            received = len(await self.reader.readexactly(int(headers["content-length"])))
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            while True:
+                size = int((await self.reader.readline()).split(b";", 1)[0], 16)
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while (await self.reader.readline()) not in (b"\r\n", b""):
+                        pass
+                    break
+                received += len(await self.reader.readexactly(size + 2)) - 2
+        elif status not in (204, 304):
+            received = len(await self.reader.read())
+            headers["connection"] = "close"
+
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, received
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+            self.reader = self.writer = None
+
+
+async def run_load(
+    host: str,
+    port: int,
+    path: str,
+    concurrency: int,
+    duration: float,
+    method: str = "GET",
+    body: bytes = b"",
+    uds: Optional[str] = None,
+) -> LoadResult:
+    """
+    Keep ``concurrency`` requests in flight against ``host:port`` for ``duration`` seconds.
+
+    With ``uds``, connections go to that Unix domain socket instead.
+
+    Responses with a 5xx status and failed requests are counted as errors and
+    excluded from the latency sample.
+    """
+    result = LoadResult()
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        connection = Connection(host, port, uds)
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    status, received = await connection.request(method, path, body)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    result.errors += 1
+                    await connection.close()
+                    continue
+                if status >= 500:
+                    result.errors += 1
+                    continue
+                result.latencies.append(time.perf_counter() - started)
+                result.bytes_received += received
+        finally:
+            await connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    return result
@@ -0,0 +1,420 @@
+"""End-to-end benchmark suite for the proxy.
+
+For every scenario and concurrency level, a fresh proxy process is started in
+front of the local upstream stub (:mod:`benchmarks.upstream`) and driven by
+the load generator (:mod:`benchmarks.loadgen`) for a fixed duration. Each run
+reports requests/sec, p50/p99/p999 latency, the proxy's peak RSS and its CPU
+time per request and per MB sent to clients. Peak RSS and CPU are read from
+``/proc`` and are only available on Linux.
+
+The ``gzip`` and ``gzip-passthrough`` scenarios proxy the same gzip-encoded
+upstream body with and without decoding it, and ``compress`` has the proxy
+compress an uncompressed text body itself.
+
+``--engines`` runs every scenario on several server engines (event loop and
+HTTP parser) and upstream transports, to compare their throughput in MB/s and
+their CPU time per request. Results of engines other than ``auto`` are keyed
+``scenario@concurrency/engine``.
+
+``--sockets tcp,unix`` runs every scenario a second time with the load
+generator, the proxy and the upstream stub talking over Unix domain sockets
+instead of loopback TCP, to compare their latency. Those results are keyed
+``scenario@concurrency/unix`` (after the engine, if any).
+
+Results are written as JSON. Passing ``--baseline`` compares them against a
+stored result file and exits with status 1 if any run regressed by more than
+the tolerances.
+
+Usage:
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --scenarios small,sse --concurrency 1,64 --fast-path
+    python -m benchmarks.suite --baseline benchmarks/baseline.json
+    python -m benchmarks.suite --http2   # requires the bench extra (hypercorn, h2)
+    python -m benchmarks.suite --scenarios small,large --engines asyncio,asyncio-raw,uvloop,uvloop-raw
+    python -m benchmarks.suite --scenarios small,latency --sockets tcp,unix
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import quote
+
+from benchmarks.loadgen import run_load
+
+# name -> (method, upstream query string, request body size)
+SCENARIOS: Dict[str, Tuple[str, str, int]] = {
+    "small": ("GET", "size=64", 0),
+    "large": ("GET", "size=1048576", 0),
+    "chunked": ("GET", "size=65536&chunks=16", 0),
+    "latency": ("GET", "size=1024&latency=0.05", 0),
+    "sse": ("GET", "size=64&events=20&interval=0.005", 0),
+    "upload": ("POST", "size=64", 65536),
+    "gzip": ("GET", "size=1048576&encoding=gzip", 0),
+    "gzip-passthrough": ("GET", "size=1048576&encoding=gzip", 0),
+    "compress": ("GET", "size=1048576&text=1", 0),
+}
+DEFAULT_SCENARIOS = ["small", "large", "chunked", "latency", "sse", "upload", "gzip", "gzip-passthrough", "compress"]
+
+# Proxy settings a scenario runs with, on top of the environment
+SCENARIO_ENV: Dict[str, Dict[str, str]] = {
+    "gzip-passthrough": {"HTTPKIT_ENCODING_PASSTHROUGH": "1"},
+    "compress": {"HTTPKIT_COMPRESS_RESPONSES": "1"},
+}
+DEFAULT_CONCURRENCY = [1, 16, 64]
+
+# name -> (uvicorn options, proxy settings) of the engines --engines can compare
+ENGINES: Dict[str, Tuple[List[str], Dict[str, str]]] = {
+    "auto": ([], {}),
+    "asyncio": (["--loop", "asyncio", "--http", "h11"], {"HTTPKIT_ENGINE": "asyncio"}),
+    "uvloop": (["--loop", "uvloop", "--http", "httptools"], {"HTTPKIT_ENGINE": "uvloop"}),
+    "asyncio-raw": (
+        ["--loop", "asyncio", "--http", "h11"], {"HTTPKIT_ENGINE": "asyncio", "HTTPKIT_UPSTREAM_TRANSPORT": "raw"},
+    ),
+    "uvloop-raw": (
+        ["--loop", "uvloop", "--http", "httptools"], {"HTTPKIT_ENGINE": "uvloop", "HTTPKIT_UPSTREAM_TRANSPORT": "raw"},
+    ),
+}
+
+# How the load generator, the proxy and the upstream stub are connected
+SOCKETS = ("tcp", "unix")
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def connect(address: Union[int, str]) -> socket.socket:
+    """Connect to a port on 127.0.0.1, or to a Unix domain socket path."""
+    if isinstance(address, int):
+        return socket.create_connection(("127.0.0.1", address), timeout=0.2)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def wait_for_port(address: Union[int, str], process: subprocess.Popen, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with status {process.returncode}")
+        try:
+            with connect(address):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"{process.args} did not start listening on {address}")
+
+
+@contextmanager
+def serve(args: List[str], address: Union[int, str], env: Optional[Dict[str, str]] = None) -> Iterator[subprocess.Popen]:
+    """Run a server subprocess, listening on a port or a Unix socket path, until the block exits."""
+    process = subprocess.Popen([sys.executable, *args], env=env)
+    try:
+        wait_for_port(address, process)
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """Return the user + system CPU time of a process, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def peak_rss_bytes(pid: int) -> Optional[int]:
+    """Return the peak resident set size of a process, or None where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+@contextmanager
+def self_signed_certificate() -> Iterator[Tuple[str, str]]:
+    """Create a throwaway certificate for 127.0.0.1 with the openssl CLI."""
+    with tempfile.TemporaryDirectory(prefix="httpkit-bench-") as directory:
+        certfile = os.path.join(directory, "cert.pem")
+        keyfile = os.path.join(directory, "key.pem")
+        subprocess.run(
+            [
+                "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                "-keyout", keyfile, "-out", certfile,
+                "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+            ],
+            check=True,
+            capture_output=True,
+        )
+        yield certfile, keyfile
+
+
+def run_one(
+    scenario: str,
+    concurrency: int,
+    upstream: str,
+    args: argparse.Namespace,
+    proxy_env: Dict[str, str],
+    engine: str = "auto",
+    upstream_uds: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Benchmark one scenario at one concurrency level against a fresh proxy process.
+
+    With ``upstream_uds`` the proxy listens on a Unix domain socket and
+    forwards to the upstream stub listening on ``upstream_uds``.
+    """
+    method, query, body_size = SCENARIOS[scenario]
+    engine_args, engine_env = ENGINES[engine]
+    app = "httpkit.tools.asgi_proxy:app" if args.fast_path else "httpkit.tools.proxy:app"
+    body = b"x" * body_size
+
+    if upstream_uds:
+        proxy_port = 0
+        proxy_uds = os.path.join(os.path.dirname(upstream_uds), f"proxy-{scenario}-{concurrency}-{engine}.sock")
+        listen_args = ["--uds", proxy_uds]
+        socket_env = {"HTTPKIT_UNIX_SOCKETS": upstream_uds}
+        path = f"/proxy/unix:{quote(upstream_uds, safe='')}/bench?{query}"
+    else:
+        proxy_port = free_port()
+        proxy_uds = None
+        listen_args = ["--host", "127.0.0.1", "--port", str(proxy_port)]
+        socket_env = {}
+        path = f"/proxy/{upstream}/bench?{query}"
+
+    with serve(
+        ["-m", "uvicorn", app, *listen_args, "--log-level", "warning", "--no-access-log", *engine_args],
+        proxy_uds or proxy_port,
+        {**proxy_env, **SCENARIO_ENV.get(scenario, {}), **engine_env, **socket_env},
+    ) as proxy_process:
+        # Warm up connections and code paths before measuring
+        asyncio.run(run_load("127.0.0.1", proxy_port, path, concurrency, args.warmup, method, body, proxy_uds))
+
+        cpu_before = cpu_seconds(proxy_process.pid)
+        result = asyncio.run(
+            run_load("127.0.0.1", proxy_port, path, concurrency, args.duration, method, body, proxy_uds)
+        )
+        cpu_after = cpu_seconds(proxy_process.pid)
+        peak_rss = peak_rss_bytes(proxy_process.pid)
+
+    cpu_per_request = cpu_per_mb = None
+    if cpu_before is not None and cpu_after is not None and result.requests:
+        cpu_per_request = (cpu_after - cpu_before) / result.requests * 1000
+        if result.bytes_received:
+            cpu_per_mb = (cpu_after - cpu_before) * 1000 / (result.bytes_received / (1024 * 1024))
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "engine": engine,
+        "socket": "unix" if upstream_uds else "tcp",
+        "requests": result.requests,
+        "errors": result.errors,
+        "rps": round(result.rps, 1),
+        "p50_ms": round(result.percentile(0.50) * 1000, 3),
+        "p99_ms": round(result.percentile(0.99) * 1000, 3),
+        "p999_ms": round(result.percentile(0.999) * 1000, 3),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1) if peak_rss is not None else None,
+        "cpu_ms_per_request": round(cpu_per_request, 4) if cpu_per_request is not None else None,
+        "cpu_ms_per_mb": round(cpu_per_mb, 2) if cpu_per_mb is not None else None,
+        "mb_received": round(result.bytes_received / (1024 * 1024), 1),
+        "mb_per_second": round(result.bytes_received / (1024 * 1024) / result.elapsed, 3) if result.elapsed else None,
+    }
+
+
+def run_key(run: Dict[str, Any]) -> str:
+    key = f"{run['scenario']}@{run['concurrency']}"
+    if run.get("engine", "auto") != "auto":
+        key = f"{key}/{run['engine']}"
+    return key if run.get("socket", "tcp") == "tcp" else f"{key}/{run['socket']}"
+
+
+def compare(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.10,
+    latency_tolerance: float = 0.25,
+) -> List[str]:
+    """
+    Compare two result files and describe every regression beyond the tolerances.
+
+    Throughput, peak RSS and CPU per request and per MB may move by ``tolerance`` (a
+    fraction) and p99 latency by ``latency_tolerance``. Runs missing from
+    either file are ignored.
+
+    Returns:
+        One message per regression; empty if there are none.
+    """
+    regressions = []
+    for key, base in baseline.get("results", {}).items():
+        current = results.get("results", {}).get(key)
+        if current is None:
+            continue
+        checks = [
+            ("rps", -1, tolerance),
+            ("mb_per_second", -1, tolerance),
+            ("p99_ms", 1, latency_tolerance),
+            ("peak_rss_mb", 1, tolerance),
+            ("cpu_ms_per_request", 1, tolerance),
+            ("cpu_ms_per_mb", 1, tolerance),
+        ]
+        for metric, direction, allowed in checks:
+            before, after = base.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if change * direction > allowed:
+                regressions.append(f"{key}: {metric} {before} -> {after} ({change:+.1%}, allowed {allowed:.0%})")
+        if current.get("errors", 0) > base.get("errors", 0):
+            regressions.append(f"{key}: errors {base.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+
+def print_table(runs: List[Dict[str, Any]]):
+    columns = [
+        "scenario", "concurrency", "engine", "socket", "rps", "mb_per_second", "p50_ms", "p99_ms", "p999_ms", "peak_rss_mb",
+        "cpu_ms_per_request", "cpu_ms_per_mb", "mb_received", "errors",
+    ]
+    print("  ".join(f"{column:>18}" for column in columns))
+    for run in runs:
+        print("  ".join(f"{str(run[column]):>18}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTPKit proxy benchmark suite")
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS),
+                        help=f"Comma-separated scenarios out of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)),
+                        help="Comma-separated concurrency levels (default: 1,16,64)")
+    parser.add_argument("--duration", type=float, default=5.0, help="Measured seconds per run (default: 5)")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Warm-up seconds per run (default: 1)")
+    parser.add_argument("--fast-path", action="store_true", help="Benchmark the raw ASGI fast path")
+    parser.add_argument("--http2", action="store_true",
+                        help="Serve the upstream over HTTP/2 with TLS (requires hypercorn, h2 and openssl)")
+    parser.add_argument("--engines", default="auto",
+                        help=f"Comma-separated engines to compare out of {', '.join(ENGINES)} (default: auto)")
+    parser.add_argument("--sockets", default="tcp",
+                        help="Comma-separated ways to connect client, proxy and upstream: tcp, unix (default: tcp)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this result file and exit 1 on regressions")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to --baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Allowed regression of RPS, peak RSS and CPU per request and per MB (default: 0.10)")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25,
+                        help="Allowed regression of p99 latency (default: 0.25)")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    engines = [name.strip() for name in args.engines.split(",") if name.strip()]
+    unknown = [name for name in engines if name not in ENGINES]
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(unknown)}")
+    sockets = [name.strip() for name in args.sockets.split(",") if name.strip()]
+    unknown = [name for name in sockets if name not in SOCKETS]
+    if unknown:
+        parser.error(f"unknown sockets: {', '.join(unknown)}")
+    if "unix" in sockets and args.http2:
+        parser.error("--http2 does not support --sockets unix")
+
+    proxy_env = dict(os.environ)
+    upstream_port = free_port()
+    upstream_args = ["-m", "benchmarks.upstream", "--port", str(upstream_port)]
+
+    runs = []
+    with ExitStack() as stack:
+        if args.http2:
+            certfile, keyfile = stack.enter_context(self_signed_certificate())
+            upstream_args += ["--http2", "--certfile", certfile, "--keyfile", keyfile]
+            proxy_env["SSL_CERT_FILE"] = certfile
+            upstream = f"https://127.0.0.1:{upstream_port}"
+        else:
+            upstream = f"127.0.0.1:{upstream_port}"
+        stack.enter_context(serve(upstream_args, upstream_port))
+        upstream_uds = None
+        if "unix" in sockets:
+            upstream_uds = os.path.join(stack.enter_context(tempfile.TemporaryDirectory(prefix="httpkit-bench-")), "upstream.sock")
+            stack.enter_context(serve(["-m", "benchmarks.upstream", "--uds", upstream_uds], upstream_uds))
+
+        for scenario in scenarios:
+            for concurrency in levels:
+                for engine in engines:
+                    for socket_type in sockets:
+                        run = run_one(
+                            scenario, concurrency, upstream, args, proxy_env, engine,
+                            upstream_uds if socket_type == "unix" else None,
+                        )
+                        runs.append(run)
+                        print(
+                            f"{run_key(run)}: {run['rps']} req/s, {run['mb_per_second']} MB/s, "
+                            f"p50 {run['p50_ms']} ms, p99 {run['p99_ms']} ms",
+                            file=sys.stderr,
+                        )
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fast_path": args.fast_path,
+            "http2": args.http2,
+            "engines": engines,
+            "sockets": sockets,
+            "duration": args.duration,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": {run_key(run): run for run in runs},
+    }
+    print_table(runs)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.latency_tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Local upstream stand-in for the benchmark suite.
+
+Every request is answered according to its query string, so one server can
+play every scenario:
+
+- ``latency``: seconds to wait before sending the response headers
+- ``size``: response body size in bytes
+- ``chunks``: send the body in this many pieces; more than one uses chunked
+  transfer encoding instead of Content-Length
+- ``events`` / ``interval``: answer with a ``text/event-stream`` of this many
+  events, ``interval`` seconds apart
+- ``text``: with ``text=1``, send compressible ``text/plain`` instead of
+  ``application/octet-stream``
+- ``encoding``: with ``encoding=gzip``, send the body gzip-compressed with
+  Content-Encoding; ``size`` is the uncompressed size
+
+Usage:
+    python -m benchmarks.upstream --port 9000
+    python -m benchmarks.upstream --uds /tmp/upstream.sock
+    python -m benchmarks.upstream --port 9443 --http2 --certfile cert.pem --keyfile key.pem
+"""
+
+import argparse
+import asyncio
+import gzip
+import random
+from typing import Dict, Tuple
+from urllib.parse import parse_qsl
+
+# Response bodies by size (and kind), built once and reused
+BODIES: Dict[int, bytes] = {}
+TEXT_BODIES: Dict[Tuple[int, str], bytes] = {}
+
+WORDS = [
+    b"proxy", b"upstream", b"request", b"response", b"stream", b"header", b"latency", b"client",
+    b"connection", b"pool", b"cache", b"origin", b"status", b"body", b"chunk", b"encoding",
+]
+
+
+def body_of_size(size: int) -> bytes:
+    body = BODIES.get(size)
+    if body is None:
+        body = BODIES[size] = (b"0123456789abcdef" * (size // 16 + 1))[:size]
+    return body
+
+
+def text_of_size(size: int, encoding: str = "") -> bytes:
+    """Return ``size`` bytes of word-salad text (compressing about 3:1), gzipped if asked."""
+    body = TEXT_BODIES.get((size, encoding))
+    if body is None:
+        rng = random.Random(size)
+        words = []
+        length = 0
+        while length < size:
+            word = rng.choice(WORDS) + b"-" + str(rng.randrange(100000)).encode()
+            words.append(word)
+            length += len(word) + 1
+        body = b" ".join(words)[:size]
+        if encoding == "gzip":
+            body = gzip.compress(body, compresslevel=6)
+        TEXT_BODIES[(size, encoding)] = body
+    return body
+
+
+async def app(scope, receive, send):
+    """ASGI application serving the responses described in the module docstring."""
+    if scope["type"] != "http":
+        return
+
+    params = dict(parse_qsl(scope["query_string"].decode("latin-1")))
+    latency = float(params.get("latency", 0))
+    size = int(params.get("size", 64))
+    chunks = max(1, int(params.get("chunks", 1)))
+    events = int(params.get("events", 0))
+    interval = float(params.get("interval", 0))
+    text = params.get("text") == "1"
+    encoding = params.get("encoding", "")
+
+    # Drain the request body, as a real upstream would
+    more_body = True
+    while more_body:
+        message = await receive()
+        more_body = message.get("more_body", False)
+
+    if latency:
+        await asyncio.sleep(latency)
+
+    if events:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+        })
+        data = b"data: " + body_of_size(size) + b"\n\n"
+        for _ in range(events):
+            await send({"type": "http.response.body", "body": data, "more_body": True})
+            if interval:
+                await asyncio.sleep(interval)
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    if text or encoding:
+        body = text_of_size(size, encoding)
+        headers = [(b"content-type", b"text/plain; charset=utf-8")]
+        if encoding:
+            headers.append((b"content-encoding", encoding.encode()))
+    else:
+        body = body_of_size(size)
+        headers = [(b"content-type", b"application/octet-stream")]
+    size = len(body)
+    if chunks == 1:
+        headers.append((b"content-length", str(size).encode()))
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+    step = max(1, -(-size // chunks))
+    view = memoryview(body)
+    for start in range(0, size, step):
+        await send({"type": "http.response.body", "body": bytes(view[start:start + step]), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark upstream stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--uds", help="Listen on this Unix domain socket instead of --host and --port")
+    parser.add_argument("--http2", action="store_true",
+                        help="Serve HTTP/2 over TLS with hypercorn (requires the bench extra)")
+    parser.add_argument("--certfile", help="TLS certificate for --http2")
+    parser.add_argument("--keyfile", help="TLS private key for --http2")
+    args = parser.parse_args()
+    if args.http2 and args.uds:
+        parser.error("--http2 does not support --uds")
+
+    if args.http2:
+        # uvicorn only speaks HTTP/1.1; hypercorn negotiates h2 via ALPN
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+
+        config = Config()
+        config.bind = [f"{args.host}:{args.port}"]
+        config.certfile = args.certfile
+        config.keyfile = args.keyfile
+        config.alpn_protocols = ["h2", "http/1.1"]
+        config.loglevel = "WARNING"
+        asyncio.run(serve(app, config))
+    else:
+        import uvicorn
+
+        uvicorn.run(app, host=args.host, port=args.port, uds=args.uds, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Structured access log written off the event loop.
+
+Each finished request is appended to a preallocated ring buffer as a tuple of
+its fields; nothing is formatted, encoded or written on the event loop. A
+background thread drains the buffer every ``flush_interval`` seconds (sooner
+when it fills up), encodes the records as JSON lines and writes each batch
+with a single ``write()``, rotating the file once it exceeds ``max_bytes``.
+
+The event loop is the only producer and the flush thread the only consumer,
+so the buffer needs no lock: the loop fills a slot and then advances
+``tail``, the thread reads up to ``tail`` and then advances ``head``. When the
+buffer is full the record is dropped and counted rather than waiting for the
+thread. A batch that cannot be written (a full disk, a failed rotation) is
+counted as lost and logged, and the thread carries on with the next one.
+
+Requests can be sampled: only ``sample_rate`` of them are logged, except for
+errors (status 500 and above) and requests slower than ``slow_seconds``,
+which are always logged.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fields of a record, in the order they are passed to AccessLog.log()
+FIELDS = (
+    "time", "client", "method", "target", "status", "bytes_in", "bytes_out",
+    "duration", "queue_wait", "ttfb", "error",
+)
+
+
+class CountingBody:
+    """Wrap a request body iterator to count the bytes forwarded upstream."""
+
+    __slots__ = ("body", "bytes")
+
+    def __init__(self, body):
+        self.body = body
+        self.bytes = 0
+
+    async def __aiter__(self):
+        async for chunk in self.body:
+            self.bytes += len(chunk)
+            yield chunk
+
+
+class AccessLog:
+    """
+    A JSON lines access log, sampled and written in batches by a background thread.
+
+    Args:
+        path: File the log is written to.
+        capacity: Records the ring buffer holds before new ones are dropped.
+        sample_rate: Fraction of requests logged, between 0 and 1.
+        slow_seconds: Requests at least this slow are always logged, 0 to sample them too.
+        log_errors: Whether requests answered with 500 or above are always logged.
+        max_bytes: Size at which the file is rotated, 0 to never rotate.
+        backups: Rotated files kept, as ``path.1`` (newest) to ``path.{backups}``.
+        flush_interval: Seconds between flushes of the buffer.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int = 8192,
+        sample_rate: float = 1.0,
+        slow_seconds: float = 0.0,
+        log_errors: bool = True,
+        max_bytes: int = 0,
+        backups: int = 5,
+        flush_interval: float = 0.2,
+    ):
+        self.path = path
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.log_errors = log_errors
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.records: List[Optional[tuple]] = [None] * capacity
+        # Records ever added (tail) and ever taken by the flush thread (head)
+        self.head = 0
+        self.tail = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.written = 0
+        self.rotations = 0
+        self.write_errors = 0
+        self.lost = 0
+        self.file = open(path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="httpkit-access-log", daemon=True)
+        self.thread.start()
+
+    def log(
+        self,
+        client: Optional[str],
+        method: str,
+        target: str,
+        status: int,
+        bytes_in: int,
+        bytes_out: int,
+        duration: float,
+        queue_wait: Optional[float] = None,
+        ttfb: Optional[float] = None,
+        error: Optional[str] = None,
+    ):
+        """Queue a record of a finished request, unless it is sampled out or the buffer is full."""
+        if not (
+            (self.log_errors and status >= 500)
+            or (self.slow_seconds and duration >= self.slow_seconds)
+            or self.sample_rate >= 1
+            or random.random() < self.sample_rate
+        ):
+            self.sampled_out += 1
+            return
+        tail = self.tail
+        if tail - self.head >= self.capacity:
+            self.dropped += 1
+            return
+        self.records[tail % self.capacity] = (
+            time.time(), client, method, target, status, bytes_in, bytes_out, duration, queue_wait, ttfb, error,
+        )
+        self.tail = tail + 1
+        if tail - self.head >= self.capacity // 2:
+            self.wakeup.set()
+
+    def run(self):
+        """Flush the buffer until the log is closed."""
+        while not self.stopping:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """Write every buffered record to the file; called from the flush thread."""
+        head, tail = self.head, self.tail
+        if head == tail:
+            return
+        lines = []
+        for index in range(head, tail):
+            slot = index % self.capacity
+            record = self.records[slot]
+            self.records[slot] = None
+            lines.append(json.dumps(dict(zip(FIELDS, record)), separators=(",", ":")))
+        self.head = tail
+        data = "\n".join(lines) + "\n"
+        if self.max_bytes and self.size and self.size + len(data) > self.max_bytes:
+            try:
+                self.rotate()
+            except OSError as e:
+                # The batch still goes to the current file, if it can be written at all
+                self.write_errors += 1
+                logger.warning("Could not rotate access log %s: %s", self.path, e)
+        try:
+            if self.file.closed:
+                # The file could not be reopened after a rotation
+                self.file = open(self.path, "a", encoding="utf-8")
+                self.size = self.file.tell()
+            self.file.write(data)
+            self.file.flush()
+        except OSError as e:
+            self.write_errors += 1
+            self.lost += len(lines)
+            logger.warning("Could not write %d access log records to %s: %s", len(lines), self.path, e)
+            return
+        self.size += len(data)
+        self.written += len(lines)
+
+    def rotate(self):
+        """Move the file to ``path.1``, shifting older backups up and dropping the oldest."""
+        self.file.close()
+        try:
+            for index in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            if self.backups > 0:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+            self.rotations += 1
+        finally:
+            # Keep writing to the current file if it could not be moved
+            self.file = open(self.path, "a", encoding="utf-8")
+            self.size = self.file.tell()
+
+    def close(self):
+        """Flush the remaining records and stop the flush thread."""
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join()
+        self.file.close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "path": self.path,
+            "buffered": self.tail - self.head,
+            "written": self.written,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "write_errors": self.write_errors,
+            "lost": self.lost,
+        }
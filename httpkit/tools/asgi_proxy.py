@@ -0,0 +1,178 @@
+"""Raw ASGI fast path for the HTTP proxy.
+
+This module provides an ASGI application that serves ``/proxy/...`` requests
+directly on the ASGI scope/receive/send, without FastAPI routing, parameter
+coercion or ``Request`` construction. Everything else (``/`` and the admin
+endpoints) is delegated to the FastAPI app in :mod:`httpkit.tools.proxy`.
+"""
+
+from typing import Dict, Optional, Tuple
+
+import httpx
+from fastapi.responses import JSONResponse
+
+from httpkit.tools import proxy
+from httpkit.tools.balancer import NoHealthyMembers, UnknownGroup
+from httpkit.tools.limits import Overloaded
+from httpkit.tools.ratelimit import RateLimited
+from httpkit.tools.spool import BodyTooLarge
+from httpkit.tools.unixsocket import UnknownSocket
+
+PROXY_PREFIX = "/proxy/"
+PROXY_PREFIX_LENGTH = len(PROXY_PREFIX)
+GROUP_PREFIX = "/proxy/@"
+GROUP_PREFIX_LENGTH = len(GROUP_PREFIX)
+UNIX_PREFIX = "/proxy/unix:"
+UNIX_PREFIX_LENGTH = len(UNIX_PREFIX)
+
+# Methods accepted by the proxy routes; anything else is left to FastAPI (405)
+PROXY_METHODS = frozenset(["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
+
+
+def split_host_port(segment: str) -> Optional[Tuple[str, str]]:
+    """
+    Split ``host:port`` at the last colon that leaves both sides non-empty.
+
+    This mirrors how the ``{target_host}:{target_port}`` route pattern matches.
+    """
+    colon = segment.rfind(":", 0, len(segment) - 1)
+    if colon <= 0:
+        return None
+    return segment[:colon], segment[colon + 1:]
+
+
+def parse_proxy_path(path: str) -> Optional[Tuple[str, str, int, str]]:
+    """
+    Parse a ``/proxy/[{scheme}://]{host}:{port}/{path}`` URL path.
+
+    Only paths the FastAPI routes would accept with a valid integer port are
+    parsed; anything else returns None so the caller can fall back to FastAPI,
+    which produces the same 404/422 responses as before.
+
+    Args:
+        path: The ASGI ``scope["path"]``.
+
+    Returns:
+        A ``(scheme, target_host, target_port, path)`` tuple, or None.
+    """
+    if not path.startswith(PROXY_PREFIX):
+        return None
+
+    slash = path.find("/", PROXY_PREFIX_LENGTH)
+    if slash == -1:
+        return None
+    segment = path[PROXY_PREFIX_LENGTH:slash]
+
+    host_port = split_host_port(segment)
+    if host_port is not None:
+        # /proxy/{target_host}:{target_port}/{path}
+        scheme = "http"
+    elif len(segment) > 1 and segment[-1] == ":" and path.startswith("/", slash + 1):
+        # /proxy/{scheme}://{target_host}:{target_port}/{path}
+        scheme = segment[:-1]
+        start = slash + 2
+        slash = path.find("/", start)
+        if slash == -1:
+            return None
+        host_port = split_host_port(path[start:slash])
+        if host_port is None:
+            return None
+    else:
+        return None
+
+    target_host, target_port = host_port
+    if not (target_port.isascii() and target_port.isdigit()):
+        return None
+    return scheme, target_host, int(target_port), path[slash + 1:]
+
+
+def parse_group_path(path: str) -> Optional[Tuple[str, str]]:
+    """
+    Parse a ``/proxy/@{group}/{path}`` URL path into ``(group, path)``, or return None.
+    """
+    if not path.startswith(GROUP_PREFIX):
+        return None
+    slash = path.find("/", GROUP_PREFIX_LENGTH)
+    if slash <= GROUP_PREFIX_LENGTH:
+        return None
+    return path[GROUP_PREFIX_LENGTH:slash], path[slash + 1:]
+
+
+def error_response(status_code: int, detail: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    """Build an error response shaped like FastAPI's ``HTTPException`` handler output."""
+    return JSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+
+
+async def app(scope, receive, send):
+    """
+    ASGI entry point serving ``/proxy/...`` directly and delegating everything else to FastAPI.
+
+    Run it with ``httpkit-proxy --fast-path`` or
+    ``uvicorn httpkit.tools.asgi_proxy:app``.
+    """
+    if scope["type"] != "http":
+        if scope["type"] == "lifespan":
+            proxy.FAST_PATH_ENABLED = True
+        await proxy.app(scope, receive, send)
+        return
+
+    target = group = unix = None
+    if scope["method"] in PROXY_METHODS and not scope.get("root_path"):
+        if scope["path"].startswith(UNIX_PREFIX):
+            unix = scope["path"][UNIX_PREFIX_LENGTH:]
+        else:
+            group = parse_group_path(scope["path"])
+            if group is None:
+                target = parse_proxy_path(scope["path"])
+    if target is None and group is None and unix is None:
+        await proxy.app(scope, receive, send)
+        return
+
+    if unix is not None:
+        try:
+            target_url = proxy.unix_target_url(unix, scope["query_string"])
+        except UnknownSocket as e:
+            response = error_response(403, str(e))
+            await response(scope, receive, send)
+            return
+    elif group is not None:
+        try:
+            target_url = proxy.group_target_url(group[0], group[1], scope["query_string"])
+        except (UnknownGroup, NoHealthyMembers) as e:
+            response = error_response(404 if isinstance(e, UnknownGroup) else 503, str(e))
+            await response(scope, receive, send)
+            return
+    else:
+        scheme, target_host, target_port, path = target
+
+        # Validate scheme
+        if scheme.lower() not in ["http", "https"]:
+            response = error_response(400, f"Invalid scheme: {scheme}. Only http and https are supported.")
+            await response(scope, receive, send)
+            return
+
+        target_url = proxy.build_target_url(scheme, target_host, target_port, path, scope["query_string"])
+
+    raw_headers = scope["headers"]
+    headers = proxy.filter_request_headers(raw_headers)
+    body = (
+        proxy.stream_request_body(receive, proxy.REQUEST_CHUNK_SIZE)
+        if proxy.has_request_body(raw_headers)
+        else None
+    )
+
+    client = scope.get("client")
+    try:
+        response = await proxy.send_upstream(scope["method"], target_url, headers, body, client[0] if client else None)
+    except RateLimited as e:
+        response = error_response(429, f"Rate limit exceeded: {e.reason}", {"Retry-After": str(e.retry_after)})
+    except Overloaded as e:
+        response = error_response(503, f"Proxy overloaded: {e.reason}", {"Retry-After": str(e.retry_after)})
+    except BodyTooLarge as e:
+        response = error_response(413, str(e))
+    except httpx.RequestError as e:
+        response = error_response(502, f"Error forwarding request to target server: {str(e)}")
+    except Exception as e:
+        response = error_response(500, f"Internal server error: {str(e)}")
+
+    await response(scope, receive, send)
@@ -0,0 +1,252 @@
+"""Named upstream groups with load balancing and active health checks.
+
+Groups are defined in the configuration file and addressed as
+``/proxy/@{group}/{path}``. Each request picks one healthy member of the group:
+
+- ``round_robin`` cycles through the healthy members.
+- ``least_outstanding`` samples two healthy members at random and picks the
+  one with fewer requests in flight ("power of two choices").
+- ``peak_ewma`` samples two members the same way and picks the one with the
+  lower peak-EWMA latency weighted by its requests in flight.
+
+Every strategy is O(1) per request. Members are plain origins, so requests to
+them reuse the proxy's pooled connections like any other request. A member's
+load and latency are tracked per origin and shared by every group listing it.
+
+Besides failing health checks, a member can be ejected for a while (for
+example, while its circuit breaker is open). It rejoins its groups once the
+ejection has expired.
+"""
+
+import asyncio
+import math
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+import httpx
+
+from httpkit.tools.unixsocket import UNIX_SCHEME, unix_origin
+
+STRATEGIES = ("round_robin", "least_outstanding", "peak_ewma")
+
+# Seconds over which a member's latency EWMA forgets old samples
+EWMA_DECAY_SECONDS = 10.0
+
+
+class UnknownGroup(LookupError):
+    """Raised when a request names an upstream group that is not configured."""
+
+
+class NoHealthyMembers(Exception):
+    """Raised when every member of an upstream group is marked unhealthy."""
+
+
+def normalize_origin(url: str) -> str:
+    """
+    Return ``scheme://host:port`` for a member URL, filling in the default port.
+
+    A Unix socket origin, ``http+unix://{socket}``, is returned with its socket
+    path percent-encoded, whether or not it was given encoded.
+    """
+    if url.startswith(UNIX_SCHEME + "://"):
+        return unix_origin(unquote(url[len(UNIX_SCHEME) + 3:].rstrip("/")))
+    parsed = httpx.URL(url)
+    if parsed.scheme not in ("http", "https"):
+        raise ValueError(f"Upstream member {url} must use http or https")
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    host = f"[{parsed.host}]" if ":" in parsed.host else parsed.host
+    return f"{parsed.scheme}://{host}:{port}"
+
+
+class Member:
+    """One upstream origin: its requests in flight, latency estimate, health and ejection."""
+
+    __slots__ = ("origin", "outstanding", "ewma", "updated", "healthy", "failures", "successes", "ejected_until")
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.outstanding = 0
+        self.ewma = 0.0
+        self.updated = time.monotonic()
+        self.healthy = True
+        self.failures = 0
+        self.successes = 0
+        self.ejected_until = 0.0
+
+    def observe(self, latency: float):
+        """Fold a response latency into the peak EWMA: jumps up at once, decays down slowly."""
+        now = time.monotonic()
+        if latency > self.ewma:
+            self.ewma = latency
+        else:
+            weight = math.exp(-(now - self.updated) / EWMA_DECAY_SECONDS)
+            self.ewma = self.ewma * weight + latency * (1.0 - weight)
+        self.updated = now
+
+    def release(self):
+        self.outstanding -= 1
+
+    def cost(self) -> float:
+        # The small floor keeps requests in flight relevant before any latency is known
+        return (self.ewma + 0.001) * (self.outstanding + 1)
+
+
+class UpstreamGroup:
+    """
+    A named set of upstream members and the strategy used to pick between them.
+
+    Args:
+        name: The group name used in ``/proxy/@{name}/...``.
+        members: The member objects, in configuration order.
+        strategy: One of ``round_robin``, ``least_outstanding`` or ``peak_ewma``.
+        health_path: Path requested by active health checks, or None to disable them.
+        health_interval: Seconds between health check rounds.
+        health_timeout: Timeout of each health check request.
+        unhealthy_threshold: Consecutive failed checks before a member is dropped.
+        healthy_threshold: Consecutive passed checks before a dropped member returns.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        members: List[Member],
+        strategy: str = "round_robin",
+        health_path: Optional[str] = None,
+        health_interval: float = 5.0,
+        health_timeout: float = 2.0,
+        unhealthy_threshold: int = 2,
+        healthy_threshold: int = 1,
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Upstream group {name}: unknown balancing strategy {strategy!r}")
+        if not members:
+            raise ValueError(f"Upstream group {name} has no members")
+        self.name = name
+        self.members = members
+        self.strategy = strategy
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+        self.healthy: List[Member] = list(members)
+        self.next = 0
+        # When the earliest ejected member is due to rejoin
+        self.reinstate_at = math.inf
+
+    def select(self) -> Member:
+        """Pick a healthy member for one request."""
+        if self.reinstate_at <= time.monotonic():
+            self.update_healthy()
+        healthy = self.healthy
+        count = len(healthy)
+        if count == 0:
+            raise NoHealthyMembers(f"No healthy members in upstream group {self.name}")
+        if count == 1:
+            return healthy[0]
+
+        if self.strategy == "round_robin":
+            self.next = (self.next + 1) % count
+            return healthy[self.next]
+
+        # Power of two choices: two distinct random members, keep the cheaper one
+        first = random.randrange(count)
+        second = random.randrange(count - 1)
+        if second >= first:
+            second += 1
+        a, b = healthy[first], healthy[second]
+        if self.strategy == "least_outstanding":
+            return a if a.outstanding <= b.outstanding else b
+        return a if a.cost() <= b.cost() else b
+
+    def update_healthy(self):
+        """Recompute the members eligible for requests: healthy and not ejected."""
+        now = time.monotonic()
+        self.healthy = [member for member in self.members if member.healthy and member.ejected_until <= now]
+        self.reinstate_at = min(
+            (member.ejected_until for member in self.members if member.ejected_until > now),
+            default=math.inf,
+        )
+
+    async def check(self, client_for: Callable[[str], httpx.AsyncClient]):
+        """Run one round of health checks against every member."""
+        results = await asyncio.gather(*(self.probe(member, client_for(member.origin)) for member in self.members))
+        changed = False
+        for member, passed in zip(self.members, results):
+            if passed:
+                member.successes += 1
+                member.failures = 0
+                if not member.healthy and member.successes >= self.healthy_threshold:
+                    member.healthy = changed = True
+            else:
+                member.failures += 1
+                member.successes = 0
+                if member.healthy and member.failures >= self.unhealthy_threshold:
+                    member.healthy = False
+                    changed = True
+        if changed:
+            self.update_healthy()
+
+    async def probe(self, member: Member, client: httpx.AsyncClient) -> bool:
+        try:
+            response = await client.get(member.origin + self.health_path, timeout=self.health_timeout)
+        except httpx.HTTPError:
+            return False
+        return 200 <= response.status_code < 400
+
+    async def run_health_checks(self, client_for: Callable[[str], httpx.AsyncClient]):
+        """Check the members every ``health_interval`` seconds until cancelled."""
+        while True:
+            await self.check(client_for)
+            await asyncio.sleep(self.health_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the strategy and per-member state of the group."""
+        return {
+            "strategy": self.strategy,
+            "healthy": len(self.healthy),
+            "members": {
+                member.origin: {
+                    "healthy": member.healthy,
+                    "ejected": member.ejected_until > time.monotonic(),
+                    "outstanding": member.outstanding,
+                    "ewma_ms": round(member.ewma * 1000, 3),
+                }
+                for member in self.members
+            },
+        }
+
+
+def load_groups(config: Dict[str, Any]) -> Tuple[Dict[str, UpstreamGroup], Dict[str, Member]]:
+    """
+    Build the upstream groups from the ``upstream_groups`` section of a configuration.
+
+    Returns:
+        The groups by name, and their members by origin (one object per origin,
+        shared by every group that lists it).
+    """
+    members: Dict[str, Member] = {}
+    groups: Dict[str, UpstreamGroup] = {}
+    for name, values in config.get("upstream_groups", {}).items():
+        group_members = []
+        for url in values.get("members", []):
+            origin = normalize_origin(url)
+            member = members.get(origin)
+            if member is None:
+                member = members[origin] = Member(origin)
+            group_members.append(member)
+
+        health = values.get("health_check")
+        groups[name] = UpstreamGroup(
+            name,
+            group_members,
+            strategy=values.get("balancing", "round_robin"),
+            health_path=health.get("path", "/health") if health else None,
+            health_interval=float(health.get("interval_seconds", 5.0)) if health else 5.0,
+            health_timeout=float(health.get("timeout_seconds", 2.0)) if health else 2.0,
+            unhealthy_threshold=int(health.get("unhealthy_threshold", 2)) if health else 2,
+            healthy_threshold=int(health.get("healthy_threshold", 1)) if health else 1,
+        )
+    return groups, members
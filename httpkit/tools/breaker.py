@@ -0,0 +1,239 @@
+"""Per-origin circuit breakers.
+
+Each upstream origin (scheme, host and port) gets a breaker tracking the
+outcome of its most recent requests in a fixed-size sliding window. The
+circuit opens when an origin fails too many times in a row, or when too large
+a share of the window failed or was slow. While open, requests to the origin
+fail fast with :class:`CircuitOpen` instead of waiting for a timeout and
+holding a concurrency slot. Once the open period has passed the circuit is
+half-open: a few probe requests go through, and their outcome decides whether
+it closes again or reopens for a longer period.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from httpkit.tools.limits import Overloaded
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Bits of a window entry
+FAILED = 1
+SLOW = 2
+
+
+class CircuitOpen(Overloaded):
+    """Raised when a request is rejected because its origin's circuit is open."""
+
+    def __init__(self, origin: str, retry_after: int):
+        super().__init__(f"circuit open for {origin}", retry_after)
+        self.origin = origin
+
+
+class CircuitBreaker:
+    """The circuit state and sliding outcome window of one origin."""
+
+    __slots__ = (
+        "origin", "breakers", "state", "window", "position", "count", "failures", "slow",
+        "consecutive_failures", "open_until", "reopens", "probes", "probe_successes", "trips",
+    )
+
+    def __init__(self, origin: str, breakers: "CircuitBreakers"):
+        self.origin = origin
+        self.breakers = breakers
+        self.state = CLOSED
+        self.window = bytearray(breakers.window)
+        self.position = 0
+        self.count = 0
+        self.failures = 0
+        self.slow = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.reopens = 0
+        self.probes = 0
+        self.probe_successes = 0
+        self.trips = 0
+
+    def admit(self) -> bool:
+        """
+        Let a request through, or raise :class:`CircuitOpen`.
+
+        Returns:
+            True if the request is a half-open probe, which the caller must
+            hand back with :meth:`release_probe` once it is done.
+        """
+        if self.state == CLOSED:
+            return False
+        if self.state == OPEN:
+            now = time.monotonic()
+            if now < self.open_until:
+                self.breakers.rejected += 1
+                raise CircuitOpen(self.origin, max(1, round(self.open_until - now)))
+            self.transition(HALF_OPEN)
+        if self.probes >= self.breakers.half_open_probes:
+            self.breakers.rejected += 1
+            raise CircuitOpen(self.origin, 1)
+        self.probes += 1
+        return True
+
+    def release_probe(self):
+        if self.state == HALF_OPEN and self.probes > 0:
+            self.probes -= 1
+
+    def record(self, latency: float, failed: bool):
+        """Record the outcome of one request to the origin."""
+        breakers = self.breakers
+        slow = breakers.slow_call_seconds > 0 and latency >= breakers.slow_call_seconds
+
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self.open()
+            else:
+                self.probe_successes += 1
+                if self.probe_successes >= breakers.half_open_probes:
+                    self.close()
+            return
+        if self.state == OPEN:
+            # A request admitted before the circuit opened
+            return
+
+        entry = (FAILED if failed else 0) | (SLOW if slow else 0)
+        if self.count == len(self.window):
+            old = self.window[self.position]
+            self.failures -= old & FAILED
+            self.slow -= (old & SLOW) >> 1
+        else:
+            self.count += 1
+        self.window[self.position] = entry
+        self.position = (self.position + 1) % len(self.window)
+        self.failures += failed
+        self.slow += slow
+        self.consecutive_failures = self.consecutive_failures + 1 if failed else 0
+
+        if self.consecutive_failures >= breakers.failure_threshold:
+            self.open()
+        elif self.count >= breakers.min_requests and (
+            self.failures >= self.count * breakers.error_rate
+            or self.slow >= self.count * breakers.slow_call_rate
+        ):
+            self.open()
+
+    def open(self):
+        """Open the circuit, for longer each time a half-open probe fails in a row."""
+        breakers = self.breakers
+        if self.state == HALF_OPEN:
+            self.reopens += 1
+        duration = min(breakers.max_open_seconds, breakers.open_seconds * (2 ** self.reopens))
+        self.open_until = time.monotonic() + duration
+        self.trips += 1
+        self.transition(OPEN)
+
+    def close(self):
+        self.reopens = 0
+        self.reset_window()
+        self.transition(CLOSED)
+
+    def reset_window(self):
+        self.position = self.count = self.failures = self.slow = 0
+        self.consecutive_failures = 0
+
+    def transition(self, state: str):
+        self.state = state
+        self.probes = self.probe_successes = 0
+        if state == OPEN:
+            self.reset_window()
+        if self.breakers.on_transition is not None:
+            self.breakers.on_transition(self.origin, state, self.open_until if state == OPEN else 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "requests": self.count,
+            "failures": self.failures,
+            "slow": self.slow,
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "retry_in_seconds": round(max(0.0, self.open_until - time.monotonic()), 3) if self.state == OPEN else 0.0,
+        }
+
+
+class CircuitBreakers:
+    """
+    The circuit breakers of every origin, sharing one policy.
+
+    Args:
+        failure_threshold: Consecutive failures that open the circuit.
+        error_rate: Share of failed requests in the window (0-1) that opens the circuit.
+        slow_call_seconds: Latency above which a request counts as slow, or 0
+            to ignore latency.
+        slow_call_rate: Share of slow requests in the window (0-1) that opens the circuit.
+        window: Number of recent requests per origin the rates are computed over.
+        min_requests: Requests needed in the window before the rates are considered.
+        open_seconds: How long the circuit first stays open.
+        max_open_seconds: Cap on the open period, which doubles on every failed probe.
+        half_open_probes: Concurrent probe requests allowed while half-open, and
+            successful probes needed to close the circuit.
+        max_origins: Number of origins tracked (least recently used are dropped).
+        on_transition: Called with ``(origin, state, open_until)`` on every state change.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        error_rate: float = 0.5,
+        slow_call_seconds: float = 0.0,
+        slow_call_rate: float = 1.0,
+        window: int = 100,
+        min_requests: int = 20,
+        open_seconds: float = 5.0,
+        max_open_seconds: float = 60.0,
+        half_open_probes: int = 3,
+        max_origins: int = 1024,
+        on_transition: Optional[Callable[[str, str, float], None]] = None,
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.window = max(1, window)
+        self.min_requests = max(1, min(min_requests, self.window))
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max(open_seconds, max_open_seconds)
+        self.half_open_probes = max(1, half_open_probes)
+        self.max_origins = max_origins
+        self.on_transition = on_transition
+        self.breakers: "OrderedDict[str, CircuitBreaker]" = OrderedDict()
+        self.rejected = 0
+
+    def get(self, origin: str) -> CircuitBreaker:
+        """Return the breaker of ``origin``, creating it closed if needed."""
+        breaker = self.breakers.get(origin)
+        if breaker is None:
+            breaker = self.breakers[origin] = CircuitBreaker(origin, self)
+            if len(self.breakers) > self.max_origins:
+                self.breakers.popitem(last=False)
+        else:
+            self.breakers.move_to_end(origin)
+        return breaker
+
+    def counts(self) -> Dict[str, int]:
+        """Return the number of breakers in each state."""
+        counts = {CLOSED: 0, OPEN: 0, HALF_OPEN: 0}
+        for breaker in self.breakers.values():
+            counts[breaker.state] += 1
+        return counts
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the state counts, rejections and every circuit that is not closed."""
+        return {
+            **self.counts(),
+            "rejected": self.rejected,
+            "origins": {
+                origin: breaker.stats()
+                for origin, breaker in self.breakers.items()
+                if breaker.state != CLOSED
+            },
+        }
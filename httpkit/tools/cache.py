@@ -0,0 +1,421 @@
+"""Shared in-memory HTTP response cache for the proxy.
+
+This module implements the parts of RFC 9111 a shared (proxy) cache needs:
+storability checks, freshness calculation from Cache-Control / Expires /
+Last-Modified, Vary-aware cache keys, and validator-based revalidation with
+If-None-Match / If-Modified-Since. Entries are evicted least-recently-used
+first against a total byte budget.
+"""
+
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+# Statuses that may be cached with heuristic freshness (RFC 9110, section 15.1)
+HEURISTICALLY_CACHEABLE_STATUSES = frozenset([200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501])
+
+# Statuses that may be cached when the response carries explicit freshness
+CACHEABLE_STATUSES = HEURISTICALLY_CACHEABLE_STATUSES | frozenset([302, 307])
+
+# Fraction of (Date - Last-Modified) used as heuristic freshness, and its cap
+HEURISTIC_FRACTION = 0.1
+MAX_HEURISTIC_LIFETIME = 24 * 60 * 60
+
+# Fixed per-entry overhead charged against the byte budget
+ENTRY_OVERHEAD = 256
+
+# Headers from a 304 response that must not overwrite the stored ones
+NOT_MODIFIED_SKIP_HEADERS = frozenset(["content-length", "content-encoding", "transfer-encoding", "content-range"])
+
+# Request headers that make the request conditional on the client's side
+CLIENT_CONDITIONAL_HEADERS = frozenset(["if-none-match", "if-modified-since", "if-match", "if-unmodified-since", "if-range"])
+
+# Stored headers repeated on a 304 sent to the client
+NOT_MODIFIED_RESPONSE_HEADERS = frozenset(["cache-control", "content-location", "date", "etag", "expires", "last-modified", "vary"])
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Parse a Cache-Control header into a dict of lowercase directives to (unquoted) arguments."""
+    directives: Dict[str, Optional[str]] = {}
+    if not value:
+        return directives
+    for part in value.split(","):
+        name, _, argument = part.strip().partition("=")
+        name = name.strip().lower()
+        if name:
+            directives[name] = argument.strip().strip('"') if argument else None
+    return directives
+
+
+def parse_http_date(value: Optional[str]) -> Optional[float]:
+    """Parse an HTTP-date into a POSIX timestamp, returning None if it is missing or invalid."""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def parse_seconds(value: Optional[str]) -> Optional[int]:
+    """Parse a delta-seconds directive argument, returning None if it is invalid."""
+    if value is None or not value.isdigit():
+        return None
+    return int(value)
+
+
+def lower_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    """Return a copy of ``headers`` with lowercase names."""
+    return {k.lower(): v for k, v in headers.items()}
+
+
+class CacheEntry:
+    """A stored response together with the metadata needed to compute its age and freshness."""
+
+    __slots__ = (
+        "key", "status_code", "headers", "body", "size", "request_time", "response_time",
+        "date_value", "age_value", "freshness_lifetime", "no_cache", "must_revalidate",
+        "etag", "last_modified",
+    )
+
+    def __init__(
+        self,
+        key: Tuple[str, Tuple[str, ...]],
+        status_code: int,
+        headers: Dict[str, str],
+        body: bytes,
+        request_time: float,
+        response_time: float,
+    ):
+        self.key = key
+        self.status_code = status_code
+        self.body = body
+        self.request_time = request_time
+        self.update_headers(headers, response_time)
+
+    def update_headers(self, headers: Dict[str, str], response_time: float):
+        """(Re)compute all header-derived metadata, e.g. after a successful revalidation."""
+        self.headers = headers
+        self.response_time = response_time
+        lowered = lower_headers(headers)
+        cache_control = parse_cache_control(lowered.get("cache-control"))
+
+        self.date_value = parse_http_date(lowered.get("date")) or response_time
+        self.age_value = parse_seconds(lowered.get("age")) or 0
+        self.etag = lowered.get("etag")
+        self.last_modified = lowered.get("last-modified")
+        self.no_cache = "no-cache" in cache_control
+        self.must_revalidate = "must-revalidate" in cache_control or "proxy-revalidate" in cache_control
+        self.freshness_lifetime = freshness_lifetime(self.status_code, lowered, cache_control, self.date_value)
+        self.size = (
+            len(self.body)
+            + sum(len(k) + len(v) for k, v in headers.items())
+            + ENTRY_OVERHEAD
+        )
+
+    def current_age(self, now: float) -> float:
+        """Return the entry's current age in seconds (RFC 9111, section 4.2.3)."""
+        apparent_age = max(0.0, self.response_time - self.date_value)
+        response_delay = self.response_time - self.request_time
+        corrected_initial_age = max(apparent_age, self.age_value + response_delay)
+        return corrected_initial_age + (now - self.response_time)
+
+    def has_validator(self) -> bool:
+        """Return True if the entry can be revalidated with a conditional request."""
+        return self.etag is not None or self.last_modified is not None
+
+    def not_modified_for(self, request_headers: Dict[str, str]) -> bool:
+        """Evaluate the client's If-None-Match / If-Modified-Since against this entry."""
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            if self.etag is None:
+                return False
+            if if_none_match.strip() == "*":
+                return True
+            own = weak_etag(self.etag)
+            return any(weak_etag(tag) == own for tag in if_none_match.split(","))
+
+        if_modified_since = parse_http_date(request_headers.get("if-modified-since"))
+        last_modified = parse_http_date(self.last_modified)
+        return if_modified_since is not None and last_modified is not None and last_modified <= if_modified_since
+
+
+def weak_etag(tag: str) -> str:
+    """Normalise an entity tag for weak comparison."""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def freshness_lifetime(
+    status_code: int,
+    headers: Dict[str, str],
+    cache_control: Dict[str, Optional[str]],
+    date_value: float,
+) -> float:
+    """Return the freshness lifetime of a response in seconds (RFC 9111, section 4.2.1)."""
+    for directive in ("s-maxage", "max-age"):
+        seconds = parse_seconds(cache_control.get(directive))
+        if seconds is not None:
+            return float(seconds)
+
+    if "expires" in headers:
+        expires = parse_http_date(headers["expires"])
+        # An invalid Expires value means "already expired"
+        return max(0.0, expires - date_value) if expires is not None else 0.0
+
+    last_modified = parse_http_date(headers.get("last-modified"))
+    if last_modified is not None and status_code in HEURISTICALLY_CACHEABLE_STATUSES:
+        return min(MAX_HEURISTIC_LIFETIME, max(0.0, (date_value - last_modified) * HEURISTIC_FRACTION))
+
+    return 0.0
+
+
+class ResponseCache:
+    """
+    Byte-bounded LRU cache of upstream responses shared by all proxied requests.
+
+    Entries are keyed on the full target URL (scheme, host, port, path and
+    query) plus the values of the request headers listed in the response's
+    Vary header.
+
+    Args:
+        max_bytes: Total budget for stored bodies and headers.
+        max_entry_bytes: Largest single response that will be stored.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes or max_bytes, max_bytes)
+        self.current_bytes = 0
+        self.entries: "OrderedDict[Tuple[str, Tuple[str, ...]], CacheEntry]" = OrderedDict()
+        # Vary'd request header names last seen for each URL
+        self.vary: Dict[str, Tuple[str, ...]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.revalidated = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache counters and current occupancy."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "revalidated": self.revalidated,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def make_key(self, url: str, request_headers: Dict[str, str], vary: Iterable[str]) -> Tuple[str, Tuple[str, ...]]:
+        """Build the cache key for ``url`` from the values of the Vary'd request headers."""
+        return url, tuple(
+            " ".join(request_headers.get(name, "").split()) for name in vary
+        )
+
+    def lookup(self, url: str, request_headers: Dict[str, str]) -> Optional[CacheEntry]:
+        """Return the stored entry matching the URL and Vary'd headers, marking it recently used."""
+        vary = self.vary.get(url)
+        if vary is None:
+            return None
+        entry = self.entries.get(self.make_key(url, request_headers, vary))
+        if entry is not None:
+            self.entries.move_to_end(entry.key)
+        return entry
+
+    def is_usable(self, entry: CacheEntry, request_cache_control: Dict[str, Optional[str]], now: float) -> bool:
+        """Return True if ``entry`` may be served without contacting the upstream."""
+        if entry.no_cache or "no-cache" in request_cache_control:
+            return False
+
+        age = entry.current_age(now)
+        max_age = parse_seconds(request_cache_control.get("max-age"))
+        if max_age is not None and age > max_age:
+            return False
+
+        min_fresh = parse_seconds(request_cache_control.get("min-fresh")) or 0
+        remaining = entry.freshness_lifetime - age - min_fresh
+        if remaining > 0:
+            return True
+
+        # Stale: only acceptable if the client explicitly allows it
+        if "max-stale" in request_cache_control and not entry.must_revalidate:
+            max_stale = parse_seconds(request_cache_control["max-stale"])
+            return max_stale is None or -remaining <= max_stale
+        return False
+
+    def conditional_headers(self, entry: CacheEntry) -> Dict[str, str]:
+        """Return the validator headers for revalidating ``entry`` upstream."""
+        headers = {}
+        if entry.etag is not None:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified is not None:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def is_storable(
+        self,
+        status_code: int,
+        response_headers: Dict[str, str],
+        request_headers: Dict[str, str],
+    ) -> bool:
+        """Return True if a GET response may be stored by a shared cache (RFC 9111, section 3)."""
+        if status_code not in CACHEABLE_STATUSES:
+            return False
+
+        request_cache_control = parse_cache_control(request_headers.get("cache-control"))
+        if "no-store" in request_cache_control:
+            return False
+
+        response_headers = lower_headers(response_headers)
+        cache_control = parse_cache_control(response_headers.get("cache-control"))
+        if "no-store" in cache_control or "private" in cache_control:
+            return False
+        if response_headers.get("vary", "").strip() == "*" or "set-cookie" in response_headers:
+            return False
+
+        if "authorization" in request_headers and not (
+            "public" in cache_control or "s-maxage" in cache_control or "must-revalidate" in cache_control
+        ):
+            return False
+
+        content_length = parse_seconds(response_headers.get("content-length"))
+        if content_length is not None and content_length > self.max_entry_bytes:
+            return False
+
+        explicit = (
+            "max-age" in cache_control
+            or "s-maxage" in cache_control
+            or "expires" in response_headers
+            or "public" in cache_control
+        )
+        if explicit:
+            return True
+        # Without explicit freshness, only store what is heuristically fresh or can be revalidated
+        return status_code in HEURISTICALLY_CACHEABLE_STATUSES and (
+            "last-modified" in response_headers or "etag" in response_headers
+        )
+
+    def store(
+        self,
+        url: str,
+        request_headers: Dict[str, str],
+        status_code: int,
+        response_headers: Dict[str, str],
+        body: bytes,
+        request_time: float,
+        response_time: float,
+    ) -> Optional[CacheEntry]:
+        """Store a complete response, evicting least-recently-used entries to stay within budget."""
+        key = self.store_key(url, request_headers, response_headers)
+        return self.add(CacheEntry(key, status_code, response_headers, body, request_time, response_time))
+
+    def store_key(self, url: str, request_headers: Dict[str, str], response_headers: Dict[str, str]) -> Tuple[str, Tuple[str, ...]]:
+        """Record the Vary header of a response about to be stored and return its cache key."""
+        vary = tuple(
+            name.strip().lower()
+            for name in lower_headers(response_headers).get("vary", "").split(",")
+            if name.strip()
+        )
+        if self.vary.get(url, vary) != vary:
+            # The upstream changed its Vary header; older variants are unreachable now
+            self.invalidate(url)
+        self.vary[url] = vary
+        return self.make_key(url, request_headers, vary)
+
+    def add(self, entry: CacheEntry) -> Optional[CacheEntry]:
+        """Insert ``entry``, replacing its previous version and evicting least-recently-used entries."""
+        if entry.size > self.max_entry_bytes:
+            return None
+
+        self.remove(entry.key)
+        self.entries[entry.key] = entry
+        self.current_bytes += entry.size
+        self.stores += 1
+
+        while self.current_bytes > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.current_bytes -= evicted.size
+            self.evictions += 1
+            self.discard(evicted)
+        return entry
+
+    def refresh(self, entry: CacheEntry, not_modified_headers: Dict[str, str], response_time: float):
+        """Update a stored entry with the headers of a 304 response (RFC 9111, section 4.3.4)."""
+        headers = dict(entry.headers)
+        lowered_names = {k.lower(): k for k in headers}
+        for name, value in not_modified_headers.items():
+            lowered = name.lower()
+            if lowered in NOT_MODIFIED_SKIP_HEADERS:
+                continue
+            headers.pop(lowered_names.get(lowered, name), None)
+            headers[name] = value
+
+        old_size = entry.size
+        entry.update_headers(headers, response_time)
+        if entry.key in self.entries:
+            self.current_bytes += entry.size - old_size
+
+    def remove(self, key: Tuple[str, Tuple[str, ...]]):
+        """Remove a single entry if it is present."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry.size
+            self.discard(entry)
+
+    def discard(self, entry: CacheEntry):
+        """Release what ``entry`` holds besides memory once it has been removed; nothing here."""
+
+    def invalidate(self, url: str):
+        """Remove every stored variant of ``url``."""
+        for key in [key for key in self.entries if key[0] == url]:
+            self.remove(key)
+        self.vary.pop(url, None)
+
+    async def fill(
+        self,
+        chunks: AsyncIterator[bytes],
+        url: str,
+        request_headers: Dict[str, str],
+        status_code: int,
+        response_headers: Dict[str, str],
+        request_time: float,
+        response_time: float,
+    ) -> AsyncIterator[bytes]:
+        """
+        Pass ``chunks`` through unchanged while collecting them for the cache.
+
+        The response is stored only once the body has been read completely.
+        Collection is abandoned as soon as the body outgrows ``max_entry_bytes``.
+        """
+        buffer: Optional[bytearray] = bytearray()
+        async for chunk in chunks:
+            if buffer is not None:
+                buffer += chunk
+                if len(buffer) > self.max_entry_bytes:
+                    buffer = None
+            yield chunk
+        if buffer is not None:
+            self.store(url, request_headers, status_code, response_headers, bytes(buffer), request_time, response_time)
+
+
+def cached_response_headers(entry: CacheEntry, now: float, status: str, not_modified: bool = False) -> Dict[str, str]:
+    """
+    Return the headers to send with a response served from ``entry``.
+
+    For a 304 response only the headers RFC 9110 (section 15.4.5) asks for are kept.
+    """
+    headers = {
+        k: v for k, v in entry.headers.items()
+        if k.lower() != "age" and (not not_modified or k.lower() in NOT_MODIFIED_RESPONSE_HEADERS)
+    }
+    headers["Age"] = str(int(entry.current_age(now)))
+    headers["X-Cache"] = status
+    if "date" not in lower_headers(headers):
+        headers["Date"] = formatdate(now, usegmt=True)
+    return headers
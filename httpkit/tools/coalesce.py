@@ -0,0 +1,209 @@
+"""Single-flight coalescing of identical concurrent upstream requests.
+
+When many identical GETs arrive while one is already waiting on the upstream,
+only the first one is sent. Every duplicate subscribes to the same flight and
+receives the same status, headers and streamed body. Each subscriber has its
+own bounded chunk queue, and the flight reads the upstream only as fast as its
+slowest subscriber drains it, so memory stays bounded.
+
+A flight admits new subscribers until its first body chunk has been read;
+requests arriving later start a new flight.
+"""
+
+import asyncio
+from contextlib import AsyncExitStack
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+# Request headers that make otherwise identical requests produce different responses
+DEFAULT_KEY_HEADERS = (
+    "authorization",
+    "cookie",
+    "accept",
+    "accept-encoding",
+    "accept-language",
+    "range",
+    "if-none-match",
+    "if-modified-since",
+)
+
+# Marks the end of the body in a subscriber queue
+END_OF_BODY = object()
+
+FlightKey = Tuple[str, str, Tuple[bytes, ...]]
+Opener = Callable[[], Awaitable[Tuple[httpx.Response, AsyncExitStack]]]
+
+
+class Subscription:
+    """
+    One requester's view of a flight.
+
+    It exposes the parts of ``httpx.Response`` the proxy uses (``status_code``,
+    ``headers``, ``aiter_bytes()``, ``aiter_raw()`` and ``aclose()``), so it
+    can stand in for an upstream response. Both iterators yield the body as the
+    flight read it: decoded, or raw when the coalescer was created with ``raw``.
+    """
+
+    def __init__(self, flight: "Flight", coalesced: bool, buffer_chunks: int):
+        self.flight = flight
+        # True for requests that joined a flight someone else started
+        self.coalesced = coalesced
+        self.queue: "asyncio.Queue" = asyncio.Queue(maxsize=buffer_chunks)
+
+    @property
+    def status_code(self) -> int:
+        return self.flight.status_code
+
+    @property
+    def headers(self) -> httpx.Headers:
+        return self.flight.headers
+
+    async def aiter_bytes(self) -> AsyncIterator[bytes]:
+        """Yield the shared body chunks as the flight delivers them."""
+        while True:
+            item = await self.queue.get()
+            if item is END_OF_BODY:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    aiter_raw = aiter_bytes
+
+    async def aclose(self):
+        """Leave the flight; the upstream is closed once every subscriber has left."""
+        self.flight.unsubscribe(self)
+
+
+class Flight:
+    """A single upstream request and the subscribers sharing its response."""
+
+    def __init__(self, coalescer: "RequestCoalescer", key: FlightKey):
+        self.coalescer = coalescer
+        self.key = key
+        self.subscribers: List[Subscription] = []
+        self.status_code = 0
+        self.headers = httpx.Headers()
+        self.ready: "asyncio.Future" = asyncio.get_running_loop().create_future()
+        self.task: Optional["asyncio.Task"] = None
+
+    def subscribe(self, coalesced: bool) -> Subscription:
+        subscription = Subscription(self, coalesced, self.coalescer.buffer_chunks)
+        self.subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription in self.subscribers:
+            self.subscribers.remove(subscription)
+        # Drain the queue so a flight blocked on this subscriber can move on
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+
+    def close_admission(self):
+        if self.coalescer.flights.get(self.key) is self:
+            del self.coalescer.flights[self.key]
+
+    async def run(self, opener: Opener):
+        """Send the upstream request and fan its body out to every subscriber."""
+        try:
+            response, exit_stack = await opener()
+        except asyncio.CancelledError:
+            self.close_admission()
+            self.ready.cancel()
+            raise
+        except Exception as e:
+            self.close_admission()
+            self.ready.set_exception(e)
+            # Mark the exception as retrieved; subscribers re-raise it themselves
+            self.ready.exception()
+            return
+
+        async with exit_stack:
+            self.status_code = response.status_code
+            self.headers = response.headers
+            self.ready.set_result(None)
+
+            try:
+                chunks = response.aiter_raw() if self.coalescer.raw else response.aiter_bytes()
+                async for chunk in chunks:
+                    self.close_admission()
+                    if not self.subscribers:
+                        return
+                    for subscription in list(self.subscribers):
+                        await subscription.queue.put(chunk)
+                self.close_admission()
+                for subscription in list(self.subscribers):
+                    await subscription.queue.put(END_OF_BODY)
+            except Exception as e:
+                self.close_admission()
+                for subscription in list(self.subscribers):
+                    await subscription.queue.put(e)
+            finally:
+                self.close_admission()
+
+
+class RequestCoalescer:
+    """
+    Coalesce identical concurrent requests into one upstream request.
+
+    Args:
+        key_headers: Request headers (besides method and URL) that must match
+            for two requests to share a flight.
+        buffer_chunks: Maximum number of body chunks buffered per subscriber.
+        raw: Share the body as received, without decoding its content-encoding.
+    """
+
+    def __init__(self, key_headers: Iterable[str] = DEFAULT_KEY_HEADERS, buffer_chunks: int = 16, raw: bool = False):
+        self.key_headers = tuple(name.strip().lower().encode("latin-1") for name in key_headers if name.strip())
+        self.buffer_chunks = buffer_chunks
+        self.raw = raw
+        self.flights: Dict[FlightKey, Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the coalescing counters."""
+        return {
+            "flights_started": self.leaders,
+            "requests_coalesced": self.coalesced,
+            "flights_in_progress": len(self.flights),
+        }
+
+    def make_key(self, method: str, url: str, headers: List[Tuple[bytes, bytes]]) -> FlightKey:
+        """Build the flight key from the method, URL and the selected raw request headers."""
+        values: Dict[bytes, bytes] = {}
+        for name, value in headers:
+            if name in self.key_headers:
+                # Repeated headers are combined, as they would be on the wire
+                values[name] = values[name] + b", " + value if name in values else value
+        return method, url, tuple(values.get(name, b"") for name in self.key_headers)
+
+    async def open(self, key: FlightKey, opener: Opener) -> Tuple[Subscription, AsyncExitStack]:
+        """
+        Join the flight for ``key``, starting it with ``opener`` if none is admitting.
+
+        Returns:
+            A subscription standing in for the upstream response, and an exit
+            stack that unsubscribes when closed.
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight(self, key)
+            self.flights[key] = flight
+            subscription = flight.subscribe(coalesced=False)
+            self.leaders += 1
+            # The flight runs in its own task so it survives its starter disconnecting
+            flight.task = asyncio.ensure_future(flight.run(opener))
+        else:
+            subscription = flight.subscribe(coalesced=True)
+            self.coalesced += 1
+
+        exit_stack = AsyncExitStack()
+        exit_stack.push_async_callback(subscription.aclose)
+        try:
+            await asyncio.shield(flight.ready)
+        except BaseException:
+            await exit_stack.aclose()
+            raise
+        return subscription, exit_stack
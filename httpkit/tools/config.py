@@ -0,0 +1,60 @@
+"""Configuration file support for httpkit tools.
+
+Settings are read from a JSON file, whose path is given with ``--config`` or
+``HTTPKIT_CONFIG_FILE``. Command-line arguments and environment variables
+take precedence over values from the file.
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional
+
+
+def load_config(path: Optional[str]) -> Dict[str, Any]:
+    """
+    Load a JSON configuration file.
+
+    Args:
+        path: Path to the file, or None for an empty configuration.
+
+    Returns:
+        The parsed configuration object.
+    """
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f"Configuration file {path} must contain a JSON object")
+    return config
+
+
+def setting(config: Dict[str, Any], env_name: str, key: str, default: Any, convert=int) -> Any:
+    """
+    Resolve a setting from the environment, then ``config[key]``, then ``default``.
+
+    Args:
+        config: The loaded configuration (or a section of it).
+        env_name: The environment variable to check first.
+        key: The key to look up in ``config``.
+        default: The value used when neither source sets it.
+        convert: Callable applied to values from the environment or file.
+    """
+    value = os.environ.get(env_name)
+    if value is not None:
+        return convert(value)
+    if key in config:
+        return convert(config[key])
+    return default
+
+
+def parse_origin_values(value: str) -> Dict[str, int]:
+    """Parse ``origin=N,origin=N`` pairs, e.g. ``https://api.example.com:443=50``."""
+    values = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        origin, _, number = item.rpartition("=")
+        values[origin.strip().rstrip("/")] = int(number)
+    return values
@@ -0,0 +1,442 @@
+"""On-disk tier of the response cache, for responses too large to keep in memory.
+
+:class:`DiskCache` is a :class:`~httpkit.tools.cache.ResponseCache` whose
+bodies live in files: the freshness, Vary and revalidation rules are the
+same, only storage and serving differ.
+
+* Bodies are written to a temporary file while they stream to the first
+  client, hashed on the way, and then renamed to ``objects/<xx>/<digest>``.
+  Identical bodies under different URLs share one file, which is deleted
+  when its last entry goes.
+* Bodies are written from a worker thread, overlapping with sending the same
+  chunk to the client, so a write stalled behind disk writeback holds up
+  only its own response and not the event loop.
+* Hits are served from the file by :class:`CachedFileResponse`: with the ASGI
+  ``http.response.zerocopysend`` extension where the server offers it (the
+  server then uses ``sendfile``), otherwise as ``memoryview`` slices of a
+  read-only ``mmap``, so no ``read()`` call or slicing copies the body into
+  Python first. Single-range ``Range`` requests are answered with 206 from
+  the same file.
+* Entries and their metadata are appended to ``index.jsonl`` as they are
+  stored or removed. On startup the journal is replayed, entries whose file
+  is gone are dropped, files no entry refers to are deleted, and the journal
+  is rewritten in least-recently-used order; it is rewritten the same way
+  when it has grown well past the number of entries, and on close.
+
+Every worker process needs its own index, so :meth:`DiskCache.open_shard`
+takes the first ``worker-N`` subdirectory no other process holds (by an
+``flock`` on its lock file). Each shard keeps its entries across restarts
+and has its own byte budget.
+"""
+
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from starlette.responses import Response
+
+from httpkit.tools.cache import CacheEntry, ResponseCache
+from httpkit.tools.spool import write_all
+
+INDEX_FILE = "index.jsonl"
+LOCK_FILE = "lock"
+OBJECTS_DIR = "objects"
+TEMP_DIR = "tmp"
+
+# Shards tried by DiskCache.open_shard, one per worker process
+MAX_SHARDS = 64
+
+# The journal is rewritten once it holds this many more records than there are entries
+JOURNAL_SLACK = 1024
+
+# Size of the mmap slices sent when the server cannot send the file itself
+SEND_CHUNK_SIZE = 256 * 1024
+
+
+class CacheLocked(Exception):
+    """Raised when another process holds the cache directory."""
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised for a byte range that lies entirely beyond the end of the body."""
+
+
+class DiskEntry(CacheEntry):
+    """A cache entry whose body is the file named by ``digest``."""
+
+    __slots__ = ("digest", "length")
+
+    def __init__(
+        self,
+        key: Tuple[str, Tuple[str, ...]],
+        status_code: int,
+        headers: Dict[str, str],
+        digest: str,
+        length: int,
+        request_time: float,
+        response_time: float,
+    ):
+        self.digest = digest
+        self.length = length
+        super().__init__(key, status_code, headers, b"", request_time, response_time)
+
+    def update_headers(self, headers: Dict[str, str], response_time: float):
+        super().update_headers(headers, response_time)
+        self.size += self.length
+
+
+def parse_range(value: str, length: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a ``Range`` header into the first and last byte offsets it asks for.
+
+    Returns:
+        None if the header should be ignored: another unit, several ranges
+        (the whole body is sent instead) or a malformed value.
+
+    Raises:
+        RangeNotSatisfiable: The range starts beyond the end of the body.
+    """
+    unit, _, ranges = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, dash, last = (part.strip() for part in ranges.partition("-"))
+    if not dash or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # A suffix range: the last N bytes
+        if int(last) == 0:
+            raise RangeNotSatisfiable()
+        return max(0, length - int(last)), length - 1
+    start = int(first)
+    end = min(int(last), length - 1) if last else length - 1
+    if start >= length:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, end
+
+
+class DiskCache(ResponseCache):
+    """
+    Byte-bounded LRU cache of upstream responses stored as files in ``directory``.
+
+    Args:
+        directory: Directory holding the index and the body files; created if needed.
+        max_bytes: Total budget for stored bodies and headers.
+        max_entry_bytes: Largest single response that will be stored.
+
+    Raises:
+        CacheLocked: Another process is using ``directory``.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_entry_bytes: Optional[int] = None):
+        super().__init__(max_bytes, max_entry_bytes)
+        self.directory = directory
+        self.references: Dict[str, int] = {}
+        os.makedirs(os.path.join(directory, OBJECTS_DIR), exist_ok=True)
+        os.makedirs(os.path.join(directory, TEMP_DIR), exist_ok=True)
+        self.lock_fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(self.lock_fd)
+                raise CacheLocked(directory)
+        # Bodies that were still being written when the last process stopped
+        for name in os.listdir(os.path.join(directory, TEMP_DIR)):
+            os.remove(os.path.join(directory, TEMP_DIR, name))
+        self.journal = None
+        self.records = 0
+        self.load()
+        self.compact(sweep=True)
+
+    @classmethod
+    def open_shard(cls, directory: str, max_bytes: int, max_entry_bytes: Optional[int] = None) -> "DiskCache":
+        """Open the first ``worker-N`` subdirectory of ``directory`` no other process holds."""
+        for shard in range(MAX_SHARDS):
+            try:
+                return cls(os.path.join(directory, f"worker-{shard}"), max_bytes, max_entry_bytes)
+            except CacheLocked:
+                continue
+        raise CacheLocked(directory)
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, OBJECTS_DIR, digest[:2], digest)
+
+    def stats(self) -> Dict[str, int]:
+        stats = super().stats()
+        stats["files"] = len(self.references)
+        return stats
+
+    def lookup(self, url: str, request_headers: Dict[str, str]) -> Optional[CacheEntry]:
+        entry = super().lookup(url, request_headers)
+        if entry is not None and not os.path.exists(self.object_path(entry.digest)):
+            # Deleted behind our back
+            self.remove(entry.key)
+            return None
+        return entry
+
+    def add(self, entry: CacheEntry) -> Optional[CacheEntry]:
+        self.references[entry.digest] = self.references.get(entry.digest, 0) + 1
+        added = super().add(entry)
+        if added is None:
+            self.release(entry.digest)
+        else:
+            self.append({"op": "put", **self.record(entry)})
+        return added
+
+    def discard(self, entry: CacheEntry):
+        self.release(entry.digest)
+        self.append({"op": "del", "url": entry.key[0], "key": list(entry.key[1])})
+
+    def refresh(self, entry: CacheEntry, not_modified_headers: Dict[str, str], response_time: float):
+        super().refresh(entry, not_modified_headers, response_time)
+        if entry.key in self.entries:
+            self.append({"op": "put", **self.record(entry)})
+
+    def release(self, digest: str):
+        """Drop a reference to a body file, deleting the file with its last reference."""
+        count = self.references.get(digest, 0) - 1
+        if count > 0:
+            self.references[digest] = count
+            return
+        self.references.pop(digest, None)
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def record(self, entry: DiskEntry) -> Dict[str, object]:
+        return {
+            "url": entry.key[0],
+            "key": list(entry.key[1]),
+            "vary": list(self.vary.get(entry.key[0], ())),
+            "status": entry.status_code,
+            "headers": entry.headers,
+            "digest": entry.digest,
+            "length": entry.length,
+            "request_time": entry.request_time,
+            "response_time": entry.response_time,
+        }
+
+    def append(self, record: Dict[str, object]):
+        """Append a record to the journal; nothing is written while the journal is replayed."""
+        if self.journal is None:
+            return
+        self.journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.journal.flush()
+        self.records += 1
+        if self.records > 2 * len(self.entries) + JOURNAL_SLACK:
+            self.compact()
+
+    def load(self):
+        """Replay the journal into the index, skipping entries whose file is missing or truncated."""
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        sizes: Dict[str, int] = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    key = (record["url"], tuple(record["key"]))
+                    if record["op"] == "del":
+                        self.remove(key)
+                        continue
+                    digest, length = record["digest"], record["length"]
+                except (ValueError, KeyError, TypeError):
+                    # A record cut short by a crash
+                    continue
+                if digest not in sizes:
+                    try:
+                        sizes[digest] = os.stat(self.object_path(digest)).st_size
+                    except OSError:
+                        sizes[digest] = -1
+                if sizes[digest] != length:
+                    self.remove(key)
+                    continue
+                self.vary[key[0]] = tuple(record["vary"])
+                self.add(DiskEntry(
+                    key, record["status"], record["headers"], digest, length,
+                    record["request_time"], record["response_time"],
+                ))
+        self.stores = self.evictions = 0
+
+    def compact(self, sweep: bool = False):
+        """
+        Rewrite the journal with one record per entry, least recently used first.
+
+        With ``sweep``, body files no entry refers to are deleted too.
+        """
+        if self.journal is not None:
+            self.journal.close()
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps({"op": "put", **self.record(entry)}, separators=(",", ":")) + "\n")
+        os.replace(path + ".tmp", path)
+        self.records = len(self.entries)
+        if sweep:
+            objects = os.path.join(self.directory, OBJECTS_DIR)
+            for prefix in os.listdir(objects):
+                for name in os.listdir(os.path.join(objects, prefix)):
+                    if name not in self.references:
+                        os.remove(os.path.join(objects, prefix, name))
+        self.journal = open(path, "a", encoding="utf-8")
+
+    def close(self):
+        """Rewrite the journal in LRU order and release the directory."""
+        if self.journal is None:
+            return
+        self.compact()
+        self.journal.close()
+        self.journal = None
+        os.close(self.lock_fd)
+
+    async def fill(
+        self,
+        chunks: AsyncIterator[bytes],
+        url: str,
+        request_headers: Dict[str, str],
+        status_code: int,
+        response_headers: Dict[str, str],
+        request_time: float,
+        response_time: float,
+    ) -> AsyncIterator[bytes]:
+        """
+        Pass ``chunks`` through unchanged while writing them to a file for the cache.
+
+        The response is stored only once the body has been read completely.
+        Writing is abandoned as soon as the body outgrows ``max_entry_bytes``.
+        Each chunk is written in a worker thread while it is sent to the
+        client, and the write is awaited before the next chunk is read.
+        """
+        loop = asyncio.get_running_loop()
+        fd, temp_path = self.temp_file()
+        digest = hashlib.blake2b(digest_size=20)
+        length = 0
+        writing: Optional[asyncio.Future] = None
+        try:
+            async for chunk in chunks:
+                if writing is not None:
+                    await asyncio.shield(writing)
+                    writing = None
+                if fd is not None:
+                    length += len(chunk)
+                    if length > self.max_entry_bytes:
+                        os.close(fd)
+                        os.remove(temp_path)
+                        fd = None
+                    else:
+                        digest.update(chunk)
+                        writing = loop.run_in_executor(None, write_all, fd, chunk)
+                yield chunk
+            if writing is not None:
+                await asyncio.shield(writing)
+                writing = None
+            if fd is not None:
+                os.close(fd)
+                fd = None
+                self.store_file(
+                    temp_path, digest.hexdigest(), length, url, request_headers,
+                    status_code, response_headers, request_time, response_time,
+                )
+        finally:
+            if fd is not None:
+                # The client went away or the upstream failed before the end of the body.
+                # The descriptor must outlive a write still running in the thread.
+                if writing is not None and not writing.done():
+                    writing.add_done_callback(lambda _, fd=fd, path=temp_path: discard_file(fd, path))
+                else:
+                    discard_file(fd, temp_path)
+
+    def temp_file(self) -> Tuple[int, str]:
+        temp_path = os.path.join(self.directory, TEMP_DIR, os.urandom(8).hex())
+        return os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), temp_path
+
+    def store_file(
+        self,
+        temp_path: str,
+        digest: str,
+        length: int,
+        url: str,
+        request_headers: Dict[str, str],
+        status_code: int,
+        response_headers: Dict[str, str],
+        request_time: float,
+        response_time: float,
+    ) -> Optional[CacheEntry]:
+        """Move a completely written body to its content address and store its entry."""
+        path = self.object_path(digest)
+        if digest in self.references:
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        key = self.store_key(url, request_headers, response_headers)
+        return self.add(DiskEntry(key, status_code, response_headers, digest, length, request_time, response_time))
+
+
+def discard_file(fd: int, path: str):
+    os.close(fd)
+    os.remove(path)
+
+
+class CachedFileResponse(Response):
+    """
+    Serve ``count`` bytes of an open cache file from ``offset``, then close the file.
+
+    The file is opened when the response is built, so the body stays readable
+    even if its entry is evicted and the file deleted before it is sent.
+    """
+
+    def __init__(self, fd: int, offset: int, count: int, status_code: int, headers: Dict[str, str]):
+        self.fd = fd
+        self.offset = offset
+        self.count = count
+        headers = {k: v for k, v in headers.items() if k.lower() != "content-length"}
+        super().__init__(status_code=status_code, headers={**headers, "Content-Length": str(count)})
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if self.count == 0 or scope.get("method") == "HEAD":
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            elif "http.response.zerocopysend" in (scope.get("extensions") or {}):
+                with open(self.fd, "rb", closefd=False) as file:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": self.offset,
+                        "count": self.count,
+                        "more_body": False,
+                    })
+            else:
+                mapped = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+                view = memoryview(mapped)
+                try:
+                    end = self.offset + self.count
+                    for position in range(self.offset, end, SEND_CHUNK_SIZE):
+                        await send({
+                            "type": "http.response.body",
+                            "body": view[position:min(end, position + SEND_CHUNK_SIZE)],
+                            "more_body": True,
+                        })
+                finally:
+                    view.release()
+                    try:
+                        mapped.close()
+                    except BufferError:
+                        # The server still buffers a slice; the map is unmapped once it lets go
+                        pass
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(self.fd)
@@ -0,0 +1,225 @@
+"""In-process DNS cache for upstream connections.
+
+httpx resolves an upstream's host name through the system resolver every time
+it opens a connection. :class:`DNSCache` keeps the addresses of each host for
+``ttl`` seconds instead, and remembers failed lookups for ``negative_ttl``
+seconds so a missing host fails fast. Concurrent lookups of the same host
+share one resolution. Hosts still in use are re-resolved in the background
+shortly before their entry expires, so busy upstreams never wait for DNS; if
+such a refresh fails, the previous addresses are kept.
+
+:class:`CachingNetworkBackend` plugs the cache into httpcore's connection
+setup. Only the TCP connect uses the cached address: TLS still verifies and
+sends SNI for the original host name.
+"""
+
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpcore
+
+Resolver = Callable[[str, int], Awaitable[List[str]]]
+
+
+async def system_resolver(host: str, port: int) -> List[str]:
+    """Resolve ``host`` with the system resolver, in the event loop's executor."""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    addresses = []
+    for family, _, _, _, sockaddr in infos:
+        if sockaddr[0] not in addresses:
+            addresses.append(sockaddr[0])
+    return addresses
+
+
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+class DNSEntry:
+    """The cached outcome of resolving one host."""
+
+    __slots__ = ("addresses", "error", "expires", "used")
+
+    def __init__(self, addresses: List[str], error: Optional[OSError], expires: float):
+        self.addresses = addresses
+        self.error = error
+        self.expires = expires
+        # Whether the entry was used since it was last resolved
+        self.used = False
+
+
+class DNSCache:
+    """
+    Cache of host name resolutions with TTLs, negative caching and background refresh.
+
+    Args:
+        ttl: Seconds a successful resolution is used.
+        negative_ttl: Seconds a failed resolution is remembered.
+        max_hosts: Number of hosts cached (least recently used are dropped).
+        resolver: Async callable ``(host, port) -> addresses``; the system
+            resolver by default.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        negative_ttl: float = 5.0,
+        max_hosts: int = 4096,
+        resolver: Optional[Resolver] = None,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_hosts = max_hosts
+        self.resolver = resolver or system_resolver
+        self.entries: "OrderedDict[str, DNSEntry]" = OrderedDict()
+        self.pending: Dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache size and counters."""
+        return {
+            "hosts": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
+
+    async def resolve(self, host: str, port: int) -> List[str]:
+        """
+        Return the addresses of ``host``, from the cache when possible.
+
+        Raises:
+            OSError: The host could not be resolved (now, or within ``negative_ttl``).
+        """
+        entry = self.entries.get(host)
+        if entry is not None and entry.expires > time.monotonic():
+            self.entries.move_to_end(host)
+            entry.used = True
+            if entry.error is not None:
+                self.negative_hits += 1
+                raise entry.error
+            self.hits += 1
+            return entry.addresses
+
+        self.misses += 1
+        entry = await self.lookup(host, port)
+        entry.used = True
+        if entry.error is not None:
+            raise entry.error
+        return entry.addresses
+
+    async def lookup(self, host: str, port: int) -> DNSEntry:
+        """Resolve ``host`` and store the result, sharing the lookup with concurrent callers."""
+        future = self.pending.get(host)
+        if future is None:
+            future = self.pending[host] = asyncio.ensure_future(self.resolve_entry(host, port))
+            future.add_done_callback(lambda _: self.pending.pop(host, None))
+        return await asyncio.shield(future)
+
+    async def resolve_entry(self, host: str, port: int) -> DNSEntry:
+        try:
+            addresses = await self.resolver(host, port)
+            if not addresses:
+                raise socket.gaierror(socket.EAI_NONAME, f"No addresses found for {host}")
+            entry = DNSEntry(addresses, None, time.monotonic() + self.ttl)
+        except OSError as e:
+            entry = DNSEntry([], e, time.monotonic() + self.negative_ttl)
+        self.entries[host] = entry
+        self.entries.move_to_end(host)
+        if len(self.entries) > self.max_hosts:
+            self.entries.popitem(last=False)
+        return entry
+
+    async def refresh_due(self, within: float):
+        """Re-resolve hosts used since their last resolution that expire within ``within`` seconds."""
+        now = time.monotonic()
+        due = []
+        for host, entry in list(self.entries.items()):
+            if entry.expires > now + within:
+                continue
+            if entry.used and entry.error is None:
+                due.append((host, entry))
+            elif entry.expires <= now:
+                # Expired and idle: drop it rather than keep resolving it
+                del self.entries[host]
+
+        for host, entry in due:
+            refreshed = await self.lookup(host, 0)
+            if refreshed.error is None:
+                self.refreshes += 1
+            else:
+                # Keep serving the last good addresses until the next attempt
+                self.refresh_failures += 1
+                entry.expires = time.monotonic() + self.negative_ttl
+                entry.used = False
+                self.entries[host] = entry
+
+    async def run_refresh(self, interval: float):
+        """Refresh hosts about to expire every ``interval`` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh_due(interval * 2)
+
+
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """
+    An httpcore network backend that connects to host names through a :class:`DNSCache`.
+
+    A host's addresses are tried in order until one accepts the connection.
+    """
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend, cache: DNSCache):
+        self.backend = backend
+        self.cache = cache
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if is_ip_address(host):
+            return await self.backend.connect_tcp(host, port, timeout, local_address, socket_options)
+        try:
+            addresses = await self.cache.resolve(host, port)
+        except OSError as e:
+            raise httpcore.ConnectError(f"Failed to resolve {host}: {e}") from e
+
+        error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self.backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds):
+        await self.backend.sleep(seconds)
+
+
+def install_dns_cache(transport, cache: DNSCache) -> bool:
+    """
+    Route the connections of an ``httpx.AsyncHTTPTransport`` through ``cache``.
+
+    httpx does not expose its network backend publicly, so this replaces
+    httpcore's and returns False if the pool's layout is unfamiliar.
+    """
+    pool = getattr(transport, "_pool", None)
+    backend = getattr(pool, "_network_backend", None)
+    if backend is None:
+        return False
+    pool._network_backend = CachingNetworkBackend(backend, cache)
+    return True
@@ -0,0 +1,111 @@
+"""Content-encoding negotiation and streaming response compression.
+
+By default the proxy decodes upstream bodies and sends them to clients
+uncompressed; only with ``HTTPKIT_ENCODING_PASSTHROUGH`` are they forwarded
+byte for byte. When response compression is enabled, uncompressed upstream
+responses with a compressible content type are compressed on the fly for
+clients that accept gzip or zstd. zstd is only offered when the optional
+``zstandard`` package is installed.
+
+Compressed chunks are flushed after every upstream chunk, so streamed
+responses reach the client as promptly as they would uncompressed.
+"""
+
+import zlib
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Encodings the proxy can produce, in order of preference
+SUPPORTED_ENCODINGS: Tuple[str, ...] = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+# Content types worth compressing; everything else (images, archives, ...) is
+# usually compressed already
+COMPRESSIBLE_PREFIXES = ("text/",)
+COMPRESSIBLE_TYPES = frozenset([
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/x-ndjson",
+    "application/graphql-response+json",
+    "image/svg+xml",
+])
+COMPRESSIBLE_SUFFIXES = ("+json", "+xml")
+
+# Streams that must not be delayed or re-framed by compression
+STREAMING_TYPES = frozenset(["text/event-stream"])
+
+
+def parse_accept_encoding(value: str) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into a mapping of coding to q-value."""
+    codings = {}
+    for item in value.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, number = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        codings[coding] = quality
+    return codings
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Return the preferred coding the client accepts out of ``SUPPORTED_ENCODINGS``, or None."""
+    if not accept_encoding:
+        return None
+    codings = parse_accept_encoding(accept_encoding)
+    wildcard = codings.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for coding in SUPPORTED_ENCODINGS:
+        quality = codings.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    """Return True if responses of ``content_type`` are worth compressing."""
+    if not content_type:
+        return False
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type in STREAMING_TYPES:
+        return False
+    return (
+        media_type.startswith(COMPRESSIBLE_PREFIXES)
+        or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith(COMPRESSIBLE_SUFFIXES)
+    )
+
+
+async def compress_chunks(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    """Compress a body with ``encoding`` ("gzip" or "zstd"), flushing after every chunk."""
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        async for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(flush_block)
+            if data:
+                yield data
+        yield compressor.flush()
+        return
+
+    # wbits=31 selects the gzip container
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
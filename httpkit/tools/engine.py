@@ -0,0 +1,56 @@
+"""Selection of the event loop and HTTP parser the proxy server runs on.
+
+uvicorn can run on the standard asyncio event loop with the pure-Python h11
+parser, or on uvloop with the httptools parser, which cut the per-request and
+per-byte overhead of the server considerably. The ``auto`` engine uses uvloop
+and httptools when they are installed (``pip install httpkit[fast]``) and
+falls back to asyncio and h11 otherwise; ``uvloop`` insists on them and
+``asyncio`` never uses them.
+"""
+
+import asyncio
+import importlib.util
+import sys
+from typing import Dict, Optional
+
+ENGINES = ("auto", "uvloop", "asyncio")
+
+
+def installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def server_options(engine: str) -> Dict[str, str]:
+    """
+    Return the uvicorn ``loop`` and ``http`` options for ``engine``.
+
+    Raises:
+        ValueError: If the engine is unknown, or is ``uvloop`` without uvloop and httptools installed.
+    """
+    if engine == "auto":
+        return {
+            "loop": "uvloop" if installed("uvloop") else "asyncio",
+            "http": "httptools" if installed("httptools") else "h11",
+        }
+    if engine == "uvloop":
+        missing = [module for module in ("uvloop", "httptools") if not installed(module)]
+        if missing:
+            raise ValueError(f"The uvloop engine needs {' and '.join(missing)} installed")
+        return {"loop": "uvloop", "http": "httptools"}
+    if engine == "asyncio":
+        return {"loop": "asyncio", "http": "h11"}
+    raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+
+
+def active_loop() -> str:
+    """Return the name of the running event loop's implementation."""
+    return "uvloop" if type(asyncio.get_running_loop()).__module__.startswith("uvloop") else "asyncio"
+
+
+def active_http_parser() -> Optional[str]:
+    """Return the HTTP parser uvicorn serves this process with, or None when not served by uvicorn."""
+    if "uvicorn.protocols.http.httptools_impl" in sys.modules:
+        return "httptools"
+    if "uvicorn.protocols.http.h11_impl" in sys.modules:
+        return "h11"
+    return None
@@ -0,0 +1,530 @@
+"""Per-origin concurrency limits with fair queuing for the proxy.
+
+Every upstream request needs a slot from :class:`ConcurrencyLimiter` for as
+long as its response is being streamed. A slot is only granted while both the
+global ceiling and the target origin's own limit have room. Requests that have
+to wait are queued by priority class and origin. Freed slots are shared
+between the classes by weighted deficit round robin, and within a class
+round-robin across the origins with waiters, so neither a flood of batch
+requests nor a slow backend with a deep queue can starve other traffic.
+
+Under overload the wait queue is bounded in length and in time: requests that
+cannot be queued, or that wait longer than the queue deadline, are shed with
+:class:`Overloaded`. Optionally, :class:`AIMDLimit` adapts the global ceiling
+to the upstream latency it measures.
+
+With several worker processes each one has its own limiter; a shared node
+budget (see :class:`httpkit.tools.workers.NodeBudget`) then caps the requests
+in flight across all of them. A worker that finds the node budget spent keeps
+its waiters queued and looks again every ``NODE_POLL_SECONDS``.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, Optional, Tuple
+
+
+def origin_of(url: str) -> str:
+    """Return the ``scheme://host:port`` origin of an absolute upstream URL."""
+    authority_start = url.index("://") + 3
+    path_start = url.find("/", authority_start)
+    return url if path_start == -1 else url[:path_start]
+
+
+# Name of the only priority class of a limiter configured without classes
+DEFAULT_PRIORITY = "default"
+
+# How often waiters are retried while other workers hold the whole node budget
+NODE_POLL_SECONDS = 0.005
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed because the wait queue is full or its wait deadline passed."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AIMDLimit:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit driven by upstream latency.
+
+    Each origin keeps a baseline: the lowest response-header latency seen in
+    the current and previous window of samples. A sample well above its
+    origin's baseline, or a failed request, signals congestion and shrinks the
+    limit by ``backoff`` (at most once per observed round trip). Otherwise the
+    limit grows by roughly one per round trip while it is actually being used.
+
+    Args:
+        initial: The starting limit.
+        min_limit: The limit never drops below this.
+        max_limit: The limit never grows above this.
+        backoff: Multiplier applied on congestion.
+        tolerance: Latency / baseline ratio above which a sample counts as congested.
+        min_delta: Absolute latency increase (seconds) ignored as noise.
+        window: Number of samples after which each origin's baseline is refreshed.
+        max_origins: Number of origin baselines kept (least recently used are dropped).
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: Optional[int] = None,
+        backoff: float = 0.9,
+        tolerance: float = 2.0,
+        min_delta: float = 0.01,
+        window: int = 500,
+        max_origins: int = 1024,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit or initial)
+        self.estimate = float(min(max(initial, self.min_limit), self.max_limit))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.min_delta = min_delta
+        self.window = window
+        self.max_origins = max_origins
+        self.last_decrease = 0.0
+        # origin -> (baseline, current window minimum, samples in current window)
+        self.baselines: "OrderedDict[str, Tuple[float, float, int]]" = OrderedDict()
+
+    @property
+    def limit(self) -> int:
+        return int(self.estimate)
+
+    def baseline(self, origin: str, latency: float) -> float:
+        """Fold ``latency`` into the origin's windowed minimum and return its baseline."""
+        baseline, window_min, samples = self.baselines.pop(origin, (latency, latency, 0))
+        window_min = min(window_min, latency)
+        baseline = min(baseline, latency)
+        samples += 1
+        if samples >= self.window:
+            # Forget old minimums so the baseline can follow a slower upstream
+            baseline, window_min, samples = window_min, math.inf, 0
+        self.baselines[origin] = (baseline, window_min, samples)
+        if len(self.baselines) > self.max_origins:
+            self.baselines.popitem(last=False)
+        return baseline
+
+    def update(self, origin: str, latency: float, in_flight: int, failed: bool = False) -> int:
+        """Record one request outcome and return the new limit."""
+        if failed:
+            congested = True
+        else:
+            baseline = self.baseline(origin, latency)
+            congested = latency > baseline * self.tolerance and latency - baseline > self.min_delta
+
+        if congested:
+            now = time.monotonic()
+            if now - self.last_decrease >= latency:
+                self.estimate = max(self.min_limit, self.estimate * self.backoff)
+                self.last_decrease = now
+        elif in_flight * 2 >= self.estimate:
+            self.estimate = min(self.max_limit, self.estimate + 1.0 / self.estimate)
+        return self.limit
+
+
+class OriginState:
+    """Slot accounting for a single origin, and its wait queues by priority class."""
+
+    __slots__ = ("origin", "limit", "active", "queues")
+
+    def __init__(self, origin: str, limit: int):
+        self.origin = origin
+        self.limit = limit
+        self.active = 0
+        # Priority class name -> requests of that class waiting for this origin
+        self.queues: Dict[str, "WaitQueue"] = {}
+
+    def queued(self) -> int:
+        return sum(queue.queued() for queue in self.queues.values())
+
+
+class WaitQueue:
+    """Requests of one priority class waiting for a slot for one origin, in arrival order."""
+
+    __slots__ = ("state", "waiters", "scheduled")
+
+    def __init__(self, state: OriginState):
+        self.state = state
+        self.waiters: Deque[asyncio.Future] = deque()
+        # Whether the queue is in its class's round-robin rotation
+        self.scheduled = False
+
+    def queued(self) -> int:
+        return sum(1 for waiter in self.waiters if not waiter.done())
+
+
+class PriorityClass:
+    """
+    A class of requests that gets a share of freed slots in proportion to its weight.
+
+    Args:
+        name: The class name.
+        weight: Relative share of freed slots while other classes are waiting too.
+        max_queue: Maximum number of waiting requests of this class, 0 for no bound.
+        max_wait: Maximum seconds a request of this class may wait for a slot,
+            0 for no deadline, or None for the limiter's deadline.
+    """
+
+    __slots__ = (
+        "name", "weight", "max_queue", "max_wait", "deficit", "ready", "backlogged", "waiting",
+        "granted", "shed_queue_full", "shed_timeout",
+    )
+
+    def __init__(self, name: str, weight: float = 1.0, max_queue: int = 0, max_wait: Optional[float] = None):
+        if weight <= 0:
+            raise ValueError(f"Priority class {name!r} needs a positive weight")
+        self.name = name
+        self.weight = weight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        # Slots the class may still take in its current deficit round-robin turn
+        self.deficit = 0.0
+        # Origin queues with waiters, served round-robin within the class
+        self.ready: Deque[WaitQueue] = deque()
+        self.backlogged = False
+        self.waiting = 0
+
+        self.granted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    def next_queue(self) -> Optional[WaitQueue]:
+        """Return the next origin queue whose first waiter can take a slot, dropping drained queues."""
+        for _ in range(len(self.ready)):
+            queue = self.ready[0]
+            waiters = queue.waiters
+            while waiters and waiters[0].done():
+                waiters.popleft()
+            if not waiters:
+                self.ready.popleft()
+                queue.scheduled = False
+                if queue.state.queues.get(self.name) is queue:
+                    del queue.state.queues[self.name]
+                continue
+            if queue.state.active >= queue.state.limit:
+                # Blocked by its own origin's limit; keep its place and try the next origin
+                self.ready.rotate(-1)
+                continue
+            return queue
+        return None
+
+    def queued(self) -> int:
+        return sum(queue.queued() for queue in self.ready)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "max_queue": self.max_queue,
+            "max_wait": self.max_wait,
+            "queued": self.queued(),
+            "granted": self.granted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+        }
+
+
+class Slot:
+    """Async context manager holding one limiter slot for an origin."""
+
+    __slots__ = ("limiter", "origin", "priority", "held")
+
+    def __init__(self, limiter: "ConcurrencyLimiter", origin: str, priority: Optional[str] = None):
+        self.limiter = limiter
+        self.origin = origin
+        self.priority = priority
+        self.held = False
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.origin, self.priority)
+        self.held = True
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def release(self):
+        """Give the slot back early; leaving the context afterwards does nothing."""
+        if self.held:
+            self.held = False
+            self.limiter.release(self.origin)
+
+
+class ConcurrencyLimiter:
+    """
+    Global concurrency ceiling with per-origin limits, priority classes and fair queuing.
+
+    Freed slots are shared between the priority classes with waiters by
+    deficit round robin: on its turn a class takes as many slots as its
+    accumulated weight allows, so under contention each class is served in
+    proportion to its weight, whatever the depth of its queue. Within a class,
+    origins with waiters are served round-robin.
+
+    Args:
+        limit: Maximum number of requests in flight across all origins.
+        origin_limit: Default maximum number of requests in flight per origin.
+        origin_overrides: Per-origin limits that replace ``origin_limit``.
+        max_queue: Maximum number of waiting requests, 0 for no bound.
+        max_wait: Maximum seconds a request may wait for a slot, 0 for no deadline.
+        retry_after: Seconds suggested to shed clients before retrying.
+        adaptive: Optional latency-driven controller for the global limit.
+        priorities: The priority classes; a single ``default`` class when omitted.
+        default_priority: Class of requests without a known class; the first one by default.
+        node: Optional budget shared with the other workers of the node, with
+            ``take()`` and ``give()`` methods; every granted slot holds one unit of it.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        origin_limit: Optional[int] = None,
+        origin_overrides: Optional[Dict[str, int]] = None,
+        max_queue: int = 0,
+        max_wait: float = 0.0,
+        retry_after: int = 1,
+        adaptive: Optional[AIMDLimit] = None,
+        priorities: Optional[Iterable[PriorityClass]] = None,
+        default_priority: Optional[str] = None,
+        node=None,
+    ):
+        self.limit = adaptive.limit if adaptive else limit
+        self.origin_limit = origin_limit or limit
+        self.origin_overrides = dict(origin_overrides or {})
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.adaptive = adaptive
+        self.active = 0
+        self.waiting = 0
+        self.origins: Dict[str, OriginState] = {}
+        self.priorities: Dict[str, PriorityClass] = {
+            priority.name: priority for priority in priorities or [PriorityClass(DEFAULT_PRIORITY)]
+        }
+        self.default_priority = self.priorities[default_priority or next(iter(self.priorities))]
+        # Classes with waiters, in deficit round-robin order
+        self.backlog: Deque[PriorityClass] = deque()
+        self.node = node
+        self.node_poll: Optional[asyncio.TimerHandle] = None
+
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+
+    def slot(self, origin: str, priority: Optional[str] = None) -> Slot:
+        """Return an async context manager that holds a slot for ``origin``."""
+        return Slot(self, origin, priority)
+
+    def state_for(self, origin: str) -> OriginState:
+        state = self.origins.get(origin)
+        if state is None:
+            state = OriginState(origin, self.origin_overrides.get(origin, self.origin_limit))
+            self.origins[origin] = state
+        return state
+
+    async def acquire(self, origin: str, priority: Optional[str] = None):
+        """
+        Wait until a slot for ``origin`` is available and take it.
+
+        Args:
+            origin: The upstream origin.
+            priority: The request's priority class; unknown or missing classes
+                use the default class.
+
+        Raises:
+            Overloaded: If the wait queue is full or the wait deadline passes.
+        """
+        cls = self.priorities.get(priority, self.default_priority) if priority else self.default_priority
+        state = self.state_for(origin)
+        if (
+            self.active < self.limit and state.active < state.limit and not state.queues
+            and (self.node is None or self.node.take())
+        ):
+            self.grant(state)
+            cls.granted += 1
+            return
+
+        if (self.max_queue and self.waiting >= self.max_queue) or (cls.max_queue and cls.waiting >= cls.max_queue):
+            self.shed_queue_full += 1
+            cls.shed_queue_full += 1
+            self.discard_idle(state)
+            raise Overloaded("Too many requests waiting for an upstream slot", self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue = state.queues.get(cls.name)
+        if queue is None:
+            queue = state.queues[cls.name] = WaitQueue(state)
+        queue.waiters.append(waiter)
+        if not queue.scheduled:
+            queue.scheduled = True
+            cls.ready.append(queue)
+        if not cls.backlogged:
+            cls.backlogged = True
+            self.backlog.append(cls)
+        self.waiting += 1
+        cls.waiting += 1
+        if self.active < self.limit:
+            # Capacity is free, but earlier waiters of this origin may come first
+            self.dispatch()
+        max_wait = self.max_wait if cls.max_wait is None else cls.max_wait
+        try:
+            if max_wait:
+                await asyncio.wait_for(waiter, max_wait)
+            else:
+                await waiter
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as the deadline passed; keep it
+                return
+            self.shed_timeout += 1
+            cls.shed_timeout += 1
+            self.discard_idle(state)
+            raise Overloaded("Timed out waiting for an upstream slot", self.retry_after)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as the waiter was cancelled
+                self.release(origin)
+            else:
+                self.discard_idle(state)
+            raise
+        finally:
+            self.waiting -= 1
+            cls.waiting -= 1
+
+    def release(self, origin: str):
+        """Return a slot taken for ``origin`` and hand freed capacity to waiters."""
+        state = self.origins[origin]
+        state.active -= 1
+        self.active -= 1
+        if self.node is not None:
+            self.node.give()
+        self.dispatch()
+        self.discard_idle(state)
+
+    def grant(self, state: OriginState):
+        state.active += 1
+        self.active += 1
+
+    def dispatch(self):
+        """Grant free slots to queued requests: classes by deficit round robin, origins round-robin within a class."""
+        backlog = self.backlog
+        blocked = 0
+        while self.active < self.limit and blocked < len(backlog):
+            cls = backlog[0]
+            queue = cls.next_queue()
+            if queue is None:
+                if cls.ready:
+                    # Every origin the class waits for is at its own limit
+                    backlog.rotate(-1)
+                    blocked += 1
+                else:
+                    backlog.popleft()
+                    cls.backlogged = False
+                    cls.deficit = 0.0
+                continue
+            if cls.deficit < 1:
+                # A new turn: the class earns its weight in slots
+                cls.deficit += cls.weight
+                if cls.deficit < 1:
+                    backlog.rotate(-1)
+                    continue
+            if self.node is not None and not self.node.take():
+                # Other workers hold the rest of the node budget
+                self.poll_node()
+                break
+
+            blocked = 0
+            cls.deficit -= 1
+            cls.granted += 1
+            self.grant(queue.state)
+            queue.waiters.popleft().set_result(None)
+            # The class's next slot goes to its next origin, and its turn ends once its credit is spent
+            cls.ready.rotate(-1)
+            if cls.deficit < 1:
+                backlog.rotate(-1)
+
+    def poll_node(self):
+        if self.node_poll is None:
+            self.node_poll = asyncio.get_running_loop().call_later(NODE_POLL_SECONDS, self.repoll)
+
+    def repoll(self):
+        self.node_poll = None
+        self.dispatch()
+
+    def discard_idle(self, state: OriginState):
+        """Forget origins with nothing in flight or queued, so the table stays bounded."""
+        if state.active == 0 and state.queued() == 0 and self.origins.get(state.origin) is state:
+            del self.origins[state.origin]
+
+    def set_limit(self, limit: int):
+        """Change the global ceiling, granting queued requests if it grew."""
+        self.limit = limit
+        self.dispatch()
+
+    def observe(self, origin: str, latency: float, failed: bool = False):
+        """Feed an upstream response latency (or failure) to the adaptive controller, if any."""
+        if self.adaptive is None:
+            return
+        limit = self.adaptive.update(origin, latency, self.active, failed)
+        if limit != self.limit:
+            self.set_limit(limit)
+
+    def queued(self) -> int:
+        """Return the number of requests waiting for a slot."""
+        return sum(state.queued() for state in self.origins.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the global, per-class and per-origin slot usage and queue depths."""
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued(),
+            "adaptive": self.adaptive is not None,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+            "priorities": {name: priority.stats() for name, priority in self.priorities.items()},
+            "origins": {
+                origin: {"limit": state.limit, "active": state.active, "queued": state.queued()}
+                for origin, state in self.origins.items()
+            },
+        }
+
+
+def pool_stats(client) -> Dict[str, Dict[str, int]]:
+    """
+    Return active/idle connection counts per origin for an httpx client's pool.
+
+    httpx does not expose its pool publicly, so this inspects httpcore's
+    connection pool and returns an empty result if its layout is unfamiliar.
+    A :class:`~httpkit.tools.rawhttp.RawTransport` reports its own
+    connections, and those of its httpx fallback. The connections of a
+    :class:`~httpkit.tools.unixsocket.UnixSocketTransport` are counted for
+    its socket's origin.
+    """
+    transport = getattr(client, "_transport", None)
+    counts: Dict[str, Dict[str, int]] = {}
+    if hasattr(transport, "connection_counts"):
+        counts.update(transport.connection_counts())
+        transport = transport.fallback
+    socket_origin = getattr(transport, "origin", None)
+    pool = getattr(transport, "_pool", None)
+    for connection in getattr(pool, "connections", None) or []:
+        origin = getattr(connection, "_origin", None)
+        if origin is None:
+            continue
+        name = socket_origin or f"{origin.scheme.decode()}://{origin.host.decode()}:{origin.port}"
+        entry = counts.setdefault(name, {"active": 0, "idle": 0})
+        entry["idle" if connection.is_idle() else "active"] += 1
+    return counts
+
+
+def pool_pending(client) -> int:
+    """Return the number of requests waiting for a connection from an httpx client's pool."""
+    transport = getattr(client, "_transport", None)
+    pool = getattr(getattr(transport, "fallback", transport), "_pool", None)
+    requests = getattr(pool, "_requests", None) or []
+    return sum(1 for request in requests if getattr(request, "connection", None) is None)
@@ -0,0 +1,458 @@
+"""Prometheus metrics for the proxy.
+
+Every metric value lives in a preallocated array of float64 slots. Series are
+assigned slots the first time a label combination is seen; after that,
+recording a request is a few dictionary lookups and in-place additions, with
+no allocations and no locks (each worker process only writes its own slots
+from its event loop thread).
+
+With several worker processes, each worker's slots are a memory-mapped file in
+a shared directory, next to a small index describing its series. Whichever
+worker serves ``/metrics`` reads every worker's file and sums them, so the
+exposition covers the whole server. When a worker exits, for whatever reason,
+the supervisor calls :func:`retire_worker`: the worker's counters and
+histograms are added to a ``retired`` file, its gauges are dropped, and its
+own files are deleted, so a crashed worker neither inflates the gauges nor
+leaves a file behind for every scrape to read.
+"""
+
+import json
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Distinct upstream label values kept before further upstreams are reported as "other"
+MAX_UPSTREAM_LABELS = 256
+
+# Slot 0 absorbs writes once the store is full, so recording never fails
+SINK = 0
+
+# Files holding the counters and histograms of workers that exited, and the lock
+# that keeps scrapes from reading them while a worker is being retired
+RETIRED = "retired"
+LOCK_FILE = ".lock"
+
+HELP = {
+    "httpkit_requests_total": ("counter", "Proxied requests by method, status and upstream origin."),
+    "httpkit_request_duration_seconds": ("histogram", "Time from receiving a proxied request until its response was sent."),
+    "httpkit_upstream_ttfb_seconds": ("histogram", "Time from sending a request upstream until its response headers arrived."),
+    "httpkit_queue_wait_seconds": ("histogram", "Time requests waited for a concurrency slot."),
+    "httpkit_request_bytes_total": ("counter", "Request body bytes received from clients."),
+    "httpkit_response_bytes_total": ("counter", "Response body bytes sent to clients."),
+    "httpkit_requests_shed_total": ("counter", "Requests rejected with 503 because the proxy was overloaded."),
+    "httpkit_concurrency_limit": ("gauge", "Current global concurrency limit."),
+    "httpkit_concurrency_active": ("gauge", "Requests currently holding a concurrency slot."),
+    "httpkit_concurrency_queued": ("gauge", "Requests waiting for a concurrency slot."),
+    "httpkit_pool_connections": ("gauge", "Upstream connections in the httpx pools by state."),
+    "httpkit_pool_pending_requests": ("gauge", "Requests waiting for an upstream connection from the httpx pools."),
+    "httpkit_circuit_breakers": ("gauge", "Upstream circuit breakers by state."),
+    "httpkit_circuit_breaker_transitions_total": ("counter", "Circuit breaker state changes by upstream origin and new state."),
+    "httpkit_circuit_breaker_rejected_total": ("counter", "Requests rejected with 503 because their upstream's circuit was open."),
+    "httpkit_priority_requests_total": ("counter", "Requests granted a concurrency slot by priority class."),
+    "httpkit_priority_queue_wait_seconds": ("histogram", "Time requests waited for a concurrency slot by priority class."),
+    "httpkit_priority_queued": ("gauge", "Requests waiting for a concurrency slot by priority class."),
+    "httpkit_priority_shed_total": ("counter", "Requests rejected with 503 while queued by priority class."),
+    "httpkit_streams_active": ("gauge", "Event streams currently being relayed."),
+    "httpkit_stream_first_event_seconds": ("histogram", "Time from receiving a streamed request until its first event was relayed."),
+    "httpkit_stream_event_gap_seconds": ("histogram", "Time between consecutive events of a stream."),
+    "httpkit_stream_idle_timeouts_total": ("counter", "Streams ended because their upstream sent nothing for the idle timeout."),
+    "httpkit_rate_limited_total": ("counter", "Requests rejected with 429 by rate limit (client, api_key or origin)."),
+    "httpkit_access_log_dropped_total": ("counter", "Access log records dropped because the write buffer was full."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class SlotStore:
+    """
+    A fixed number of float64 slots, in process memory or in a memory-mapped file.
+
+    Args:
+        capacity: Number of slots to preallocate.
+        directory: Directory shared by all workers, or None for a private store.
+    """
+
+    def __init__(self, capacity: int = 65536, directory: Optional[str] = None):
+        self.capacity = capacity
+        self.used = SINK + 1
+        self.series: List[Tuple[str, Labels, int, int]] = []
+        self.directory = directory
+        self.index_file = None
+        if directory:
+            path = os.path.join(directory, f"worker-{os.getpid()}")
+            with open(path + ".db", "wb") as f:
+                f.truncate(capacity * 8)
+            with open(path + ".db", "r+b") as f:
+                self.buffer = mmap.mmap(f.fileno(), capacity * 8)
+            self.index_file = open(path + ".json", "w", encoding="utf-8")
+        else:
+            self.buffer = bytearray(capacity * 8)
+        self.values = memoryview(self.buffer).cast("d")
+
+    def allocate(self, name: str, labels: Labels, size: int = 1) -> int:
+        """Reserve ``size`` consecutive slots for a series and return the first one."""
+        if self.used + size > self.capacity:
+            return SINK
+        start = self.used
+        self.used += size
+        self.series.append((name, labels, start, size))
+        if self.index_file is not None:
+            self.index_file.write(json.dumps([name, labels, start, size]) + "\n")
+            self.index_file.flush()
+        return start
+
+    def close(self):
+        if self.index_file is not None:
+            self.index_file.close()
+            self.values.release()
+            self.buffer.close()
+
+
+@contextmanager
+def locked(directory: str, exclusive: bool) -> Iterator[None]:
+    """Hold the metrics directory's lock, shared by scrapes and exclusive while retiring a worker."""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+
+def read_files(path: str) -> Optional[Tuple[List[Tuple[str, Labels, int, int]], memoryview]]:
+    """Return the series index and slot values of the ``.json`` and ``.db`` files at ``path``, or None if missing."""
+    try:
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        with open(path + ".db", "rb") as f:
+            values = memoryview(f.read()).cast("d")
+    except OSError:
+        return None
+    series = []
+    for line in lines:
+        try:
+            name, labels, start, size = json.loads(line)
+        except ValueError:
+            # A line still being written by its worker
+            continue
+        series.append((name, tuple(tuple(pair) for pair in labels), start, size))
+    return series, values
+
+
+def read_worker_files(directory: str) -> Iterable[Tuple[List[Tuple[str, Labels, int, int]], memoryview]]:
+    """Yield the series index and slot values of every worker that wrote to ``directory``, and of retired ones."""
+    with locked(directory, exclusive=False):
+        sources = []
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".json"):
+                source = read_files(os.path.join(directory, filename[:-5]))
+                if source is not None:
+                    sources.append(source)
+    return sources
+
+
+def retire_worker(directory: str, pid: int):
+    """
+    Fold the counters and histograms of the exited worker ``pid`` into the retired file and delete its files.
+
+    Its gauges describe a process that no longer exists, so they are dropped.
+    """
+    path = os.path.join(directory, f"worker-{pid}")
+    retired_path = os.path.join(directory, RETIRED)
+    with locked(directory, exclusive=True):
+        source = read_files(path)
+        if source is not None:
+            retired = read_files(retired_path)
+            slots = {}
+            values = array("d")
+            if retired is not None:
+                slots = {(name, labels): (start, size) for name, labels, start, size in retired[0]}
+                values.frombytes(retired[1].tobytes())
+            new_series = []
+            for name, labels, start, size in source[0]:
+                if HELP.get(name, ("counter",))[0] == "gauge" or start + size > len(source[1]):
+                    continue
+                slot = slots.get((name, labels))
+                if slot is None:
+                    slot = slots[(name, labels)] = (len(values), size)
+                    values.extend([0.0] * size)
+                    new_series.append(json.dumps([name, labels, slot[0], size]) + "\n")
+                for i in range(size):
+                    values[slot[0] + i] += source[1][start + i]
+            with open(retired_path + ".db", "wb") as f:
+                values.tofile(f)
+            with open(retired_path + ".json", "a", encoding="utf-8") as f:
+                f.writelines(new_series)
+        for suffix in (".json", ".db"):
+            try:
+                os.unlink(path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+class ProxyMetrics:
+    """
+    Counters, gauges and histograms recorded by the proxy.
+
+    Args:
+        directory: Directory shared by all worker processes, or None when
+            running a single process.
+        capacity: Number of slots preallocated per worker.
+    """
+
+    def __init__(self, directory: Optional[str] = None, capacity: int = 65536):
+        self.store = SlotStore(capacity, directory)
+        self.values = self.store.values
+        self.buckets = LATENCY_BUCKETS
+        self.histogram_size = len(self.buckets) + 3  # buckets, +Inf, sum, count
+
+        # method -> status -> upstream -> slot
+        self.request_slots: Dict[str, Dict[int, Dict[str, int]]] = {}
+        # upstream -> first slot of its histogram
+        self.duration_slots: Dict[str, int] = {}
+        self.ttfb_slots: Dict[str, int] = {}
+        self.first_event_slots: Dict[str, int] = {}
+        self.event_gap_slots: Dict[str, int] = {}
+        # (upstream, state) -> slot
+        self.transition_slots: Dict[Tuple[str, str], int] = {}
+        # priority class -> (queue wait histogram, requests, shed, queued) slots
+        self.priority_slots: Dict[str, Tuple[int, int, int, int]] = {}
+        # rate limit -> rejected slot
+        self.rate_limited_slots: Dict[str, int] = {}
+        self.upstreams = set()
+
+        self.queue_wait = self.store.allocate("httpkit_queue_wait_seconds", (), self.histogram_size)
+        self.bytes_in = self.store.allocate("httpkit_request_bytes_total", ())
+        self.bytes_out = self.store.allocate("httpkit_response_bytes_total", ())
+        self.shed = self.store.allocate("httpkit_requests_shed_total", ())
+        self.limit = self.store.allocate("httpkit_concurrency_limit", ())
+        self.active = self.store.allocate("httpkit_concurrency_active", ())
+        self.queued = self.store.allocate("httpkit_concurrency_queued", ())
+        self.pool_active = self.store.allocate("httpkit_pool_connections", (("state", "active"),))
+        self.pool_idle = self.store.allocate("httpkit_pool_connections", (("state", "idle"),))
+        self.pool_pending = self.store.allocate("httpkit_pool_pending_requests", ())
+        self.breakers_open = self.store.allocate("httpkit_circuit_breakers", (("state", "open"),))
+        self.breakers_half_open = self.store.allocate("httpkit_circuit_breakers", (("state", "half_open"),))
+        self.breaker_rejected = self.store.allocate("httpkit_circuit_breaker_rejected_total", ())
+        self.streams_active = self.store.allocate("httpkit_streams_active", ())
+        self.stream_idle_timeouts = self.store.allocate("httpkit_stream_idle_timeouts_total", ())
+        self.access_log_dropped = self.store.allocate("httpkit_access_log_dropped_total", ())
+        self.gauges = (
+            self.limit, self.active, self.queued, self.pool_active, self.pool_idle, self.pool_pending,
+            self.breakers_open, self.breakers_half_open, self.streams_active,
+        )
+
+    def upstream_label(self, upstream: str) -> str:
+        """Return the label for ``upstream``, folding new upstreams into "other" past the cap."""
+        if upstream in self.upstreams:
+            return upstream
+        if len(self.upstreams) >= MAX_UPSTREAM_LABELS:
+            return "other"
+        self.upstreams.add(upstream)
+        return upstream
+
+    def request_slot(self, method: str, status: int, upstream: str) -> int:
+        try:
+            return self.request_slots[method][status][upstream]
+        except KeyError:
+            pass
+        label = self.upstream_label(upstream)
+        by_upstream = self.request_slots.setdefault(method, {}).setdefault(status, {})
+        slot = by_upstream.get(label)
+        if slot is None:
+            slot = self.store.allocate(
+                "httpkit_requests_total",
+                (("method", method), ("status", str(status)), ("upstream", label)),
+            )
+            by_upstream[label] = slot
+        return slot
+
+    def histogram_slot(self, slots: Dict[str, int], name: str, upstream: str) -> int:
+        start = slots.get(upstream)
+        if start is None:
+            label = self.upstream_label(upstream)
+            start = slots.get(label)
+            if start is None:
+                start = self.store.allocate(name, (("upstream", label),), self.histogram_size)
+                slots[label] = start
+        return start
+
+    def observe(self, start: int, value: float):
+        """Add ``value`` to the histogram whose slots begin at ``start``."""
+        values = self.values
+        values[start + bisect_left(self.buckets, value)] += 1
+        values[start + self.histogram_size - 2] += value
+        values[start + self.histogram_size - 1] += 1
+
+    def record_request(self, method: str, status: int, upstream: str, duration: float, bytes_out: int):
+        """Record a finished proxied request."""
+        self.values[self.request_slot(method, status, upstream)] += 1
+        self.observe(self.histogram_slot(self.duration_slots, "httpkit_request_duration_seconds", upstream), duration)
+        self.values[self.bytes_out] += bytes_out
+
+    def record_upstream(self, upstream: str, queue_wait: float, ttfb: float):
+        """Record the queue wait and time to first byte of one upstream request."""
+        self.observe(self.queue_wait, queue_wait)
+        self.observe(self.histogram_slot(self.ttfb_slots, "httpkit_upstream_ttfb_seconds", upstream), ttfb)
+
+    def slots_for_priority(self, priority: str) -> Tuple[int, int, int, int]:
+        slots = self.priority_slots.get(priority)
+        if slots is None:
+            labels = (("priority", priority),)
+            slots = self.priority_slots[priority] = (
+                self.store.allocate("httpkit_priority_queue_wait_seconds", labels, self.histogram_size),
+                self.store.allocate("httpkit_priority_requests_total", labels),
+                self.store.allocate("httpkit_priority_shed_total", labels),
+                self.store.allocate("httpkit_priority_queued", labels),
+            )
+        return slots
+
+    def record_priority(self, priority: str, queue_wait: float):
+        """Record a request of class ``priority`` granted a slot after ``queue_wait`` seconds."""
+        wait, requests, _, _ = self.slots_for_priority(priority)
+        self.observe(wait, queue_wait)
+        self.values[requests] += 1
+
+    def record_first_event(self, upstream: str, seconds: float):
+        """Record the time until the first event of a stream from ``upstream``."""
+        self.observe(self.histogram_slot(self.first_event_slots, "httpkit_stream_first_event_seconds", upstream), seconds)
+
+    def record_event_gap(self, upstream: str, seconds: float):
+        """Record the time between two events of a stream from ``upstream``."""
+        self.observe(self.histogram_slot(self.event_gap_slots, "httpkit_stream_event_gap_seconds", upstream), seconds)
+
+    def record_transition(self, upstream: str, state: str):
+        """Count a circuit breaker of ``upstream`` changing to ``state``."""
+        slot = self.transition_slots.get((upstream, state))
+        if slot is None:
+            label = self.upstream_label(upstream)
+            slot = self.transition_slots.get((label, state))
+            if slot is None:
+                slot = self.store.allocate(
+                    "httpkit_circuit_breaker_transitions_total", (("upstream", label), ("state", state))
+                )
+                self.transition_slots[(label, state)] = slot
+        self.values[slot] += 1
+
+    def add_bytes_in(self, count: int):
+        self.values[self.bytes_in] += count
+
+    def set_gauges(self, limit: int, active: int, queued: int, shed: int, pool_active: int, pool_idle: int, pool_pending: int):
+        """Store this worker's current limiter and connection pool state."""
+        values = self.values
+        values[self.limit] = limit
+        values[self.active] = active
+        values[self.queued] = queued
+        values[self.shed] = shed
+        values[self.pool_active] = pool_active
+        values[self.pool_idle] = pool_idle
+        values[self.pool_pending] = pool_pending
+
+    def set_breaker_gauges(self, open_count: int, half_open_count: int, rejected: int):
+        """Store this worker's circuit breaker counts."""
+        values = self.values
+        values[self.breakers_open] = open_count
+        values[self.breakers_half_open] = half_open_count
+        values[self.breaker_rejected] = rejected
+
+    def set_priority_gauges(self, priority: str, queued: int, shed: int):
+        """Store this worker's queue depth and shed count of a priority class."""
+        _, _, shed_slot, queued_slot = self.slots_for_priority(priority)
+        self.values[queued_slot] = queued
+        self.values[shed_slot] = shed
+
+    def set_stream_gauges(self, active: int, idle_timeouts: int):
+        """Store this worker's open streams and idle timeout count."""
+        self.values[self.streams_active] = active
+        self.values[self.stream_idle_timeouts] = idle_timeouts
+
+    def set_rate_limit_gauges(self, rejected: Dict[str, int]):
+        """Store this worker's rate limit rejections by limit."""
+        for limit, count in rejected.items():
+            slot = self.rate_limited_slots.get(limit)
+            if slot is None:
+                slot = self.rate_limited_slots[limit] = self.store.allocate("httpkit_rate_limited_total", (("limit", limit),))
+            self.values[slot] = count
+
+    def set_access_log_gauges(self, dropped: int):
+        """Store this worker's count of dropped access log records."""
+        self.values[self.access_log_dropped] = dropped
+
+    def close(self):
+        """Zero this worker's gauges so a stopped worker no longer contributes to them."""
+        for slot in self.gauges:
+            self.values[slot] = 0
+        for _, _, _, queued in self.priority_slots.values():
+            self.values[queued] = 0
+        self.store.close()
+
+    def collect(self) -> Dict[Tuple[str, Labels], List[float]]:
+        """Return the slot values of every series, summed across workers."""
+        if self.store.directory:
+            sources = list(read_worker_files(self.store.directory))
+        else:
+            sources = [(self.store.series, self.values)]
+
+        totals: Dict[Tuple[str, Labels], List[float]] = {}
+        for series, values in sources:
+            for name, labels, start, size in series:
+                if start + size > len(values):
+                    continue
+                total = totals.get((name, labels))
+                if total is None:
+                    total = totals[(name, labels)] = [0.0] * size
+                for i in range(size):
+                    total[i] += values[start + i]
+        return totals
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        by_name: Dict[str, List[Tuple[Labels, List[float]]]] = {}
+        for (name, labels), values in self.collect().items():
+            by_name.setdefault(name, []).append((labels, values))
+
+        lines = []
+        for name, (kind, help_text) in HELP.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, values in sorted(by_name.get(name, [])):
+                if kind == "histogram":
+                    cumulative = 0.0
+                    for bound, count in zip(self.buckets + (float("inf"),), values):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {format_value(cumulative)}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {format_value(values[-2])}")
+                    lines.append(f"{name}_count{format_labels(labels)} {format_value(values[-1])}")
+                else:
+                    lines.append(f"{name}{format_labels(labels)} {format_value(values[0])}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = (f'{key}="{escape_label(value)}"' for key, value in labels)
+    return "{" + ",".join(pairs) + "}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
@@ -0,0 +1,179 @@
+"""Priority classes for proxied requests.
+
+Requests are put in a priority class so that the concurrency limiter can
+share slots between classes by weight (see
+:class:`~httpkit.tools.limits.ConcurrencyLimiter`): for example interactive
+calls with weight 8 and batch backfills with weight 1 get eight slots for
+every one the backfill gets while both are queued, and the backfill still
+progresses.
+
+A request's class is taken from the priority header if the client sent one
+naming a configured class, otherwise from the first matching rule on the
+upstream origin (or upstream group) and path, otherwise it is the default
+class. The header is not forwarded upstream.
+
+Classes and rules come from the configuration file::
+
+    {
+      "priority_classes": {
+        "interactive": {"weight": 8, "max_queue_size": 200, "max_queue_wait_seconds": 2},
+        "batch": {"weight": 1, "max_queue_size": 5000, "max_queue_wait_seconds": 60}
+      },
+      "default_priority": "interactive",
+      "priority_rules": [
+        {"path_prefix": "/v1/batches", "priority": "batch"},
+        {"group": "backfill", "priority": "batch"}
+      ]
+    }
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from httpkit.tools.balancer import UpstreamGroup, normalize_origin
+from httpkit.tools.limits import PriorityClass, origin_of
+
+PRIORITY_HEADER = "X-HTTPKit-Priority"
+
+
+class PriorityRule:
+    """
+    Assigns a class to requests for some origins and/or path prefix.
+
+    Args:
+        priority: The class assigned by the rule.
+        origins: Upstream origins the rule applies to, or None for any origin.
+        path_prefix: Upstream path prefix the rule applies to, or None for any path.
+    """
+
+    __slots__ = ("priority", "origins", "path_prefix")
+
+    def __init__(self, priority: str, origins: Optional[Iterable[str]] = None, path_prefix: Optional[str] = None):
+        self.priority = priority
+        self.origins = frozenset(origins) if origins is not None else None
+        self.path_prefix = path_prefix
+
+    def matches(self, origin: str, path: str) -> bool:
+        if self.origins is not None and origin not in self.origins:
+            return False
+        return self.path_prefix is None or path.startswith(self.path_prefix)
+
+
+class Classifier:
+    """
+    Assign proxied requests to priority classes.
+
+    Args:
+        classes: Names of the configured classes.
+        default: Class of requests no header or rule assigns.
+        rules: Rules tried in order after the header.
+        header: Request header naming the class, or None to ignore headers.
+    """
+
+    def __init__(
+        self,
+        classes: Iterable[str],
+        default: str,
+        rules: Iterable[PriorityRule] = (),
+        header: Optional[str] = PRIORITY_HEADER,
+    ):
+        self.classes = frozenset(classes)
+        self.default = default
+        self.rules = list(rules)
+        self.header = header.lower().encode("latin-1") if header else None
+        for name in [default] + [rule.priority for rule in self.rules]:
+            if name not in self.classes:
+                raise ValueError(f"Unknown priority class: {name}")
+
+    def classify(
+        self, headers: List[Tuple[bytes, bytes]], target_url: str
+    ) -> Tuple[str, List[Tuple[bytes, bytes]]]:
+        """
+        Return the class of a request, and its headers without the priority header.
+
+        Args:
+            headers: The request headers to forward, as raw byte pairs with lowercase names.
+            target_url: The full upstream URL.
+        """
+        if self.header is not None:
+            for name, value in headers:
+                if name == self.header:
+                    headers = [(k, v) for k, v in headers if k != self.header]
+                    value = value.decode("latin-1").strip()
+                    if value in self.classes:
+                        return value, headers
+                    break
+
+        if self.rules:
+            origin = origin_of(target_url)
+            path = target_url[len(origin):] or "/"
+            for rule in self.rules:
+                if rule.matches(origin, path):
+                    return rule.priority, headers
+        return self.default, headers
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """Parse ``name=weight,name=weight`` pairs, e.g. ``interactive=8,batch=1``."""
+    weights = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight) if weight.strip() else 1.0
+    return weights
+
+
+def load_priorities(
+    config: Dict[str, Any],
+    groups: Dict[str, UpstreamGroup],
+    weights: Optional[Dict[str, float]] = None,
+    default: Optional[str] = None,
+    header: Optional[str] = PRIORITY_HEADER,
+) -> Tuple[List[PriorityClass], Optional[Classifier]]:
+    """
+    Build the priority classes and the classifier from a configuration.
+
+    Args:
+        config: The loaded configuration.
+        groups: The upstream groups, so rules can name a group instead of origins.
+        weights: Class weights that override (or add to) the configured classes.
+        default: Default class overriding ``default_priority``.
+        header: Request header naming the class.
+
+    Returns:
+        The classes, and a classifier, or no classes and None when none are configured.
+
+    Raises:
+        ValueError: A rule or the default names an unknown class or group.
+    """
+    settings = dict(config.get("priority_classes", {}))
+    for name, weight in (weights or {}).items():
+        settings[name] = {**settings.get(name, {}), "weight": weight}
+    if not settings:
+        return [], None
+
+    classes = []
+    for name, values in settings.items():
+        max_wait = values.get("max_queue_wait_seconds")
+        classes.append(PriorityClass(
+            name,
+            weight=float(values.get("weight", 1.0)),
+            max_queue=int(values.get("max_queue_size", 0)),
+            max_wait=float(max_wait) if max_wait is not None else None,
+        ))
+
+    rules = []
+    for values in config.get("priority_rules", []):
+        origins = None
+        if "origin" in values:
+            origins = [normalize_origin(values["origin"])]
+        elif "group" in values:
+            group = groups.get(values["group"])
+            if group is None:
+                raise ValueError(f"Unknown upstream group in priority rule: {values['group']}")
+            origins = [member.origin for member in group.members]
+        rules.append(PriorityRule(values["priority"], origins, values.get("path_prefix")))
+
+    default = default or config.get("default_priority") or classes[0].name
+    return classes, Classifier([cls.name for cls in classes], default, rules, header)
@@ -5,42 +5,969 @@ This module provides a simple HTTP proxy service that forwards requests to a tar
 
 import httpx
 from fastapi import FastAPI, Request, Response, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import uvicorn
-from typing import List, Dict, Any, Optional
+from starlette.requests import ClientDisconnect
+from typing import List, Dict, Any, Optional, Tuple
 import asyncio
+import functools
 import os
-from contextlib import asynccontextmanager
+import time
+from contextlib import asynccontextmanager, AsyncExitStack
 
-# Global httpx client
+from httpkit.tools.accesslog import AccessLog, CountingBody
+from httpkit.tools.balancer import Member, NoHealthyMembers, UnknownGroup, UpstreamGroup, load_groups, normalize_origin
+from httpkit.tools.breaker import HALF_OPEN, OPEN, CircuitBreakers
+from httpkit.tools.cache import (
+    CLIENT_CONDITIONAL_HEADERS,
+    CacheEntry,
+    ResponseCache,
+    cached_response_headers,
+    parse_cache_control,
+)
+from httpkit.tools.coalesce import DEFAULT_KEY_HEADERS, RequestCoalescer
+from httpkit.tools.config import load_config, parse_origin_values, setting
+from httpkit.tools.diskcache import (
+    CachedFileResponse,
+    DiskCache,
+    DiskEntry,
+    RangeNotSatisfiable,
+    parse_range,
+)
+from httpkit.tools.dns import DNSCache, install_dns_cache
+from httpkit.tools.encoding import choose_encoding, compress_chunks, is_compressible
+from httpkit.tools.engine import ENGINES, active_http_parser, active_loop, server_options
+from httpkit.tools.metrics import ProxyMetrics
+from httpkit.tools.priority import Classifier, load_priorities, parse_weights
+from httpkit.tools.ratelimit import BucketTable, RateLimit, RateLimited, RateLimiter, load_rate_limits
+from httpkit.tools.rawhttp import RawTransport
+from httpkit.tools.retries import IDEMPOTENT_METHODS, ResilientSender, RetryBudget
+from httpkit.tools.spool import BodyBudget, BodyTooLarge, SpooledBody
+from httpkit.tools.streaming import DEFAULT_STREAM_TYPES, SSE_TYPE, StreamTracker, is_stream, media_type, relay_events
+from httpkit.tools.limits import AIMDLimit, ConcurrencyLimiter, Overloaded, origin_of, pool_pending, pool_stats
+from httpkit.tools.timing import RequestTimer, SlowRequests, current_timer
+from httpkit.tools.unixsocket import UNIX_SCHEME, UnixSocketTransport, UnknownSocket, match_socket, unix_origin
+from httpkit.tools.warmup import ConnectionWarmer
+from httpkit.tools.workers import NodeBudget, Supervisor
+
+# JSON lines access log, written in batches by a background thread. Requests
+# are sampled at ACCESS_LOG_SAMPLE_RATE, except errors and requests slower than
+# ACCESS_LOG_SLOW_SECONDS. The log is None unless ACCESS_LOG is set.
+ACCESS_LOG: Optional[str] = None
+ACCESS_LOG_SAMPLE_RATE = 1.0
+ACCESS_LOG_SLOW_SECONDS = 1.0
+ACCESS_LOG_ERRORS = True
+ACCESS_LOG_BUFFER = 8192
+ACCESS_LOG_MAX_BYTES = 100 * 1024 * 1024
+ACCESS_LOG_BACKUPS = 5
+access_log: Optional[AccessLog] = None
+
+# Phase timing: a Server-Timing header on responses, and the SLOW_REQUESTS
+# slowest requests of the last one to two windows for /debug/slow
+SERVER_TIMING = False
+SLOW_REQUESTS = 0
+SLOW_REQUESTS_WINDOW_SECONDS = 300.0
+slow_requests: Optional[SlowRequests] = None
+
+# Global httpx client, shared by every origin without a dedicated pool
 http_client: Optional[httpx.AsyncClient] = None
+MAX_CONNECTIONS = 200
+MAX_KEEPALIVE_CONNECTIONS = 50
+
+# Dedicated httpx clients for origins with their own pool limits
+origin_clients: Dict[str, httpx.AsyncClient] = {}
+
+# In-process DNS cache used to open upstream connections; a TTL of 0 disables it
+DNS_CACHE_TTL_SECONDS = 60.0
+DNS_NEGATIVE_TTL_SECONDS = 5.0
+dns_cache: Optional[DNSCache] = None
+dns_refresh_task: Optional[asyncio.Task] = None
+
+# Hot origins kept warm with a minimum number of idle connections, by origin
+WARM_PATH = "/"
+WARM_INTERVAL_SECONDS = 10.0
+connection_warmer: Optional[ConnectionWarmer] = None
+warmup_task: Optional[asyncio.Task] = None
 
 # Global concurrency limiter
-# Default to 100 concurrent requests, can be adjusted based on system resources
+# Default to 100 concurrent requests, can be adjusted based on system resources.
+# Each origin is further limited to ORIGIN_MAX_CONCURRENT_REQUESTS (default: no
+# tighter than the global limit), and waiting requests are served round-robin
+# across origins.
 MAX_CONCURRENT_REQUESTS = 100
-request_semaphore: Optional[asyncio.Semaphore] = None
-
-# List of hop-by-hop headers that should not be forwarded
-HOP_BY_HOP_HEADERS = [
-    "connection",
-    "keep-alive",
-    "proxy-authenticate",
-    "proxy-authorization",
-    "te",
-    "trailers",
-    "transfer-encoding",
-    "upgrade",
-    "host",
-]
+ORIGIN_MAX_CONCURRENT_REQUESTS = 0
+request_limiter: Optional[ConcurrencyLimiter] = None
+
+# Load shedding: at most MAX_QUEUE_SIZE requests wait for a slot, each for at
+# most MAX_QUEUE_WAIT_SECONDS, before being rejected with 503 and Retry-After.
+MAX_QUEUE_SIZE = 1000
+MAX_QUEUE_WAIT_SECONDS = 10.0
+RETRY_AFTER_SECONDS = 1
+
+# With adaptive concurrency the global limit moves between
+# MIN_CONCURRENT_REQUESTS and MAX_CONCURRENT_REQUESTS following upstream latency
+ADAPTIVE_CONCURRENCY = False
+MIN_CONCURRENT_REQUESTS = 1
+
+# Priority classes share the concurrency budget by weight; requests name their
+# class in PRIORITY_HEADER or are classified by origin and path rules. The
+# classifier is None when no classes are configured.
+PRIORITY_HEADER = "X-HTTPKit-Priority"
+request_classifier: Optional[Classifier] = None
+
+# Token-bucket rate limits in requests per second per client IP, API key and
+# upstream origin, 0 for no limit. Bursts default to one second of the rate.
+# Workers share the buckets through RATE_LIMIT_FILE. The limiter is None when
+# no limit is set.
+CLIENT_RATE_LIMIT = 0.0
+CLIENT_RATE_BURST = 0.0
+API_KEY_RATE_LIMIT = 0.0
+API_KEY_RATE_BURST = 0.0
+API_KEY_HEADER = "X-API-Key"
+ORIGIN_RATE_LIMIT = 0.0
+ORIGIN_RATE_BURST = 0.0
+RATE_LIMIT_SLOTS = 65536
+RATE_LIMIT_FILE: Optional[str] = None
+request_rate_limiter: Optional[RateLimiter] = None
+
+# With several worker processes, MAX_CONCURRENT_REQUESTS holds for the whole
+# node: the budget and its counters live in NODE_STATE_FILE, shared by every
+# worker. The budget is None with a single process.
+NODE_STATE_FILE: Optional[str] = None
+node_budget: Optional[NodeBudget] = None
+
+# Named upstream groups from the configuration file, addressed as
+# /proxy/@{group}/{path}, and their members by origin
+upstream_groups: Dict[str, UpstreamGroup] = {}
+group_members: Dict[str, Member] = {}
+health_check_tasks: List[asyncio.Task] = []
+
+# Path of the JSON configuration file, if any
+CONFIG_FILE: Optional[str] = None
+
+# Shared response cache, disabled unless a byte budget is configured
+CACHE_MAX_BYTES = 0
+CACHE_MAX_ENTRY_BYTES = 0
+response_cache: Optional[ResponseCache] = None
+
+# On-disk cache tier for large responses, disabled unless a directory is configured
+DISK_CACHE_DIR: Optional[str] = None
+DISK_CACHE_MAX_BYTES = 10 * 1024 * 1024 * 1024
+DISK_CACHE_MAX_ENTRY_BYTES = 0
+DISK_CACHE_MIN_BYTES = 1024 * 1024
+disk_cache: Optional[DiskCache] = None
+
+# Single-flight coalescing of identical concurrent GETs, disabled by default
+COALESCE_REQUESTS = False
+COALESCE_BUFFER_CHUNKS = 16
+request_coalescer: Optional[RequestCoalescer] = None
+
+# Upstream statuses that count as congestion for the adaptive limit
+OVERLOAD_STATUS_CODES = frozenset([503, 504])
+
+# Retries and hedging of idempotent requests without a body (or with a
+# spooled one, see below), disabled by default. Retries and hedges both draw
+# from a budget of RETRY_BUDGET_PERCENT of recent requests.
+MAX_RETRIES = 0
+RETRY_BUDGET_PERCENT = 10.0
+RETRY_BACKOFF_SECONDS = 0.05
+HEDGE_PERCENTILE = 0.0
+HEDGE_MIN_DELAY_SECONDS = 0.005
+request_retries: Optional[ResilientSender] = None
+
+# Spooling of request bodies, disabled by default. With SPOOL_REQUEST_BODIES
+# the bodies of idempotent requests are read in full before they are sent, in
+# memory up to SPOOL_MEMORY_BYTES and in a temporary file past that, so they
+# can be retried and hedged like requests without a body. Spooled bytes in
+# flight are bounded by SPOOL_BUDGET_BYTES.
+SPOOL_REQUEST_BODIES = False
+SPOOL_MEMORY_BYTES = 1024 * 1024
+SPOOL_MAX_BODY_BYTES = 100 * 1024 * 1024
+SPOOL_BUDGET_BYTES = 512 * 1024 * 1024
+SPOOL_WAIT_SECONDS = 5.0
+SPOOL_DIR: Optional[str] = None
+body_budget: Optional[BodyBudget] = None
+
+# Per-origin circuit breakers, disabled by default. While an origin's circuit
+# is open its requests fail fast with 503 and it is ejected from upstream groups.
+CIRCUIT_BREAKER = False
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_ERROR_RATE_PERCENT = 50.0
+BREAKER_SLOW_CALL_SECONDS = 0.0
+BREAKER_OPEN_SECONDS = 5.0
+BREAKER_HALF_OPEN_PROBES = 3
+request_breakers: Optional[CircuitBreakers] = None
+
+# Upstream statuses that count as failures for the circuit breakers
+BREAKER_FAILURE_STATUS_CODES = frozenset([502, 503, 504])
+
+# Prometheus metrics, served on /metrics. With several workers, each one
+# writes its slots to METRICS_DIR and /metrics sums every worker's values.
+METRICS_ENABLED = True
+METRICS_DIR: Optional[str] = None
+METRICS_REFRESH_SECONDS = 1.0
+request_metrics: Optional[ProxyMetrics] = None
+metrics_refresh_task: Optional[asyncio.Task] = None
+
+# Content encoding. By default upstream bodies are decoded and sent to clients
+# uncompressed. With ENCODING_PASSTHROUGH the client's Accept-Encoding goes
+# upstream unchanged and bodies are forwarded byte for byte, keeping their
+# Content-Encoding and Content-Length.
+ENCODING_PASSTHROUGH = False
+
+# Optional on-the-fly compression of uncompressed upstream responses of at
+# least COMPRESS_MIN_BYTES, for clients that accept gzip or zstd
+COMPRESS_RESPONSES = False
+COMPRESS_MIN_BYTES = 1024
+
+# Long-lived event streams (SSE, NDJSON token streams) are relayed chunk by
+# chunk outside the concurrency budget, with their own idle timeout between
+# reads and SSE heartbeats every STREAM_HEARTBEAT_SECONDS of upstream silence
+STREAM_CONTENT_TYPES = frozenset(DEFAULT_STREAM_TYPES)
+STREAM_CHUNKED = False
+STREAM_IDLE_TIMEOUT_SECONDS = 300.0
+STREAM_HEARTBEAT_SECONDS = 15.0
+stream_tracker = StreamTracker()
+
+# Methods that never invalidate cached responses
+SAFE_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+# Maximum size of the chunks request bodies are forwarded upstream in
+REQUEST_CHUNK_SIZE = 64 * 1024
+
+# Whether the global client was created with HTTP/2 enabled
+HTTP2_ENABLED = False
+
+# The server engine (see httpkit.tools.engine), chosen when the server starts
+ENGINE = "auto"
+
+# Upstream transport: "httpx", or "raw" for the asyncio protocol transport of
+# httpkit.tools.rawhttp, which serves plain http:// origins and hands https://
+# (and with it HTTP/2) to httpx
+UPSTREAM_TRANSPORT = "httpx"
+UPSTREAM_TRANSPORTS = ("httpx", "raw")
+
+# Unix domain sockets that may be used as upstreams, as /proxy/unix:{socket}/{path}.
+# Each gets a client with a connection pool of its own (see httpkit.tools.unixsocket).
+UNIX_SOCKETS: Tuple[str, ...] = ()
+
+# Whether /proxy/ requests are served by the raw ASGI fast path (httpkit.tools.asgi_proxy)
+FAST_PATH_ENABLED = False
+
+# Hop-by-hop headers that should not be forwarded (RFC 9110, section 7.6.1). Names are
+# matched as raw bytes: ASGI servers and HTTP/2 deliver them lowercase already
+HOP_BY_HOP_HEADERS = frozenset([
+    b"connection",
+    b"keep-alive",
+    b"proxy-authenticate",
+    b"proxy-authorization",
+    b"te",
+    b"trailers",
+    b"transfer-encoding",
+    b"upgrade",
+    b"host",
+])
 
 # Additional headers that should not be forwarded from the response
-UNSAFE_RESPONSE_HEADERS = [
-    "content-length",  # Will be handled by the streaming response
-    "content-encoding",  # Let FastAPI handle this
-    "transfer-encoding",  # Let FastAPI handle this
-    "connection",
-    "server",  # Don't expose upstream server details
-]
+UNSAFE_RESPONSE_HEADERS = HOP_BY_HOP_HEADERS | frozenset([
+    b"content-length",  # Will be handled by the streaming response
+    b"content-encoding",  # Let FastAPI handle this
+    b"server",  # Don't expose upstream server details
+])
+
+# With encoding passthrough the body is forwarded as received, so its length and encoding still apply
+PASSTHROUGH_UNSAFE_RESPONSE_HEADERS = UNSAFE_RESPONSE_HEADERS - frozenset([b"content-length", b"content-encoding"])
+
+class UpstreamStreamingResponse(StreamingResponse):
+    """
+    Streaming response that owns an upstream response opened with ``stream=True``.
+
+    The upstream body is pulled one chunk at a time, only as fast as the client
+    accepts it, so slow clients apply backpressure to the upstream connection.
+    Everything registered on ``exit_stack`` (the upstream response and its
+    ``request_limiter`` slot) is released once the body has been sent, the
+    client disconnects, or the transfer fails.
+
+    The status and headers are the upstream's; headers are forwarded as raw
+    byte pairs (``raw_headers``, filtered by :func:`filter_response_headers`
+    unless given), so repeated headers such as ``Set-Cookie`` are kept.
+    """
+
+    def __init__(
+        self,
+        upstream: httpx.Response,
+        exit_stack: AsyncExitStack,
+        content=None,
+        raw_headers: Optional[List[Tuple[bytes, bytes]]] = None,
+        **kwargs,
+    ):
+        streaming = is_stream(upstream.headers, STREAM_CONTENT_TYPES, STREAM_CHUNKED)
+        if content is None:
+            # Unencoded streams skip the decoder, so events are relayed exactly as read
+            content = upstream.aiter_raw() if streaming and "content-encoding" not in upstream.headers else upstream_body(upstream)
+        super().__init__(content, status_code=upstream.status_code, **kwargs)
+        self.raw_headers = filter_response_headers(upstream) if raw_headers is None else raw_headers
+        self.upstream = upstream
+        self.exit_stack = exit_stack
+        self.bytes_sent = 0
+        # Set by send_upstream so the request is recorded once it has been sent
+        self.method: Optional[str] = None
+        self.origin = ""
+        self.started = 0.0
+        self.streaming = streaming
+        # Also set by send_upstream when requests are timed
+        self.timer: Optional[RequestTimer] = None
+        self.client: Optional[str] = None
+        self.target_url = ""
+        self.request_body = None
+
+    async def stream_response(self, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        body = self.body_iterator
+        if self.streaming:
+            body = relay_events(
+                body,
+                stream_tracker,
+                self.started,
+                STREAM_HEARTBEAT_SECONDS if media_type(self.upstream.headers.get("content-type")) == SSE_TYPE else 0.0,
+                functools.partial(request_metrics.record_first_event, self.origin) if request_metrics else None,
+                functools.partial(request_metrics.record_event_gap, self.origin) if request_metrics else None,
+            )
+        async for chunk in body:
+            self.bytes_sent += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def __call__(self, scope, receive, send):
+        try:
+            async with self.exit_stack:
+                await super().__call__(scope, receive, send)
+        finally:
+            if self.method is not None:
+                finished = time.monotonic()
+                if request_metrics is not None:
+                    request_metrics.record_request(
+                        self.method, self.status_code, self.origin, finished - self.started, self.bytes_sent
+                    )
+                if self.timer is not None:
+                    self.timer.finished = finished
+                    log_request(
+                        self.timer, self.client, self.method, self.target_url, self.status_code,
+                        request_bytes(self.request_body), self.bytes_sent,
+                    )
+
+
+async def stream_request_body(receive, chunk_size: int):
+    """
+    Yield the incoming request body as it arrives, in chunks of at most ``chunk_size`` bytes.
+
+    Nothing beyond the chunk currently being forwarded is held in memory, so the
+    cost of an upload stays bounded regardless of its size.
+
+    Args:
+        receive: The ASGI receive callable of the incoming request.
+        chunk_size: The maximum size of each yielded chunk.
+    """
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnect()
+        chunk = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if request_metrics is not None:
+            request_metrics.add_bytes_in(len(chunk))
+        for start in range(0, len(chunk), chunk_size):
+            yield chunk[start:start + chunk_size]
+
+
+def request_bytes(body) -> int:
+    """Return the request body bytes forwarded so far, when they are being counted."""
+    return body.bytes if isinstance(body, CountingBody) else 0
+
+
+def log_request(
+    timer: RequestTimer,
+    client: Optional[str],
+    method: str,
+    target_url: str,
+    status: int,
+    bytes_in: int,
+    bytes_out: int,
+    error: Optional[str] = None,
+):
+    """Record a finished request in the access log and the slow request log."""
+    duration = timer.finished - timer.started
+    if access_log is not None:
+        access_log.log(
+            client, method, target_url, status, bytes_in, bytes_out, duration, timer.queue_wait(), timer.ttfb(), error
+        )
+    if slow_requests is not None and slow_requests.admits(duration, timer.finished):
+        slow_requests.add(duration, {
+            "time": time.time(),
+            "method": method,
+            "target": target_url,
+            "status": status,
+            "client": client,
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "phases": timer.phases(),
+            "error": error,
+        })
+
+
+def has_request_body(raw_headers: List[Tuple[bytes, bytes]]) -> bool:
+    """Return True if the client announced a request body via Content-Length or chunked encoding."""
+    for name, value in raw_headers:
+        if name == b"content-length":
+            return value.strip() != b"0"
+        if name == b"transfer-encoding" and b"chunked" in value.lower():
+            return True
+    return False
+
+
+def connection_options(raw_headers: List[Tuple[bytes, bytes]]) -> List[bytes]:
+    """Return the header names listed in the Connection header, which only apply to this hop."""
+    options = []
+    for name, value in raw_headers:
+        if name == b"connection":
+            options.extend(option.strip().lower() for option in value.split(b","))
+    return options
+
+
+def filter_headers(raw_headers: List[Tuple[bytes, bytes]], drop: frozenset) -> List[Tuple[bytes, bytes]]:
+    """
+    Return ``raw_headers`` without the names in ``drop`` or listed in the Connection header.
+
+    Names and values stay the bytes they arrived as, in order, duplicates included.
+    """
+    options = connection_options(raw_headers)
+    if options:
+        drop = drop.union(options)
+    return [(name, value) for name, value in raw_headers if name not in drop]
+
+
+def filter_request_headers(raw_headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    """Return the raw ASGI request headers to forward, dropping hop-by-hop headers."""
+    return filter_headers(raw_headers, HOP_BY_HOP_HEADERS)
+
+
+def header_value(raw_headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[str]:
+    """Return the decoded value of the first ``name`` header, or None."""
+    for key, value in raw_headers:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def decode_headers(raw_headers: List[Tuple[bytes, bytes]]) -> Dict[str, str]:
+    """Decode raw request headers into a dict keyed by lowercase name, for the response cache."""
+    return {name.decode("latin-1"): value.decode("latin-1") for name, value in raw_headers}
+
+
+def build_target_url(scheme: str, target_host: str, target_port: int, path: str, query_string: bytes) -> str:
+    """Construct the upstream URL, passing the client's query string through unchanged."""
+    target_url = f"{scheme}://{target_host}:{target_port}/{path}"
+    if query_string:
+        target_url = f"{target_url}?{query_string.decode('latin-1')}"
+    return target_url
+
+
+def group_target_url(group_name: str, path: str, query_string: bytes) -> str:
+    """
+    Pick a member of an upstream group and build the URL to send the request to.
+
+    Raises:
+        UnknownGroup: If no group with that name is configured.
+        NoHealthyMembers: If every member of the group is unhealthy.
+    """
+    group = upstream_groups.get(group_name)
+    if group is None:
+        raise UnknownGroup(f"Unknown upstream group: {group_name}")
+    target_url = f"{group.select().origin}/{path}"
+    if query_string:
+        target_url = f"{target_url}?{query_string.decode('latin-1')}"
+    return target_url
+
+
+def unix_target_url(target: str, query_string: bytes) -> str:
+    """
+    Build the URL of a request to a configured Unix socket upstream from the ``{socket}/{path}`` after ``unix:``.
+
+    Raises:
+        UnknownSocket: If the target does not start with a configured socket.
+    """
+    match = match_socket(target, UNIX_SOCKETS)
+    if match is None:
+        raise UnknownSocket(f"Unix socket is not a configured upstream: {target}")
+    socket_path, path = match
+    target_url = f"{unix_origin(socket_path)}/{path}"
+    if query_string:
+        target_url = f"{target_url}?{query_string.decode('latin-1')}"
+    return target_url
+
+
+def filter_response_headers(response: httpx.Response) -> List[Tuple[bytes, bytes]]:
+    """Return the upstream response headers that are safe to forward to the client, as raw byte pairs."""
+    unsafe = PASSTHROUGH_UNSAFE_RESPONSE_HEADERS if ENCODING_PASSTHROUGH else UNSAFE_RESPONSE_HEADERS
+    # HTTP/1.1 names keep the upstream's case, and starlette looks headers up by lowercase name
+    return filter_headers([(name.lower(), value) for name, value in response.headers.raw], unsafe)
+
+
+def joined_headers(raw_headers: List[Tuple[bytes, bytes]]) -> Dict[str, str]:
+    """
+    Return raw header pairs as a dict for the cache, joining repeated headers with ", " (RFC 9110 section 5.3).
+
+    ``Set-Cookie``, the one header that cannot be joined, is never cached.
+    """
+    headers: Dict[str, str] = {}
+    for name, value in raw_headers:
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return headers
+
+
+def upstream_body(response: httpx.Response):
+    """Return an iterator over the upstream body: as received with encoding passthrough, decoded otherwise."""
+    return response.aiter_raw() if ENCODING_PASSTHROUGH else response.aiter_bytes()
+
+
+def compress_response(response: "UpstreamStreamingResponse", request_headers: List[Tuple[bytes, bytes]]):
+    """Compress an uncompressed upstream body on the fly if it is large enough and the client accepts it."""
+    upstream_headers = response.upstream.headers
+    if response.status_code != 200 or "content-encoding" in upstream_headers:
+        return
+    if not is_compressible(upstream_headers.get("content-type")):
+        return
+    # Intermediaries must not change the content of no-transform responses (RFC 9110 section 7.7)
+    if "no-transform" in parse_cache_control(upstream_headers.get("cache-control")):
+        return
+    length = upstream_headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) < COMPRESS_MIN_BYTES:
+        return
+    encoding = choose_encoding(header_value(request_headers, b"accept-encoding"))
+    if encoding is None:
+        return
+
+    headers = response.headers
+    if "content-length" in headers:
+        del headers["content-length"]
+    headers["Content-Encoding"] = encoding
+    vary = headers.get("vary")
+    if not vary:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+    # The compressed body is a different representation, no longer byte-identical
+    etag = headers.get("etag")
+    if etag and etag.startswith('"'):
+        headers["ETag"] = "W/" + etag
+    response.body_iterator = compress_chunks(response.body_iterator, encoding)
+
+
+async def request_upstream(method: str, target_url: str, headers: List[Tuple[bytes, bytes]], body) -> Tuple[httpx.Response, AsyncExitStack]:
+    """
+    Send a request upstream and return as soon as the response headers arrive.
+
+    Returns:
+        The streamed upstream response, and an exit stack holding it and its
+        ``request_limiter`` slot. The caller must close the stack once the
+        body has been consumed.
+
+    Raises:
+        CircuitOpen: The origin's circuit breaker is open, checked before
+            waiting for a slot.
+    """
+    origin = origin_of(target_url)
+    client = origin_clients.get(origin, http_client)
+    member = group_members.get(origin)
+    breaker = request_breakers.get(origin) if request_breakers is not None else None
+    priority = None
+    timer = current_timer.get()
+    if request_classifier is not None:
+        priority, headers = request_classifier.classify(headers, target_url)
+
+    upstream_request = client.build_request(
+        method=method,
+        url=target_url,
+        headers=headers,
+        content=body,
+    )
+    if timer is not None:
+        upstream_request.extensions["trace"] = timer.trace
+
+    async with AsyncExitStack() as stack:
+        # Fail fast while the origin's circuit is open; half-open probes are counted
+        if breaker is not None and breaker.admit():
+            stack.callback(breaker.release_probe)
+
+        # Acquire a global and per-origin slot to limit concurrency. The slot
+        # stays held until the response body has been fully streamed to the
+        # client, unless the response turns out to be a long-lived stream.
+        queued = time.monotonic()
+        slot = await stack.enter_async_context(request_limiter.slot(origin, priority))
+        if priority is not None and request_metrics is not None:
+            request_metrics.record_priority(priority, time.monotonic() - queued)
+
+        # Group members count their requests in flight until the body is sent
+        if member is not None:
+            member.outstanding += 1
+            stack.callback(member.release)
+
+        # Time to response headers, excluding the queue wait, drives the adaptive limit
+        started = time.monotonic()
+        if timer is not None:
+            timer.begin(queued, started)
+        try:
+            response = await client.send(upstream_request, stream=True)
+        except httpx.TransportError:
+            request_limiter.observe(origin, time.monotonic() - started, failed=True)
+            if breaker is not None:
+                breaker.record(time.monotonic() - started, failed=True)
+            raise
+        received = time.monotonic()
+        request_limiter.observe(origin, received - started, failed=response.status_code in OVERLOAD_STATUS_CODES)
+        if breaker is not None:
+            breaker.record(received - started, failed=response.status_code in BREAKER_FAILURE_STATUS_CODES)
+        if member is not None:
+            member.observe(received - started)
+        if request_metrics is not None:
+            request_metrics.record_upstream(origin, started - queued, received - started)
+        if timer is not None:
+            timer.headers = received
+        if is_stream(response.headers, STREAM_CONTENT_TYPES, STREAM_CHUNKED):
+            # Streams leave the short-request budget, and each read of their
+            # body waits up to the stream idle timeout instead of the request timeout
+            slot.release()
+            timeouts = response.request.extensions.get("timeout")
+            if timeouts is not None:
+                response.request.extensions["timeout"] = {**timeouts, "read": STREAM_IDLE_TIMEOUT_SECONDS or None}
+        stack.push_async_callback(response.aclose)
+        return response, stack.pop_all()
+
+
+async def open_upstream(method: str, target_url: str, headers: List[Tuple[bytes, bytes]], body) -> Tuple[httpx.Response, AsyncExitStack]:
+    """
+    Open an upstream response, joining an identical in-flight GET when coalescing is enabled.
+
+    Coalesced requests share one upstream request and one ``request_limiter``
+    slot; the returned response is then a subscription to the shared body.
+    Idempotent requests are retried and hedged through ``request_retries``
+    when it is enabled: those with a body only while ``body_budget`` is set,
+    after their body has been spooled so every attempt can send it.
+    """
+    spooled = None
+    if body is not None and body_budget is not None and method in IDEMPOTENT_METHODS:
+        spooled = body = await spool_request_body(body, headers)
+
+    opener = lambda: request_upstream(method, target_url, headers, body)
+    if request_retries is not None and method in IDEMPOTENT_METHODS and (body is None or spooled is not None):
+        opener = functools.partial(request_retries.send, opener, origin_of(target_url))
+
+    if request_coalescer is not None and method == "GET" and body is None:
+        return await request_coalescer.open(request_coalescer.make_key(method, target_url, headers), opener)
+    if spooled is None:
+        return await opener()
+    try:
+        response, exit_stack = await opener()
+    except BaseException:
+        spooled.close()
+        raise
+    # The body is kept until the response is done, then its file and budget are released
+    exit_stack.callback(spooled.close)
+    return response, exit_stack
+
+
+async def spool_request_body(body, headers: List[Tuple[bytes, bytes]]) -> SpooledBody:
+    """
+    Read a request body into a :class:`SpooledBody` counted against ``body_budget``.
+
+    Raises:
+        BodyTooLarge: The body is larger than SPOOL_MAX_BODY_BYTES or the whole budget.
+        Overloaded: The budget had no room for the body within SPOOL_WAIT_SECONDS.
+    """
+    spooled = SpooledBody(SPOOL_MEMORY_BYTES, SPOOL_MAX_BODY_BYTES, body_budget, SPOOL_DIR, REQUEST_CHUNK_SIZE)
+    length = header_value(headers, b"content-length")
+    try:
+        await spooled.fill(body, int(length) if length is not None and length.strip().isdigit() else None)
+    except BaseException:
+        spooled.close()
+        raise
+    return spooled
+
+
+def error_status(error: Exception) -> int:
+    """Return the status code the proxy answers with when forwarding fails with ``error``."""
+    if isinstance(error, RateLimited):
+        return 429
+    if isinstance(error, Overloaded):
+        return 503
+    if isinstance(error, BodyTooLarge):
+        return 413
+    if isinstance(error, httpx.RequestError):
+        return 502
+    return 500
+
+
+async def send_upstream(
+    method: str, target_url: str, headers: List[Tuple[bytes, bytes]], body, client: Optional[str] = None
+) -> Response:
+    """
+    Send a request to the target server and wrap the streamed reply in a response.
+
+    This is the transport core shared by the FastAPI routes and the raw ASGI
+    fast path. Errors from httpx are propagated to the caller. Every request
+    is recorded in ``request_metrics``: failures here, streamed responses once
+    their body has been sent.
+
+    Args:
+        method: The HTTP method.
+        target_url: The full upstream URL.
+        headers: The request headers to forward, as raw byte pairs.
+        body: An async byte iterator for the request body, or None.
+        client: The client IP address, for per-client rate limits.
+
+    Returns:
+        A response that streams the upstream body to the client.
+
+    Raises:
+        RateLimited: The request exceeds a rate limit.
+    """
+    # Check if global client is initialized
+    if http_client is None:
+        # Initialize client if not already done (for tests or direct calls)
+        await startup_event()
+
+    started = time.monotonic()
+    # Requests are only timed while something uses the timings
+    timer = token = None
+    if SERVER_TIMING or slow_requests is not None or access_log is not None:
+        timer = RequestTimer(started)
+        token = current_timer.set(timer)
+        if access_log is not None and body is not None:
+            body = CountingBody(body)
+    try:
+        if request_rate_limiter is not None:
+            request_rate_limiter.check(client, headers, origin_of(target_url))
+        response = await forward_upstream(method, target_url, headers, body)
+    except Exception as e:
+        finished = time.monotonic()
+        if request_metrics is not None:
+            request_metrics.record_request(method, error_status(e), origin_of(target_url), finished - started, 0)
+        if timer is not None:
+            timer.finished = finished
+            log_request(
+                timer, client, method, target_url, error_status(e), request_bytes(body), 0, str(e) or type(e).__name__
+            )
+        raise
+    finally:
+        if token is not None:
+            current_timer.reset(token)
+
+    if SERVER_TIMING and timer is not None:
+        response.headers.append("Server-Timing", timer.server_timing())
+
+    if isinstance(response, UpstreamStreamingResponse):
+        if response.streaming:
+            # Ask buffering reverse proxies in front (nginx) to pass events straight through
+            response.headers.setdefault("X-Accel-Buffering", "no")
+        elif COMPRESS_RESPONSES:
+            compress_response(response, headers)
+        response.method = method
+        response.origin = origin_of(target_url)
+        response.started = started
+        response.timer = timer
+        response.client = client
+        response.target_url = target_url
+        response.request_body = body
+    else:
+        # Cached responses are already complete
+        finished = time.monotonic()
+        sent = response.count if isinstance(response, CachedFileResponse) else len(response.body)
+        if request_metrics is not None:
+            request_metrics.record_request(
+                method, response.status_code, origin_of(target_url), finished - started, sent
+            )
+        if timer is not None:
+            timer.finished = finished
+            log_request(timer, client, method, target_url, response.status_code, 0, sent)
+    return response
+
+
+async def forward_upstream(method: str, target_url: str, headers: List[Tuple[bytes, bytes]], body) -> Response:
+    """Serve the request from the cache or the upstream, without recording metrics."""
+    # Without an Accept-Encoding of the client's, httpx would ask for (and decode) gzip
+    if ENCODING_PASSTHROUGH and header_value(headers, b"accept-encoding") is None:
+        headers = headers + [(b"accept-encoding", b"identity")]
+
+    if (response_cache is not None or disk_cache is not None) and method == "GET":
+        return await send_upstream_cached(target_url, headers)
+
+    response, exit_stack = await open_upstream(method, target_url, headers, body)
+
+    # Successful unsafe requests invalidate what the cache holds for the URL
+    if method not in SAFE_METHODS and response.status_code < 400:
+        for cache in cache_tiers():
+            cache.invalidate(target_url)
+
+    # Hand the upstream response and the limiter slot over to the
+    # streaming response, which releases them when the transfer ends
+    return UpstreamStreamingResponse(response, exit_stack)
+
+
+def cached_response(entry: CacheEntry, request_headers: Dict[str, str], now: float, cache_status: str) -> Response:
+    """Build a response from a cache entry, answering the client's own conditionals with 304."""
+    if entry.not_modified_for(request_headers):
+        return Response(
+            status_code=304,
+            headers=cached_response_headers(entry, now, cache_status, not_modified=True),
+        )
+    if isinstance(entry, DiskEntry):
+        return cached_file_response(entry, request_headers, now, cache_status)
+    return Response(
+        content=entry.body,
+        status_code=entry.status_code,
+        headers=cached_response_headers(entry, now, cache_status),
+    )
+
+
+def cached_file_response(entry: DiskEntry, request_headers: Dict[str, str], now: float, cache_status: str) -> Response:
+    """Serve an entry of the disk cache from its file, or the byte range the client asked for."""
+    headers = cached_response_headers(entry, now, cache_status)
+    status_code, start, end = entry.status_code, 0, entry.length - 1
+    range_header = request_headers.get("range")
+    if range_header is not None and entry.status_code == 200 and if_range_matches(entry, request_headers.get("if-range")):
+        try:
+            span = parse_range(range_header, entry.length)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=416, headers={"Content-Range": f"bytes */{entry.length}", "X-Cache": cache_status}
+            )
+        if span is not None:
+            status_code, (start, end) = 206, span
+            headers["Content-Range"] = f"bytes {start}-{end}/{entry.length}"
+    if entry.status_code == 200:
+        headers["Accept-Ranges"] = "bytes"
+    fd = os.open(disk_cache.object_path(entry.digest), os.O_RDONLY)
+    return CachedFileResponse(fd, start, end - start + 1, status_code, headers)
+
+
+def if_range_matches(entry: CacheEntry, if_range: Optional[str]) -> bool:
+    """Return True if a Range request applies to ``entry`` given its If-Range header (RFC 9110, section 13.1.5)."""
+    if if_range is None:
+        return True
+    if if_range.startswith('"'):
+        return entry.etag == if_range
+    return entry.last_modified is not None and entry.last_modified == if_range
+
+
+def cache_tiers() -> List[ResponseCache]:
+    """Return the enabled response caches, the in-memory one first."""
+    return [cache for cache in (response_cache, disk_cache) if cache is not None]
+
+
+def storage_tier(content_length: Optional[str]) -> Optional[ResponseCache]:
+    """Pick the cache for a response: the disk for large or unknown lengths, memory otherwise."""
+    if disk_cache is not None and (
+        response_cache is None
+        or content_length is None
+        or not content_length.isdigit()
+        or int(content_length) >= DISK_CACHE_MIN_BYTES
+    ):
+        return disk_cache
+    return response_cache
+
+
+async def send_upstream_cached(target_url: str, headers: List[Tuple[bytes, bytes]]) -> Response:
+    """
+    Serve a GET from the response caches when possible, revalidating or filling them otherwise.
+
+    Fresh entries are answered without touching the upstream or the limiter.
+    Stale entries with a validator are revalidated with If-None-Match /
+    If-Modified-Since; a 304 refreshes the entry. Storable misses are written
+    to the cache while they stream to the requesting client: to
+    ``disk_cache`` if they are large (see :func:`storage_tier`), to
+    ``response_cache`` otherwise. Range requests are only answered from the
+    disk cache, and forwarded when it has no fresh entry.
+    """
+    request_headers = decode_headers(headers)
+    request_cache_control = parse_cache_control(request_headers.get("cache-control"))
+    ranged = "range" in request_headers
+    if "no-store" in request_cache_control or (ranged and disk_cache is None):
+        response, exit_stack = await open_upstream("GET", target_url, headers, None)
+        return UpstreamStreamingResponse(response, exit_stack)
+
+    now = time.time()
+    tiers = cache_tiers()
+    cache, entry = None, None
+    for tier in tiers:
+        entry = tier.lookup(target_url, request_headers)
+        if entry is not None:
+            cache = tier
+            break
+    if entry is not None and cache.is_usable(entry, request_cache_control, now) and (not ranged or cache is disk_cache):
+        cache.hits += 1
+        return cached_response(entry, request_headers, now, "HIT")
+
+    if ranged:
+        response, exit_stack = await open_upstream("GET", target_url, headers, None)
+        return UpstreamStreamingResponse(response, exit_stack)
+
+    if "only-if-cached" in request_cache_control:
+        for tier in [cache] if cache is not None else tiers:
+            tier.misses += 1
+        return Response(status_code=504, headers={"X-Cache": "MISS"})
+
+    forward_headers = headers
+    revalidating = entry is not None and entry.has_validator()
+    if revalidating:
+        # Replace any client conditionals with the cache's own validators
+        forward_headers = [
+            (name, value) for name, value in headers
+            if name.decode("latin-1") not in CLIENT_CONDITIONAL_HEADERS
+        ]
+        forward_headers.extend(
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in cache.conditional_headers(entry).items()
+        )
+        cache.revalidations += 1
+    else:
+        for tier in [cache] if cache is not None else tiers:
+            tier.misses += 1
+
+    request_time = time.time()
+    response, exit_stack = await open_upstream("GET", target_url, forward_headers, None)
+    response_time = time.time()
+
+    if revalidating and response.status_code == 304:
+        async with exit_stack:
+            cache.revalidated += 1
+            cache.refresh(entry, dict(response.headers), response_time)
+        return cached_response(entry, request_headers, response_time, "REVALIDATED")
+
+    filtered_headers = filter_response_headers(response)
+    content = None
+    # Only the request that started a coalesced flight fills the cache
+    coalesced = getattr(response, "coalesced", False)
+    tier = storage_tier(response.headers.get("content-length"))
+    if not coalesced and tier.is_storable(response.status_code, dict(response.headers), request_headers):
+        # A response only lives in one tier; drop what the other one holds for the URL
+        for other in tiers:
+            if other is not tier:
+                other.invalidate(target_url)
+        content = tier.fill(
+            upstream_body(response),
+            target_url,
+            request_headers,
+            response.status_code,
+            joined_headers(filtered_headers),
+            request_time,
+            response_time,
+        )
+
+    return UpstreamStreamingResponse(
+        response, exit_stack, content=content, raw_headers=filtered_headers + [(b"x-cache", b"MISS")]
+    )
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -63,7 +990,39 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_event():
     """Initialize global resources on application startup."""
-    global http_client, request_semaphore, MAX_CONCURRENT_REQUESTS
+    global http_client, request_limiter, MAX_CONCURRENT_REQUESTS, REQUEST_CHUNK_SIZE, HTTP2_ENABLED
+    global response_cache, CACHE_MAX_BYTES, CACHE_MAX_ENTRY_BYTES
+    global disk_cache, DISK_CACHE_DIR, DISK_CACHE_MAX_BYTES, DISK_CACHE_MAX_ENTRY_BYTES, DISK_CACHE_MIN_BYTES
+    global request_coalescer, COALESCE_REQUESTS, COALESCE_BUFFER_CHUNKS
+    global origin_clients, MAX_CONNECTIONS, MAX_KEEPALIVE_CONNECTIONS, ORIGIN_MAX_CONCURRENT_REQUESTS, CONFIG_FILE
+    global MAX_QUEUE_SIZE, MAX_QUEUE_WAIT_SECONDS, RETRY_AFTER_SECONDS, ADAPTIVE_CONCURRENCY, MIN_CONCURRENT_REQUESTS
+    global request_metrics, metrics_refresh_task, METRICS_ENABLED, METRICS_DIR
+    global upstream_groups, group_members, health_check_tasks
+    global request_retries, MAX_RETRIES, RETRY_BUDGET_PERCENT, RETRY_BACKOFF_SECONDS, HEDGE_PERCENTILE, HEDGE_MIN_DELAY_SECONDS
+    global body_budget, SPOOL_REQUEST_BODIES, SPOOL_MEMORY_BYTES, SPOOL_MAX_BODY_BYTES, SPOOL_BUDGET_BYTES
+    global SPOOL_WAIT_SECONDS, SPOOL_DIR
+    global ENCODING_PASSTHROUGH, COMPRESS_RESPONSES, COMPRESS_MIN_BYTES
+    global dns_cache, dns_refresh_task, DNS_CACHE_TTL_SECONDS, DNS_NEGATIVE_TTL_SECONDS
+    global connection_warmer, warmup_task, WARM_PATH, WARM_INTERVAL_SECONDS
+    global request_breakers, CIRCUIT_BREAKER, BREAKER_FAILURE_THRESHOLD, BREAKER_ERROR_RATE_PERCENT
+    global BREAKER_SLOW_CALL_SECONDS, BREAKER_OPEN_SECONDS, BREAKER_HALF_OPEN_PROBES
+    global STREAM_CONTENT_TYPES, STREAM_CHUNKED, STREAM_IDLE_TIMEOUT_SECONDS, STREAM_HEARTBEAT_SECONDS
+    global request_classifier, PRIORITY_HEADER
+    global request_rate_limiter, CLIENT_RATE_LIMIT, CLIENT_RATE_BURST, API_KEY_RATE_LIMIT, API_KEY_RATE_BURST
+    global API_KEY_HEADER, ORIGIN_RATE_LIMIT, ORIGIN_RATE_BURST, RATE_LIMIT_SLOTS, RATE_LIMIT_FILE
+    global access_log, ACCESS_LOG, ACCESS_LOG_SAMPLE_RATE, ACCESS_LOG_SLOW_SECONDS, ACCESS_LOG_ERRORS
+    global ACCESS_LOG_BUFFER, ACCESS_LOG_MAX_BYTES, ACCESS_LOG_BACKUPS
+    global SERVER_TIMING, SLOW_REQUESTS, SLOW_REQUESTS_WINDOW_SECONDS, slow_requests
+    global node_budget, NODE_STATE_FILE
+    global ENGINE, UPSTREAM_TRANSPORT, UNIX_SOCKETS
+    
+    # Read the configuration on top of the defaults, not on top of what an
+    # earlier startup in this process (as in tests) left behind
+    globals().update(DEFAULT_SETTINGS)
+    
+    # Load the optional configuration file; environment variables take precedence
+    CONFIG_FILE = os.environ.get("HTTPKIT_CONFIG_FILE", CONFIG_FILE)
+    config = load_config(CONFIG_FILE)
     
     # Get timeout from environment variable or use default
     timeout_seconds = float(os.environ.get("HTTPKIT_TIMEOUT_SECONDS", 30.0))
@@ -71,33 +1030,478 @@ async def startup_event():
     # Check if h2 is installed to enable HTTP/2
     import importlib.util
     h2_installed = importlib.util.find_spec("h2") is not None
+    HTTP2_ENABLED = h2_installed
     
-    # Initialize the global HTTP client with HTTP/2 support if available
-    http_client = httpx.AsyncClient(
-        timeout=timeout_seconds,
-        http2=h2_installed,  # Enable HTTP/2 if h2 package is installed
-        limits=httpx.Limits(
-            max_connections=200,
-            max_keepalive_connections=50,
+    # Cache upstream DNS resolutions, refreshing hosts in use before they expire
+    DNS_CACHE_TTL_SECONDS = setting(config, "HTTPKIT_DNS_CACHE_TTL_SECONDS", "dns_cache_ttl_seconds", DNS_CACHE_TTL_SECONDS, float)
+    DNS_NEGATIVE_TTL_SECONDS = setting(config, "HTTPKIT_DNS_NEGATIVE_TTL_SECONDS", "dns_negative_ttl_seconds", DNS_NEGATIVE_TTL_SECONDS, float)
+    if dns_refresh_task is not None:
+        dns_refresh_task.cancel()
+        dns_refresh_task = None
+    dns_cache = DNSCache(DNS_CACHE_TTL_SECONDS, DNS_NEGATIVE_TTL_SECONDS) if DNS_CACHE_TTL_SECONDS > 0 else None
+    if dns_cache is not None:
+        dns_refresh_task = asyncio.ensure_future(dns_cache.run_refresh(max(1.0, DNS_CACHE_TTL_SECONDS / 4)))
+    
+    ENGINE = os.environ.get("HTTPKIT_ENGINE", ENGINE).lower()
+    UPSTREAM_TRANSPORT = setting(config, "HTTPKIT_UPSTREAM_TRANSPORT", "upstream_transport", UPSTREAM_TRANSPORT, str)
+    if UPSTREAM_TRANSPORT not in UPSTREAM_TRANSPORTS:
+        raise ValueError(f"Unknown upstream transport {UPSTREAM_TRANSPORT!r}, expected one of {', '.join(UPSTREAM_TRANSPORTS)}")
+    
+    UNIX_SOCKETS = setting(
+        config, "HTTPKIT_UNIX_SOCKETS", "unix_sockets", UNIX_SOCKETS,
+        lambda value: tuple(path.strip() for path in (value.split(",") if isinstance(value, str) else value) if path.strip()),
+    )
+    
+    def make_client(max_connections: int, max_keepalive_connections: int, uds: Optional[str] = None) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
             keepalive_expiry=30.0
         )
-    )
+        if uds is not None:
+            # Unix socket upstreams speak HTTP/1.1 and need neither DNS nor the raw transport
+            return httpx.AsyncClient(timeout=timeout_seconds, transport=UnixSocketTransport(uds, limits=limits))
+        transport = httpx.AsyncHTTPTransport(
+            http2=h2_installed,  # Enable HTTP/2 if h2 package is installed
+            limits=limits,
+        )
+        if dns_cache is not None:
+            install_dns_cache(transport, dns_cache)
+        if UPSTREAM_TRANSPORT == "raw":
+            transport = RawTransport(transport, max_keepalive_connections, 30.0, dns_cache, max_connections)
+        return httpx.AsyncClient(timeout=timeout_seconds, transport=transport)
+    
+    # Initialize the global HTTP client with HTTP/2 support if available
+    MAX_CONNECTIONS = setting(config, "HTTPKIT_MAX_CONNECTIONS", "max_connections", MAX_CONNECTIONS)
+    MAX_KEEPALIVE_CONNECTIONS = setting(config, "HTTPKIT_MAX_KEEPALIVE_CONNECTIONS", "max_keepalive_connections", MAX_KEEPALIVE_CONNECTIONS)
+    http_client = make_client(MAX_CONNECTIONS, MAX_KEEPALIVE_CONNECTIONS)
+    
+    # Origins with their own pool limits get a dedicated client
+    origin_config = {origin.rstrip("/"): values for origin, values in config.get("origins", {}).items()}
+    origin_clients = {
+        origin: make_client(
+            int(values.get("max_connections", MAX_CONNECTIONS)),
+            int(values.get("max_keepalive_connections", MAX_KEEPALIVE_CONNECTIONS)),
+        )
+        for origin, values in origin_config.items()
+        if "max_connections" in values or "max_keepalive_connections" in values
+    }
+    # ...and so does every Unix socket upstream
+    socket_config = {normalize_origin(origin): values for origin, values in origin_config.items() if origin.startswith(UNIX_SCHEME)}
+    for path in UNIX_SOCKETS:
+        values = socket_config.get(unix_origin(path), {})
+        origin_clients[unix_origin(path)] = make_client(
+            int(values.get("max_connections", MAX_CONNECTIONS)),
+            int(values.get("max_keepalive_connections", MAX_KEEPALIVE_CONNECTIONS)),
+            uds=path,
+        )
+    
+    # Keep a minimum of idle connections open to hot origins, from startup on
+    warm_origins = {
+        normalize_origin(origin): int(values["min_idle_connections"])
+        for origin, values in origin_config.items()
+        if "min_idle_connections" in values
+    }
+    warm_origins.update({
+        normalize_origin(origin): count
+        for origin, count in parse_origin_values(os.environ.get("HTTPKIT_WARM_ORIGINS", "")).items()
+    })
+    WARM_PATH = setting(config, "HTTPKIT_WARM_PATH", "warm_path", WARM_PATH, str)
+    WARM_INTERVAL_SECONDS = setting(config, "HTTPKIT_WARM_INTERVAL_SECONDS", "warm_interval_seconds", WARM_INTERVAL_SECONDS, float)
+    if warmup_task is not None:
+        warmup_task.cancel()
+        warmup_task = None
+    connection_warmer = ConnectionWarmer(warm_origins, client_for, WARM_PATH) if warm_origins else None
+    if connection_warmer is not None:
+        warmup_task = asyncio.ensure_future(connection_warmer.run(WARM_INTERVAL_SECONDS))
+    
+    # Named upstream groups, with active health checks where configured
+    for task in health_check_tasks:
+        task.cancel()
+    upstream_groups, group_members = load_groups(config)
+    health_check_tasks = [
+        asyncio.ensure_future(group.run_health_checks(client_for))
+        for group in upstream_groups.values()
+        if group.health_path
+    ]
     
     # Get max concurrent requests from environment variable or use default
-    max_concurrent_requests = int(os.environ.get("HTTPKIT_MAX_CONCURRENT_REQUESTS", MAX_CONCURRENT_REQUESTS))
+    max_concurrent_requests = setting(config, "HTTPKIT_MAX_CONCURRENT_REQUESTS", "max_concurrent_requests", MAX_CONCURRENT_REQUESTS)
     
     # Update the global MAX_CONCURRENT_REQUESTS
     MAX_CONCURRENT_REQUESTS = max_concurrent_requests
     
-    # Initialize the request semaphore
-    request_semaphore = asyncio.Semaphore(max_concurrent_requests)
+    # Per-origin concurrency: a default for every origin plus explicit overrides
+    ORIGIN_MAX_CONCURRENT_REQUESTS = setting(
+        config.get("origin_defaults", {}),
+        "HTTPKIT_ORIGIN_MAX_CONCURRENT_REQUESTS",
+        "max_concurrent_requests",
+        ORIGIN_MAX_CONCURRENT_REQUESTS,
+    )
+    origin_limits = {
+        origin: int(values["max_concurrent_requests"])
+        for origin, values in origin_config.items()
+        if "max_concurrent_requests" in values
+    }
+    origin_limits.update(parse_origin_values(os.environ.get("HTTPKIT_ORIGIN_LIMITS", "")))
+    
+    # Bounded queueing and load shedding
+    MAX_QUEUE_SIZE = setting(config, "HTTPKIT_MAX_QUEUE_SIZE", "max_queue_size", MAX_QUEUE_SIZE)
+    MAX_QUEUE_WAIT_SECONDS = setting(config, "HTTPKIT_MAX_QUEUE_WAIT_SECONDS", "max_queue_wait_seconds", MAX_QUEUE_WAIT_SECONDS, float)
+    RETRY_AFTER_SECONDS = setting(config, "HTTPKIT_RETRY_AFTER_SECONDS", "retry_after_seconds", RETRY_AFTER_SECONDS)
+    
+    # Optionally adapt the global limit to upstream latency, starting from the maximum
+    ADAPTIVE_CONCURRENCY = setting(
+        config, "HTTPKIT_ADAPTIVE_CONCURRENCY", "adaptive_concurrency", ADAPTIVE_CONCURRENCY,
+        lambda value: str(value).lower() in ("1", "true", "yes"),
+    )
+    MIN_CONCURRENT_REQUESTS = setting(config, "HTTPKIT_MIN_CONCURRENT_REQUESTS", "min_concurrent_requests", MIN_CONCURRENT_REQUESTS)
+    adaptive = AIMDLimit(max_concurrent_requests, MIN_CONCURRENT_REQUESTS, max_concurrent_requests) if ADAPTIVE_CONCURRENCY else None
+    
+    # Priority classes, chosen by request header or by origin/group and path rules
+    PRIORITY_HEADER = setting(config, "HTTPKIT_PRIORITY_HEADER", "priority_header", PRIORITY_HEADER, str)
+    priority_classes, request_classifier = load_priorities(
+        config,
+        upstream_groups,
+        weights=parse_weights(os.environ.get("HTTPKIT_PRIORITY_CLASSES", "")),
+        default=os.environ.get("HTTPKIT_DEFAULT_PRIORITY"),
+        header=PRIORITY_HEADER or None,
+    )
+    
+    # The node-wide budget shared with the other worker processes
+    NODE_STATE_FILE = setting(config, "HTTPKIT_NODE_STATE_FILE", "node_state_file", NODE_STATE_FILE, str) or None
+    if node_budget is not None:
+        node_budget.close()
+    node_budget = NodeBudget(NODE_STATE_FILE, max_concurrent_requests) if NODE_STATE_FILE else None
+    if node_budget is not None:
+        node_budget.attach()
+    
+    # Initialize the request limiter
+    request_limiter = ConcurrencyLimiter(
+        max_concurrent_requests,
+        ORIGIN_MAX_CONCURRENT_REQUESTS,
+        origin_limits,
+        max_queue=MAX_QUEUE_SIZE,
+        max_wait=MAX_QUEUE_WAIT_SECONDS,
+        retry_after=RETRY_AFTER_SECONDS,
+        adaptive=adaptive,
+        priorities=priority_classes or None,
+        default_priority=request_classifier.default if request_classifier else None,
+        node=node_budget,
+    )
+    
+    # Token-bucket rate limits per client, API key and origin
+    CLIENT_RATE_LIMIT = setting(config, "HTTPKIT_CLIENT_RATE_LIMIT", "client_rate_limit", CLIENT_RATE_LIMIT, float)
+    CLIENT_RATE_BURST = setting(config, "HTTPKIT_CLIENT_RATE_BURST", "client_rate_burst", CLIENT_RATE_BURST, float)
+    API_KEY_RATE_LIMIT = setting(config, "HTTPKIT_API_KEY_RATE_LIMIT", "api_key_rate_limit", API_KEY_RATE_LIMIT, float)
+    API_KEY_RATE_BURST = setting(config, "HTTPKIT_API_KEY_RATE_BURST", "api_key_rate_burst", API_KEY_RATE_BURST, float)
+    API_KEY_HEADER = setting(config, "HTTPKIT_API_KEY_HEADER", "api_key_header", API_KEY_HEADER, str)
+    ORIGIN_RATE_LIMIT = setting(config, "HTTPKIT_ORIGIN_RATE_LIMIT", "origin_rate_limit", ORIGIN_RATE_LIMIT, float)
+    ORIGIN_RATE_BURST = setting(config, "HTTPKIT_ORIGIN_RATE_BURST", "origin_rate_burst", ORIGIN_RATE_BURST, float)
+    RATE_LIMIT_SLOTS = setting(config, "HTTPKIT_RATE_LIMIT_SLOTS", "rate_limit_slots", RATE_LIMIT_SLOTS)
+    RATE_LIMIT_FILE = setting(config, "HTTPKIT_RATE_LIMIT_FILE", "rate_limit_file", RATE_LIMIT_FILE, str) or None
+    origin_rate_limit, origin_rate_limits = load_rate_limits(origin_config, ORIGIN_RATE_LIMIT, ORIGIN_RATE_BURST)
+    if request_rate_limiter is not None:
+        request_rate_limiter.table.close()
+    request_rate_limiter = RateLimiter(
+        BucketTable(RATE_LIMIT_SLOTS, path=RATE_LIMIT_FILE),
+        client=RateLimit(CLIENT_RATE_LIMIT, CLIENT_RATE_BURST) if CLIENT_RATE_LIMIT > 0 else None,
+        api_key=RateLimit(API_KEY_RATE_LIMIT, API_KEY_RATE_BURST) if API_KEY_RATE_LIMIT > 0 else None,
+        origin=origin_rate_limit,
+        origin_overrides=origin_rate_limits,
+        api_key_header=API_KEY_HEADER,
+    ) if CLIENT_RATE_LIMIT > 0 or API_KEY_RATE_LIMIT > 0 or origin_rate_limit or any(origin_rate_limits.values()) else None
+    
+    # Get the request body chunk size from environment variable or use default
+    REQUEST_CHUNK_SIZE = int(os.environ.get("HTTPKIT_REQUEST_CHUNK_SIZE", REQUEST_CHUNK_SIZE))
+    
+    # Enable the response cache when a byte budget is configured
+    CACHE_MAX_BYTES = int(os.environ.get("HTTPKIT_CACHE_MAX_BYTES", CACHE_MAX_BYTES))
+    CACHE_MAX_ENTRY_BYTES = int(os.environ.get("HTTPKIT_CACHE_MAX_ENTRY_BYTES", CACHE_MAX_ENTRY_BYTES))
+    response_cache = ResponseCache(CACHE_MAX_BYTES, CACHE_MAX_ENTRY_BYTES) if CACHE_MAX_BYTES > 0 else None
+    
+    # On-disk tier for large responses; each worker takes its own shard of the directory
+    DISK_CACHE_DIR = setting(config, "HTTPKIT_DISK_CACHE_DIR", "disk_cache_dir", DISK_CACHE_DIR, str) or None
+    DISK_CACHE_MAX_BYTES = setting(config, "HTTPKIT_DISK_CACHE_MAX_BYTES", "disk_cache_max_bytes", DISK_CACHE_MAX_BYTES)
+    DISK_CACHE_MAX_ENTRY_BYTES = setting(
+        config, "HTTPKIT_DISK_CACHE_MAX_ENTRY_BYTES", "disk_cache_max_entry_bytes", DISK_CACHE_MAX_ENTRY_BYTES
+    )
+    DISK_CACHE_MIN_BYTES = setting(config, "HTTPKIT_DISK_CACHE_MIN_BYTES", "disk_cache_min_bytes", DISK_CACHE_MIN_BYTES)
+    if disk_cache is not None:
+        disk_cache.close()
+    disk_cache = DiskCache.open_shard(
+        DISK_CACHE_DIR, DISK_CACHE_MAX_BYTES, DISK_CACHE_MAX_ENTRY_BYTES
+    ) if DISK_CACHE_DIR else None
+    
+    # Content-encoding passthrough and optional response compression
+    ENCODING_PASSTHROUGH = setting(
+        config, "HTTPKIT_ENCODING_PASSTHROUGH", "encoding_passthrough", ENCODING_PASSTHROUGH,
+        lambda value: str(value).lower() in ("1", "true", "yes"),
+    )
+    COMPRESS_RESPONSES = setting(
+        config, "HTTPKIT_COMPRESS_RESPONSES", "compress_responses", COMPRESS_RESPONSES,
+        lambda value: str(value).lower() in ("1", "true", "yes"),
+    )
+    COMPRESS_MIN_BYTES = setting(config, "HTTPKIT_COMPRESS_MIN_BYTES", "compress_min_bytes", COMPRESS_MIN_BYTES)
+    
+    # Long-lived event streams
+    STREAM_CONTENT_TYPES = setting(
+        config, "HTTPKIT_STREAM_CONTENT_TYPES", "stream_content_types", STREAM_CONTENT_TYPES,
+        lambda value: frozenset(
+            media_type(item) for item in (value.split(",") if isinstance(value, str) else value) if item.strip()
+        ),
+    )
+    STREAM_CHUNKED = setting(
+        config, "HTTPKIT_STREAM_CHUNKED", "stream_chunked", STREAM_CHUNKED,
+        lambda value: str(value).lower() in ("1", "true", "yes"),
+    )
+    STREAM_IDLE_TIMEOUT_SECONDS = setting(config, "HTTPKIT_STREAM_IDLE_TIMEOUT_SECONDS", "stream_idle_timeout_seconds", STREAM_IDLE_TIMEOUT_SECONDS, float)
+    STREAM_HEARTBEAT_SECONDS = setting(config, "HTTPKIT_STREAM_HEARTBEAT_SECONDS", "stream_heartbeat_seconds", STREAM_HEARTBEAT_SECONDS, float)
+    
+    # Enable single-flight coalescing of identical concurrent GETs if requested
+    COALESCE_REQUESTS = os.environ.get("HTTPKIT_COALESCE_REQUESTS", str(COALESCE_REQUESTS)).lower() in ("1", "true", "yes")
+    COALESCE_BUFFER_CHUNKS = int(os.environ.get("HTTPKIT_COALESCE_BUFFER_CHUNKS", COALESCE_BUFFER_CHUNKS))
+    coalesce_headers = os.environ.get("HTTPKIT_COALESCE_HEADERS", ",".join(DEFAULT_KEY_HEADERS)).split(",")
+    request_coalescer = RequestCoalescer(coalesce_headers, COALESCE_BUFFER_CHUNKS, raw=ENCODING_PASSTHROUGH) if COALESCE_REQUESTS else None
+    
+    # Budgeted retries and hedging for idempotent requests
+    MAX_RETRIES = setting(config, "HTTPKIT_MAX_RETRIES", "max_retries", MAX_RETRIES)
+    RETRY_BUDGET_PERCENT = setting(config, "HTTPKIT_RETRY_BUDGET_PERCENT", "retry_budget_percent", RETRY_BUDGET_PERCENT, float)
+    RETRY_BACKOFF_SECONDS = setting(config, "HTTPKIT_RETRY_BACKOFF_SECONDS", "retry_backoff_seconds", RETRY_BACKOFF_SECONDS, float)
+    HEDGE_PERCENTILE = setting(config, "HTTPKIT_HEDGE_PERCENTILE", "hedge_percentile", HEDGE_PERCENTILE, float)
+    HEDGE_MIN_DELAY_SECONDS = setting(config, "HTTPKIT_HEDGE_MIN_DELAY_SECONDS", "hedge_min_delay_seconds", HEDGE_MIN_DELAY_SECONDS, float)
+    request_retries = ResilientSender(
+        max_retries=MAX_RETRIES,
+        budget=RetryBudget(RETRY_BUDGET_PERCENT / 100.0),
+        backoff=RETRY_BACKOFF_SECONDS,
+        hedge_percentile=HEDGE_PERCENTILE,
+        hedge_min_delay=HEDGE_MIN_DELAY_SECONDS,
+    ) if MAX_RETRIES > 0 or HEDGE_PERCENTILE > 0 else None
+
+    # Spooled request bodies, so idempotent requests with a body can be retried too
+    SPOOL_REQUEST_BODIES = setting(
+        config, "HTTPKIT_SPOOL_REQUEST_BODIES", "spool_request_bodies", SPOOL_REQUEST_BODIES,
+        lambda value: str(value).lower() in ("1", "true", "yes"),
+    )
+    SPOOL_MEMORY_BYTES = setting(config, "HTTPKIT_SPOOL_MEMORY_BYTES", "spool_memory_bytes", SPOOL_MEMORY_BYTES)
+    SPOOL_MAX_BODY_BYTES = setting(config, "HTTPKIT_SPOOL_MAX_BODY_BYTES", "spool_max_body_bytes", SPOOL_MAX_BODY_BYTES)
+    SPOOL_BUDGET_BYTES = setting(config, "HTTPKIT_SPOOL_BUDGET_BYTES", "spool_budget_bytes", SPOOL_BUDGET_BYTES)
+    SPOOL_WAIT_SECONDS = setting(config, "HTTPKIT_SPOOL_WAIT_SECONDS", "spool_wait_seconds", SPOOL_WAIT_SECONDS, float)
+    SPOOL_DIR = setting(config, "HTTPKIT_SPOOL_DIR", "spool_dir", SPOOL_DIR, str) or None
+    body_budget = BodyBudget(
+        SPOOL_BUDGET_BYTES, SPOOL_WAIT_SECONDS, RETRY_AFTER_SECONDS
+    ) if SPOOL_REQUEST_BODIES and request_retries is not None else None
+    
+    # Per-origin circuit breakers
+    CIRCUIT_BREAKER = setting(
+        config, "HTTPKIT_CIRCUIT_BREAKER", "circuit_breaker", CIRCUIT_BREAKER,
+        lambda value: str(value).lower() in ("1", "true", "yes"),
+    )
+    BREAKER_FAILURE_THRESHOLD = setting(config, "HTTPKIT_BREAKER_FAILURE_THRESHOLD", "breaker_failure_threshold", BREAKER_FAILURE_THRESHOLD)
+    BREAKER_ERROR_RATE_PERCENT = setting(config, "HTTPKIT_BREAKER_ERROR_RATE_PERCENT", "breaker_error_rate_percent", BREAKER_ERROR_RATE_PERCENT, float)
+    BREAKER_SLOW_CALL_SECONDS = setting(config, "HTTPKIT_BREAKER_SLOW_CALL_SECONDS", "breaker_slow_call_seconds", BREAKER_SLOW_CALL_SECONDS, float)
+    BREAKER_OPEN_SECONDS = setting(config, "HTTPKIT_BREAKER_OPEN_SECONDS", "breaker_open_seconds", BREAKER_OPEN_SECONDS, float)
+    BREAKER_HALF_OPEN_PROBES = setting(config, "HTTPKIT_BREAKER_HALF_OPEN_PROBES", "breaker_half_open_probes", BREAKER_HALF_OPEN_PROBES)
+    request_breakers = CircuitBreakers(
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        error_rate=BREAKER_ERROR_RATE_PERCENT / 100.0,
+        slow_call_seconds=BREAKER_SLOW_CALL_SECONDS,
+        slow_call_rate=BREAKER_ERROR_RATE_PERCENT / 100.0,
+        open_seconds=BREAKER_OPEN_SECONDS,
+        half_open_probes=BREAKER_HALF_OPEN_PROBES,
+        on_transition=circuit_changed,
+    ) if CIRCUIT_BREAKER else None
+    
+    # Access log, flushed by a background thread
+    ACCESS_LOG = setting(config, "HTTPKIT_ACCESS_LOG", "access_log", ACCESS_LOG, str) or None
+    ACCESS_LOG_SAMPLE_RATE = setting(config, "HTTPKIT_ACCESS_LOG_SAMPLE_RATE", "access_log_sample_rate", ACCESS_LOG_SAMPLE_RATE, float)
+    ACCESS_LOG_SLOW_SECONDS = setting(config, "HTTPKIT_ACCESS_LOG_SLOW_SECONDS", "access_log_slow_seconds", ACCESS_LOG_SLOW_SECONDS, float)
+    ACCESS_LOG_ERRORS = setting(
+        config, "HTTPKIT_ACCESS_LOG_ERRORS", "access_log_errors", ACCESS_LOG_ERRORS,
+        lambda value: str(value).lower() in ("1", "true", "yes"),
+    )
+    ACCESS_LOG_BUFFER = setting(config, "HTTPKIT_ACCESS_LOG_BUFFER", "access_log_buffer", ACCESS_LOG_BUFFER)
+    ACCESS_LOG_MAX_BYTES = setting(config, "HTTPKIT_ACCESS_LOG_MAX_BYTES", "access_log_max_bytes", ACCESS_LOG_MAX_BYTES)
+    ACCESS_LOG_BACKUPS = setting(config, "HTTPKIT_ACCESS_LOG_BACKUPS", "access_log_backups", ACCESS_LOG_BACKUPS)
+    if access_log is not None:
+        access_log.close()
+    access_log = AccessLog(
+        ACCESS_LOG.replace("{pid}", str(os.getpid())),
+        capacity=ACCESS_LOG_BUFFER,
+        sample_rate=ACCESS_LOG_SAMPLE_RATE,
+        slow_seconds=ACCESS_LOG_SLOW_SECONDS,
+        log_errors=ACCESS_LOG_ERRORS,
+        max_bytes=ACCESS_LOG_MAX_BYTES,
+        backups=ACCESS_LOG_BACKUPS,
+    ) if ACCESS_LOG else None
+    
+    # Phase timing for the Server-Timing header and /debug/slow
+    SERVER_TIMING = setting(
+        config, "HTTPKIT_SERVER_TIMING", "server_timing", SERVER_TIMING,
+        lambda value: str(value).lower() in ("1", "true", "yes"),
+    )
+    SLOW_REQUESTS = setting(config, "HTTPKIT_SLOW_REQUESTS", "slow_requests", SLOW_REQUESTS)
+    SLOW_REQUESTS_WINDOW_SECONDS = setting(
+        config, "HTTPKIT_SLOW_REQUESTS_WINDOW_SECONDS", "slow_requests_window_seconds", SLOW_REQUESTS_WINDOW_SECONDS, float
+    )
+    slow_requests = SlowRequests(SLOW_REQUESTS, SLOW_REQUESTS_WINDOW_SECONDS) if SLOW_REQUESTS > 0 else None
+    
+    # Metrics; workers sharing a metrics directory publish their gauges periodically
+    METRICS_ENABLED = os.environ.get("HTTPKIT_METRICS", str(METRICS_ENABLED)).lower() in ("1", "true", "yes")
+    METRICS_DIR = os.environ.get("HTTPKIT_METRICS_DIR", METRICS_DIR)
+    if request_metrics is None or request_metrics.store.directory != METRICS_DIR:
+        request_metrics = ProxyMetrics(METRICS_DIR) if METRICS_ENABLED else None
+    elif not METRICS_ENABLED:
+        request_metrics = None
+    if request_metrics is not None and METRICS_DIR and metrics_refresh_task is None:
+        metrics_refresh_task = asyncio.ensure_future(refresh_metrics_periodically())
+
+
+# The settings startup_event reads, as defined above
+DEFAULT_SETTINGS = {
+    name: globals()[name] for name in startup_event.__code__.co_names if name.isupper() and name != "DEFAULT_SETTINGS"
+}
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up resources on application shutdown."""
-    global http_client
+    global http_client, request_metrics, metrics_refresh_task, health_check_tasks, dns_refresh_task, warmup_task
+    global request_rate_limiter, access_log, disk_cache, node_budget
+    for task in health_check_tasks:
+        task.cancel()
+    health_check_tasks = []
+    for task in (dns_refresh_task, warmup_task):
+        if task is not None:
+            task.cancel()
+    dns_refresh_task = warmup_task = None
     if http_client:
         await http_client.aclose()
+    for client in origin_clients.values():
+        await client.aclose()
+    if metrics_refresh_task is not None:
+        metrics_refresh_task.cancel()
+        metrics_refresh_task = None
+    if request_metrics is not None and request_metrics.store.directory:
+        request_metrics.close()
+        request_metrics = None
+    if request_rate_limiter is not None:
+        request_rate_limiter.table.close()
+        request_rate_limiter = None
+    if access_log is not None:
+        access_log.close()
+        access_log = None
+    if disk_cache is not None:
+        disk_cache.close()
+        disk_cache = None
+    if node_budget is not None:
+        node_budget.close()
+        node_budget = None
+
+
+def client_for(origin: str) -> httpx.AsyncClient:
+    """Return the pooled client used for requests to ``origin``."""
+    return origin_clients.get(origin, http_client)
+
+
+def circuit_changed(origin: str, state: str, open_until: float):
+    """Count a circuit breaker transition and eject the origin from its groups while open."""
+    if request_metrics is not None:
+        request_metrics.record_transition(origin, state)
+    member = group_members.get(origin)
+    if member is not None:
+        member.ejected_until = open_until if state == OPEN else 0.0
+        for group in upstream_groups.values():
+            if member in group.members:
+                group.update_healthy()
+
+
+def refresh_metrics():
+    """Copy this worker's limiter and connection pool state into its metric gauges."""
+    clients = [http_client] if http_client else []
+    clients += list(origin_clients.values())
+    pool_active = pool_idle = 0
+    for client in clients:
+        for connections in pool_stats(client).values():
+            pool_active += connections["active"]
+            pool_idle += connections["idle"]
+
+    limiter = request_limiter
+    request_metrics.set_gauges(
+        limit=limiter.limit if limiter else MAX_CONCURRENT_REQUESTS,
+        active=limiter.active if limiter else 0,
+        queued=limiter.queued() if limiter else 0,
+        shed=limiter.shed_queue_full + limiter.shed_timeout if limiter else 0,
+        pool_active=pool_active,
+        pool_idle=pool_idle,
+        pool_pending=sum(pool_pending(client) for client in clients),
+    )
+    if request_breakers is not None:
+        counts = request_breakers.counts()
+        request_metrics.set_breaker_gauges(counts[OPEN], counts[HALF_OPEN], request_breakers.rejected)
+    if request_classifier is not None and limiter is not None:
+        for name, priority in limiter.priorities.items():
+            request_metrics.set_priority_gauges(name, priority.queued(), priority.shed_queue_full + priority.shed_timeout)
+    request_metrics.set_stream_gauges(stream_tracker.active, stream_tracker.idle_timeouts)
+    if request_rate_limiter is not None:
+        request_metrics.set_rate_limit_gauges(request_rate_limiter.rejected)
+    if access_log is not None:
+        request_metrics.set_access_log_gauges(access_log.dropped)
+
+
+async def refresh_metrics_periodically():
+    """Keep this worker's gauges current for scrapes served by other workers."""
+    while True:
+        if request_metrics is not None:
+            refresh_metrics()
+        await asyncio.sleep(METRICS_REFRESH_SECONDS)
+
+
+@app.api_route(
+    "/proxy/@{group}/{path:path}",
+    methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
+)
+async def proxy_group_request(request: Request, group: str, path: str):
+    """
+    Forward the incoming request to a member of a named upstream group.
+
+    Args:
+        request: The incoming request.
+        group: The name of the upstream group.
+        path: The path to forward the request to.
+
+    Returns:
+        The response from the selected member.
+    """
+    try:
+        target_url = group_target_url(group, path, request.scope["query_string"])
+    except UnknownGroup as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except NoHealthyMembers as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return await forward_request(request, target_url)
+
+
+@app.api_route(
+    "/proxy/unix:{target:path}",
+    methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
+)
+async def proxy_unix_request(request: Request, target: str):
+    """
+    Forward the incoming request to an upstream listening on a configured Unix domain socket.
+
+    Args:
+        request: The incoming request.
+        target: The socket path, percent-encoded or not, followed by the path to forward the request to.
+
+    Returns:
+        The response from the upstream.
+    """
+    try:
+        target_url = unix_target_url(target, request.scope["query_string"])
+    except UnknownSocket as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    return await forward_request(request, target_url)
 
 
 @app.api_route(
@@ -124,9 +1528,6 @@ async def proxy_request(
     Returns:
         The response from the target server.
     """
-    # Use the global client and semaphore
-    global http_client, request_semaphore
-    
     # Validate scheme
     if scheme.lower() not in ["http", "https"]:
         raise HTTPException(
@@ -135,49 +1536,37 @@ async def proxy_request(
         )
     
     # Construct the target URL
-    target_url = f"{scheme}://{target_host}:{target_port}/{path}"
-    if request.query_params:
-        query_string = str(request.query_params)
-        target_url = f"{target_url}?{query_string}"
+    target_url = build_target_url(scheme, target_host, target_port, path, request.scope["query_string"])
+    return await forward_request(request, target_url)
+
 
+async def forward_request(request: Request, target_url: str) -> Response:
+    """Forward the incoming request to ``target_url``, mapping failures to HTTP errors."""
     # Get request headers, filtering out hop-by-hop headers
-    headers = {
-        k: v for k, v in request.headers.items() 
-        if k.lower() not in HOP_BY_HOP_HEADERS
-    }
+    headers = filter_request_headers(request.headers.raw)
 
-    # Get request body
-    body = await request.body()
+    # Stream the request body upstream as it arrives. httpx keeps the client's
+    # Content-Length if one was sent and uses chunked transfer otherwise.
+    body = stream_request_body(request.receive, REQUEST_CHUNK_SIZE) if has_request_body(request.headers.raw) else None
 
     try:
-        # Check if global client is initialized
-        if http_client is None:
-            # Initialize client if not already done (for tests or direct calls)
-            await startup_event()
-            
-        # Acquire semaphore to limit concurrency
-        async with request_semaphore:
-            # Forward the request to the target server using the global client
-            response = await http_client.request(
-                method=request.method,
-                url=target_url,
-                headers=headers,
-                content=body,
-            )
-
-            # Filter out unsafe response headers
-            filtered_headers = {
-                k: v for k, v in response.headers.items()
-                if k.lower() not in UNSAFE_RESPONSE_HEADERS
-            }
-
-            # Return a streaming response
-            return StreamingResponse(
-                response.aiter_bytes(),
-                status_code=response.status_code,
-                headers=filtered_headers,
-                media_type=response.headers.get("content-type")
-            )
+        return await send_upstream(
+            request.method, target_url, headers, body, request.client.host if request.client else None
+        )
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded: {e.reason}",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Proxy overloaded: {e.reason}",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except BodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except httpx.RequestError as e:
         raise HTTPException(
             status_code=502,
@@ -228,13 +1617,189 @@ async def root():
         ],
         "configuration": {
             "max_concurrent_requests": MAX_CONCURRENT_REQUESTS,
+            "origin_max_concurrent_requests": request_limiter.origin_limit if request_limiter else MAX_CONCURRENT_REQUESTS,
+            "adaptive_concurrency": ADAPTIVE_CONCURRENCY,
+            "min_concurrent_requests": MIN_CONCURRENT_REQUESTS,
+            "max_queue_size": MAX_QUEUE_SIZE,
+            "max_queue_wait_seconds": MAX_QUEUE_WAIT_SECONDS,
+            "priority_classes": {
+                name: priority.weight for name, priority in request_limiter.priorities.items()
+            } if request_classifier and request_limiter else {},
+            "default_priority": request_classifier.default if request_classifier else None,
+            "client_rate_limit": CLIENT_RATE_LIMIT,
+            "api_key_rate_limit": API_KEY_RATE_LIMIT,
+            "api_key_header": API_KEY_HEADER,
+            "origin_rate_limit": ORIGIN_RATE_LIMIT,
+            "rate_limit_shared": RATE_LIMIT_FILE is not None,
+            "node_state_shared": NODE_STATE_FILE is not None,
+            "access_log": ACCESS_LOG,
+            "access_log_sample_rate": ACCESS_LOG_SAMPLE_RATE,
+            "access_log_slow_seconds": ACCESS_LOG_SLOW_SECONDS,
+            "server_timing": SERVER_TIMING,
+            "slow_requests": SLOW_REQUESTS,
+            "max_connections": MAX_CONNECTIONS,
+            "max_keepalive_connections": MAX_KEEPALIVE_CONNECTIONS,
+            "config_file": CONFIG_FILE,
+            "dns_cache_ttl_seconds": DNS_CACHE_TTL_SECONDS,
+            "warm_origins": len(connection_warmer.origins) if connection_warmer else 0,
             "timeout_seconds": http_client.timeout.read if http_client else 30.0,
-            "http2_enabled": http_client.http2 if http_client else False,
+            "http2_enabled": HTTP2_ENABLED if http_client else False,
+            "engine": ENGINE,
+            "event_loop": active_loop(),
+            "http_parser": active_http_parser(),
+            "upstream_transport": UPSTREAM_TRANSPORT,
+            "unix_sockets": list(UNIX_SOCKETS),
+            "request_chunk_size": REQUEST_CHUNK_SIZE,
+            "fast_path_enabled": FAST_PATH_ENABLED,
+            "cache_max_bytes": CACHE_MAX_BYTES,
+            "disk_cache_dir": DISK_CACHE_DIR,
+            "disk_cache_max_bytes": DISK_CACHE_MAX_BYTES,
+            "coalesce_requests": COALESCE_REQUESTS,
+            "encoding_passthrough": ENCODING_PASSTHROUGH,
+            "compress_responses": COMPRESS_RESPONSES,
+            "stream_content_types": sorted(STREAM_CONTENT_TYPES),
+            "stream_chunked": STREAM_CHUNKED,
+            "stream_idle_timeout_seconds": STREAM_IDLE_TIMEOUT_SECONDS,
+            "stream_heartbeat_seconds": STREAM_HEARTBEAT_SECONDS,
+            "metrics_enabled": METRICS_ENABLED,
+            "max_retries": MAX_RETRIES,
+            "retry_budget_percent": RETRY_BUDGET_PERCENT,
+            "hedge_percentile": HEDGE_PERCENTILE,
+            "spool_request_bodies": SPOOL_REQUEST_BODIES,
+            "spool_memory_bytes": SPOOL_MEMORY_BYTES,
+            "spool_max_body_bytes": SPOOL_MAX_BODY_BYTES,
+            "spool_budget_bytes": SPOOL_BUDGET_BYTES,
+            "circuit_breaker": CIRCUIT_BREAKER,
+            "breaker_failure_threshold": BREAKER_FAILURE_THRESHOLD,
+            "breaker_error_rate_percent": BREAKER_ERROR_RATE_PERCENT,
+            "breaker_open_seconds": BREAKER_OPEN_SECONDS,
             "configuration_options": [
-                "CLI: --max-concurrent-requests <number>, --timeout <seconds>",
-                "ENV: HTTPKIT_MAX_CONCURRENT_REQUESTS, HTTPKIT_TIMEOUT_SECONDS"
+                "CLI: --max-concurrent-requests <number>, --timeout <seconds>, --request-chunk-size <bytes>, --fast-path, "
+                "--config <file>, --origin-max-concurrent-requests <number>, --origin-limit <origin>=<number>, "
+                "--max-connections <number>, --max-keepalive-connections <number>, "
+                "--cache-max-bytes <bytes>, --cache-max-entry-bytes <bytes>, --coalesce-requests, "
+                "--coalesce-headers <names>, --coalesce-buffer-chunks <number>, --adaptive-concurrency, "
+                "--min-concurrent-requests <number>, --max-queue-size <number>, --max-queue-wait <seconds>, "
+                "--retry-after <seconds>, --disable-metrics, --metrics-dir <directory>, --max-retries <number>, "
+                "--retry-budget-percent <percent>, --retry-backoff <seconds>, --hedge-percentile <percentile>, "
+                "--hedge-min-delay <seconds>, --circuit-breaker, --breaker-failure-threshold <number>, "
+                "--breaker-error-rate-percent <percent>, --breaker-slow-call <seconds>, --breaker-open-seconds <seconds>, "
+                "--breaker-half-open-probes <number>, --encoding-passthrough, --compress-responses, "
+                "--compress-min-bytes <bytes>, --dns-cache-ttl <seconds>, --dns-negative-ttl <seconds>, "
+                "--warm-origin <origin>=<connections>, --warm-path <path>, --warm-interval <seconds>, "
+                "--stream-content-types <types>, --stream-chunked, --stream-idle-timeout <seconds>, "
+                "--stream-heartbeat <seconds>, --priority-class <name>=<weight>, --default-priority <name>, "
+                "--priority-header <name>, --client-rate-limit <rps>, --client-rate-burst <requests>, "
+                "--api-key-rate-limit <rps>, --api-key-rate-burst <requests>, --api-key-header <name>, "
+                "--origin-rate-limit <rps>, --origin-rate-burst <requests>, --rate-limit-file <file>, "
+                "--access-log <file>, --access-log-sample-rate <fraction>, --access-log-slow <seconds>, "
+                "--access-log-no-errors, --access-log-buffer <records>, --access-log-max-bytes <bytes>, "
+                "--access-log-backups <number>, --server-timing, --slow-requests <number>, "
+                "--slow-requests-window <seconds>, --disk-cache-dir <directory>, --disk-cache-max-bytes <bytes>, "
+                "--disk-cache-max-entry-bytes <bytes>, --disk-cache-min-bytes <bytes>, --workers <number>, "
+                "--pin-workers, --graceful-timeout <seconds>, --node-state-file <file>, --engine <engine>, "
+                "--upstream-transport <transport>, --spool-request-bodies, --spool-memory-bytes <bytes>, "
+                "--spool-max-body-bytes <bytes>, --spool-budget-bytes <bytes>, --spool-dir <directory>, --host <address>, "
+                "--port <port>, --uds <path>, --unix-socket <path>",
+                "ENV: HTTPKIT_MAX_CONCURRENT_REQUESTS, HTTPKIT_TIMEOUT_SECONDS, HTTPKIT_REQUEST_CHUNK_SIZE, HTTPKIT_FAST_PATH, "
+                "HTTPKIT_CONFIG_FILE, HTTPKIT_ORIGIN_MAX_CONCURRENT_REQUESTS, HTTPKIT_ORIGIN_LIMITS, "
+                "HTTPKIT_MAX_CONNECTIONS, HTTPKIT_MAX_KEEPALIVE_CONNECTIONS, "
+                "HTTPKIT_CACHE_MAX_BYTES, HTTPKIT_CACHE_MAX_ENTRY_BYTES, HTTPKIT_COALESCE_REQUESTS, "
+                "HTTPKIT_COALESCE_HEADERS, HTTPKIT_COALESCE_BUFFER_CHUNKS, HTTPKIT_ADAPTIVE_CONCURRENCY, "
+                "HTTPKIT_MIN_CONCURRENT_REQUESTS, HTTPKIT_MAX_QUEUE_SIZE, HTTPKIT_MAX_QUEUE_WAIT_SECONDS, "
+                "HTTPKIT_RETRY_AFTER_SECONDS, HTTPKIT_METRICS, HTTPKIT_METRICS_DIR, HTTPKIT_MAX_RETRIES, "
+                "HTTPKIT_RETRY_BUDGET_PERCENT, HTTPKIT_RETRY_BACKOFF_SECONDS, HTTPKIT_HEDGE_PERCENTILE, "
+                "HTTPKIT_HEDGE_MIN_DELAY_SECONDS, HTTPKIT_CIRCUIT_BREAKER, HTTPKIT_BREAKER_FAILURE_THRESHOLD, "
+                "HTTPKIT_BREAKER_ERROR_RATE_PERCENT, HTTPKIT_BREAKER_SLOW_CALL_SECONDS, HTTPKIT_BREAKER_OPEN_SECONDS, "
+                "HTTPKIT_BREAKER_HALF_OPEN_PROBES, HTTPKIT_ENCODING_PASSTHROUGH, HTTPKIT_COMPRESS_RESPONSES, "
+                "HTTPKIT_COMPRESS_MIN_BYTES, HTTPKIT_DNS_CACHE_TTL_SECONDS, HTTPKIT_DNS_NEGATIVE_TTL_SECONDS, "
+                "HTTPKIT_WARM_ORIGINS, HTTPKIT_WARM_PATH, HTTPKIT_WARM_INTERVAL_SECONDS, "
+                "HTTPKIT_STREAM_CONTENT_TYPES, HTTPKIT_STREAM_CHUNKED, HTTPKIT_STREAM_IDLE_TIMEOUT_SECONDS, "
+                "HTTPKIT_STREAM_HEARTBEAT_SECONDS, HTTPKIT_PRIORITY_CLASSES, HTTPKIT_DEFAULT_PRIORITY, "
+                "HTTPKIT_PRIORITY_HEADER, HTTPKIT_CLIENT_RATE_LIMIT, HTTPKIT_CLIENT_RATE_BURST, "
+                "HTTPKIT_API_KEY_RATE_LIMIT, HTTPKIT_API_KEY_RATE_BURST, HTTPKIT_API_KEY_HEADER, "
+                "HTTPKIT_ORIGIN_RATE_LIMIT, HTTPKIT_ORIGIN_RATE_BURST, HTTPKIT_RATE_LIMIT_SLOTS, HTTPKIT_RATE_LIMIT_FILE, "
+                "HTTPKIT_ACCESS_LOG, HTTPKIT_ACCESS_LOG_SAMPLE_RATE, HTTPKIT_ACCESS_LOG_SLOW_SECONDS, "
+                "HTTPKIT_ACCESS_LOG_ERRORS, HTTPKIT_ACCESS_LOG_BUFFER, HTTPKIT_ACCESS_LOG_MAX_BYTES, HTTPKIT_ACCESS_LOG_BACKUPS, "
+                "HTTPKIT_SERVER_TIMING, HTTPKIT_SLOW_REQUESTS, HTTPKIT_SLOW_REQUESTS_WINDOW_SECONDS, "
+                "HTTPKIT_DISK_CACHE_DIR, HTTPKIT_DISK_CACHE_MAX_BYTES, HTTPKIT_DISK_CACHE_MAX_ENTRY_BYTES, "
+                "HTTPKIT_DISK_CACHE_MIN_BYTES, HTTPKIT_WORKERS, HTTPKIT_PIN_WORKERS, HTTPKIT_GRACEFUL_TIMEOUT_SECONDS, "
+                "HTTPKIT_NODE_STATE_FILE, HTTPKIT_ENGINE, HTTPKIT_UPSTREAM_TRANSPORT, HTTPKIT_SPOOL_REQUEST_BODIES, "
+                "HTTPKIT_SPOOL_MEMORY_BYTES, HTTPKIT_SPOOL_MAX_BODY_BYTES, HTTPKIT_SPOOL_BUDGET_BYTES, "
+                "HTTPKIT_SPOOL_WAIT_SECONDS, HTTPKIT_SPOOL_DIR, HTTPKIT_HOST, HTTPKIT_PORT, HTTPKIT_UDS, HTTPKIT_UNIX_SOCKETS"
             ]
-        }
+        },
+        "cache": response_cache.stats() if response_cache else None,
+        "disk_cache": disk_cache.stats() if disk_cache else None,
+        "coalescing": request_coalescer.stats() if request_coalescer else None,
+        "retries": request_retries.stats() if request_retries else None,
+        "request_bodies": body_budget.stats() if body_budget else None,
+        "circuit_breakers": request_breakers.stats() if request_breakers else None,
+        "dns_cache": dns_cache.stats() if dns_cache else None,
+        "warmup": connection_warmer.stats() if connection_warmer else None,
+        "streams": stream_tracker.stats(),
+        "rate_limits": request_rate_limiter.stats() if request_rate_limiter else None,
+        "access_log": access_log.stats() if access_log else None,
+        "node": node_budget.stats() if node_budget else None,
+        "concurrency": {
+            "limit": request_limiter.limit if request_limiter else MAX_CONCURRENT_REQUESTS,
+            "active": request_limiter.active if request_limiter else 0,
+            "queued": request_limiter.queued() if request_limiter else 0,
+            "shed": request_limiter.shed_queue_full + request_limiter.shed_timeout if request_limiter else 0,
+            "priorities": {
+                name: priority.stats() for name, priority in request_limiter.priorities.items()
+            } if request_classifier and request_limiter else None,
+        },
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Return the proxy metrics in the Prometheus text exposition format."""
+    if request_metrics is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    refresh_metrics()
+    return PlainTextResponse(request_metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/debug/slow")
+async def debug_slow(limit: Optional[int] = None):
+    """Return the slowest recent requests with their phase breakdown, slowest first."""
+    if slow_requests is None:
+        raise HTTPException(status_code=404, detail="The slow request log is disabled")
+    return {
+        "window_seconds": slow_requests.window,
+        "requests": slow_requests.slowest(limit),
+    }
+
+
+@app.get("/upstreams")
+async def upstreams():
+    """Return per-origin concurrency slots, queue depths, connection pool, circuit and upstream group state."""
+    limiter_stats = request_limiter.stats() if request_limiter else {"limit": MAX_CONCURRENT_REQUESTS, "active": 0, "queued": 0, "origins": {}}
+    origins = {
+        origin: {**values, "connections": {"active": 0, "idle": 0}}
+        for origin, values in limiter_stats.pop("origins").items()
+    }
+
+    clients = [http_client] if http_client else []
+    clients += list(origin_clients.values())
+    for client in clients:
+        for origin, connections in pool_stats(client).items():
+            entry = origins.setdefault(origin, {"limit": None, "active": 0, "queued": 0, "connections": {"active": 0, "idle": 0}})
+            entry["connections"]["active"] += connections["active"]
+            entry["connections"]["idle"] += connections["idle"]
+
+    if request_breakers is not None:
+        for origin, breaker in request_breakers.breakers.items():
+            entry = origins.setdefault(origin, {"limit": None, "active": 0, "queued": 0, "connections": {"active": 0, "idle": 0}})
+            entry["circuit"] = breaker.state
+
+    return {
+        **limiter_stats,
+        "pool_pending": sum(pool_pending(client) for client in clients),
+        "origins": origins,
+        "groups": {name: group.stats() for name, group in upstream_groups.items()},
     }
 
 
@@ -250,6 +1815,170 @@ def main():
                         help="Maximum number of concurrent requests (default: 100)")
     parser.add_argument("--timeout", type=float, 
                         help="HTTP client timeout in seconds (default: 30.0)")
+    parser.add_argument("--request-chunk-size", type=int,
+                        help="Maximum chunk size in bytes for forwarded request bodies (default: 65536)")
+    parser.add_argument("--fast-path", action="store_true",
+                        help="Serve /proxy/ requests with the raw ASGI fast path instead of FastAPI routes")
+    parser.add_argument("--cache-max-bytes", type=int,
+                        help="Byte budget of the in-memory response cache, 0 disables it (default: 0)")
+    parser.add_argument("--cache-max-entry-bytes", type=int,
+                        help="Largest response the cache will store (default: the cache budget)")
+    parser.add_argument("--config",
+                        help="Path to a JSON configuration file")
+    parser.add_argument("--origin-max-concurrent-requests", type=int,
+                        help="Default maximum number of concurrent requests per origin (default: the global limit)")
+    parser.add_argument("--origin-limit", action="append", default=[], metavar="ORIGIN=N",
+                        help="Concurrency limit for one origin, e.g. https://api.example.com:443=50 (repeatable)")
+    parser.add_argument("--max-connections", type=int,
+                        help="Maximum connections in the shared upstream pool (default: 200)")
+    parser.add_argument("--max-keepalive-connections", type=int,
+                        help="Maximum idle keep-alive connections in the shared upstream pool (default: 50)")
+    parser.add_argument("--coalesce-requests", action="store_true",
+                        help="Coalesce identical concurrent GETs into a single upstream request")
+    parser.add_argument("--coalesce-headers",
+                        help="Comma-separated request headers that must match for GETs to be coalesced")
+    parser.add_argument("--coalesce-buffer-chunks", type=int,
+                        help="Body chunks buffered per coalesced subscriber (default: 16)")
+    parser.add_argument("--adaptive-concurrency", action="store_true",
+                        help="Adapt the concurrency limit to upstream latency (AIMD), up to --max-concurrent-requests")
+    parser.add_argument("--min-concurrent-requests", type=int,
+                        help="Lowest limit the adaptive concurrency limit can reach (default: 1)")
+    parser.add_argument("--max-queue-size", type=int,
+                        help="Maximum requests waiting for a slot before new ones get 503, 0 for no bound (default: 1000)")
+    parser.add_argument("--max-queue-wait", type=float,
+                        help="Seconds a request may wait for a slot before it gets 503, 0 for no deadline (default: 10.0)")
+    parser.add_argument("--retry-after", type=int,
+                        help="Retry-After seconds sent with 503 overload responses (default: 1)")
+    parser.add_argument("--max-retries", type=int,
+                        help="Retries of failed idempotent requests without a body (or with --spool-request-bodies), 0 disables retries (default: 0)")
+    parser.add_argument("--retry-budget-percent", type=float,
+                        help="Retries and hedges allowed as a percentage of requests (default: 10)")
+    parser.add_argument("--retry-backoff", type=float,
+                        help="Base delay in seconds of the jittered exponential retry backoff (default: 0.05)")
+    parser.add_argument("--hedge-percentile", type=float,
+                        help="Send a hedged copy of idempotent requests slower than this latency percentile, 0 disables hedging (default: 0)")
+    parser.add_argument("--hedge-min-delay", type=float,
+                        help="Minimum delay in seconds before a hedged copy is sent (default: 0.005)")
+    parser.add_argument("--spool-request-bodies", action="store_true",
+                        help="Spool the bodies of idempotent requests so they are retried and hedged too")
+    parser.add_argument("--spool-memory-bytes", type=int,
+                        help="Bytes of a spooled body held in memory before it moves to a temporary file (default: 1048576)")
+    parser.add_argument("--spool-max-body-bytes", type=int,
+                        help="Largest request body that is spooled; larger ones are refused with 413 (default: 104857600)")
+    parser.add_argument("--spool-budget-bytes", type=int,
+                        help="Spooled request body bytes in flight across all requests (default: 536870912)")
+    parser.add_argument("--spool-dir", type=str,
+                        help="Directory of the temporary files of spooled bodies (default: the system temporary directory)")
+    parser.add_argument("--circuit-breaker", action="store_true",
+                        help="Fail requests to failing upstreams fast with 503 using per-origin circuit breakers")
+    parser.add_argument("--breaker-failure-threshold", type=int,
+                        help="Consecutive upstream failures that open a circuit (default: 5)")
+    parser.add_argument("--breaker-error-rate-percent", type=float,
+                        help="Percentage of failed or slow recent requests that opens a circuit (default: 50)")
+    parser.add_argument("--breaker-slow-call", type=float,
+                        help="Seconds to response headers above which a request counts as slow, 0 to ignore latency (default: 0)")
+    parser.add_argument("--breaker-open-seconds", type=float,
+                        help="Seconds a circuit stays open before probing the upstream again (default: 5.0)")
+    parser.add_argument("--breaker-half-open-probes", type=int,
+                        help="Probe requests that must succeed to close a half-open circuit (default: 3)")
+    parser.add_argument("--encoding-passthrough", action="store_true",
+                        help="Forward compressed upstream bodies unchanged instead of decoding them")
+    parser.add_argument("--compress-responses", action="store_true",
+                        help="Compress uncompressed upstream responses with gzip or zstd for clients that accept it")
+    parser.add_argument("--compress-min-bytes", type=int,
+                        help="Smallest response body, by Content-Length, that is compressed (default: 1024)")
+    parser.add_argument("--dns-cache-ttl", type=float,
+                        help="Seconds upstream DNS resolutions are cached, 0 disables the cache (default: 60)")
+    parser.add_argument("--dns-negative-ttl", type=float,
+                        help="Seconds failed upstream DNS resolutions are cached (default: 5)")
+    parser.add_argument("--warm-origin", action="append", default=[], metavar="ORIGIN=N",
+                        help="Keep N idle connections open to an origin, e.g. https://api.example.com:443=4 (repeatable)")
+    parser.add_argument("--warm-path", help="Path requested to warm connections (default: /)")
+    parser.add_argument("--warm-interval", type=float,
+                        help="Seconds between connection warming rounds (default: 10)")
+    parser.add_argument("--stream-content-types",
+                        help="Comma-separated content types relayed as long-lived streams "
+                             "(default: text/event-stream,application/x-ndjson)")
+    parser.add_argument("--stream-chunked", action="store_true",
+                        help="Also relay chunked responses without a Content-Length as streams")
+    parser.add_argument("--stream-idle-timeout", type=float,
+                        help="Seconds a stream may go without upstream data before it is ended, 0 for no limit (default: 300)")
+    parser.add_argument("--stream-heartbeat", type=float,
+                        help="Seconds of upstream silence after which an SSE heartbeat is sent, 0 disables (default: 15)")
+    parser.add_argument("--priority-class", action="append", default=[], metavar="NAME=WEIGHT",
+                        help="Define a priority class sharing the concurrency budget by weight, e.g. interactive=8 (repeatable)")
+    parser.add_argument("--default-priority",
+                        help="Priority class of requests no header or rule assigns (default: the first class)")
+    parser.add_argument("--priority-header",
+                        help="Request header naming a request's priority class (default: X-HTTPKit-Priority)")
+    parser.add_argument("--client-rate-limit", type=float,
+                        help="Requests per second allowed per client IP, 0 for no limit (default: 0)")
+    parser.add_argument("--client-rate-burst", type=float,
+                        help="Requests a client may send at once above its rate (default: one second of the rate)")
+    parser.add_argument("--api-key-rate-limit", type=float,
+                        help="Requests per second allowed per API key, 0 for no limit (default: 0)")
+    parser.add_argument("--api-key-rate-burst", type=float,
+                        help="Requests an API key may send at once above its rate (default: one second of the rate)")
+    parser.add_argument("--api-key-header",
+                        help="Request header holding the API key (default: X-API-Key)")
+    parser.add_argument("--origin-rate-limit", type=float,
+                        help="Requests per second forwarded to each upstream origin, 0 for no limit (default: 0)")
+    parser.add_argument("--origin-rate-burst", type=float,
+                        help="Requests forwarded at once to an origin above its rate (default: one second of the rate)")
+    parser.add_argument("--rate-limit-file",
+                        help="File through which workers share rate limit buckets (default: a temporary file when HTTPKIT_WORKERS > 1)")
+    parser.add_argument("--access-log",
+                        help="Write a JSON lines access log to this file (default: no access log)")
+    parser.add_argument("--access-log-sample-rate", type=float,
+                        help="Fraction of requests written to the access log (default: 1.0)")
+    parser.add_argument("--access-log-slow", type=float,
+                        help="Always log requests taking at least this many seconds, 0 to sample them too (default: 1.0)")
+    parser.add_argument("--access-log-no-errors", action="store_true",
+                        help="Sample requests answered with 5xx like any other instead of always logging them")
+    parser.add_argument("--access-log-buffer", type=int,
+                        help="Records buffered for the access log writer before new ones are dropped (default: 8192)")
+    parser.add_argument("--access-log-max-bytes", type=int,
+                        help="Size at which the access log is rotated, 0 to never rotate (default: 104857600)")
+    parser.add_argument("--access-log-backups", type=int,
+                        help="Rotated access log files kept (default: 5)")
+    parser.add_argument("--server-timing", action="store_true",
+                        help="Add a Server-Timing header with the phases of each request to proxied responses")
+    parser.add_argument("--slow-requests", type=int,
+                        help="Keep the N slowest recent requests with their phases for /debug/slow, 0 disables (default: 0)")
+    parser.add_argument("--slow-requests-window", type=float,
+                        help="Seconds after which slow requests start to age out of /debug/slow (default: 300)")
+    parser.add_argument("--disk-cache-dir",
+                        help="Directory of the on-disk cache tier for large responses (default: disabled)")
+    parser.add_argument("--disk-cache-max-bytes", type=int,
+                        help="Byte budget of the disk cache per worker (default: 10737418240)")
+    parser.add_argument("--disk-cache-max-entry-bytes", type=int,
+                        help="Largest response the disk cache will store (default: the disk cache budget)")
+    parser.add_argument("--disk-cache-min-bytes", type=int,
+                        help="Responses at least this large go to the disk cache rather than memory (default: 1048576)")
+    parser.add_argument("--disable-metrics", action="store_true",
+                        help="Disable the Prometheus /metrics endpoint and metric recording")
+    parser.add_argument("--metrics-dir",
+                        help="Directory where workers share metrics (default: a temporary directory when HTTPKIT_WORKERS > 1)")
+    parser.add_argument("--workers", type=int,
+                        help="Number of worker processes (default: one per CPU core with HTTPKIT_ENV=production, otherwise 1)")
+    parser.add_argument("--pin-workers", action="store_true",
+                        help="Pin each worker process to its own CPU")
+    parser.add_argument("--graceful-timeout", type=float,
+                        help="Seconds workers get to finish in-flight requests on reload or shutdown (default: 30)")
+    parser.add_argument("--node-state-file",
+                        help="File through which workers share the node-wide concurrency budget (default: a temporary file when HTTPKIT_WORKERS > 1)")
+    parser.add_argument("--engine", choices=ENGINES,
+                        help="Event loop and HTTP parser: uvloop and httptools, plain asyncio and h11, or auto to use uvloop when installed (default: auto)")
+    parser.add_argument("--upstream-transport", choices=UPSTREAM_TRANSPORTS,
+                        help="Send plain HTTP/1.1 upstream requests with httpx or the raw asyncio transport (default: httpx)")
+    parser.add_argument("--host", type=str,
+                        help="Address to listen on (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int,
+                        help="Port to listen on (default: 8000)")
+    parser.add_argument("--uds", type=str,
+                        help="Listen on this Unix domain socket instead of a TCP port")
+    parser.add_argument("--unix-socket", action="append", default=[], metavar="PATH",
+                        help="Unix domain socket that may be used as an upstream, as /proxy/unix:PATH/... (repeatable)")
     args = parser.parse_args()
     
     # Get configuration from environment variables or command line arguments
@@ -264,16 +1993,314 @@ def main():
     if args.timeout is not None:
         os.environ["HTTPKIT_TIMEOUT_SECONDS"] = str(args.timeout)
     
+    if args.request_chunk_size is not None:
+        os.environ["HTTPKIT_REQUEST_CHUNK_SIZE"] = str(args.request_chunk_size)
+    
+    if args.fast_path:
+        os.environ["HTTPKIT_FAST_PATH"] = "1"
+    
+    if args.cache_max_bytes is not None:
+        os.environ["HTTPKIT_CACHE_MAX_BYTES"] = str(args.cache_max_bytes)
+    
+    if args.cache_max_entry_bytes is not None:
+        os.environ["HTTPKIT_CACHE_MAX_ENTRY_BYTES"] = str(args.cache_max_entry_bytes)
+    
+    if args.config is not None:
+        os.environ["HTTPKIT_CONFIG_FILE"] = args.config
+    
+    if args.origin_max_concurrent_requests is not None:
+        os.environ["HTTPKIT_ORIGIN_MAX_CONCURRENT_REQUESTS"] = str(args.origin_max_concurrent_requests)
+    
+    if args.origin_limit:
+        os.environ["HTTPKIT_ORIGIN_LIMITS"] = ",".join(args.origin_limit)
+    
+    if args.max_connections is not None:
+        os.environ["HTTPKIT_MAX_CONNECTIONS"] = str(args.max_connections)
+    
+    if args.max_keepalive_connections is not None:
+        os.environ["HTTPKIT_MAX_KEEPALIVE_CONNECTIONS"] = str(args.max_keepalive_connections)
+    
+    if args.coalesce_requests:
+        os.environ["HTTPKIT_COALESCE_REQUESTS"] = "1"
+    
+    if args.coalesce_headers is not None:
+        os.environ["HTTPKIT_COALESCE_HEADERS"] = args.coalesce_headers
+    
+    if args.coalesce_buffer_chunks is not None:
+        os.environ["HTTPKIT_COALESCE_BUFFER_CHUNKS"] = str(args.coalesce_buffer_chunks)
+    
+    if args.adaptive_concurrency:
+        os.environ["HTTPKIT_ADAPTIVE_CONCURRENCY"] = "1"
+    
+    if args.min_concurrent_requests is not None:
+        os.environ["HTTPKIT_MIN_CONCURRENT_REQUESTS"] = str(args.min_concurrent_requests)
+    
+    if args.max_queue_size is not None:
+        os.environ["HTTPKIT_MAX_QUEUE_SIZE"] = str(args.max_queue_size)
+    
+    if args.max_queue_wait is not None:
+        os.environ["HTTPKIT_MAX_QUEUE_WAIT_SECONDS"] = str(args.max_queue_wait)
+    
+    if args.retry_after is not None:
+        os.environ["HTTPKIT_RETRY_AFTER_SECONDS"] = str(args.retry_after)
+    
+    if args.max_retries is not None:
+        os.environ["HTTPKIT_MAX_RETRIES"] = str(args.max_retries)
+    
+    if args.retry_budget_percent is not None:
+        os.environ["HTTPKIT_RETRY_BUDGET_PERCENT"] = str(args.retry_budget_percent)
+    
+    if args.retry_backoff is not None:
+        os.environ["HTTPKIT_RETRY_BACKOFF_SECONDS"] = str(args.retry_backoff)
+    
+    if args.hedge_percentile is not None:
+        os.environ["HTTPKIT_HEDGE_PERCENTILE"] = str(args.hedge_percentile)
+    
+    if args.hedge_min_delay is not None:
+        os.environ["HTTPKIT_HEDGE_MIN_DELAY_SECONDS"] = str(args.hedge_min_delay)
+    
+    if args.spool_request_bodies:
+        os.environ["HTTPKIT_SPOOL_REQUEST_BODIES"] = "1"
+    
+    if args.spool_memory_bytes is not None:
+        os.environ["HTTPKIT_SPOOL_MEMORY_BYTES"] = str(args.spool_memory_bytes)
+    
+    if args.spool_max_body_bytes is not None:
+        os.environ["HTTPKIT_SPOOL_MAX_BODY_BYTES"] = str(args.spool_max_body_bytes)
+    
+    if args.spool_budget_bytes is not None:
+        os.environ["HTTPKIT_SPOOL_BUDGET_BYTES"] = str(args.spool_budget_bytes)
+    
+    if args.spool_dir:
+        os.environ["HTTPKIT_SPOOL_DIR"] = args.spool_dir
+    
+    if args.circuit_breaker:
+        os.environ["HTTPKIT_CIRCUIT_BREAKER"] = "1"
+    
+    if args.breaker_failure_threshold is not None:
+        os.environ["HTTPKIT_BREAKER_FAILURE_THRESHOLD"] = str(args.breaker_failure_threshold)
+    
+    if args.breaker_error_rate_percent is not None:
+        os.environ["HTTPKIT_BREAKER_ERROR_RATE_PERCENT"] = str(args.breaker_error_rate_percent)
+    
+    if args.breaker_slow_call is not None:
+        os.environ["HTTPKIT_BREAKER_SLOW_CALL_SECONDS"] = str(args.breaker_slow_call)
+    
+    if args.breaker_open_seconds is not None:
+        os.environ["HTTPKIT_BREAKER_OPEN_SECONDS"] = str(args.breaker_open_seconds)
+    
+    if args.breaker_half_open_probes is not None:
+        os.environ["HTTPKIT_BREAKER_HALF_OPEN_PROBES"] = str(args.breaker_half_open_probes)
+    
+    if args.encoding_passthrough:
+        os.environ["HTTPKIT_ENCODING_PASSTHROUGH"] = "1"
+    
+    if args.compress_responses:
+        os.environ["HTTPKIT_COMPRESS_RESPONSES"] = "1"
+    
+    if args.compress_min_bytes is not None:
+        os.environ["HTTPKIT_COMPRESS_MIN_BYTES"] = str(args.compress_min_bytes)
+    
+    if args.dns_cache_ttl is not None:
+        os.environ["HTTPKIT_DNS_CACHE_TTL_SECONDS"] = str(args.dns_cache_ttl)
+    
+    if args.dns_negative_ttl is not None:
+        os.environ["HTTPKIT_DNS_NEGATIVE_TTL_SECONDS"] = str(args.dns_negative_ttl)
+    
+    if args.warm_origin:
+        os.environ["HTTPKIT_WARM_ORIGINS"] = ",".join(args.warm_origin)
+    
+    if args.warm_path is not None:
+        os.environ["HTTPKIT_WARM_PATH"] = args.warm_path
+    
+    if args.warm_interval is not None:
+        os.environ["HTTPKIT_WARM_INTERVAL_SECONDS"] = str(args.warm_interval)
+    
+    if args.stream_content_types is not None:
+        os.environ["HTTPKIT_STREAM_CONTENT_TYPES"] = args.stream_content_types
+    
+    if args.stream_chunked:
+        os.environ["HTTPKIT_STREAM_CHUNKED"] = "1"
+    
+    if args.stream_idle_timeout is not None:
+        os.environ["HTTPKIT_STREAM_IDLE_TIMEOUT_SECONDS"] = str(args.stream_idle_timeout)
+    
+    if args.stream_heartbeat is not None:
+        os.environ["HTTPKIT_STREAM_HEARTBEAT_SECONDS"] = str(args.stream_heartbeat)
+    
+    if args.priority_class:
+        os.environ["HTTPKIT_PRIORITY_CLASSES"] = ",".join(args.priority_class)
+    
+    if args.default_priority is not None:
+        os.environ["HTTPKIT_DEFAULT_PRIORITY"] = args.default_priority
+    
+    if args.priority_header is not None:
+        os.environ["HTTPKIT_PRIORITY_HEADER"] = args.priority_header
+    
+    if args.client_rate_limit is not None:
+        os.environ["HTTPKIT_CLIENT_RATE_LIMIT"] = str(args.client_rate_limit)
+    
+    if args.client_rate_burst is not None:
+        os.environ["HTTPKIT_CLIENT_RATE_BURST"] = str(args.client_rate_burst)
+    
+    if args.api_key_rate_limit is not None:
+        os.environ["HTTPKIT_API_KEY_RATE_LIMIT"] = str(args.api_key_rate_limit)
+    
+    if args.api_key_rate_burst is not None:
+        os.environ["HTTPKIT_API_KEY_RATE_BURST"] = str(args.api_key_rate_burst)
+    
+    if args.api_key_header is not None:
+        os.environ["HTTPKIT_API_KEY_HEADER"] = args.api_key_header
+    
+    if args.origin_rate_limit is not None:
+        os.environ["HTTPKIT_ORIGIN_RATE_LIMIT"] = str(args.origin_rate_limit)
+    
+    if args.origin_rate_burst is not None:
+        os.environ["HTTPKIT_ORIGIN_RATE_BURST"] = str(args.origin_rate_burst)
+    
+    if args.rate_limit_file is not None:
+        os.environ["HTTPKIT_RATE_LIMIT_FILE"] = args.rate_limit_file
+    
+    if args.access_log is not None:
+        os.environ["HTTPKIT_ACCESS_LOG"] = args.access_log
+    
+    if args.access_log_sample_rate is not None:
+        os.environ["HTTPKIT_ACCESS_LOG_SAMPLE_RATE"] = str(args.access_log_sample_rate)
+    
+    if args.access_log_slow is not None:
+        os.environ["HTTPKIT_ACCESS_LOG_SLOW_SECONDS"] = str(args.access_log_slow)
+    
+    if args.access_log_no_errors:
+        os.environ["HTTPKIT_ACCESS_LOG_ERRORS"] = "0"
+    
+    if args.access_log_buffer is not None:
+        os.environ["HTTPKIT_ACCESS_LOG_BUFFER"] = str(args.access_log_buffer)
+    
+    if args.access_log_max_bytes is not None:
+        os.environ["HTTPKIT_ACCESS_LOG_MAX_BYTES"] = str(args.access_log_max_bytes)
+    
+    if args.access_log_backups is not None:
+        os.environ["HTTPKIT_ACCESS_LOG_BACKUPS"] = str(args.access_log_backups)
+    
+    if args.server_timing:
+        os.environ["HTTPKIT_SERVER_TIMING"] = "1"
+    
+    if args.slow_requests is not None:
+        os.environ["HTTPKIT_SLOW_REQUESTS"] = str(args.slow_requests)
+    
+    if args.slow_requests_window is not None:
+        os.environ["HTTPKIT_SLOW_REQUESTS_WINDOW_SECONDS"] = str(args.slow_requests_window)
+    
+    if args.disk_cache_dir is not None:
+        os.environ["HTTPKIT_DISK_CACHE_DIR"] = args.disk_cache_dir
+    
+    if args.disk_cache_max_bytes is not None:
+        os.environ["HTTPKIT_DISK_CACHE_MAX_BYTES"] = str(args.disk_cache_max_bytes)
+    
+    if args.disk_cache_max_entry_bytes is not None:
+        os.environ["HTTPKIT_DISK_CACHE_MAX_ENTRY_BYTES"] = str(args.disk_cache_max_entry_bytes)
+    
+    if args.disk_cache_min_bytes is not None:
+        os.environ["HTTPKIT_DISK_CACHE_MIN_BYTES"] = str(args.disk_cache_min_bytes)
+    
+    if args.disable_metrics:
+        os.environ["HTTPKIT_METRICS"] = "0"
+    
+    if args.metrics_dir is not None:
+        os.environ["HTTPKIT_METRICS_DIR"] = args.metrics_dir
+    
+    if args.workers is not None:
+        os.environ["HTTPKIT_WORKERS"] = str(args.workers)
+    
+    if args.pin_workers:
+        os.environ["HTTPKIT_PIN_WORKERS"] = "1"
+    
+    if args.graceful_timeout is not None:
+        os.environ["HTTPKIT_GRACEFUL_TIMEOUT_SECONDS"] = str(args.graceful_timeout)
+    
+    if args.node_state_file is not None:
+        os.environ["HTTPKIT_NODE_STATE_FILE"] = args.node_state_file
+    
+    if args.engine is not None:
+        os.environ["HTTPKIT_ENGINE"] = args.engine
+    
+    if args.upstream_transport is not None:
+        os.environ["HTTPKIT_UPSTREAM_TRANSPORT"] = args.upstream_transport
+    
+    if args.host is not None:
+        os.environ["HTTPKIT_HOST"] = args.host
+    
+    if args.port is not None:
+        os.environ["HTTPKIT_PORT"] = str(args.port)
+    
+    if args.uds:
+        os.environ["HTTPKIT_UDS"] = args.uds
+    
+    if args.unix_socket:
+        os.environ["HTTPKIT_UNIX_SOCKETS"] = ",".join(args.unix_socket)
+    
     # Disable reload in production for better performance
     reload = os.environ.get("HTTPKIT_ENV", "development").lower() == "development"
     
+    # The fast path bypasses FastAPI routing for /proxy/ requests
+    fast_path = os.environ.get("HTTPKIT_FAST_PATH", "").lower() in ("1", "true", "yes")
+    app_path = "httpkit.tools.asgi_proxy:app" if fast_path else "httpkit.tools.proxy:app"
+    
+    # One worker process per core in production
+    production = os.environ.get("HTTPKIT_ENV", "development").lower() == "production"
+    workers = int(os.environ.get("HTTPKIT_WORKERS") or ((os.cpu_count() or 1) if production else 1))
+    graceful_timeout = float(os.environ.get("HTTPKIT_GRACEFUL_TIMEOUT_SECONDS", "30"))
+    
+    # A TCP address, or a Unix domain socket for sidecar deployments
+    host = os.environ.get("HTTPKIT_HOST", "0.0.0.0")
+    port = int(os.environ.get("HTTPKIT_PORT", "8000"))
+    uds = os.environ.get("HTTPKIT_UDS") or None
+    
+    # uvloop and httptools when available, unless another engine is asked for
+    try:
+        engine_options = server_options(os.environ.get("HTTPKIT_ENGINE", ENGINE).lower())
+    except ValueError as e:
+        parser.error(str(e))
+    
+    # Workers are separate processes; give them a directory to share metrics through
+    if workers > 1 and not os.environ.get("HTTPKIT_METRICS_DIR"):
+        import tempfile
+        os.environ["HTTPKIT_METRICS_DIR"] = tempfile.mkdtemp(prefix="httpkit-metrics-")
+    # ...and a file to share rate limit buckets through
+    if workers > 1 and not os.environ.get("HTTPKIT_RATE_LIMIT_FILE"):
+        import tempfile
+        os.environ["HTTPKIT_RATE_LIMIT_FILE"] = os.path.join(tempfile.mkdtemp(prefix="httpkit-ratelimit-"), "buckets")
+    # ...and a file to share the node-wide concurrency budget through
+    if workers > 1 and not os.environ.get("HTTPKIT_NODE_STATE_FILE"):
+        import tempfile
+        os.environ["HTTPKIT_NODE_STATE_FILE"] = os.path.join(tempfile.mkdtemp(prefix="httpkit-node-"), "state")
+    
+    # Supervised workers, each on its own SO_REUSEPORT socket (or all on one Unix socket)
+    import socket
+    if workers > 1 and (uds or hasattr(socket, "SO_REUSEPORT")):
+        Supervisor(
+            app_path,
+            host,
+            port,
+            workers,
+            pin=os.environ.get("HTTPKIT_PIN_WORKERS", "").lower() in ("1", "true", "yes"),
+            graceful_timeout=graceful_timeout,
+            node_state=os.environ["HTTPKIT_NODE_STATE_FILE"],
+            options=engine_options,
+            uds=uds,
+            metrics_dir=os.environ["HTTPKIT_METRICS_DIR"],
+        ).run()
+        return
+    
     uvicorn.run(
-        "httpkit.tools.proxy:app", 
-        host="0.0.0.0", 
-        port=8000, 
+        app_path, 
+        host=host, 
+        port=port, 
+        uds=uds,
         reload=reload,
-        # Use multiple workers in production for better performance
-        workers=int(os.environ.get("HTTPKIT_WORKERS", "1"))
+        workers=workers,
+        timeout_graceful_shutdown=graceful_timeout,
+        **engine_options,
     )
 
 
@@ -0,0 +1,276 @@
+"""Token-bucket rate limiting by client, API key and upstream origin.
+
+Every limited key (a client IP, an API key or an upstream origin) has a token
+bucket refilled at ``rate`` tokens per second up to ``burst`` tokens; each
+request takes one token and is rejected with 429 when its bucket is empty.
+
+Buckets live in :class:`BucketTable`, a fixed-size, set-associative table of
+32-byte slots. A key hashes to one set of ``ways`` slots and is looked up only
+there, so a request costs O(1) whatever the number of keys. Each slot records
+when its bucket will be full again: a bucket past that point is
+indistinguishable from a new one, so its slot is free for another key. When
+every slot of a set is in use, the bucket closest to full is evicted. Memory
+is therefore bounded by the table size, with no sweeper.
+
+With several worker processes the table is a memory-mapped file shared by all
+of them, and a set is updated under an ``fcntl`` lock on its byte range, so
+limits hold for the whole server without an external service. Keys are hashed
+with BLAKE2b, which (unlike ``hash()``) is the same in every process. Bucket
+times come from ``time.monotonic()``, which Linux shares across processes.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from httpkit.tools.balancer import normalize_origin
+from httpkit.tools.limits import Overloaded
+
+# Slot layout, in 8-byte words: key hash, tokens, last update, full again at
+SLOT_WORDS = 4
+SLOT_BYTES = SLOT_WORDS * 8
+
+CLIENT = "client"
+API_KEY = "api_key"
+ORIGIN = "origin"
+
+
+class RateLimited(Overloaded):
+    """Raised when a request exceeds a rate limit; answered with 429 and ``Retry-After``."""
+
+    def __init__(self, limit: str, retry_after: int):
+        super().__init__(f"rate limit exceeded for {limit.replace('_', ' ')}", retry_after)
+        self.limit = limit
+
+
+class RateLimit:
+    """A sustained ``rate`` in requests per second with bursts of up to ``burst`` requests."""
+
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, rate: float, burst: float = 0.0):
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+
+
+def key_hash(key: str) -> int:
+    """Return a non-zero 64-bit hash of ``key`` that is stable across processes."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+class BucketTable:
+    """
+    Token buckets in a fixed-size table, private or shared across processes.
+
+    Args:
+        slots: Number of buckets the table holds.
+        ways: Slots per set; a key may only occupy a slot of its set.
+        path: File shared by every worker, or None for a table private to this process.
+    """
+
+    def __init__(self, slots: int = 65536, ways: int = 8, path: Optional[str] = None):
+        self.ways = ways
+        self.path = path
+        self.fd: Optional[int] = None
+        size = max(ways, slots) // ways * ways * SLOT_BYTES
+        if path:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            # Workers may open the file concurrently; it only ever grows
+            size = max(size, os.fstat(self.fd).st_size // (ways * SLOT_BYTES) * ways * SLOT_BYTES)
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+            self.buffer = mmap.mmap(self.fd, size)
+        else:
+            self.buffer = bytearray(size)
+        self.keys = memoryview(self.buffer).cast("Q")
+        self.values = memoryview(self.buffer).cast("d")
+        self.sets = size // (ways * SLOT_BYTES)
+        self.evictions = 0
+
+    def take(self, key: str, limit: RateLimit, now: Optional[float] = None) -> float:
+        """
+        Take a token from the bucket of ``key``.
+
+        Returns:
+            0 if the request may proceed, otherwise the seconds until a token is available.
+        """
+        hashed = key_hash(key)
+        first = (hashed % self.sets) * self.ways
+        self.lock(first)
+        try:
+            now = time.monotonic() if now is None else now
+            slot = self.find(hashed, first, now)
+            values = self.values
+            base = slot * SLOT_WORDS
+            if self.keys[base] == hashed and 0 <= now - values[base + 2]:
+                tokens = min(limit.burst, values[base + 1] + (now - values[base + 2]) * limit.rate)
+            else:
+                # A new bucket (or one from a clock that has since restarted) starts full
+                self.keys[base] = hashed
+                tokens = limit.burst
+
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / limit.rate
+            values[base + 1] = tokens
+            values[base + 2] = now
+            values[base + 3] = now + (limit.burst - tokens) / limit.rate
+            return wait
+        finally:
+            self.unlock(first)
+
+    def refund(self, key: str, limit: RateLimit):
+        """Give back a token taken for a request that was rejected by a later limit."""
+        hashed = key_hash(key)
+        first = (hashed % self.sets) * self.ways
+        self.lock(first)
+        try:
+            for slot in range(first, first + self.ways):
+                base = slot * SLOT_WORDS
+                if self.keys[base] == hashed:
+                    tokens = min(limit.burst, self.values[base + 1] + 1)
+                    self.values[base + 1] = tokens
+                    self.values[base + 3] = self.values[base + 2] + (limit.burst - tokens) / limit.rate
+                    return
+        finally:
+            self.unlock(first)
+
+    def find(self, hashed: int, first: int, now: float) -> int:
+        """Return the slot holding ``hashed`` in its set, or the slot it should replace."""
+        keys = self.keys
+        values = self.values
+        free = None
+        victim, victim_full_at = first, math.inf
+        for slot in range(first, first + self.ways):
+            base = slot * SLOT_WORDS
+            key = keys[base]
+            if key == hashed:
+                return slot
+            if free is None:
+                full_at = values[base + 3]
+                if key == 0 or full_at <= now:
+                    free = slot
+                elif full_at < victim_full_at:
+                    victim, victim_full_at = slot, full_at
+        if free is not None:
+            return free
+        # Every bucket of the set is in use; drop the one closest to full
+        self.evictions += 1
+        return victim
+
+    def lock(self, first: int):
+        if self.fd is not None and fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.ways * SLOT_BYTES, first * SLOT_BYTES)
+
+    def unlock(self, first: int):
+        if self.fd is not None and fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, self.ways * SLOT_BYTES, first * SLOT_BYTES)
+
+    def close(self):
+        self.keys.release()
+        self.values.release()
+        if self.fd is not None:
+            self.buffer.close()
+            os.close(self.fd)
+            self.fd = None
+
+
+class RateLimiter:
+    """
+    Apply the client, API key and origin rate limits to proxied requests.
+
+    Args:
+        table: The buckets.
+        client: Limit per client IP, or None.
+        api_key: Limit per value of ``api_key_header``, or None. Requests
+            without the header are only limited per client.
+        origin: Default limit per upstream origin, or None.
+        origin_overrides: Limits of specific origins, replacing ``origin``
+            (None for no limit).
+        api_key_header: The request header holding the API key.
+    """
+
+    def __init__(
+        self,
+        table: BucketTable,
+        client: Optional[RateLimit] = None,
+        api_key: Optional[RateLimit] = None,
+        origin: Optional[RateLimit] = None,
+        origin_overrides: Optional[Dict[str, Optional[RateLimit]]] = None,
+        api_key_header: str = "X-API-Key",
+    ):
+        self.table = table
+        self.client = client
+        self.api_key = api_key
+        self.origin = origin
+        self.origin_overrides = dict(origin_overrides or {})
+        self.api_key_header = api_key_header.lower().encode("latin-1")
+        self.allowed = 0
+        self.rejected = {CLIENT: 0, API_KEY: 0, ORIGIN: 0}
+
+    def check(self, client: Optional[str], headers: List[Tuple[bytes, bytes]], origin: str):
+        """
+        Take a token for the request from each bucket that applies.
+
+        Raises:
+            RateLimited: A bucket was empty. Tokens already taken for the
+                request from other buckets are given back.
+        """
+        taken = []
+        for name, key, limit in self.limits(client, headers, origin):
+            wait = self.table.take(key, limit)
+            if wait:
+                for taken_key, taken_limit in taken:
+                    self.table.refund(taken_key, taken_limit)
+                self.rejected[name] += 1
+                raise RateLimited(name, max(1, math.ceil(wait)))
+            taken.append((key, limit))
+        self.allowed += 1
+
+    def limits(self, client: Optional[str], headers: List[Tuple[bytes, bytes]], origin: str):
+        """Yield ``(name, bucket key, limit)`` for every limit that applies to a request."""
+        if self.client is not None and client:
+            yield CLIENT, "c:" + client, self.client
+        if self.api_key is not None:
+            for name, value in headers:
+                if name == self.api_key_header:
+                    yield API_KEY, "k:" + value.decode("latin-1"), self.api_key
+                    break
+        limit = self.origin_overrides.get(origin, self.origin)
+        if limit is not None:
+            yield ORIGIN, "o:" + origin, limit
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "allowed": self.allowed,
+            "rejected": dict(self.rejected),
+            "evictions": self.table.evictions,
+            "shared": self.table.path is not None,
+        }
+
+
+def load_rate_limits(
+    origins: Dict[str, Dict[str, object]], default_rate: float, default_burst: float
+) -> Tuple[Optional[RateLimit], Dict[str, Optional[RateLimit]]]:
+    """
+    Return the default origin limit and the per-origin ``rate_limit`` / ``rate_burst`` overrides.
+
+    An override with a ``rate_limit`` of 0 exempts its origin from the default limit.
+    """
+    overrides = {
+        normalize_origin(origin): RateLimit(float(values["rate_limit"]), float(values.get("rate_burst", 0)))
+        if float(values["rate_limit"]) > 0 else None
+        for origin, values in origins.items()
+        if "rate_limit" in values
+    }
+    return (RateLimit(default_rate, default_burst) if default_rate > 0 else None), overrides
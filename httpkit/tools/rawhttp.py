@@ -0,0 +1,583 @@
+"""A lean HTTP/1.1 upstream transport built directly on asyncio protocols.
+
+:class:`RawTransport` is an httpx transport, so the proxy keeps sending
+requests through ``httpx.AsyncClient`` with its timeouts, errors and
+response API, but plain ``http://`` requests skip httpcore and h11. Each
+upstream connection is an ``asyncio.BufferedProtocol``: the event loop reads
+from the socket straight into a preallocated block, and response body chunks
+are handed on as ``memoryview`` slices of that block, without intermediate
+``bytes`` copies. A block is never written to again once part of it has been
+handed out, so chunks stay valid for as long as anything refers to them. Only
+status lines, headers and chunk size lines are copied to be parsed.
+
+Connections are kept alive and reused per origin, most recently used first.
+Like httpx's pool, a transport opens at most ``max_connections`` connections
+at once: a request that finds none idle for its origin and no room to open
+one closes an idle connection to another origin, or else waits for one to be
+released, for up to the ``pool`` timeout.
+A request that fails because a reused connection turned out to have been
+closed by the upstream is retried on another connection, if its body can be
+sent again and either none of it had been written yet or its method is
+idempotent: the upstream may have acted on a request whose response never
+came.
+
+``https://`` requests, and with them HTTP/2, which upstreams only offer over
+TLS, are handed to the ``fallback`` httpx transport.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from httpkit.tools.dns import DNSCache, is_ip_address
+from httpkit.tools.retries import IDEMPOTENT_METHODS
+
+# Size of the blocks the socket is read into, and the free space below which a new one is started
+READ_BLOCK_SIZE = 256 * 1024
+MIN_READ_SIZE = 16 * 1024
+# Unread bytes at which a connection stops reading from its socket until they are consumed
+HIGH_WATER = 1024 * 1024
+MAX_HEAD_BYTES = 64 * 1024
+
+
+class StaleConnection(Exception):
+    """
+    A reused connection was closed by the upstream before any of the response arrived.
+
+    Args:
+        sent: Whether any of the request had been written to the connection.
+    """
+
+    def __init__(self, sent: bool = True):
+        super().__init__()
+        self.sent = sent
+
+
+class UpstreamConnection(asyncio.BufferedProtocol):
+    """One HTTP/1.1 connection to an upstream origin, read into preallocated blocks."""
+
+    def __init__(self, key: Tuple[str, int]):
+        self.key = key
+        self.origin = f"http://{key[0]}:{key[1]}"
+        self.transport: Optional[asyncio.Transport] = None
+        self.block = memoryview(bytearray(READ_BLOCK_SIZE))
+        self.offset = 0
+        # Received and not yet consumed
+        self.chunks: Deque[memoryview] = deque()
+        self.buffered = 0
+        self.reading_paused = False
+        self.closed = False
+        self.waiter: Optional[asyncio.Future] = None
+        # Set while the transport's write buffer is above its high-water mark
+        self.drained: Optional[asyncio.Future] = None
+        # The request being exchanged, for the errors raised
+        self.request: Optional[httpx.Request] = None
+        self.requests = 0
+        self.idle_since = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if len(self.block) - self.offset < MIN_READ_SIZE:
+            self.block = memoryview(bytearray(READ_BLOCK_SIZE))
+            self.offset = 0
+        return self.block[self.offset:]
+
+    def buffer_updated(self, nbytes: int):
+        self.chunks.append(self.block[self.offset:self.offset + nbytes])
+        self.offset += nbytes
+        self.buffered += nbytes
+        if self.buffered > HIGH_WATER and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+        self.wake()
+
+    def eof_received(self):
+        self.closed = True
+        self.wake()
+        return False
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.wake()
+        if self.drained is not None and not self.drained.done():
+            self.drained.set_result(None)
+
+    def pause_writing(self):
+        self.drained = asyncio.get_running_loop().create_future()
+
+    def resume_writing(self):
+        if self.drained is not None and not self.drained.done():
+            self.drained.set_result(None)
+        self.drained = None
+
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def read(self, timeout: Optional[float]) -> Optional[memoryview]:
+        """Return the next received chunk, or None once the upstream closed the connection."""
+        while not self.chunks:
+            if self.closed:
+                return None
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self.waiter, timeout)
+            except asyncio.TimeoutError:
+                raise httpx.ReadTimeout("Timed out reading from the upstream", request=self.request) from None
+            finally:
+                self.waiter = None
+        chunk = self.chunks.popleft()
+        self.buffered -= len(chunk)
+        if self.reading_paused and self.buffered <= HIGH_WATER // 2 and not self.closed:
+            self.reading_paused = False
+            self.transport.resume_reading()
+        return chunk
+
+    def unread(self, chunk: memoryview):
+        self.chunks.appendleft(chunk)
+        self.buffered += len(chunk)
+
+    async def read_until(self, delimiter: bytes, timeout: Optional[float], first: bool = False) -> bytearray:
+        """
+        Return the bytes up to and including ``delimiter``, leaving the rest unread.
+
+        Raises:
+            StaleConnection: If ``first`` (the start of a response) and a reused
+                connection was closed before anything arrived.
+        """
+        data = bytearray()
+        while True:
+            chunk = await self.read(timeout)
+            if chunk is None:
+                if first and not data and self.requests > 1:
+                    raise StaleConnection()
+                raise httpx.RemoteProtocolError("The upstream closed the connection mid-message", request=self.request)
+            start = max(0, len(data) - len(delimiter) + 1)
+            data += chunk
+            end = data.find(delimiter, start)
+            if end != -1:
+                end += len(delimiter)
+                extra = len(data) - end
+                if extra:
+                    self.unread(chunk[len(chunk) - extra:])
+                    del data[end:]
+                return data
+            if len(data) > MAX_HEAD_BYTES:
+                raise httpx.RemoteProtocolError("The upstream sent an oversized message head", request=self.request)
+
+    async def write(self, data: List[Any], timeout: Optional[float]):
+        if self.closed:
+            if self.requests > 1:
+                raise StaleConnection(sent=False)
+            raise httpx.WriteError("The upstream closed the connection", request=self.request)
+        self.transport.writelines(data)
+        if self.drained is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.drained), timeout)
+            except asyncio.TimeoutError:
+                raise httpx.WriteTimeout("Timed out writing to the upstream", request=self.request) from None
+
+    def read_timeout(self) -> Optional[float]:
+        # Looked up for every read, as the proxy lengthens it for event streams
+        return self.request.extensions.get("timeout", {}).get("read")
+
+    async def body(self, length: Optional[int], chunked: bool) -> AsyncIterator[memoryview]:
+        """Yield the response body: ``length`` bytes, chunked, or everything until the connection closes."""
+        if chunked:
+            while True:
+                line = await self.read_until(b"\r\n", self.read_timeout())
+                try:
+                    size = int(bytes(line).split(b";", 1)[0].strip(), 16)
+                except ValueError:
+                    raise httpx.RemoteProtocolError("Malformed chunk size from the upstream", request=self.request) from None
+                if size == 0:
+                    # Skip the trailers
+                    while len(await self.read_until(b"\r\n", self.read_timeout())) > 2:
+                        pass
+                    return
+                async for chunk in self.fixed(size):
+                    yield chunk
+                if await self.read_until(b"\r\n", self.read_timeout()) != b"\r\n":
+                    raise httpx.RemoteProtocolError("Malformed chunk from the upstream", request=self.request)
+        elif length is not None:
+            async for chunk in self.fixed(length):
+                yield chunk
+        else:
+            while True:
+                chunk = await self.read(self.read_timeout())
+                if chunk is None:
+                    return
+                yield chunk
+
+    async def fixed(self, length: int) -> AsyncIterator[memoryview]:
+        remaining = length
+        while remaining:
+            chunk = await self.read(self.read_timeout())
+            if chunk is None:
+                raise httpx.RemoteProtocolError(
+                    "The upstream closed the connection before sending the complete body", request=self.request,
+                )
+            if len(chunk) > remaining:
+                self.unread(chunk[remaining:])
+                chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+        if self.transport is not None:
+            self.transport.close()
+
+
+class RawResponseStream(httpx.AsyncByteStream):
+    """The body of a response read from an :class:`UpstreamConnection`."""
+
+    def __init__(self, transport: "RawTransport", connection: UpstreamConnection, chunks: AsyncIterator[memoryview], keep_alive: bool):
+        self.transport = transport
+        self.connection = connection
+        self.chunks = chunks
+        self.keep_alive = keep_alive
+        self.complete = False
+        self.released = False
+
+    async def __aiter__(self) -> AsyncIterator[memoryview]:
+        async for chunk in self.chunks:
+            yield chunk
+        self.complete = True
+
+    async def aclose(self):
+        if not self.released:
+            self.released = True
+            self.transport.release(self.connection, self.complete and self.keep_alive)
+
+
+def header_tokens(headers: List[Tuple[bytes, bytes]], name: bytes) -> List[bytes]:
+    """Return the comma-separated, lowercased tokens of every ``name`` (lowercase) header."""
+    return [
+        token.strip().lower()
+        for key, value in headers if key.lower() == name
+        for token in value.split(b",")
+    ]
+
+
+class RawTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport speaking HTTP/1.1 to ``http://`` upstreams on asyncio protocols.
+
+    Args:
+        fallback: The transport for every other request (``https://``, HTTP/2).
+        max_keepalive_connections: Idle connections kept open across all origins.
+        keepalive_expiry: Seconds an idle connection is kept before it is closed.
+        dns_cache: Optional cache to resolve upstream host names through.
+        max_connections: Connections open at once across all origins, or None for no limit.
+    """
+
+    def __init__(
+        self,
+        fallback: httpx.AsyncBaseTransport,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        dns_cache: Optional[DNSCache] = None,
+        max_connections: Optional[int] = None,
+    ):
+        self.fallback = fallback
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.dns_cache = dns_cache
+        # (host, port) -> idle connections, most recently used last
+        self.idle: Dict[Tuple[str, int], Deque[UpstreamConnection]] = {}
+        self.idle_count = 0
+        # origin -> connections with a request in progress
+        self.active: Dict[str, int] = {}
+        # Connections open or being opened, and requests waiting for room to open one
+        self.open_count = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.connects = 0
+        self.reuses = 0
+        self.pool_waits = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.url.scheme != "http":
+            return await self.fallback.handle_async_request(request)
+
+        timeouts = request.extensions.get("timeout", {})
+        trace = request.extensions.get("trace")
+        key = (request.url.host, request.url.port or 80)
+        headers = request.headers.raw
+        head = b"".join([
+            request.method.encode("ascii"), b" ", request.url.raw_path, b" HTTP/1.1\r\n",
+            *[b"%s: %s\r\n" % (name, value) for name, value in headers],
+            b"\r\n",
+        ])
+        chunked = b"chunked" in header_tokens(headers, b"transfer-encoding")
+        replayable = isinstance(request.stream, httpx.ByteStream)
+
+        while True:
+            connection = await self.checkout(key, timeouts.get("pool"), request)
+            if connection is None:
+                try:
+                    connection = await self.connect(key, timeouts.get("connect"), trace, request)
+                except BaseException:
+                    self.closed_one()
+                    raise
+            try:
+                return await self.exchange(connection, request, head, chunked, timeouts, trace)
+            except StaleConnection as e:
+                self.release(connection, False)
+                if not replayable or (e.sent and request.method not in IDEMPOTENT_METHODS):
+                    raise httpx.RemoteProtocolError("The upstream closed a kept-alive connection", request=request) from None
+            except BaseException:
+                self.release(connection, False)
+                raise
+
+    async def exchange(
+        self,
+        connection: UpstreamConnection,
+        request: httpx.Request,
+        head: bytes,
+        chunked: bool,
+        timeouts: Dict[str, Optional[float]],
+        trace,
+    ) -> httpx.Response:
+        connection.request = request
+        connection.requests += 1
+        origin = connection.origin
+        self.active[origin] = self.active.get(origin, 0) + 1
+
+        if trace is not None:
+            await trace("http11.send_request_headers.started", {"request": request})
+        write_timeout = timeouts.get("write")
+        pending: List[Any] = [head]
+        try:
+            async for chunk in request.stream:
+                if not chunk:
+                    continue
+                if chunked:
+                    pending += (b"%x\r\n" % len(chunk), chunk, b"\r\n")
+                else:
+                    pending.append(chunk)
+                await connection.write(pending, write_timeout)
+                pending = []
+            if chunked:
+                pending.append(b"0\r\n\r\n")
+            if pending:
+                await connection.write(pending, write_timeout)
+        except StaleConnection:
+            # Only the head can have been refused unwritten; later writes follow part of the request
+            raise StaleConnection(sent=pending[0] is not head) from None
+
+        read_timeout = timeouts.get("read")
+        status = None
+        while True:
+            version, status, reason, response_headers = self.parse_head(
+                await connection.read_until(b"\r\n\r\n", read_timeout, first=status is None), request,
+            )
+            # Interim responses (100 Continue, 103 Early Hints) precede the real one
+            if not 100 <= status < 200 or status == 101:
+                break
+
+        keep_alive = (
+            version == b"HTTP/1.1"
+            and b"close" not in header_tokens(response_headers, b"connection")
+            and b"close" not in header_tokens(request.headers.raw, b"connection")
+        )
+        length: Optional[int] = None
+        response_chunked = False
+        if request.method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            length = 0
+        elif b"chunked" in header_tokens(response_headers, b"transfer-encoding")[-1:]:
+            response_chunked = True
+        else:
+            lengths = {value for name, value in response_headers if name == b"content-length"}
+            if len(lengths) > 1:
+                raise httpx.RemoteProtocolError("Conflicting Content-Length headers from the upstream", request=request)
+            if lengths:
+                try:
+                    length = int(lengths.pop())
+                except ValueError:
+                    raise httpx.RemoteProtocolError("Malformed Content-Length from the upstream", request=request) from None
+            else:
+                # Delimited by the end of the connection
+                keep_alive = False
+
+        stream = RawResponseStream(
+            self, connection, connection.body(length, response_chunked), keep_alive,
+        )
+        if length == 0:
+            stream.complete = True
+        return httpx.Response(
+            status,
+            headers=response_headers,
+            stream=stream,
+            extensions={"http_version": version, "reason_phrase": reason},
+        )
+
+    @staticmethod
+    def parse_head(head: bytearray, request: httpx.Request) -> Tuple[bytes, int, bytes, List[Tuple[bytes, bytes]]]:
+        lines = bytes(head).split(b"\r\n")
+        version, _, rest = lines[0].partition(b" ")
+        status, _, reason = rest.partition(b" ")
+        if not version.startswith(b"HTTP/1.") or not status.isdigit():
+            raise httpx.RemoteProtocolError("Malformed status line from the upstream", request=request)
+        headers = []
+        for line in lines[1:-2]:
+            name, separator, value = line.partition(b":")
+            if not separator:
+                raise httpx.RemoteProtocolError("Malformed header from the upstream", request=request)
+            headers.append((name.strip().lower(), value.strip()))
+        return version, int(status), reason, headers
+
+    async def connect(self, key: Tuple[str, int], timeout: Optional[float], trace, request: httpx.Request) -> UpstreamConnection:
+        host, port = key
+        addresses = [host]
+        if self.dns_cache is not None and not is_ip_address(host):
+            try:
+                addresses = await self.dns_cache.resolve(host, port)
+            except OSError as e:
+                raise httpx.ConnectError(f"Failed to resolve {host}: {e}", request=request) from e
+
+        if trace is not None:
+            await trace("connection.connect_tcp.started", {"host": host, "port": port})
+        loop = asyncio.get_running_loop()
+        error: Optional[OSError] = None
+        for address in addresses:
+            try:
+                _, connection = await asyncio.wait_for(
+                    loop.create_connection(lambda: UpstreamConnection(key), address, port), timeout,
+                )
+                break
+            except asyncio.TimeoutError:
+                raise httpx.ConnectTimeout(f"Timed out connecting to {host}:{port}", request=request) from None
+            except OSError as e:
+                error = e
+        else:
+            raise httpx.ConnectError(str(error), request=request) from error
+        if trace is not None:
+            await trace("connection.connect_tcp.complete", {"return_value": connection})
+        self.connects += 1
+        return connection
+
+    async def checkout(self, key: Tuple[str, int], timeout: Optional[float], request: httpx.Request) -> Optional[UpstreamConnection]:
+        """
+        Return an idle connection to ``key``, or None once there is room to open a new one.
+
+        Raises:
+            httpx.PoolTimeout: If no connection could be had within ``timeout``.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        waited = False
+        while True:
+            connection = self.idle_connection(key)
+            if connection is not None:
+                return connection
+            if self.max_connections is None or self.open_count < self.max_connections:
+                self.open_count += 1
+                return None
+            if self.evict_idle():
+                continue
+            if not waited:
+                waited = True
+                self.pool_waits += 1
+            waiter = loop.create_future()
+            self.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, None if deadline is None else max(0.0, deadline - loop.time()))
+            except BaseException as e:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # Woken just as it gave up: pass the wakeup on
+                    self.notify()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise httpx.PoolTimeout("Timed out waiting for an upstream connection", request=request) from None
+                raise
+
+    def notify(self):
+        """Wake the longest waiting request: a connection was closed or became idle."""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def closed_one(self):
+        self.open_count -= 1
+        self.notify()
+
+    def discard(self, connection: UpstreamConnection):
+        connection.close()
+        self.closed_one()
+
+    def evict_idle(self) -> bool:
+        """Close the least recently used idle connection, of any origin, to make room for a new one."""
+        oldest = None
+        for queue in self.idle.values():
+            if queue and (oldest is None or queue[0].idle_since < oldest[0].idle_since):
+                oldest = queue
+        if oldest is None:
+            return False
+        self.idle_count -= 1
+        self.discard(oldest.popleft())
+        return True
+
+    def idle_connection(self, key: Tuple[str, int]) -> Optional[UpstreamConnection]:
+        queue = self.idle.get(key)
+        now = time.monotonic()
+        while queue:
+            connection = queue.pop()
+            self.idle_count -= 1
+            if connection.closed or connection.chunks or now - connection.idle_since > self.keepalive_expiry:
+                self.discard(connection)
+                continue
+            self.reuses += 1
+            return connection
+        return None
+
+    def release(self, connection: UpstreamConnection, reusable: bool):
+        """Return a connection after its response; it is kept for reuse or closed."""
+        if connection.request is not None:
+            connection.request = None
+            self.active[connection.origin] -= 1
+            if not self.active[connection.origin]:
+                del self.active[connection.origin]
+        if not reusable or connection.closed or connection.chunks or self.idle_count >= self.max_keepalive_connections:
+            self.discard(connection)
+            return
+        connection.idle_since = time.monotonic()
+        self.idle.setdefault(connection.key, deque()).append(connection)
+        self.idle_count += 1
+        self.notify()
+
+    def connection_counts(self) -> Dict[str, Dict[str, int]]:
+        """Return active/idle connection counts per origin, as :func:`limits.pool_stats` does."""
+        counts = {origin: {"active": active, "idle": 0} for origin, active in self.active.items()}
+        for (host, port), queue in self.idle.items():
+            if queue:
+                counts.setdefault(f"http://{host}:{port}", {"active": 0, "idle": 0})["idle"] += len(queue)
+        return counts
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connects": self.connects,
+            "reuses": self.reuses,
+            "open": self.open_count,
+            "pool_waits": self.pool_waits,
+            "active": sum(self.active.values()),
+            "idle": self.idle_count,
+        }
+
+    async def aclose(self):
+        for queue in self.idle.values():
+            for connection in queue:
+                connection.close()
+                self.open_count -= 1
+        self.idle.clear()
+        self.idle_count = 0
+        await self.fallback.aclose()
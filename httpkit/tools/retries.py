@@ -0,0 +1,232 @@
+"""Budgeted retries and hedged requests for idempotent upstream requests.
+
+Failed attempts (``httpx.TransportError``) are retried with full-jitter
+exponential backoff. Every retry, and every hedge, must be paid for from a
+:class:`RetryBudget` that only grows with regular traffic, so retries stay a
+bounded fraction of the load and cannot amplify an upstream outage.
+
+Hedging sends a second copy of a request once the first has been waiting for
+response headers longer than a latency percentile of its origin. The first
+response to arrive wins; the other attempt is cancelled, or closed if it had
+already produced a response, so its connection is not left half-read.
+"""
+
+import asyncio
+import random
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+# Methods whose requests may safely be sent more than once
+IDEMPOTENT_METHODS = frozenset(["GET", "PUT", "DELETE", "OPTIONS"])
+
+Opened = Tuple[httpx.Response, AsyncExitStack]
+Opener = Callable[[], Awaitable[Opened]]
+
+
+class RetryBudget:
+    """
+    Retry tokens earned as a fraction of requests, plus a small steady allowance.
+
+    Args:
+        ratio: Tokens deposited per request, e.g. 0.1 allows retries on 10% of traffic.
+        min_per_second: Tokens added per second regardless of traffic, so a
+            quiet proxy can still retry occasionally.
+        max_balance: Cap on saved-up tokens, bounding retry bursts.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, max_balance: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self.balance = 0.0
+        self.updated = time.monotonic()
+        self.exhausted = 0
+
+    def deposit(self):
+        """Credit one request's worth of retry tokens."""
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Take one token for a retry or hedge; return False if the budget is spent."""
+        now = time.monotonic()
+        self.balance = min(self.max_balance, self.balance + (now - self.updated) * self.min_per_second)
+        self.updated = now
+        if self.balance >= 1.0:
+            self.balance -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+
+class LatencyPercentile:
+    """
+    A percentile of the most recent latencies, kept in a fixed-size ring.
+
+    The percentile is recomputed every ``refresh`` samples rather than on
+    every read, so looking it up per request is O(1).
+    """
+
+    __slots__ = ("percentile", "samples", "count", "refresh", "cached")
+
+    def __init__(self, percentile: float, size: int = 512, refresh: int = 64):
+        self.percentile = percentile
+        self.samples = array("d", bytes(8 * size))
+        self.count = 0
+        self.refresh = refresh
+        self.cached: Optional[float] = None
+
+    def add(self, latency: float):
+        self.samples[self.count % len(self.samples)] = latency
+        self.count += 1
+        if self.count % self.refresh == 0:
+            ordered = sorted(self.samples[:min(self.count, len(self.samples))])
+            self.cached = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))]
+
+    def value(self) -> Optional[float]:
+        """Return the percentile, or None until ``refresh`` samples have been seen."""
+        return self.cached
+
+
+async def close_result(task: "asyncio.Task"):
+    """Cancel a losing attempt, or close the response it already opened."""
+    if not task.done():
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            return
+    if task.cancelled() or task.exception() is not None:
+        return
+    _, exit_stack = task.result()
+    await exit_stack.aclose()
+
+
+class ResilientSender:
+    """
+    Send idempotent requests with budgeted retries and optional hedging.
+
+    Args:
+        max_retries: Retries after the first attempt fails, 0 to disable retries.
+        budget: The retry budget shared by retries and hedges.
+        backoff: Base delay in seconds of the exponential backoff.
+        backoff_max: Cap on a single backoff delay.
+        hedge_percentile: Latency percentile (e.g. 95) after which a hedge is
+            sent, or 0 to disable hedging.
+        hedge_min_delay: Lower bound in seconds on the hedge delay.
+        max_origins: Number of origins whose latencies are tracked.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 0,
+        budget: Optional[RetryBudget] = None,
+        backoff: float = 0.05,
+        backoff_max: float = 1.0,
+        hedge_percentile: float = 0.0,
+        hedge_min_delay: float = 0.0,
+        max_origins: int = 1024,
+    ):
+        self.max_retries = max_retries
+        self.budget = budget or RetryBudget()
+        self.backoff_base = backoff
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.max_origins = max_origins
+        self.latencies: "OrderedDict[str, LatencyPercentile]" = OrderedDict()
+
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return the retry and hedging counters."""
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "budget_exhausted": self.budget.exhausted,
+        }
+
+    def backoff(self, attempt: int) -> float:
+        """Return a full-jitter delay for the given retry attempt (1-based)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1))))
+
+    def tracker(self, origin: str) -> LatencyPercentile:
+        tracker = self.latencies.get(origin)
+        if tracker is None:
+            tracker = self.latencies[origin] = LatencyPercentile(self.hedge_percentile)
+            if len(self.latencies) > self.max_origins:
+                self.latencies.popitem(last=False)
+        return tracker
+
+    def hedge_delay(self, origin: str) -> Optional[float]:
+        if not self.hedge_percentile:
+            return None
+        percentile = self.tracker(origin).value()
+        return None if percentile is None else max(self.hedge_min_delay, percentile)
+
+    async def send(self, opener: Opener, origin: str) -> Opened:
+        """Open the upstream response, retrying transport errors while the budget allows."""
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return await self.attempt(opener, origin)
+            except httpx.TransportError:
+                if attempt >= self.max_retries or not self.budget.withdraw():
+                    raise
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(self.backoff(attempt))
+
+    async def timed(self, opener: Opener, origin: str) -> Opened:
+        started = time.monotonic()
+        result = await opener()
+        if self.hedge_percentile:
+            self.tracker(origin).add(time.monotonic() - started)
+        return result
+
+    async def attempt(self, opener: Opener, origin: str) -> Opened:
+        """Run one attempt, hedged with a second copy if it is slower than the hedge delay."""
+        delay = self.hedge_delay(origin)
+        if delay is None:
+            return await self.timed(opener, origin)
+
+        primary = asyncio.ensure_future(self.timed(opener, origin))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self.budget.withdraw():
+                return await primary
+        except BaseException:
+            await close_result(primary)
+            raise
+
+        self.hedges += 1
+        hedge = asyncio.ensure_future(self.timed(opener, origin))
+        winner = None
+        try:
+            pending = {primary, hedge}
+            error: Optional[BaseException] = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+            if winner is None:
+                raise error
+            if winner is hedge:
+                self.hedge_wins += 1
+            return winner.result()
+        finally:
+            # Cancel the slower attempt, or close its response if it also arrived
+            for task in (primary, hedge):
+                if task is not winner:
+                    await close_result(task)
@@ -0,0 +1,282 @@
+"""Request bodies held so that they can be sent upstream more than once.
+
+Retrying or hedging a request with a body needs the whole body at hand,
+which ``await request.body()`` would keep in memory. A :class:`SpooledBody`
+reads its source once, keeps it in memory up to ``max_memory`` bytes and in
+an unlinked temporary file past that, and can then be iterated any number of
+times, also by concurrent attempts. The file is written from a worker thread
+while the next chunk is read, so a write stalled behind disk writeback holds
+up only its own request and not the event loop.
+
+Spooled bytes in flight are counted against a shared :class:`BodyBudget`.
+A reader waits for room in the budget before it reads on, which stops reading
+from the client and pushes back on it through TCP flow control. A reader
+still waiting after ``max_wait`` is shed with :class:`Overloaded`, and a body
+that could never fit is refused with :class:`BodyTooLarge`.
+"""
+
+import asyncio
+import os
+import tempfile
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from httpkit.tools.limits import Overloaded
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class BodyTooLarge(Exception):
+    """Raised when a request body is larger than any body that may be spooled."""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Request body larger than {limit} bytes")
+        self.limit = limit
+
+
+class BodyBudget:
+    """
+    Bytes of spooled request bodies in flight, shared by all requests.
+
+    Waiting readers are granted room in arrival order, so a large body is not
+    starved by a stream of small ones.
+
+    Args:
+        max_bytes: Spooled bytes that may be in flight at once.
+        max_wait: Seconds a reader waits for room before it is shed.
+        retry_after: Seconds suggested to shed clients before retrying.
+    """
+
+    def __init__(self, max_bytes: int, max_wait: float = 5.0, retry_after: int = 1):
+        self.max_bytes = max_bytes
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.in_use = 0
+        self.peak = 0
+        self.waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+        self.bodies = 0
+        self.spilled = 0
+        self.waits = 0
+        self.shed = 0
+        self.refused = 0
+
+    async def acquire(self, size: int):
+        """
+        Take ``size`` bytes, waiting up to ``max_wait`` while the budget is spent.
+
+        Raises:
+            BodyTooLarge: If ``size`` is more than the whole budget.
+            Overloaded: If no room was freed within ``max_wait``.
+        """
+        if size > self.max_bytes:
+            self.refused += 1
+            raise BodyTooLarge(self.max_bytes)
+        if not self.waiters and self.in_use + size <= self.max_bytes:
+            self.take(size)
+            return
+
+        self.waits += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append((size, waiter))
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # The room was granted just as the deadline passed; keep it
+                return
+            self.shed += 1
+            self.dispatch()
+            raise Overloaded("Timed out waiting for request body memory", self.retry_after)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(size)
+            else:
+                self.dispatch()
+            raise
+
+    def release(self, size: int):
+        """Return ``size`` bytes and hand the freed room to waiting readers."""
+        self.in_use -= size
+        self.dispatch()
+
+    def take(self, size: int):
+        self.in_use += size
+        self.peak = max(self.peak, self.in_use)
+
+    def dispatch(self):
+        """Grant room to waiting readers in arrival order, skipping those that gave up."""
+        waiters = self.waiters
+        while waiters:
+            size, waiter = waiters[0]
+            if waiter.done():
+                waiters.popleft()
+            elif self.in_use + size <= self.max_bytes:
+                waiters.popleft()
+                self.take(size)
+                waiter.set_result(None)
+            else:
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_bytes": self.max_bytes,
+            "in_use": self.in_use,
+            "peak": self.peak,
+            "waiting": sum(1 for _, waiter in self.waiters if not waiter.done()),
+            "bodies": self.bodies,
+            "spilled": self.spilled,
+            "waits": self.waits,
+            "shed": self.shed,
+            "refused": self.refused,
+        }
+
+
+def write_all(fd: int, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def write_chunks(fd: int, chunks: List[bytes]):
+    for chunk in chunks:
+        write_all(fd, chunk)
+
+
+def close_when_done(future: asyncio.Future, fd: int):
+    """Close ``fd`` once the write ``future`` that uses it has finished."""
+    if not future.cancelled():
+        # Retrieved so that a failed write is not reported as never retrieved
+        future.exception()
+    os.close(fd)
+
+
+class SpooledBody:
+    """
+    A request body read once from its source and replayable any number of times.
+
+    Iterating yields the body in the chunks it arrived in while it is held in
+    memory, and in ``chunk_size`` reads once it has been moved to a file. The
+    file is read with ``pread``, so concurrent iterations do not interfere.
+    Call :meth:`close` to remove the file and return the body's bytes to the
+    budget.
+
+    Args:
+        max_memory: Bytes held in memory before the body is moved to a temporary file.
+        max_bytes: Largest body that may be spooled.
+        budget: The budget the body's bytes are counted against, or None.
+        directory: Directory of the temporary file; the system default when None.
+        chunk_size: Size of the reads of a body that was moved to a file.
+    """
+
+    def __init__(
+        self,
+        max_memory: int,
+        max_bytes: int,
+        budget: Optional[BodyBudget] = None,
+        directory: Optional[str] = None,
+        chunk_size: int = READ_CHUNK_SIZE,
+    ):
+        self.max_memory = max_memory
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.chunks: List[bytes] = []
+        self.fd: Optional[int] = None
+        self.size = 0
+        self.reserved = 0
+        # The write to the file in progress in a worker thread, if any
+        self.writing: Optional[asyncio.Future] = None
+        if budget is not None:
+            budget.bodies += 1
+
+    @property
+    def spilled(self) -> bool:
+        return self.fd is not None
+
+    async def fill(self, source: AsyncIterator[bytes], expected: Optional[int] = None):
+        """
+        Read ``source`` to the end.
+
+        Args:
+            source: The body as it arrives from the client.
+            expected: The announced Content-Length, if any. It is reserved in
+                the budget at once, so a body is either admitted whole or
+                waits without holding part of the budget.
+
+        Raises:
+            BodyTooLarge: If the body is, or is announced to be, larger than ``max_bytes``.
+            Overloaded: If the budget had no room for the body in time.
+        """
+        if expected:
+            await self.reserve(expected)
+        async for chunk in source:
+            end = self.size + len(chunk)
+            if end > self.reserved:
+                await self.reserve(end - self.reserved)
+            await self.append(chunk)
+        await self.written()
+
+    async def reserve(self, size: int):
+        if self.reserved + size > self.max_bytes:
+            if self.budget is not None:
+                self.budget.refused += 1
+            raise BodyTooLarge(self.max_bytes)
+        if self.budget is not None:
+            await self.budget.acquire(size)
+        self.reserved += size
+
+    async def append(self, chunk: bytes):
+        """Add ``chunk`` to the body, starting its write to the file without waiting for it to finish."""
+        await self.written()
+        if self.fd is None and self.size + len(chunk) > self.max_memory:
+            fd, path = tempfile.mkstemp(prefix="httpkit-body-", dir=self.directory)
+            # Unlinked at once, so the file goes away with the descriptor even if the process dies
+            os.unlink(path)
+            self.fd = fd
+            pending, self.chunks = self.chunks + [bytes(chunk)], []
+            if self.budget is not None:
+                self.budget.spilled += 1
+        elif self.fd is None:
+            self.chunks.append(bytes(chunk))
+            self.size += len(chunk)
+            return
+        else:
+            pending = [bytes(chunk)]
+        self.size += len(chunk)
+        self.writing = asyncio.get_running_loop().run_in_executor(None, write_chunks, self.fd, pending)
+
+    async def written(self):
+        """Wait for the write in progress, if any."""
+        if self.writing is not None:
+            # Shielded, so a cancelled request does not close the file under the thread (see close)
+            await asyncio.shield(self.writing)
+            self.writing = None
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self.fd is None:
+            for chunk in self.chunks:
+                yield chunk
+            return
+        offset = 0
+        while offset < self.size:
+            chunk = os.pread(self.fd, min(self.chunk_size, self.size - offset), offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+    def close(self):
+        """Drop the body and return its bytes to the budget."""
+        self.chunks = []
+        if self.fd is not None:
+            if self.writing is not None and not self.writing.done():
+                self.writing.add_done_callback(lambda future, fd=self.fd: close_when_done(future, fd))
+            else:
+                os.close(self.fd)
+            self.fd = None
+        self.writing = None
+        if self.budget is not None and self.reserved:
+            self.budget.release(self.reserved)
+        self.reserved = 0
@@ -0,0 +1,156 @@
+"""Low-latency relaying of long-lived event streams.
+
+Server-sent events and NDJSON token streams (the way LLM APIs stream
+completions) stay open for as long as the upstream keeps generating, with
+small writes separated by pauses. The proxy recognizes them by content type
+(and optionally treats every chunked response without a length as one), and
+then:
+
+* forwards every chunk the moment it is read, as it was read, without
+  decoding, buffering or re-chunking it;
+* releases the request's concurrency slot once the headers arrive, so open
+  streams do not use up the budget meant for short requests;
+* reads the body with a per-stream idle timeout instead of the request
+  timeout, ending the stream cleanly when the upstream goes quiet for too long;
+* sends SSE comment heartbeats while the upstream is idle, so intermediaries
+  and clients do not give up on a slow generation;
+* times the first event and the gaps between events.
+
+A heartbeat is only inserted between events, never in the middle of an event
+that has been relayed in part.
+"""
+
+import asyncio
+import time
+from typing import AsyncIterator, Callable, Dict, Iterable, Optional
+
+import httpx
+
+SSE_TYPE = "text/event-stream"
+
+# Content types relayed as streams by default
+DEFAULT_STREAM_TYPES = (SSE_TYPE, "application/x-ndjson")
+
+# An SSE comment line, ignored by clients
+HEARTBEAT = b": keep-alive\n\n"
+
+# Byte sequences that end an SSE event
+EVENT_BOUNDARIES = (b"\n\n", b"\r\n\r\n", b"\r\r")
+
+
+def media_type(content_type: Optional[str]) -> str:
+    """Return the lower-cased media type of a Content-Type value, without parameters."""
+    if not content_type:
+        return ""
+    return content_type.split(";", 1)[0].strip().lower()
+
+
+def is_stream(headers: httpx.Headers, content_types: Iterable[str], chunked: bool = False) -> bool:
+    """
+    Return True if a response with ``headers`` should be relayed as a long-lived stream.
+
+    Args:
+        headers: The upstream response headers.
+        content_types: Media types that are always streams.
+        chunked: Whether chunked responses without a Content-Length are streams too.
+    """
+    if media_type(headers.get("content-type")) in content_types:
+        return True
+    return (
+        chunked
+        and "content-length" not in headers
+        and "chunked" in headers.get("transfer-encoding", "").lower()
+    )
+
+
+class StreamTracker:
+    """Counts of open and finished streams, shared by every stream the proxy relays."""
+
+    __slots__ = ("active", "streams", "events", "heartbeats", "idle_timeouts")
+
+    def __init__(self):
+        self.active = 0
+        self.streams = 0
+        self.events = 0
+        self.heartbeats = 0
+        self.idle_timeouts = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "streams": self.streams,
+            "events": self.events,
+            "heartbeats": self.heartbeats,
+            "idle_timeouts": self.idle_timeouts,
+        }
+
+
+async def relay_events(
+    chunks: AsyncIterator[bytes],
+    tracker: StreamTracker,
+    started: float,
+    heartbeat: float = 0.0,
+    on_first_event: Optional[Callable[[float], None]] = None,
+    on_event_gap: Optional[Callable[[float], None]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Yield the chunks of an upstream stream as they arrive, with heartbeats and event timing.
+
+    The stream ends without an error when the upstream read times out, which
+    for streams is the idle timeout.
+
+    Args:
+        chunks: The upstream body, one chunk per read.
+        tracker: Counters updated as the stream progresses.
+        started: ``time.monotonic()`` when the request was received, the
+            reference for the time to the first event.
+        heartbeat: Seconds of upstream silence after which an SSE heartbeat
+            comment is sent, 0 for none.
+        on_first_event: Called with the seconds until the first chunk arrived.
+        on_event_gap: Called with the seconds between consecutive chunks.
+    """
+    iterator = chunks.__aiter__()
+    pending: Optional[asyncio.Future] = None
+    last = 0.0
+    # Heartbeats may only go between events
+    at_boundary = True
+    tracker.active += 1
+    tracker.streams += 1
+    try:
+        while True:
+            if heartbeat > 0:
+                # Wait for the read without cancelling it, so it survives the heartbeats
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                done, _ = await asyncio.wait((pending,), timeout=heartbeat)
+                if not done:
+                    if at_boundary:
+                        tracker.heartbeats += 1
+                        yield HEARTBEAT
+                    continue
+                chunk = pending.result()
+                pending = None
+            else:
+                chunk = await iterator.__anext__()
+            if not chunk:
+                continue
+
+            now = time.monotonic()
+            if last:
+                if on_event_gap is not None:
+                    on_event_gap(now - last)
+            elif on_first_event is not None:
+                on_first_event(now - started)
+            last = now
+            tracker.events += 1
+            # Chunks may be memoryviews, which have no endswith()
+            at_boundary = bytes(chunk[-4:]).endswith(EVENT_BOUNDARIES)
+            yield chunk
+    except StopAsyncIteration:
+        return
+    except httpx.ReadTimeout:
+        tracker.idle_timeouts += 1
+    finally:
+        tracker.active -= 1
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,157 @@
+"""Per-request phase timing and the slow request log.
+
+A :class:`RequestTimer` takes ``time.monotonic()`` timestamps as a proxied
+request moves through the proxy, and turns them into phases:
+
+* ``queue``: waiting for a concurrency slot;
+* ``pool``: waiting for a pooled upstream connection (or an HTTP/2 stream);
+* ``connect``: resolving the upstream host and opening the TCP connection;
+* ``tls``: the TLS handshake;
+* ``upstream``: from sending the request until the response headers arrived;
+* ``body``: streaming the response body to the client;
+* ``total``: from receiving the request until it finished (or until now).
+
+Connection events come from httpx's ``trace`` request extension, so
+``connect`` and ``tls`` only appear for requests that opened a connection.
+The timer of the request being forwarded is found through
+:data:`current_timer`, so it need not be passed down through the retry,
+hedging and coalescing layers; a retried or hedged request shows the phases
+of its latest attempt. Timers are only created while something uses them:
+the ``Server-Timing`` header, the access log or :class:`SlowRequests`.
+
+:class:`SlowRequests` keeps the slowest requests of the last one to two
+windows in two bounded heaps, for ``GET /debug/slow``.
+"""
+
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+# The timer of the request the current task is forwarding, if timing is enabled
+current_timer: ContextVar[Optional["RequestTimer"]] = ContextVar("httpkit_request_timer", default=None)
+
+
+class RequestTimer:
+    """
+    Timestamps of one proxied request.
+
+    Args:
+        started: ``time.monotonic()`` when the proxy received the request.
+    """
+
+    __slots__ = (
+        "started", "queued", "acquired", "connect_start", "connect_end",
+        "tls_start", "tls_end", "request_start", "headers", "finished",
+    )
+
+    def __init__(self, started: float):
+        self.started = started
+        self.queued = 0.0
+        self.acquired = 0.0
+        self.connect_start = 0.0
+        self.connect_end = 0.0
+        self.tls_start = 0.0
+        self.tls_end = 0.0
+        self.request_start = 0.0
+        self.headers = 0.0
+        self.finished = 0.0
+
+    def begin(self, queued: float, acquired: float):
+        """Start timing an upstream attempt that waited for its slot from ``queued`` to ``acquired``."""
+        self.queued = queued
+        self.acquired = acquired
+        self.connect_start = self.connect_end = 0.0
+        self.tls_start = self.tls_end = 0.0
+        self.request_start = self.headers = 0.0
+
+    async def trace(self, event: str, info: Dict[str, Any]):
+        """The httpx ``trace`` extension: note connection and request events."""
+        # Drop the "connection." / "http11." / "http2." prefix
+        name = event.partition(".")[2]
+        if name == "connect_tcp.started":
+            self.connect_start = time.monotonic()
+        elif name == "connect_tcp.complete":
+            self.connect_end = time.monotonic()
+        elif name == "start_tls.started":
+            self.tls_start = time.monotonic()
+        elif name == "start_tls.complete":
+            self.tls_end = time.monotonic()
+        elif name == "send_request_headers.started":
+            self.request_start = time.monotonic()
+
+    def queue_wait(self) -> Optional[float]:
+        return self.acquired - self.queued if self.acquired else None
+
+    def ttfb(self) -> Optional[float]:
+        """Seconds from the slot being acquired until the response headers arrived."""
+        return self.headers - self.acquired if self.headers else None
+
+    def phases(self, now: Optional[float] = None) -> Dict[str, float]:
+        """Return the seconds spent in each phase the request went through."""
+        phases = {}
+        if self.acquired:
+            phases["queue"] = self.acquired - self.queued
+        if self.request_start:
+            connect = tls = 0.0
+            if self.connect_end:
+                phases["connect"] = connect = self.connect_end - self.connect_start
+            if self.tls_end:
+                phases["tls"] = tls = self.tls_end - self.tls_start
+            phases["pool"] = max(0.0, self.request_start - self.acquired - connect - tls)
+        if self.headers:
+            phases["upstream"] = self.headers - (self.request_start or self.acquired)
+            if self.finished:
+                phases["body"] = self.finished - self.headers
+        phases["total"] = (self.finished or now or time.monotonic()) - self.started
+        return phases
+
+    def server_timing(self) -> str:
+        """Return the phases so far as a ``Server-Timing`` header value, in milliseconds."""
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.phases().items())
+
+
+class SlowRequests:
+    """
+    The slowest requests of the last one to two windows.
+
+    Each window keeps at most ``size`` requests in a min-heap on duration, so a
+    request costs one comparison unless it is among the slowest of its window.
+
+    Args:
+        size: Requests kept per window.
+        window: Seconds after which the current window becomes the previous one.
+    """
+
+    def __init__(self, size: int = 50, window: float = 300.0):
+        self.size = size
+        self.window = window
+        self.current: List[Tuple[float, int, Dict[str, Any]]] = []
+        self.previous: List[Tuple[float, int, Dict[str, Any]]] = []
+        self.rotated = time.monotonic()
+        # Breaks ties between equal durations, so entries are never compared
+        self.counter = itertools.count()
+
+    def admits(self, duration: float, now: Optional[float] = None) -> bool:
+        """Return True if a request of ``duration`` seconds is among the slowest of the window."""
+        now = time.monotonic() if now is None else now
+        if now - self.rotated >= self.window:
+            # Drop both windows if no request was seen for a whole window
+            self.previous = self.current if now - self.rotated < 2 * self.window else []
+            self.current = []
+            self.rotated = now
+        return len(self.current) < self.size or duration > self.current[0][0]
+
+    def add(self, duration: float, entry: Dict[str, Any]):
+        """Keep ``entry``, replacing the fastest kept request if the window is full."""
+        item = (duration, next(self.counter), entry)
+        if len(self.current) < self.size:
+            heapq.heappush(self.current, item)
+        else:
+            heapq.heapreplace(self.current, item)
+
+    def slowest(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return the kept requests, slowest first."""
+        items = sorted(self.current + self.previous, key=lambda item: item[0], reverse=True)
+        return [entry for _, _, entry in items[:limit or self.size]]
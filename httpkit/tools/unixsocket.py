@@ -0,0 +1,73 @@
+"""Upstreams reached over Unix domain sockets.
+
+In sidecar deployments the proxy, the application and its upstreams run on
+one host, where a Unix domain socket spares every hop the loopback TCP stack.
+An upstream socket is addressed as ``/proxy/unix:{socket}/{path}``, with the
+socket path percent-encoded or not, e.g. ``/proxy/unix:%2Frun%2Fapp.sock/v1``.
+Only sockets listed in the proxy's configuration can be reached, so clients
+cannot use the proxy to talk to arbitrary local services.
+
+Inside the proxy such requests go to ``http+unix://{encoded socket}/{path}``,
+so the socket is part of the origin that limits, metrics, circuit breakers and
+caches are keyed by. :class:`UnixSocketTransport` sends them over the socket
+as plain ``http://localhost`` requests, from a connection pool of its own.
+"""
+
+from typing import Iterable, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+UNIX_SCHEME = "http+unix"
+TARGET_PREFIX = "unix:"
+
+
+class UnknownSocket(Exception):
+    """Raised when a request names a Unix socket that is not configured as an upstream."""
+
+
+def unix_origin(path: str) -> str:
+    """Return the origin of requests to the Unix socket at ``path``."""
+    return f"{UNIX_SCHEME}://{quote(path, safe='')}"
+
+
+def match_socket(target: str, sockets: Iterable[str]) -> Optional[Tuple[str, str]]:
+    """
+    Split a decoded ``{socket}/{path}`` target into a configured socket and the path after it.
+
+    The longest matching socket wins, so ``/run/app.sock`` and
+    ``/run/app.sock.d/api.sock`` can both be configured.
+
+    Returns:
+        ``(socket, path)``, or None if no configured socket matches.
+    """
+    best = None
+    for socket_path in sockets:
+        if (target == socket_path or target.startswith(socket_path + "/")) and (
+            best is None or len(socket_path) > len(best)
+        ):
+            best = socket_path
+    if best is None:
+        return None
+    return best, target[len(best) + 1:]
+
+
+class UnixSocketTransport(httpx.AsyncHTTPTransport):
+    """
+    An httpx transport sending ``http+unix://`` requests to one Unix domain socket.
+
+    Args:
+        path: The socket's path.
+        **kwargs: Further ``httpx.AsyncHTTPTransport`` options, such as ``limits``.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(uds=path, **kwargs)
+        self.path = path
+        # All of the pool's connections go to this origin (see limits.pool_stats)
+        self.origin = unix_origin(path)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme="http", host="localhost", port=None)
+        request.headers["Host"] = "localhost"
+        return await super().handle_async_request(request)
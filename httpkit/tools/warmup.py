@@ -0,0 +1,83 @@
+"""Connection pre-warming for hot upstream origins.
+
+Opening an upstream connection costs a TCP handshake, and for https a TLS
+handshake, on the critical path of the first request that needs it. After a
+deploy, or once idle connections hit the pool's keep-alive expiry, that is
+every request for a while. :class:`ConnectionWarmer` keeps at least a minimum
+number of idle connections open to each configured origin: at startup, and
+then every ``interval`` seconds, it sends that many concurrent lightweight
+requests to the origin. Idle connections serve them (which also resets their
+keep-alive expiry), and connections that are missing are opened.
+
+An HTTP/2 origin multiplexes concurrent requests over one session, so for
+such origins warming keeps that single session open.
+"""
+
+import asyncio
+from typing import Callable, Dict
+
+import httpx
+
+from httpkit.tools.limits import pool_stats
+
+
+class ConnectionWarmer:
+    """
+    Keep a minimum number of idle pooled connections to hot origins.
+
+    Args:
+        origins: Minimum idle connections by ``scheme://host:port`` origin.
+        client_for: Returns the pooled client used for an origin.
+        path: Path requested to open or refresh a connection.
+        method: Method of the warming requests.
+        timeout: Timeout of each warming request.
+    """
+
+    def __init__(
+        self,
+        origins: Dict[str, int],
+        client_for: Callable[[str], httpx.AsyncClient],
+        path: str = "/",
+        method: str = "HEAD",
+        timeout: float = 5.0,
+    ):
+        self.origins = origins
+        self.client_for = client_for
+        self.path = path
+        self.method = method
+        self.timeout = timeout
+        self.rounds = 0
+        self.requests = 0
+        self.failures = 0
+
+    def stats(self) -> Dict[str, object]:
+        """Return the warming counters and the idle connections of every warmed origin."""
+        origins = {}
+        for origin, minimum in self.origins.items():
+            connections = pool_stats(self.client_for(origin)).get(origin, {"active": 0, "idle": 0})
+            origins[origin] = {"min_idle": minimum, **connections}
+        return {"rounds": self.rounds, "requests": self.requests, "failures": self.failures, "origins": origins}
+
+    async def warm(self, origin: str, count: int):
+        """Send ``count`` concurrent requests to ``origin`` so its pool holds that many connections."""
+        client = self.client_for(origin)
+
+        async def touch():
+            try:
+                await client.request(self.method, origin + self.path, timeout=self.timeout)
+            except httpx.HTTPError:
+                self.failures += 1
+
+        self.requests += count
+        await asyncio.gather(*(touch() for _ in range(count)))
+
+    async def warm_all(self):
+        """Run one warming round over every origin."""
+        self.rounds += 1
+        await asyncio.gather(*(self.warm(origin, count) for origin, count in self.origins.items() if count > 0))
+
+    async def run(self, interval: float):
+        """Warm every origin now and then every ``interval`` seconds until cancelled."""
+        while True:
+            await self.warm_all()
+            await asyncio.sleep(interval)
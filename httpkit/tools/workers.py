@@ -0,0 +1,424 @@
+"""Multi-process serving: supervised workers sharing a node-wide concurrency budget.
+
+:class:`Supervisor` runs one proxy worker per process. Every worker binds its
+own listening socket with ``SO_REUSEPORT``, so the kernel spreads incoming
+connections across workers instead of waking them all on a shared socket.
+Unix domain sockets have no such load balancing, so for them the supervisor
+binds one socket and every worker accepts from it.
+Workers can be pinned to one CPU each. The supervisor restarts workers that
+exit unexpectedly, with an increasing delay while they keep failing. On
+``SIGHUP`` it starts a new generation of workers, which read the
+configuration afresh, and then asks the old generation to drain: they stop
+accepting connections and finish in-flight requests within the graceful
+shutdown timeout. ``SIGTERM`` and ``SIGINT`` drain every worker and exit.
+
+Each worker has its own event loop, limiter and connection pools, so the
+global concurrency limit and the counters behind it would otherwise only
+describe one process. :class:`NodeBudget` keeps them in a small memory-mapped
+file shared by every worker: the node-wide limit, the requests in flight on
+the whole node, and one row of counters per worker. A worker takes a unit of
+the budget, under an ``fcntl`` lock, for every slot its limiter grants. The
+row of a worker that died is cleared by the supervisor, or by the next worker
+that claims it, so a crash never leaks budget. Likewise the supervisor
+retires the metrics files of every worker that exits (see
+:func:`~httpkit.tools.metrics.retire_worker`).
+"""
+
+import logging
+import mmap
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import stat
+import time
+from typing import Any, Dict, List, Optional
+
+from httpkit.tools.metrics import retire_worker
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Header layout, in 8-byte words: node limit, in flight, acquired total, unused
+HEADER_WORDS = 4
+# Row layout, in 8-byte words: worker pid, in flight, acquired total, unused
+ROW_WORDS = 4
+MAX_WORKERS = 256
+
+
+def pid_alive(pid: int) -> bool:
+    """Return whether a process with ``pid`` exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class NodeBudget:
+    """
+    A concurrency budget and request counters shared by every worker of a node.
+
+    Args:
+        path: File shared by every worker.
+        limit: Requests in flight allowed on the whole node, 0 for no limit,
+            or None to keep the limit already in the file.
+        rows: Number of workers the file can hold.
+    """
+
+    def __init__(self, path: str, limit: Optional[int] = None, rows: int = MAX_WORKERS):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Workers may open the file concurrently; it only ever grows
+        size = max((HEADER_WORDS + rows * ROW_WORDS) * 8, os.fstat(self.fd).st_size)
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.buffer = mmap.mmap(self.fd, size)
+        self.words = memoryview(self.buffer).cast("q")
+        self.rows = (size // 8 - HEADER_WORDS) // ROW_WORDS
+        # This process's row, once attached
+        self.row: Optional[int] = None
+        if limit is not None:
+            self.lock()
+            self.words[0] = limit
+            self.unlock()
+
+    @property
+    def limit(self) -> int:
+        return self.words[0]
+
+    def attach(self, pid: Optional[int] = None) -> int:
+        """Claim a free row, or the row of a process that no longer exists, for this worker."""
+        pid = os.getpid() if pid is None else pid
+        self.lock()
+        try:
+            for row in range(self.rows):
+                owner = self.words[HEADER_WORDS + row * ROW_WORDS]
+                if owner == 0 or owner == pid or not pid_alive(owner):
+                    self.clear(row)
+                    self.words[HEADER_WORDS + row * ROW_WORDS] = pid
+                    self.row = row
+                    return row
+        finally:
+            self.unlock()
+        raise RuntimeError(f"No free worker row in {self.path}")
+
+    def reap(self, pid: int):
+        """Clear the row of a worker that exited, returning whatever budget it still held."""
+        self.lock()
+        try:
+            for row in range(self.rows):
+                if self.words[HEADER_WORDS + row * ROW_WORDS] == pid:
+                    self.clear(row)
+        finally:
+            self.unlock()
+
+    def sweep(self):
+        """Clear the rows of every worker that no longer exists, e.g. left behind by a previous run."""
+        self.lock()
+        try:
+            for row in range(self.rows):
+                owner = self.words[HEADER_WORDS + row * ROW_WORDS]
+                if owner and not pid_alive(owner):
+                    self.clear(row)
+        finally:
+            self.unlock()
+
+    def clear(self, row: int):
+        base = HEADER_WORDS + row * ROW_WORDS
+        words = self.words
+        words[1] -= words[base + 1]
+        words[base] = words[base + 1] = words[base + 2] = 0
+
+    def take(self) -> bool:
+        """Take one unit of the node budget for this worker; False when the node is at its limit."""
+        words = self.words
+        base = HEADER_WORDS + self.row * ROW_WORDS
+        self.lock()
+        try:
+            if words[0] and words[1] >= words[0]:
+                return False
+            words[1] += 1
+            words[2] += 1
+            words[base + 1] += 1
+            words[base + 2] += 1
+            return True
+        finally:
+            self.unlock()
+
+    def give(self):
+        """Return a unit taken with :meth:`take`."""
+        words = self.words
+        base = HEADER_WORDS + self.row * ROW_WORDS
+        self.lock()
+        try:
+            words[1] -= 1
+            words[base + 1] -= 1
+        finally:
+            self.unlock()
+
+    def lock(self):
+        if fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 8, 0)
+
+    def unlock(self):
+        if fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 8, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the node limit, in-flight and acquired counts, in total and per live worker."""
+        words = self.words
+        workers = []
+        for row in range(self.rows):
+            base = HEADER_WORDS + row * ROW_WORDS
+            if words[base]:
+                workers.append({"pid": words[base], "active": words[base + 1], "acquired": words[base + 2]})
+        return {"limit": words[0], "active": words[1], "acquired": words[2], "workers": workers}
+
+    def close(self):
+        """Give up this worker's row and unmap the file."""
+        if self.row is not None:
+            self.lock()
+            self.clear(self.row)
+            self.unlock()
+            self.row = None
+        self.words.release()
+        self.buffer.close()
+        os.close(self.fd)
+
+
+def reuseport_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """Return a listening TCP socket bound with ``SO_REUSEPORT``, so each worker can have its own."""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def unix_socket(path: str, backlog: int = 2048, mode: int = 0o666) -> socket.socket:
+    """Return a listening Unix domain socket at ``path``, replacing a socket file left there."""
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, mode)
+    sock.listen(backlog)
+    return sock
+
+
+def serve_worker(
+    app: str,
+    host: str,
+    port: int,
+    cpu: Optional[int],
+    graceful_timeout: float,
+    options: Dict[str, Any],
+    listener: Optional[socket.socket] = None,
+):
+    """Entry point of a worker process: pin it, bind its own socket (or use ``listener``) and serve until told to drain."""
+    import uvicorn
+
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+    sock = listener if listener is not None else reuseport_socket(host, port)
+    # SIGTERM and SIGINT make uvicorn stop accepting and finish in-flight requests
+    server = uvicorn.Server(uvicorn.Config(app, timeout_graceful_shutdown=graceful_timeout, **options))
+    server.run(sockets=[sock])
+
+
+class Supervisor:
+    """
+    Run and supervise ``workers`` worker processes serving ``app``.
+
+    Args:
+        app: Import string of the ASGI app, e.g. ``httpkit.tools.proxy:app``.
+        host: Address the workers listen on.
+        port: Port the workers listen on.
+        workers: Number of worker processes.
+        pin: Pin worker ``i`` to the ``i``-th CPU this process may run on.
+        graceful_timeout: Seconds a draining worker gets to finish its requests.
+        node_state: The workers' :class:`NodeBudget` file, whose rows of
+            exited workers are cleared.
+        restart_delay: Delay before restarting a worker that failed right
+            after starting; it doubles with every further failure.
+        max_restart_delay: Upper bound of the restart delay.
+        options: Further ``uvicorn.Config`` options of the workers, such as ``loop`` and ``http``.
+        uds: Path of a Unix domain socket to listen on instead of ``host`` and ``port``.
+        metrics_dir: The workers' shared metrics directory, in which the
+            files of exited workers are retired.
+    """
+
+    # A worker that ran at least this long before exiting restarts without delay
+    STABLE_SECONDS = 10.0
+
+    def __init__(
+        self,
+        app: str,
+        host: str,
+        port: int,
+        workers: int,
+        pin: bool = False,
+        graceful_timeout: float = 30.0,
+        node_state: Optional[str] = None,
+        restart_delay: float = 0.5,
+        max_restart_delay: float = 30.0,
+        options: Optional[Dict[str, Any]] = None,
+        uds: Optional[str] = None,
+        metrics_dir: Optional[str] = None,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.count = workers
+        self.graceful_timeout = graceful_timeout
+        self.node_state = node_state
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.options = dict(options or {})
+        self.uds = uds
+        self.metrics_dir = metrics_dir
+        self.listener: Optional[socket.socket] = None
+        cpus = sorted(os.sched_getaffinity(0)) if pin and hasattr(os, "sched_getaffinity") else []
+        self.cpus: List[Optional[int]] = [cpus[index % len(cpus)] if cpus else None for index in range(workers)]
+        self.context = multiprocessing.get_context("spawn")
+
+        # Worker index -> its current process
+        self.workers: Dict[int, Any] = {}
+        self.started: Dict[int, float] = {}
+        self.failures: Dict[int, int] = {}
+        # Worker index -> monotonic time at which it is restarted
+        self.pending: Dict[int, float] = {}
+        # Processes of an old generation, with the time by which they must have exited
+        self.draining: Dict[Any, float] = {}
+        self.stopping = False
+        self.reloading = False
+        self.restarts = 0
+        self.budget: Optional[NodeBudget] = None
+
+    def spawn(self, index: int):
+        process = self.context.Process(
+            target=serve_worker,
+            args=(self.app, self.host, self.port, self.cpus[index], self.graceful_timeout, self.options, self.listener),
+            name=f"httpkit-worker-{index}",
+        )
+        process.start()
+        self.workers[index] = process
+        self.started[index] = time.monotonic()
+
+    def drain(self, process):
+        """Ask ``process`` to stop accepting connections and finish its requests."""
+        if process.is_alive():
+            process.terminate()
+        self.draining[process] = time.monotonic() + self.graceful_timeout + 5.0
+
+    def reload(self):
+        """Replace every worker: start the new generation first, then drain the old one."""
+        old = list(self.workers.values())
+        self.pending.clear()
+        for index in range(self.count):
+            self.spawn(index)
+        for process in old:
+            self.drain(process)
+
+    def stop(self):
+        for process in self.workers.values():
+            self.drain(process)
+        self.workers.clear()
+        self.pending.clear()
+
+    def exited(self, process):
+        """Account for a process that exited, scheduling a restart if it was a current worker."""
+        process.join()
+        if self.budget is not None:
+            self.budget.reap(process.pid)
+        if self.metrics_dir:
+            retire_worker(self.metrics_dir, process.pid)
+        if self.draining.pop(process, None) is not None:
+            return
+        index = next(index for index, worker in self.workers.items() if worker is process)
+        del self.workers[index]
+        if self.stopping:
+            return
+        logger.warning("Worker %d (pid %d) exited with code %s; restarting it", index, process.pid, process.exitcode)
+        self.restarts += 1
+        failures = 0 if time.monotonic() - self.started[index] >= self.STABLE_SECONDS else self.failures.get(index, 0)
+        delay = min(self.max_restart_delay, self.restart_delay * 2 ** (failures - 1)) if failures else 0.0
+        self.failures[index] = failures + 1
+        self.pending[index] = time.monotonic() + delay
+
+    def run(self):
+        """Start the workers and supervise them until a stop signal drains them all."""
+        previous = {
+            signum: signal.signal(signum, handler)
+            for signum, handler in (
+                (signal.SIGTERM, self.handle_stop),
+                (signal.SIGINT, self.handle_stop),
+                (signal.SIGHUP, self.handle_reload),
+            )
+        }
+        if self.node_state:
+            self.budget = NodeBudget(self.node_state)
+            self.budget.sweep()
+        if self.metrics_dir:
+            self.sweep_metrics()
+        if self.uds:
+            # Passed to every worker, which inherits the descriptor
+            self.listener = unix_socket(self.uds)
+        try:
+            for index in range(self.count):
+                self.spawn(index)
+            while self.workers or self.pending or self.draining:
+                if self.stopping and (self.workers or self.pending):
+                    self.stop()
+                if self.reloading and not self.stopping:
+                    self.reloading = False
+                    self.reload()
+
+                now = time.monotonic()
+                for index, due in list(self.pending.items()):
+                    if due <= now:
+                        del self.pending[index]
+                        self.spawn(index)
+                for process, deadline in list(self.draining.items()):
+                    if deadline <= now and process.is_alive():
+                        process.kill()
+
+                processes = list(self.workers.values()) + list(self.draining)
+                ready = multiprocessing.connection.wait([process.sentinel for process in processes], timeout=0.2)
+                for process in processes:
+                    if process.sentinel in ready:
+                        self.exited(process)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            if self.budget is not None:
+                self.budget.close()
+                self.budget = None
+            if self.listener is not None:
+                self.listener.close()
+                self.listener = None
+                if os.path.exists(self.uds):
+                    os.unlink(self.uds)
+
+    def sweep_metrics(self):
+        """Retire the metrics files of workers that no longer exist, e.g. left behind by a previous run."""
+        for filename in os.listdir(self.metrics_dir):
+            name, _, suffix = filename.partition(".")
+            if suffix == "json" and name.startswith("worker-") and name[7:].isdigit() and not pid_alive(int(name[7:])):
+                retire_worker(self.metrics_dir, int(name[7:]))
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        self.reloading = True
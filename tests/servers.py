@@ -0,0 +1,70 @@
+"""Helpers for running ASGI apps on real local sockets during tests."""
+
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import uvicorn
+
+import httpkit.tools.proxy as proxy
+
+
+@contextmanager
+def run_server(app, lifespan: str = "auto", uds: Optional[str] = None):
+    """
+    Serve ``app`` with uvicorn on an ephemeral localhost port in a background thread.
+
+    Args:
+        uds: Listen on a Unix domain socket at this path instead.
+
+    Yields:
+        The base URL of the running server, e.g. ``http://127.0.0.1:54321``,
+        or the socket's path.
+    """
+    if uds:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(uds)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", 0))
+        host, port = sock.getsockname()
+
+    config = uvicorn.Config(app, lifespan=lifespan, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline or not thread.is_alive():
+            raise RuntimeError("Test server failed to start")
+        time.sleep(0.01)
+
+    try:
+        yield uds or f"http://{host}:{port}"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        sock.close()
+
+
+def closed_port() -> int:
+    """Return a localhost port nothing is listening on, so connections to it are refused."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def keep_proxy_state(monkeypatch):
+    """
+    Restore the proxy module's globals when the test ends.
+
+    Starting ``proxy.app`` replaces its settings and the limiters, clients and
+    caches built from them; this keeps them from leaking into later tests.
+    """
+    for name, value in list(vars(proxy).items()):
+        if not name.startswith("__"):
+            monkeypatch.setattr(proxy, name, value)
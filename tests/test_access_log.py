@@ -0,0 +1,126 @@
+"""Tests for the batched, sampled JSON lines access log."""
+
+import errno
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.accesslog import AccessLog
+from tests.servers import keep_proxy_state, run_server
+
+
+async def echo(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": body + b"!"})
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_sampling_keeps_errors_and_slow_requests(tmp_path):
+    log = AccessLog(str(tmp_path / "access.log"), sample_rate=0.0, slow_seconds=1.0)
+    log.log("10.0.0.1", "GET", "http://a:80/fast", 200, 0, 10, 0.01)
+    log.log("10.0.0.1", "GET", "http://a:80/slow", 200, 0, 10, 2.5)
+    log.log("10.0.0.1", "GET", "http://a:80/broken", 502, 0, 0, 0.01, error="connection refused")
+    log.log("10.0.0.1", "GET", "http://a:80/limited", 429, 0, 0, 0.0)
+    log.close()
+
+    records = read_records(tmp_path / "access.log")
+    assert [record["target"] for record in records] == ["http://a:80/slow", "http://a:80/broken"]
+    assert records[1]["error"] == "connection refused" and records[1]["status"] == 502
+    assert log.stats()["sampled_out"] == 2 and log.stats()["written"] == 2
+
+
+def test_full_buffer_drops_records_instead_of_blocking(tmp_path):
+    log = AccessLog(str(tmp_path / "access.log"), capacity=4, flush_interval=60)
+    # Keep the flush thread asleep so the buffer fills up
+    log.wakeup.set = lambda: None
+    for i in range(10):
+        log.log(None, "GET", f"http://a:80/{i}", 200, 0, 0, 0.0)
+    assert log.dropped == 6 and log.stats()["buffered"] == 4
+
+    del log.wakeup.set
+    log.close()
+    assert [record["target"] for record in read_records(tmp_path / "access.log")] == [
+        f"http://a:80/{i}" for i in range(4)
+    ]
+
+
+def test_files_are_rotated_by_size(tmp_path):
+    path = tmp_path / "access.log"
+    log = AccessLog(str(path), max_bytes=300, backups=2)
+    for i in range(12):
+        log.log("10.0.0.1", "GET", f"http://a:80/{i}", 200, 0, 0, 0.0)
+        log.flush()
+    log.close()
+
+    assert log.rotations >= 2
+    assert path.exists() and (tmp_path / "access.log.1").exists() and (tmp_path / "access.log.2").exists()
+    assert not (tmp_path / "access.log.3").exists()
+    assert read_records(path)[-1]["target"] == "http://a:80/11"
+
+
+def test_write_errors_do_not_stop_the_flush_thread(tmp_path, monkeypatch):
+    class FullDisk:
+        closed = False
+
+        def write(self, data):
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+    path = tmp_path / "access.log"
+    log = AccessLog(str(path), flush_interval=0.01, max_bytes=10)
+    working, log.file = log.file, FullDisk()
+    log.log(None, "GET", "http://a:80/lost", 200, 0, 0, 0.0)
+    deadline = time.monotonic() + 5
+    while log.stats()["lost"] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    log.file = working
+    assert log.thread.is_alive() and log.stats()["write_errors"] == 1
+
+    # A rotation that fails leaves the records in the current file
+    def read_only(source, destination):
+        raise PermissionError(errno.EACCES, "Permission denied")
+
+    monkeypatch.setattr("httpkit.tools.accesslog.os.replace", read_only)
+    log.log(None, "GET", "http://a:80/0", 200, 0, 0, 0.0)
+    while log.stats()["written"] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    log.log(None, "GET", "http://a:80/1", 200, 0, 0, 0.0)
+    log.close()
+    assert [record["target"] for record in read_records(path)] == ["http://a:80/0", "http://a:80/1"]
+    assert log.stats()["write_errors"] == 2 and log.stats()["lost"] == 1 and log.rotations == 0
+
+
+def test_proxy_logs_requests_with_bytes_and_phases(tmp_path, monkeypatch):
+    path = tmp_path / "access.log"
+    monkeypatch.setenv("HTTPKIT_ACCESS_LOG", str(path))
+    keep_proxy_state(monkeypatch)
+
+    with run_server(echo) as upstream:
+        with TestClient(proxy.app) as client:
+            target = upstream.split("://", 1)[1]
+            assert client.post(f"/proxy/{target}/echo?x=1", content=b"hello").text == "hello!"
+            assert client.get("/proxy/127.0.0.1:1/down").status_code == 502
+            assert client.get("/").json()["access_log"]["dropped"] == 0
+
+    records = read_records(path)
+    assert len(records) == 2
+    ok, failed = records
+    assert ok["method"] == "POST" and ok["target"] == f"{upstream}/echo?x=1" and ok["status"] == 200
+    assert ok["client"] == "testclient" and ok["bytes_in"] == 5 and ok["bytes_out"] == 6
+    assert 0 <= ok["queue_wait"] <= ok["duration"] and 0 < ok["ttfb"] <= ok["duration"]
+    assert failed["status"] == 502 and failed["error"] and failed["ttfb"] is None
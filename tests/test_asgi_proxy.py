@@ -0,0 +1,100 @@
+"""Tests for the raw ASGI fast path."""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from httpkit.tools.asgi_proxy import app, parse_proxy_path
+from tests.servers import run_server
+
+
+async def echo_upstream(scope, receive, send):
+    """Minimal ASGI upstream that echoes the request it received as JSON."""
+    if scope["type"] != "http":
+        return
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    payload = json.dumps({
+        "method": scope["method"],
+        "path": scope["path"],
+        "query": scope["query_string"].decode(),
+        "headers": {k.decode(): v.decode() for k, v in scope["headers"]},
+        "body": body.decode(),
+    }).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/json")],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+@pytest.mark.parametrize("path,expected", [
+    ("/proxy/example.com:80/api/health", ("http", "example.com", 80, "api/health")),
+    ("/proxy/example.com:8080/", ("http", "example.com", 8080, "")),
+    ("/proxy/https://api.example.com:443/v1/chat/completions",
+     ("https", "api.example.com", 443, "v1/chat/completions")),
+    ("/proxy/http://[::1]:9000/a/b", ("http", "[::1]", 9000, "a/b")),
+    ("/proxy/ftp://example.com:21/file", ("ftp", "example.com", 21, "file")),
+    ("/proxy/example.com:80", None),
+    ("/proxy/example.com/path", None),
+    ("/proxy/example.com:port/path", None),
+    ("/proxy/:80/path", None),
+    ("/proxy/https://example.com/path", None),
+    ("/other/example.com:80/path", None),
+])
+def test_parse_proxy_path(path, expected):
+    """The hand-written parser accepts exactly the URLs the FastAPI routes accept."""
+    assert parse_proxy_path(path) == expected
+
+
+def test_fast_path_forwards_requests():
+    """Requests are forwarded with method, path, query, headers and body intact."""
+    with run_server(echo_upstream) as upstream, TestClient(app) as client:
+        target = upstream.split("://", 1)[1]
+        response = client.post(
+            f"/proxy/{target}/echo/path?b=2&a=1&flag",
+            content=b"hello",
+            headers={"X-Custom-Header": "test"},
+        )
+
+    assert response.status_code == 200
+    echoed = response.json()
+    assert echoed["method"] == "POST"
+    assert echoed["path"] == "/echo/path"
+    assert echoed["query"] == "b=2&a=1&flag"
+    assert echoed["headers"]["x-custom-header"] == "test"
+    assert echoed["headers"]["content-length"] == "5"
+    assert echoed["body"] == "hello"
+
+
+def test_fast_path_rejects_invalid_scheme():
+    """Invalid schemes get the same 400 error as the FastAPI routes."""
+    client = TestClient(app)
+    response = client.get("/proxy/ftp://example.com:80/path")
+    assert response.status_code == 400
+    assert "Invalid scheme" in response.json()["detail"]
+
+
+def test_fast_path_delegates_to_fastapi():
+    """Non-proxy paths and unparseable proxy URLs are handled by the FastAPI app."""
+    with TestClient(app) as client:
+        response = client.get("/")
+        assert response.status_code == 200
+        assert response.json()["configuration"]["fast_path_enabled"] is True
+
+        response = client.get("/proxy/example.com:port/path")
+        assert response.status_code == 422
+
+
+def test_fast_path_reports_upstream_errors():
+    """Connection failures become a 502 with the usual error detail."""
+    with TestClient(app) as client:
+        response = client.get("/proxy/127.0.0.1:1/unreachable")
+    assert response.status_code == 502
+    assert "Error forwarding request" in response.json()["detail"]
@@ -0,0 +1,126 @@
+"""Tests for named upstream groups, load balancing and health checks."""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools import asgi_proxy
+from httpkit.tools.balancer import Member, NoHealthyMembers, UpstreamGroup, load_groups, normalize_origin
+from tests.servers import closed_port, keep_proxy_state, run_server
+
+
+def named_upstream(name: bytes):
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = name + b" " + scope["path"].encode() + b"?" + scope["query_string"]
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+def test_normalize_origin():
+    assert normalize_origin("http://10.0.0.1:8000/") == "http://10.0.0.1:8000"
+    assert normalize_origin("https://api.example.com") == "https://api.example.com:443"
+    assert normalize_origin("http://[::1]") == "http://[::1]:80"
+    with pytest.raises(ValueError):
+        normalize_origin("ftp://example.com")
+
+
+def test_round_robin_cycles_through_healthy_members():
+    members = [Member(f"http://m{i}:80") for i in range(3)]
+    group = UpstreamGroup("g", members)
+    picked = [group.select().origin for _ in range(6)]
+    assert sorted(picked) == sorted([m.origin for m in members] * 2)
+
+    members[1].healthy = False
+    group.update_healthy()
+    assert {group.select().origin for _ in range(4)} == {"http://m0:80", "http://m2:80"}
+
+    for member in members:
+        member.healthy = False
+    group.update_healthy()
+    with pytest.raises(NoHealthyMembers):
+        group.select()
+
+
+def test_least_outstanding_and_peak_ewma_prefer_the_lighter_member():
+    busy, idle = Member("http://busy:80"), Member("http://idle:80")
+    busy.outstanding = 5
+    group = UpstreamGroup("g", [busy, idle], strategy="least_outstanding")
+    assert all(group.select() is idle for _ in range(20))
+
+    slow, fast = Member("http://slow:80"), Member("http://fast:80")
+    slow.observe(0.5)
+    fast.observe(0.01)
+    group = UpstreamGroup("g", [slow, fast], strategy="peak_ewma")
+    assert all(group.select() is fast for _ in range(20))
+
+    # A latency spike is taken at once, recoveries decay in gradually
+    fast.observe(1.0)
+    assert fast.ewma == 1.0
+    fast.observe(0.01)
+    assert fast.ewma > 0.9
+    assert all(group.select() is slow for _ in range(20))
+
+
+def test_health_checks_drop_and_restore_members():
+    async def scenario(up_url, down_url):
+        groups, _ = load_groups({"upstream_groups": {"g": {
+            "members": [up_url, down_url],
+            "health_check": {"path": "/health", "unhealthy_threshold": 2, "timeout_seconds": 0.5},
+        }}})
+        group = groups["g"]
+        async with httpx.AsyncClient() as client:
+            await group.check(lambda origin: client)
+            assert len(group.healthy) == 2
+            await group.check(lambda origin: client)
+            assert [m.origin for m in group.healthy] == [normalize_origin(up_url)]
+
+            # The member comes back once its check passes again
+            group.members[1].origin = group.members[0].origin
+            await group.check(lambda origin: client)
+            assert len(group.healthy) == 2
+
+    with run_server(named_upstream(b"up")) as up:
+        asyncio.run(scenario(up, f"http://127.0.0.1:{closed_port()}"))
+
+
+def test_group_requests_are_balanced_through_both_entry_points(tmp_path, monkeypatch):
+    with run_server(named_upstream(b"a")) as a, run_server(named_upstream(b"b")) as b:
+        config_file = tmp_path / "httpkit.json"
+        config_file.write_text(json.dumps({
+            "upstream_groups": {
+                "inference": {"members": [a, b], "balancing": "round_robin"},
+                "broken": {
+                    "members": [f"http://127.0.0.1:{closed_port()}"],
+                    "health_check": {"path": "/health", "interval_seconds": 0.05, "unhealthy_threshold": 1},
+                },
+            },
+        }))
+        monkeypatch.setenv("HTTPKIT_CONFIG_FILE", str(config_file))
+        keep_proxy_state(monkeypatch)
+
+        for app in (proxy.app, asgi_proxy.app):
+            with TestClient(app) as client:
+                bodies = [client.get("/proxy/@inference/v1/models?x=1").text for _ in range(4)]
+                assert sorted(bodies) == ["a /v1/models?x=1"] * 2 + ["b /v1/models?x=1"] * 2
+
+                assert client.get("/proxy/@missing/v1").status_code == 404
+
+                deadline = time.monotonic() + 5
+                while proxy.upstream_groups["broken"].healthy and time.monotonic() < deadline:
+                    time.sleep(0.02)
+                response = client.get("/proxy/@broken/v1")
+                assert response.status_code == 503
+                assert "No healthy members" in response.json()["detail"]
+
+                groups = client.get("/upstreams").json()["groups"]
+                assert groups["inference"]["healthy"] == 2
+                assert groups["inference"]["members"][a]["outstanding"] == 0
+                assert groups["broken"]["healthy"] == 0
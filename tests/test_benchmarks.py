@@ -0,0 +1,50 @@
+"""Tests for the benchmark suite's load generator and baseline comparison."""
+
+import asyncio
+
+import pytest
+
+from benchmarks import upstream as upstream_stub
+from benchmarks.loadgen import LoadResult, run_load
+from benchmarks.suite import compare
+from tests.servers import run_server
+
+
+@pytest.mark.parametrize("query, expected_bytes", [
+    ("size=1000", 1000),
+    ("size=1000&chunks=7", 1000),
+    ("size=10&events=3", 3 * len(b"data: 0123456789\n\n")),
+])
+def test_load_generator_reads_every_response_shape(query, expected_bytes):
+    with run_server(upstream_stub.app) as base_url:
+        host, port = base_url.split("://", 1)[1].split(":")
+        result = asyncio.run(run_load(host, int(port), f"/?{query}", concurrency=2, duration=0.2))
+
+    assert result.errors == 0
+    assert result.requests > 0
+    assert result.bytes_received == result.requests * expected_bytes
+
+
+def test_percentiles_use_nearest_rank():
+    result = LoadResult()
+    result.latencies = [i / 1000 for i in range(1, 1001)]
+    assert result.percentile(0.5) == 0.5
+    assert result.percentile(0.99) == 0.99
+    assert result.percentile(0.999) == 0.999
+
+
+def test_compare_flags_only_regressions_beyond_tolerance():
+    baseline = {"results": {
+        "small@16": {"rps": 1000, "p99_ms": 10.0, "peak_rss_mb": 60.0, "cpu_ms_per_request": 1.0, "errors": 0},
+        "large@16": {"rps": 100, "p99_ms": 50.0, "peak_rss_mb": 80.0, "cpu_ms_per_request": 5.0, "errors": 0},
+    }}
+    results = {"results": {
+        # Within tolerance or better
+        "small@16": {"rps": 950, "p99_ms": 12.0, "peak_rss_mb": 50.0, "cpu_ms_per_request": 0.8, "errors": 0},
+        # Slower, fatter and failing
+        "large@16": {"rps": 80, "p99_ms": 70.0, "peak_rss_mb": 100.0, "cpu_ms_per_request": 5.2, "errors": 3},
+    }}
+
+    regressions = compare(results, baseline, tolerance=0.10, latency_tolerance=0.25)
+    assert all(message.startswith("large@16") for message in regressions)
+    assert {message.split()[1] for message in regressions} == {"rps", "p99_ms", "peak_rss_mb", "errors"}
@@ -0,0 +1,172 @@
+"""Tests for the shared response cache."""
+
+import asyncio
+from email.utils import formatdate
+
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.cache import ResponseCache, freshness_lifetime, parse_cache_control
+from httpkit.tools.proxy import app
+from tests.servers import run_server
+
+upstream_calls = []
+
+
+async def cache_upstream(scope, receive, send):
+    """ASGI upstream with one route per caching behaviour; records each request it sees."""
+    if scope["type"] != "http":
+        return
+    request_headers = {k.decode(): v.decode() for k, v in scope["headers"]}
+    upstream_calls.append((scope["method"], scope["path"], request_headers))
+    path = scope["path"]
+
+    status = 200
+    headers = [(b"content-type", b"text/plain")]
+    body = f"call {len(upstream_calls)}".encode()
+    if path == "/max-age":
+        headers.append((b"cache-control", b"max-age=60"))
+    elif path == "/etag":
+        headers += [(b"cache-control", b"no-cache"), (b"etag", b'"v1"')]
+        if request_headers.get("if-none-match") == '"v1"':
+            status, body = 304, b""
+    elif path == "/vary":
+        headers += [(b"cache-control", b"max-age=60"), (b"vary", b"Accept-Language")]
+        body = request_headers.get("accept-language", "none").encode()
+    elif path == "/no-store":
+        headers.append((b"cache-control", b"no-store"))
+
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+@pytest.fixture
+def cached_client():
+    """A proxy client with a 1 MiB response cache, plus the upstream's host:port."""
+    upstream_calls.clear()
+    with run_server(cache_upstream) as upstream, TestClient(app) as client:
+        proxy.response_cache = ResponseCache(1024 * 1024)
+        try:
+            yield client, upstream.split("://", 1)[1]
+        finally:
+            proxy.response_cache = None
+
+
+def test_fresh_response_is_served_from_cache(cached_client):
+    """A response with max-age is fetched once and then served as a HIT."""
+    client, target = cached_client
+    first = client.get(f"/proxy/{target}/max-age")
+    second = client.get(f"/proxy/{target}/max-age")
+
+    assert first.headers["x-cache"] == "MISS"
+    assert second.headers["x-cache"] == "HIT"
+    assert second.text == first.text
+    assert "age" in second.headers
+    assert len(upstream_calls) == 1
+    assert proxy.response_cache.stats()["hits"] == 1
+
+
+def test_stale_response_is_revalidated_with_etag(cached_client):
+    """A no-cache response is revalidated with If-None-Match and refreshed on 304."""
+    client, target = cached_client
+    first = client.get(f"/proxy/{target}/etag")
+    second = client.get(f"/proxy/{target}/etag")
+
+    assert second.status_code == 200
+    assert second.headers["x-cache"] == "REVALIDATED"
+    assert second.text == first.text
+    assert upstream_calls[1][2]["if-none-match"] == '"v1"'
+    assert proxy.response_cache.stats()["revalidated"] == 1
+
+    # The client's own validator is answered by the proxy
+    third = client.get(f"/proxy/{target}/etag", headers={"If-None-Match": '"v1"'})
+    assert third.status_code == 304
+
+
+def test_vary_headers_are_part_of_the_key(cached_client):
+    """Each value of a Vary'd request header gets its own entry."""
+    client, target = cached_client
+    for language in ["en", "de", "en", "de"]:
+        response = client.get(f"/proxy/{target}/vary", headers={"Accept-Language": language})
+        assert response.text == language
+
+    assert len(upstream_calls) == 2
+
+
+def test_no_store_and_unsafe_methods_bypass_cache(cached_client):
+    """no-store responses are never stored, and a POST invalidates the URL."""
+    client, target = cached_client
+    client.get(f"/proxy/{target}/no-store")
+    client.get(f"/proxy/{target}/no-store")
+    assert len(upstream_calls) == 2
+
+    client.get(f"/proxy/{target}/max-age")
+    client.post(f"/proxy/{target}/max-age", content=b"update")
+    response = client.get(f"/proxy/{target}/max-age")
+    assert response.headers["x-cache"] == "MISS"
+    assert len(upstream_calls) == 5
+
+
+def test_lru_eviction_respects_byte_budget():
+    """Least recently used entries are evicted once the byte budget is exceeded."""
+    cache = ResponseCache(max_bytes=3000)
+    headers = {"cache-control": "max-age=60"}
+    for name in ["a", "b"]:
+        cache.store(f"http://h:80/{name}", {}, 200, headers, b"x" * 1000, 0.0, 0.0)
+    # Touch "a" so that "b" is the least recently used entry
+    assert cache.lookup("http://h:80/a", {}) is not None
+    cache.store("http://h:80/c", {}, 200, headers, b"x" * 1000, 0.0, 0.0)
+
+    assert cache.lookup("http://h:80/b", {}) is None
+    assert cache.lookup("http://h:80/a", {}) is not None
+    assert cache.current_bytes <= 3000
+    assert cache.evictions == 1
+
+
+def test_fill_stores_only_complete_bodies():
+    """Streamed bodies are stored after the last chunk, unless they outgrow the entry limit."""
+    cache = ResponseCache(max_bytes=10000, max_entry_bytes=2000)
+    headers = {"cache-control": "max-age=60"}
+
+    async def chunks(count):
+        for _ in range(count):
+            yield b"x" * 500
+
+    async def drain(url, count):
+        return b"".join([c async for c in cache.fill(chunks(count), url, {}, 200, headers, 0.0, 0.0)])
+
+    assert len(asyncio.run(drain("http://h:80/small", 2))) == 1000
+    assert len(asyncio.run(drain("http://h:80/large", 10))) == 5000
+    assert cache.lookup("http://h:80/small", {}).body == b"x" * 1000
+    assert cache.lookup("http://h:80/large", {}) is None
+
+
+def test_storability_rules():
+    """Shared-cache storability follows RFC 9111 section 3."""
+    cache = ResponseCache(max_bytes=10000)
+    assert cache.is_storable(200, {"Cache-Control": "max-age=60"}, {})
+    assert cache.is_storable(200, {"ETag": '"v1"'}, {})
+    assert not cache.is_storable(200, {}, {})
+    assert not cache.is_storable(200, {"Cache-Control": "private, max-age=60"}, {})
+    assert not cache.is_storable(200, {"Cache-Control": "max-age=60"}, {"cache-control": "no-store"})
+    assert not cache.is_storable(200, {"Cache-Control": "max-age=60", "Vary": "*"}, {})
+    assert not cache.is_storable(500, {"Cache-Control": "max-age=60"}, {})
+    assert not cache.is_storable(200, {"Cache-Control": "max-age=60"}, {"authorization": "Bearer x"})
+    assert cache.is_storable(200, {"Cache-Control": "s-maxage=60"}, {"authorization": "Bearer x"})
+
+
+def test_freshness_lifetime_precedence():
+    """s-maxage beats max-age beats Expires beats the Last-Modified heuristic."""
+    date = 1_000_000.0
+    cc = parse_cache_control("max-age=10, s-maxage=20")
+    assert freshness_lifetime(200, {}, cc, date) == 20
+    assert freshness_lifetime(200, {}, parse_cache_control("max-age=10"), date) == 10
+
+    expires = {"expires": formatdate(date + 30, usegmt=True)}
+    assert freshness_lifetime(200, expires, {}, date) == 30
+    assert freshness_lifetime(200, {"expires": "invalid"}, {}, date) == 0
+
+    last_modified = {"last-modified": formatdate(date - 1000, usegmt=True)}
+    assert freshness_lifetime(200, last_modified, {}, date) == 100
+    assert freshness_lifetime(500, last_modified, {}, date) == 0
@@ -0,0 +1,131 @@
+"""Tests for per-origin circuit breakers and outlier ejection."""
+
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.balancer import Member, UpstreamGroup
+from httpkit.tools.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreakers, CircuitOpen
+from tests.servers import closed_port, keep_proxy_state
+
+
+def expire(breaker):
+    breaker.open_until = time.monotonic() - 1
+
+
+def test_consecutive_failures_open_the_circuit_and_probes_close_it():
+    transitions = []
+    breakers = CircuitBreakers(failure_threshold=3, half_open_probes=2, open_seconds=30,
+                               on_transition=lambda origin, state, until: transitions.append(state))
+    breaker = breakers.get("http://a:80")
+
+    for failed in (True, True, False, True, True):
+        assert breaker.admit() is False
+        breaker.record(0.01, failed)
+    assert breaker.state == CLOSED
+    breaker.record(0.01, True)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpen) as excinfo:
+        breaker.admit()
+    assert excinfo.value.retry_after == 30
+    assert breakers.rejected == 1
+
+    # Once the open period is over, only half_open_probes requests go through
+    expire(breaker)
+    assert breaker.admit() and breaker.admit()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.admit()
+    breaker.record(0.01, False)
+    breaker.record(0.01, False)
+    assert breaker.state == CLOSED
+    assert transitions == [OPEN, HALF_OPEN, CLOSED]
+
+
+def test_failed_probe_reopens_for_longer():
+    breakers = CircuitBreakers(failure_threshold=1, open_seconds=1, max_open_seconds=3)
+    breaker = breakers.get("http://a:80")
+    breaker.record(0.01, True)
+
+    durations = []
+    for _ in range(3):
+        expire(breaker)
+        assert breaker.admit()
+        breaker.record(0.01, True)
+        durations.append(round(breaker.open_until - time.monotonic()))
+    assert breaker.state == OPEN
+    assert durations == [2, 3, 3]
+
+    # A cancelled probe gives its place back
+    expire(breaker)
+    assert breaker.admit()
+    breaker.release_probe()
+    assert breaker.probes == 0
+
+
+def test_error_and_slow_call_rates_over_the_window():
+    breakers = CircuitBreakers(failure_threshold=100, error_rate=0.5, window=10, min_requests=10)
+    breaker = breakers.get("http://a:80")
+    for i in range(9):
+        breaker.record(0.01, i % 2 == 0)
+    assert breaker.state == CLOSED
+    breaker.record(0.01, True)
+    assert breaker.state == OPEN
+
+    # Old outcomes slide out of the window
+    breaker = breakers.get("http://b:80")
+    for _ in range(4):
+        breaker.record(0.01, True)
+        breaker.record(0.01, False)
+    for _ in range(10):
+        breaker.record(0.01, False)
+    assert breaker.failures == 0 and breaker.state == CLOSED
+
+    breakers = CircuitBreakers(slow_call_seconds=0.5, slow_call_rate=0.8, window=5, min_requests=5)
+    breaker = breakers.get("http://c:80")
+    for latency in (1.0, 1.0, 0.1, 1.0, 1.0):
+        breaker.record(latency, False)
+    assert breaker.state == OPEN
+
+
+def test_ejected_members_rejoin_their_group_when_the_ejection_expires():
+    members = [Member("http://m0:80"), Member("http://m1:80")]
+    group = UpstreamGroup("g", members)
+    members[0].ejected_until = time.monotonic() + 0.05
+    group.update_healthy()
+    assert {group.select().origin for _ in range(4)} == {"http://m1:80"}
+    assert group.stats()["members"]["http://m0:80"]["ejected"]
+
+    time.sleep(0.06)
+    assert {group.select().origin for _ in range(4)} == {"http://m0:80", "http://m1:80"}
+
+
+def test_open_circuit_fails_fast_through_proxy(monkeypatch):
+    monkeypatch.setenv("HTTPKIT_CIRCUIT_BREAKER", "1")
+    monkeypatch.setenv("HTTPKIT_BREAKER_FAILURE_THRESHOLD", "2")
+    monkeypatch.setenv("HTTPKIT_BREAKER_OPEN_SECONDS", "30")
+    keep_proxy_state(monkeypatch)
+
+    port = closed_port()
+    with TestClient(proxy.app) as client:
+        assert client.get(f"/proxy/127.0.0.1:{port}/").status_code == 502
+        assert client.get(f"/proxy/127.0.0.1:{port}/").status_code == 502
+
+        response = client.get(f"/proxy/127.0.0.1:{port}/")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "30"
+        assert "circuit open" in response.json()["detail"]
+
+        origin = f"http://127.0.0.1:{port}"
+        breakers = client.get("/").json()["circuit_breakers"]
+        assert breakers["open"] == 1 and breakers["rejected"] == 1
+        assert breakers["origins"][origin]["state"] == OPEN
+        assert client.get("/upstreams").json()["origins"][origin]["circuit"] == OPEN
+
+        metrics = client.get("/metrics").text
+        assert 'httpkit_circuit_breakers{state="open"} 1' in metrics
+        assert f'httpkit_circuit_breaker_transitions_total{{upstream="{origin}",state="open"}} 1' in metrics
+        assert "httpkit_circuit_breaker_rejected_total 1" in metrics
@@ -0,0 +1,144 @@
+"""Tests for single-flight request coalescing."""
+
+import asyncio
+from contextlib import AsyncExitStack
+
+import httpx
+import pytest
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.coalesce import RequestCoalescer
+from httpkit.tools.proxy import app
+from tests.servers import run_server
+
+BODY_CHUNK = b"z" * 65536
+upstream_calls = []
+
+
+async def slow_upstream(scope, receive, send):
+    """ASGI upstream that takes a while to answer and then streams a 1 MiB body."""
+    if scope["type"] != "http":
+        return
+    upstream_calls.append(dict(scope["headers"]))
+    await asyncio.sleep(0.3)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    for _ in range(16):
+        await send({"type": "http.response.body", "body": BODY_CHUNK, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+@pytest.fixture
+def coalescing_proxy():
+    """A live proxy with coalescing enabled, plus the base URL of the slow upstream."""
+    upstream_calls.clear()
+    with run_server(slow_upstream) as upstream, run_server(app) as proxy_base:
+        proxy.request_coalescer = RequestCoalescer()
+        try:
+            yield proxy_base, upstream.split("://", 1)[1]
+        finally:
+            proxy.request_coalescer = None
+
+
+def fetch_concurrently(urls_and_headers):
+    async def fetch_all():
+        async with httpx.AsyncClient(timeout=30) as client:
+            return await asyncio.gather(*(client.get(url, headers=headers) for url, headers in urls_and_headers))
+    return asyncio.run(fetch_all())
+
+
+def test_identical_gets_share_one_upstream_request(coalescing_proxy):
+    """Concurrent identical GETs reach the upstream once and all get the full body."""
+    proxy_base, target = coalescing_proxy
+    responses = fetch_concurrently([(f"{proxy_base}/proxy/{target}/popular", {})] * 20)
+
+    assert len(upstream_calls) == 1
+    for response in responses:
+        assert response.status_code == 200
+        assert response.content == BODY_CHUNK * 16
+    assert proxy.request_coalescer.stats()["requests_coalesced"] == 19
+
+
+def test_requests_differing_in_key_headers_are_not_coalesced(coalescing_proxy):
+    """Requests with different credentials never share a response."""
+    proxy_base, target = coalescing_proxy
+    url = f"{proxy_base}/proxy/{target}/private"
+    fetch_concurrently([
+        (url, {"Authorization": "Bearer alice"}),
+        (url, {"Authorization": "Bearer bob"}),
+    ])
+
+    assert len(upstream_calls) == 2
+
+
+class FakeUpstream:
+    """Stand-in for a streamed httpx response."""
+
+    def __init__(self, chunks, fail_after=None):
+        self.status_code = 200
+        self.headers = httpx.Headers({"content-type": "text/plain"})
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.closed = False
+
+    async def aiter_bytes(self):
+        for index, chunk in enumerate(self.chunks):
+            if index == self.fail_after:
+                raise httpx.ReadError("upstream went away")
+            await asyncio.sleep(0)
+            yield chunk
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_leaving_subscriber_does_not_stall_the_flight():
+    """A subscriber that disconnects mid-body frees the flight for the others."""
+    upstream = FakeUpstream([bytes([i]) for i in range(50)])
+
+    async def opener():
+        stack = AsyncExitStack()
+        stack.push_async_callback(upstream.aclose)
+        return upstream, stack
+
+    async def scenario():
+        coalescer = RequestCoalescer(buffer_chunks=2)
+        key = coalescer.make_key("GET", "http://h:80/x", {})
+        (leader, leader_stack), (follower, follower_stack) = await asyncio.gather(
+            coalescer.open(key, opener), coalescer.open(key, opener)
+        )
+        assert follower.coalesced and not leader.coalesced
+
+        # The follower reads a single chunk and leaves without draining its queue
+        follower_chunks = follower.aiter_bytes()
+        await follower_chunks.__anext__()
+        await follower_stack.aclose()
+
+        body = b"".join([chunk async for chunk in leader.aiter_bytes()])
+        await leader_stack.aclose()
+        return body
+
+    assert asyncio.run(scenario()) == bytes(range(50))
+    assert upstream.closed
+
+
+def test_upstream_errors_reach_every_subscriber():
+    """A failure while streaming is raised in every subscriber."""
+    upstream = FakeUpstream([b"a", b"b", b"c"], fail_after=1)
+
+    async def opener():
+        return upstream, AsyncExitStack()
+
+    async def consume(coalescer, key):
+        subscription, stack = await coalescer.open(key, opener)
+        async with stack:
+            with pytest.raises(httpx.ReadError):
+                async for _ in subscription.aiter_bytes():
+                    pass
+
+    async def scenario():
+        coalescer = RequestCoalescer()
+        key = coalescer.make_key("GET", "http://h:80/x", {})
+        await asyncio.gather(consume(coalescer, key), consume(coalescer, key))
+        return coalescer.stats()
+
+    assert asyncio.run(scenario())["flights_started"] == 1
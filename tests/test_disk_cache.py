@@ -0,0 +1,169 @@
+"""Tests for the on-disk response cache tier."""
+
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.cache import ResponseCache
+from httpkit.tools.diskcache import CachedFileResponse, DiskCache, RangeNotSatisfiable, parse_range
+from tests.servers import keep_proxy_state, run_server
+
+ARTIFACT = bytes(range(256)) * 4096
+upstream_calls = []
+
+
+async def artifact_upstream(scope, receive, send):
+    """Serve a 1 MiB cacheable artifact at /artifact and a small cacheable body elsewhere."""
+    if scope["type"] != "http":
+        return
+    upstream_calls.append(scope["path"])
+    body = ARTIFACT if scope["path"] == "/artifact" else b"small"
+    await send({"type": "http.response.start", "status": 200, "headers": [
+        (b"content-type", b"application/octet-stream"),
+        (b"content-length", str(len(body)).encode()),
+        (b"cache-control", b"max-age=60"),
+        (b"etag", b'"v1"'),
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def fill(cache, url, body, chunk_size=1000):
+    async def chunks():
+        for position in range(0, len(body), chunk_size):
+            yield body[position:position + chunk_size]
+
+    async def drain():
+        return b"".join([c async for c in cache.fill(chunks(), url, {}, 200, {"cache-control": "max-age=60"}, 0.0, 0.0)])
+
+    return asyncio.run(drain())
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=990-2000", 1000) == (990, 999)
+    # Ignored: other units, several ranges and malformed values
+    assert parse_range("items=0-1", 1000) is None
+    assert parse_range("bytes=0-1,5-6", 1000) is None
+    assert parse_range("bytes=5-1", 1000) is None
+    assert parse_range("bytes=x-1", 1000) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=1000-", 1000)
+
+
+def test_bodies_are_content_addressed_and_evicted_with_their_files(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=25000)
+    try:
+        assert fill(cache, "http://h:80/a", b"x" * 10000) == b"x" * 10000
+        fill(cache, "http://h:80/b", b"x" * 10000)
+        a, b = cache.lookup("http://h:80/a", {}), cache.lookup("http://h:80/b", {})
+        # Identical bodies share one file
+        assert a.digest == b.digest and cache.stats()["files"] == 1
+        with open(cache.object_path(a.digest), "rb") as f:
+            assert f.read() == b"x" * 10000
+
+        fill(cache, "http://h:80/c", b"y" * 10000)
+        assert cache.lookup("http://h:80/a", {}) is None and cache.stats()["evictions"] == 1
+        # The shared file stays until its last entry goes
+        assert os.path.exists(cache.object_path(b.digest))
+        fill(cache, "http://h:80/d", b"z" * 10000)
+        assert not os.path.exists(cache.object_path(b.digest))
+        assert os.listdir(os.path.join(str(tmp_path), "tmp")) == []
+    finally:
+        cache.close()
+
+
+def test_index_survives_restarts(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1000000)
+    fill(cache, "http://h:80/a", b"a" * 5000)
+    fill(cache, "http://h:80/b", b"b" * 5000)
+    fill(cache, "http://h:80/c", b"c" * 5000)
+    cache.invalidate("http://h:80/c")
+    cache.lookup("http://h:80/a", {})
+    gone = cache.lookup("http://h:80/b", {}).digest
+    # Written, but the process died before its entry was recorded
+    os.makedirs(os.path.join(str(tmp_path), "objects", "or"), exist_ok=True)
+    with open(os.path.join(str(tmp_path), "objects", "or", "orphan"), "wb"):
+        pass
+    cache.journal.close()
+    cache.journal = None
+    os.close(cache.lock_fd)
+
+    # The journal is replayed as written, without the clean shutdown's rewrite
+    reopened = DiskCache(str(tmp_path), max_bytes=1000000)
+    try:
+        assert [key[0] for key in reopened.entries] == ["http://h:80/a", "http://h:80/b"]
+        assert reopened.lookup("http://h:80/c", {}) is None
+        assert not os.path.exists(os.path.join(str(tmp_path), "objects", "or", "orphan"))
+        os.remove(reopened.object_path(gone))
+        assert reopened.lookup("http://h:80/b", {}) is None
+        assert reopened.stats()["entries"] == 1 and reopened.current_bytes == reopened.entries[
+            ("http://h:80/a", ())
+        ].size
+    finally:
+        reopened.close()
+
+    with open(os.path.join(str(tmp_path), "index.jsonl")) as f:
+        assert len(f.readlines()) == 1
+
+
+def test_file_responses_use_zero_copy_send_when_offered(tmp_path):
+    path = tmp_path / "body"
+    path.write_bytes(b"0123456789")
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def serve(extensions):
+        messages.clear()
+        response = CachedFileResponse(os.open(path, os.O_RDONLY), 2, 5, 206, {"content-length": "10"})
+        await response({"type": "http", "method": "GET", "extensions": extensions}, None, send)
+
+    asyncio.run(serve({"http.response.zerocopysend": {}}))
+    assert (b"content-length", b"5") in messages[0]["headers"]
+    assert [(m["type"], m["offset"], m["count"]) for m in messages[1:]] == [("http.response.zerocopysend", 2, 5)]
+
+    asyncio.run(serve({}))
+    assert b"".join(m["body"] for m in messages[1:]) == b"23456"
+    # Without the extension, chunks are views of the mapped file rather than copies
+    assert isinstance(messages[1]["body"], memoryview)
+
+
+def test_proxy_serves_large_responses_and_ranges_from_disk(tmp_path, monkeypatch):
+    upstream_calls.clear()
+    keep_proxy_state(monkeypatch)
+    monkeypatch.setenv("HTTPKIT_DISK_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("HTTPKIT_DISK_CACHE_MIN_BYTES", "100000")
+
+    with run_server(artifact_upstream) as upstream, TestClient(proxy.app) as client:
+        proxy.response_cache = ResponseCache(1024 * 1024)
+        target = upstream.split("://", 1)[1]
+        # Ranges are forwarded until the disk cache has the artifact
+        assert "x-cache" not in client.get(f"/proxy/{target}/artifact", headers={"Range": "bytes=0-9"}).headers
+        first = client.get(f"/proxy/{target}/artifact")
+        assert first.headers["x-cache"] == "MISS" and first.content == ARTIFACT
+
+        hit = client.get(f"/proxy/{target}/artifact")
+        assert hit.headers["x-cache"] == "HIT" and hit.content == ARTIFACT
+        assert hit.headers["content-length"] == str(len(ARTIFACT)) and hit.headers["accept-ranges"] == "bytes"
+
+        partial = client.get(f"/proxy/{target}/artifact", headers={"Range": "bytes=1000-1999"})
+        assert partial.status_code == 206 and partial.content == ARTIFACT[1000:2000]
+        assert partial.headers["content-range"] == f"bytes 1000-1999/{len(ARTIFACT)}"
+        assert client.get(f"/proxy/{target}/artifact", headers={"Range": "bytes=-10", "If-Range": '"v1"'}).content == ARTIFACT[-10:]
+        assert client.get(f"/proxy/{target}/artifact", headers={"Range": "bytes=0-9", "If-Range": '"v0"'}).status_code == 200
+        assert client.get(f"/proxy/{target}/artifact", headers={"Range": f"bytes={len(ARTIFACT)}-"}).status_code == 416
+
+        # Small responses stay in memory
+        client.get(f"/proxy/{target}/small")
+        assert client.get(f"/proxy/{target}/small").headers["x-cache"] == "HIT"
+
+        stats = client.get("/").json()
+        assert stats["disk_cache"]["entries"] == 1 and stats["disk_cache"]["hits"] == 5
+        assert stats["cache"]["entries"] == 1
+    assert upstream_calls == ["/artifact", "/artifact", "/small"]
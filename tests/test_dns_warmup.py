@@ -0,0 +1,136 @@
+"""Tests for the DNS cache and connection pre-warming."""
+
+import asyncio
+import socket
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.dns import DNSCache, install_dns_cache
+from httpkit.tools.limits import pool_stats
+from httpkit.tools.warmup import ConnectionWarmer
+from tests.servers import keep_proxy_state, run_server
+
+
+async def hello(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"hello"})
+
+
+class StubResolver:
+    """Resolve names from a table, counting lookups; unknown names fail."""
+
+    def __init__(self, table):
+        self.table = table
+        self.calls = []
+
+    async def __call__(self, host, port):
+        self.calls.append(host)
+        await asyncio.sleep(0.01)
+        if host not in self.table:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return list(self.table[host])
+
+
+def test_resolutions_are_cached_and_shared():
+    async def scenario():
+        resolver = StubResolver({"api.test": ["10.0.0.1"]})
+        cache = DNSCache(ttl=60, negative_ttl=60, resolver=resolver)
+        # Concurrent lookups of one host share a single resolution
+        results = await asyncio.gather(*(cache.resolve("api.test", 80) for _ in range(5)))
+        assert results == [["10.0.0.1"]] * 5
+        assert await cache.resolve("api.test", 443) == ["10.0.0.1"]
+
+        # Failures are remembered too
+        for _ in range(3):
+            with pytest.raises(socket.gaierror):
+                await cache.resolve("missing.test", 80)
+
+        cache.entries["api.test"].expires = time.monotonic() - 1
+        await cache.resolve("api.test", 80)
+        return resolver.calls, cache.stats()
+
+    calls, stats = asyncio.run(scenario())
+    assert calls == ["api.test", "missing.test", "api.test"]
+    assert stats["negative_hits"] == 2 and stats["hits"] == 1
+
+
+def test_background_refresh_keeps_hosts_in_use_resolved():
+    async def scenario():
+        resolver = StubResolver({"busy.test": ["10.0.0.1"], "idle.test": ["10.0.0.2"]})
+        cache = DNSCache(ttl=1, resolver=resolver)
+        await cache.resolve("busy.test", 80)
+        await cache.resolve("idle.test", 80)
+        cache.entries["idle.test"].used = False
+        cache.entries["idle.test"].expires = time.monotonic() - 1
+
+        # A used host about to expire is re-resolved ahead of time; an expired idle one is dropped
+        resolver.table["busy.test"] = ["10.0.0.3"]
+        await cache.refresh_due(within=5)
+        assert "idle.test" not in cache.entries
+        assert await cache.resolve("busy.test", 80) == ["10.0.0.3"]
+
+        # A failed refresh keeps the last good addresses
+        del resolver.table["busy.test"]
+        await cache.refresh_due(within=5)
+        assert await cache.resolve("busy.test", 80) == ["10.0.0.3"]
+        return resolver.calls.count("busy.test"), cache.stats()
+
+    lookups, stats = asyncio.run(scenario())
+    assert lookups == 3
+    assert stats["refreshes"] == 1 and stats["refresh_failures"] == 1
+
+
+def test_connections_use_cached_addresses_and_fall_back():
+    async def scenario(port):
+        # Nothing listens on 127.0.0.2, so the second address is used
+        resolver = StubResolver({"upstream.test": ["127.0.0.2", "127.0.0.1"]})
+        cache = DNSCache(resolver=resolver)
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_keepalive_connections=0))
+        assert install_dns_cache(transport, cache)
+        async with httpx.AsyncClient(transport=transport) as client:
+            bodies = [(await client.get(f"http://upstream.test:{port}/")).text for _ in range(3)]
+            with pytest.raises(httpx.ConnectError):
+                await client.get(f"http://missing.test:{port}/")
+        return bodies, resolver.calls
+
+    with run_server(hello) as upstream_url:
+        bodies, calls = asyncio.run(scenario(int(upstream_url.rsplit(":", 1)[1])))
+    assert bodies == ["hello"] * 3
+    # Three connections, one lookup
+    assert calls == ["upstream.test", "missing.test"]
+
+
+def test_warmer_opens_and_keeps_idle_connections():
+    async def scenario(origin):
+        async with httpx.AsyncClient() as client:
+            warmer = ConnectionWarmer({origin: 3}, lambda _: client)
+            await warmer.warm_all()
+            first = pool_stats(client)[origin]
+            await warmer.warm_all()
+            return first, pool_stats(client)[origin], warmer.stats()
+
+    with run_server(hello) as upstream_url:
+        first, second, stats = asyncio.run(scenario(upstream_url))
+    assert first == {"active": 0, "idle": 3}
+    # Another round reuses the idle connections instead of adding more
+    assert second == {"active": 0, "idle": 3}
+    assert stats["requests"] == 6 and stats["failures"] == 0
+
+
+def test_proxy_warms_configured_origins_at_startup(monkeypatch):
+    with run_server(hello) as upstream_url:
+        monkeypatch.setenv("HTTPKIT_WARM_ORIGINS", f"{upstream_url}=2")
+        keep_proxy_state(monkeypatch)
+
+        with TestClient(proxy.app) as client:
+            deadline = time.monotonic() + 5
+            while client.get("/").json()["warmup"]["origins"][upstream_url]["idle"] < 2:
+                assert time.monotonic() < deadline
+                time.sleep(0.02)
+            assert client.get("/upstreams").json()["origins"][upstream_url]["connections"]["idle"] == 2
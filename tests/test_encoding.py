@@ -0,0 +1,134 @@
+"""Tests for content-encoding passthrough and response compression."""
+
+import asyncio
+import gzip
+import zlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools import asgi_proxy
+from httpkit.tools.encoding import choose_encoding, compress_chunks, is_compressible, parse_accept_encoding
+from tests.servers import keep_proxy_state, run_server
+
+
+TEXT = b"proxied text body " * 500
+
+
+def encoding_upstream(seen_accept_encoding: list):
+    """Serve TEXT gzipped on /gzip, plain on /text and /no-transform and as an event stream on /events."""
+    compressed = gzip.compress(TEXT)
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        headers = dict(scope["headers"])
+        seen_accept_encoding.append(headers.get(b"accept-encoding"))
+        if scope["path"] == "/gzip":
+            response_headers = [
+                (b"content-type", b"text/plain"),
+                (b"content-encoding", b"gzip"),
+                (b"content-length", str(len(compressed)).encode()),
+            ]
+            body = compressed
+        elif scope["path"] == "/events":
+            response_headers = [(b"content-type", b"text/event-stream")]
+            body = TEXT
+        else:
+            response_headers = [(b"content-type", b"text/plain"), (b"etag", b'"v1"')]
+            if scope["path"] == "/no-transform":
+                response_headers.append((b"cache-control", b"public, no-transform"))
+            body = b"tiny" if scope["path"] == "/tiny" else TEXT
+            response_headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": response_headers})
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+def test_accept_encoding_negotiation():
+    assert parse_accept_encoding("gzip;q=0.5, br, *;q=0") == {"gzip": 0.5, "br": 1.0, "*": 0.0}
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("br") is None
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding("*") is not None
+    assert choose_encoding(None) is None
+
+    assert is_compressible("application/json; charset=utf-8")
+    assert is_compressible("application/problem+json")
+    assert not is_compressible("text/event-stream")
+    assert not is_compressible("image/png")
+
+
+def test_compressed_chunks_decode_to_the_original_body():
+    async def chunks():
+        for start in range(0, len(TEXT), 1000):
+            yield TEXT[start:start + 1000]
+
+    async def compress():
+        return [chunk async for chunk in compress_chunks(chunks(), "gzip")]
+
+    pieces = asyncio.run(compress())
+    assert gzip.decompress(b"".join(pieces)) == TEXT
+    # Every upstream chunk is flushed, so a prefix already decodes on its own
+    assert zlib.decompressobj(31).decompress(pieces[0]) == TEXT[:1000]
+
+
+@pytest.mark.parametrize("app", [proxy.app, asgi_proxy.app])
+def test_passthrough_forwards_encoded_bytes(app, monkeypatch):
+    monkeypatch.setenv("HTTPKIT_ENCODING_PASSTHROUGH", "1")
+    keep_proxy_state(monkeypatch)
+
+    seen = []
+    with run_server(encoding_upstream(seen)) as upstream_url, TestClient(app) as client:
+        target = upstream_url.split("://", 1)[1]
+        response = client.get(f"/proxy/{target}/gzip", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["content-length"] == str(len(gzip.compress(TEXT)))
+        # The test client decodes gzip itself; the bytes on the wire are the upstream's
+        assert response.content == TEXT
+        assert response.num_bytes_downloaded == len(gzip.compress(TEXT))
+
+        # Without an Accept-Encoding of the client's, the proxy asks for identity
+        del client.headers["accept-encoding"]
+        client.get(f"/proxy/{target}/text")
+    assert seen == [b"gzip", b"identity"]
+
+
+def test_default_mode_still_decodes(monkeypatch):
+    seen = []
+    with run_server(encoding_upstream(seen)) as upstream_url, TestClient(proxy.app) as client:
+        target = upstream_url.split("://", 1)[1]
+        response = client.get(f"/proxy/{target}/gzip", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.content == TEXT
+
+
+def test_uncompressed_responses_are_compressed_for_accepting_clients(monkeypatch):
+    monkeypatch.setenv("HTTPKIT_ENCODING_PASSTHROUGH", "1")
+    monkeypatch.setenv("HTTPKIT_COMPRESS_RESPONSES", "1")
+    keep_proxy_state(monkeypatch)
+
+    seen = []
+    with run_server(encoding_upstream(seen)) as upstream_url, TestClient(proxy.app) as client:
+        target = upstream_url.split("://", 1)[1]
+        response = client.get(f"/proxy/{target}/text", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["etag"] == 'W/"v1"'
+        assert "content-length" not in response.headers
+        assert response.content == TEXT
+        assert response.num_bytes_downloaded < len(TEXT) // 10
+
+        # Too small, event streams, clients without gzip and already encoded bodies are left alone
+        for path, accept in [("/tiny", "gzip"), ("/events", "gzip"), ("/text", "identity"), ("/gzip", "gzip")]:
+            response = client.get(f"/proxy/{target}{path}", headers={"Accept-Encoding": accept})
+            assert response.headers.get("content-encoding") == ("gzip" if path == "/gzip" else None)
+
+        # The origin forbids changing the content, so it stays byte-identical
+        response = client.get(f"/proxy/{target}/no-transform", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+        assert response.headers["content-length"] == str(len(TEXT))
+        assert response.headers["etag"] == '"v1"'
+        assert response.content == TEXT
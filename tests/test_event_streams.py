@@ -0,0 +1,137 @@
+"""Tests for relaying long-lived event streams (SSE and NDJSON token streams)."""
+
+import asyncio
+import time
+
+import httpx
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.streaming import HEARTBEAT, StreamTracker, is_stream, relay_events
+from tests.servers import keep_proxy_state, run_server
+
+
+def event_upstream(gap: float, events: int = 3, stall: float = 0.0):
+    """Serve ``events`` SSE events ``gap`` seconds apart on /events, then stall for ``stall`` seconds."""
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        if scope["path"] != "/events":
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"short"})
+            return
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+        })
+        for i in range(events):
+            await send({"type": "http.response.body", "body": b"data: token %d\n\n" % i, "more_body": True})
+            await asyncio.sleep(gap)
+        await asyncio.sleep(stall)
+        await send({"type": "http.response.body", "body": b""})
+    return app
+
+
+def isolate_streams(monkeypatch):
+    keep_proxy_state(monkeypatch)
+    monkeypatch.setattr(proxy, "stream_tracker", StreamTracker())
+
+
+def read_events(url: str):
+    """Return each chunk of a streamed response with the seconds it arrived after the request."""
+    start = time.monotonic()
+    arrivals = []
+    with httpx.stream("GET", url, timeout=10) as response:
+        for chunk in response.iter_raw():
+            arrivals.append((chunk, time.monotonic() - start))
+    return response, arrivals
+
+
+def test_stream_detection():
+    assert is_stream(httpx.Headers({"content-type": "text/event-stream; charset=utf-8"}), {"text/event-stream"})
+    assert not is_stream(httpx.Headers({"content-type": "application/json"}), {"text/event-stream"})
+    chunked = httpx.Headers({"content-type": "application/json", "transfer-encoding": "chunked"})
+    assert not is_stream(chunked, {"text/event-stream"})
+    assert is_stream(chunked, {"text/event-stream"}, chunked=True)
+
+
+def test_heartbeats_only_go_between_events():
+    async def upstream():
+        yield b"data: one\n\n"
+        await asyncio.sleep(0.15)
+        yield b"data: tw"
+        await asyncio.sleep(0.15)
+        yield b"o\n\n"
+
+    async def scenario():
+        tracker = StreamTracker()
+        firsts, gaps = [], []
+        chunks = [
+            chunk async for chunk in relay_events(
+                upstream(), tracker, time.monotonic(), 0.05, firsts.append, gaps.append
+            )
+        ]
+        return chunks, firsts, gaps, tracker
+
+    chunks, firsts, gaps, tracker = asyncio.run(scenario())
+    events = [chunk for chunk in chunks if chunk != HEARTBEAT]
+    assert events == [b"data: one\n\n", b"data: tw", b"o\n\n"]
+    # Heartbeats follow the first event but never split the second one
+    heartbeats_at = [i for i, chunk in enumerate(chunks) if chunk == HEARTBEAT]
+    assert heartbeats_at and all(0 < i < chunks.index(b"data: tw") for i in heartbeats_at)
+    assert tracker.heartbeats == len(heartbeats_at) and tracker.active == 0
+    assert len(firsts) == 1 and len(gaps) == 2 and min(gaps) >= 0.1
+
+
+def test_events_are_flushed_as_they_arrive_with_heartbeats(monkeypatch):
+    isolate_streams(monkeypatch)
+    monkeypatch.setenv("HTTPKIT_STREAM_HEARTBEAT_SECONDS", "0.1")
+    # Events are further apart than the request timeout; only the stream idle timeout applies
+    monkeypatch.setenv("HTTPKIT_TIMEOUT_SECONDS", "0.15")
+
+    with run_server(event_upstream(gap=0.3)) as upstream, run_server(proxy.app) as proxy_base:
+        url = f"{proxy_base}/proxy/{upstream.split('://', 1)[1]}/events"
+        response, arrivals = read_events(url)
+
+    assert response.status_code == 200
+    assert response.headers["x-accel-buffering"] == "no"
+    events = [(chunk, at) for chunk, at in arrivals if chunk != HEARTBEAT]
+    assert [chunk for chunk, _ in events] == [b"data: token %d\n\n" % i for i in range(3)]
+    # Each event arrives on its own, as soon as the upstream sent it
+    assert events[0][1] < 0.25
+    assert events[1][1] - events[0][1] >= 0.2
+    assert len(arrivals) > len(events)
+    assert proxy.stream_tracker.heartbeats >= 2
+
+
+def test_streams_do_not_hold_concurrency_slots(monkeypatch):
+    isolate_streams(monkeypatch)
+    monkeypatch.setenv("HTTPKIT_MAX_CONCURRENT_REQUESTS", "1")
+    monkeypatch.setenv("HTTPKIT_MAX_QUEUE_WAIT_SECONDS", "0.5")
+
+    with run_server(event_upstream(gap=0.5)) as upstream, run_server(proxy.app) as proxy_base:
+        target = upstream.split("://", 1)[1]
+        with httpx.stream("GET", f"{proxy_base}/proxy/{target}/events", timeout=10) as response:
+            chunks = response.iter_raw()
+            next(chunks)
+            assert proxy.request_limiter.active == 0
+            assert httpx.get(f"{proxy_base}/", timeout=10).json()["streams"]["active"] == 1
+            # The only slot is free for short requests while the stream is open
+            assert httpx.get(f"{proxy_base}/proxy/{target}/short", timeout=10).text == "short"
+
+        metrics = httpx.get(f"{proxy_base}/metrics", timeout=10).text
+    assert "httpkit_stream_first_event_seconds_count" in metrics
+    assert "httpkit_stream_event_gap_seconds_count" in metrics
+
+
+def test_idle_streams_are_ended(monkeypatch):
+    isolate_streams(monkeypatch)
+    monkeypatch.setenv("HTTPKIT_STREAM_IDLE_TIMEOUT_SECONDS", "0.3")
+    monkeypatch.setenv("HTTPKIT_STREAM_HEARTBEAT_SECONDS", "0")
+
+    with run_server(event_upstream(gap=0.0, events=1, stall=1.5)) as upstream, run_server(proxy.app) as proxy_base:
+        response, arrivals = read_events(f"{proxy_base}/proxy/{upstream.split('://', 1)[1]}/events")
+
+    assert [chunk for chunk, _ in arrivals] == [b"data: token 0\n\n"]
+    assert arrivals[-1][1] < 1.0
+    assert proxy.stream_tracker.idle_timeouts == 1
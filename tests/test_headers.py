@@ -0,0 +1,132 @@
+"""Tests for forwarding request and response headers as raw byte pairs."""
+
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools import asgi_proxy
+from httpkit.tools.cache import ResponseCache
+from tests.servers import run_server
+
+
+async def reflect(scope, receive, send):
+    """Answer with the request headers as JSON, plus repeated and hop-by-hop response headers."""
+    if scope["type"] != "http":
+        return
+    headers = [[name.decode("latin-1"), value.decode("latin-1")] for name, value in scope["headers"]]
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"set-cookie", b"a=1; Path=/"),
+            (b"set-cookie", b"b=2; Path=/"),
+            (b"connection", b"x-upstream-hop"),
+            (b"x-upstream-hop", b"secret"),
+            (b"x-upstream", b"kept"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": json.dumps(headers).encode()})
+
+
+async def linked(scope, receive, send):
+    """Answer with a cacheable response carrying repeated Link and WWW-Authenticate headers."""
+    if scope["type"] != "http":
+        return
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"cache-control", b"max-age=60"),
+            (b"link", b"</a.css>; rel=preload"),
+            (b"link", b"</b.js>; rel=preload"),
+            (b"www-authenticate", b'Basic realm="a"'),
+            (b"www-authenticate", b'Bearer realm="b"'),
+        ],
+    })
+    await send({"type": "http.response.body", "body": b"linked"})
+
+
+def test_filter_drops_hop_by_hop_and_connection_listed_headers():
+    raw = [
+        (b"host", b"example.com"),
+        (b"connection", b"keep-alive, X-Trace-Hop"),
+        (b"keep-alive", b"timeout=5"),
+        (b"x-trace-hop", b"1"),
+        (b"accept", b"text/html"),
+        (b"accept", b"application/json"),
+        (b"te", b"trailers"),
+    ]
+    assert proxy.filter_request_headers(raw) == [(b"accept", b"text/html"), (b"accept", b"application/json")]
+    # Values are forwarded as the very same bytes objects
+    assert proxy.filter_request_headers(raw)[0][1] is raw[4][1]
+    assert proxy.filter_request_headers([(b"accept", b"*/*")]) == [(b"accept", b"*/*")]
+
+
+def test_response_filter_lowercases_names_and_keeps_duplicates(monkeypatch):
+    monkeypatch.setattr(proxy, "ENCODING_PASSTHROUGH", False)
+    response = httpx.Response(200, headers=[
+        (b"Content-Type", b"text/plain"),
+        (b"Content-Length", b"5"),
+        (b"Server", b"upstream/1.0"),
+        (b"Set-Cookie", b"a=1"),
+        (b"Set-Cookie", b"b=2"),
+        (b"Connection", b"Keep-Alive, X-Hop"),
+        (b"Keep-Alive", b"timeout=5"),
+        (b"X-Hop", b"1"),
+    ])
+    assert proxy.filter_response_headers(response) == [
+        (b"content-type", b"text/plain"), (b"set-cookie", b"a=1"), (b"set-cookie", b"b=2"),
+    ]
+
+    monkeypatch.setattr(proxy, "ENCODING_PASSTHROUGH", True)
+    assert (b"content-length", b"5") in proxy.filter_response_headers(response)
+
+
+def test_proxy_forwards_repeated_headers_both_ways():
+    with run_server(reflect) as upstream:
+        with TestClient(proxy.app) as client:
+            target = upstream.split("://", 1)[1]
+            response = client.get(
+                f"/proxy/{target}/",
+                headers=[("Accept", "text/html"), ("Accept", "application/json"), ("Connection", "x-client-hop"),
+                         ("X-Client-Hop", "1"), ("X-Client", "kept")],
+            )
+
+    assert response.status_code == 200
+    forwarded = response.json()
+    assert [value for name, value in forwarded if name == "accept"] == ["text/html", "application/json"]
+    assert ["x-client", "kept"] in forwarded
+    # The Connection header upstream is httpx's own
+    assert not any(name == "x-client-hop" or value == "x-client-hop" for name, value in forwarded)
+
+    assert response.headers.get_list("set-cookie") == ["a=1; Path=/", "b=2; Path=/"]
+    assert response.cookies["a"] == "1" and response.cookies["b"] == "2"
+    assert response.headers["x-upstream"] == "kept" and "x-upstream-hop" not in response.headers
+
+
+def test_fast_path_forwards_repeated_set_cookie_headers():
+    with run_server(reflect) as upstream:
+        with TestClient(asgi_proxy.app) as client:
+            response = client.get(f"/proxy/{upstream.split('://', 1)[1]}/")
+
+    assert response.status_code == 200
+    assert response.headers.get_list("set-cookie") == ["a=1; Path=/", "b=2; Path=/"]
+
+
+def test_cache_hits_keep_repeated_headers():
+    with run_server(linked) as upstream, TestClient(proxy.app) as client:
+        proxy.response_cache = ResponseCache(1024 * 1024)
+        try:
+            target = upstream.split("://", 1)[1]
+            miss = client.get(f"/proxy/{target}/page")
+            hit = client.get(f"/proxy/{target}/page")
+        finally:
+            proxy.response_cache = None
+
+    assert miss.headers["x-cache"] == "MISS" and hit.headers["x-cache"] == "HIT"
+    for response in (miss, hit):
+        assert ", ".join(response.headers.get_list("link")) == "</a.css>; rel=preload, </b.js>; rel=preload"
+        assert ", ".join(response.headers.get_list("www-authenticate")) == 'Basic realm="a", Bearer realm="b"'
@@ -0,0 +1,132 @@
+"""Tests for per-origin concurrency limits and pools."""
+
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.config import parse_origin_values
+from httpkit.tools.limits import ConcurrencyLimiter, origin_of
+from httpkit.tools.proxy import app
+from tests.servers import keep_proxy_state, run_server
+
+
+async def ok_upstream(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def test_origin_of():
+    assert origin_of("https://api.example.com:443/v1/chat?x=1") == "https://api.example.com:443"
+    assert origin_of("http://[::1]:8080/") == "http://[::1]:8080"
+
+
+def test_parse_origin_values():
+    assert parse_origin_values("https://a.example:443=50, http://b.example:80/=5") == {
+        "https://a.example:443": 50,
+        "http://b.example:80": 5,
+    }
+
+
+def test_per_origin_limit_does_not_block_other_origins():
+    """A saturated origin queues its own requests while other origins proceed."""
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=4, origin_limit=2)
+        await limiter.acquire("http://slow:80")
+        await limiter.acquire("http://slow:80")
+
+        blocked = asyncio.ensure_future(limiter.acquire("http://slow:80"))
+        await asyncio.sleep(0)
+        assert not blocked.done()
+
+        await asyncio.wait_for(limiter.acquire("http://fast:80"), timeout=1)
+        stats = limiter.stats()
+        assert stats["origins"]["http://slow:80"] == {"limit": 2, "active": 2, "queued": 1}
+
+        limiter.release("http://slow:80")
+        await asyncio.wait_for(blocked, timeout=1)
+        assert limiter.active == 3
+
+    asyncio.run(scenario())
+
+
+def test_freed_slots_are_shared_round_robin():
+    """Waiters from different origins are served alternately, not in arrival order."""
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=1)
+        await limiter.acquire("http://busy:80")
+        order = []
+
+        async def request(origin):
+            await limiter.acquire(origin)
+            order.append(origin)
+            limiter.release(origin)
+
+        tasks = [asyncio.ensure_future(request("http://busy:80")) for _ in range(3)]
+        tasks.append(asyncio.ensure_future(request("http://quiet:80")))
+        await asyncio.sleep(0)
+
+        limiter.release("http://busy:80")
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order.index("http://quiet:80") <= 1
+
+
+def test_cancelled_waiter_gives_its_place_away():
+    """Cancelling a queued request removes it without leaking a slot."""
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=1)
+        await limiter.acquire("http://a:80")
+        waiter = asyncio.ensure_future(limiter.acquire("http://b:80"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+
+        limiter.release("http://a:80")
+        assert limiter.active == 0
+        assert limiter.origins == {}
+
+    asyncio.run(scenario())
+
+
+def test_origin_overrides_from_config_file(tmp_path, monkeypatch):
+    """Per-origin limits and dedicated pools can be configured in a JSON file."""
+    with run_server(ok_upstream) as upstream:
+        config_file = tmp_path / "httpkit.json"
+        config_file.write_text(json.dumps({
+            "origin_defaults": {"max_concurrent_requests": 10},
+            "origins": {
+                upstream: {"max_concurrent_requests": 3, "max_connections": 3, "max_keepalive_connections": 1},
+            },
+        }))
+        monkeypatch.setenv("HTTPKIT_CONFIG_FILE", str(config_file))
+        keep_proxy_state(monkeypatch)
+
+        with TestClient(app) as client:
+            assert upstream in proxy.origin_clients
+            response = client.get(f"/proxy/{upstream.split('://', 1)[1]}/")
+            assert response.status_code == 200
+
+            stats = client.get("/upstreams").json()
+            assert stats["limit"] == proxy.MAX_CONCURRENT_REQUESTS
+            # The origin is idle again, so only its pooled connection remains visible
+            assert stats["origins"][upstream]["connections"] == {"active": 0, "idle": 1}
+            assert proxy.request_limiter.state_for(upstream).limit == 3
+            assert proxy.request_limiter.origin_limit == 10
+
+
+def test_each_startup_reads_settings_from_the_defaults(monkeypatch):
+    keep_proxy_state(monkeypatch)
+    monkeypatch.setenv("HTTPKIT_ORIGIN_MAX_CONCURRENT_REQUESTS", "7")
+    with TestClient(app):
+        assert proxy.ORIGIN_MAX_CONCURRENT_REQUESTS == 7
+
+    # A later startup without the variable falls back to the default, not to 7
+    monkeypatch.delenv("HTTPKIT_ORIGIN_MAX_CONCURRENT_REQUESTS")
+    with TestClient(app):
+        assert proxy.ORIGIN_MAX_CONCURRENT_REQUESTS == 0
@@ -0,0 +1,138 @@
+"""Tests for bounded queueing, load shedding and the adaptive concurrency limit."""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.limits import AIMDLimit, ConcurrencyLimiter, Overloaded
+from tests.servers import keep_proxy_state, run_server
+
+
+UPSTREAM_DELAY = 0.2
+
+
+async def slow_upstream(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    await asyncio.sleep(UPSTREAM_DELAY)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def test_full_queue_rejects_immediately():
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, retry_after=3)
+        await limiter.acquire("http://a:80")
+        queued = asyncio.ensure_future(limiter.acquire("http://a:80"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(Overloaded) as excinfo:
+            await limiter.acquire("http://b:80")
+        assert excinfo.value.retry_after == 3
+        assert limiter.shed_queue_full == 1
+        # The rejected origin left nothing behind
+        assert "http://b:80" not in limiter.origins
+
+        limiter.release("http://a:80")
+        await asyncio.wait_for(queued, timeout=1)
+
+    asyncio.run(scenario())
+
+
+def test_queue_wait_deadline_sheds_request():
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=1, max_wait=0.05)
+        await limiter.acquire("http://a:80")
+
+        started = time.monotonic()
+        with pytest.raises(Overloaded):
+            await limiter.acquire("http://a:80")
+        assert time.monotonic() - started < 0.5
+        assert limiter.shed_timeout == 1
+        assert limiter.queued() == 0 and limiter.waiting == 0
+
+        limiter.release("http://a:80")
+        assert limiter.active == 0
+        assert limiter.origins == {}
+
+    asyncio.run(scenario())
+
+
+def test_aimd_backs_off_on_latency_and_recovers():
+    limit = AIMDLimit(initial=20, min_limit=2, max_limit=20)
+    # Establish a 10ms baseline while the limit is in use
+    for _ in range(10):
+        assert limit.update("http://a:80", 0.01, in_flight=20) == 20
+
+    # Latency inflation shrinks the limit, at most once per round trip
+    limit.update("http://a:80", 0.1, in_flight=20)
+    assert limit.limit == 18
+    limit.update("http://a:80", 0.1, in_flight=20)
+    assert limit.limit == 18
+
+    # Another origin's slower baseline is not mistaken for congestion
+    limit.update("http://b:80", 0.5, in_flight=20)
+    limit.update("http://b:80", 0.6, in_flight=20)
+    assert limit.limit == 18
+
+    # Healthy samples grow it back, but not past the maximum
+    for _ in range(200):
+        limit.update("http://a:80", 0.01, in_flight=20)
+    assert limit.limit == 20
+
+    # An idle limit is not grown
+    limit.estimate = 10.0
+    limit.update("http://a:80", 0.01, in_flight=1)
+    assert limit.limit == 10
+
+
+def test_failures_shrink_adaptive_limit_to_minimum():
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=8, adaptive=AIMDLimit(8, min_limit=2))
+        assert limiter.limit == 8
+        for _ in range(30):
+            limiter.adaptive.last_decrease = 0.0
+            limiter.observe("http://a:80", 0.01, failed=True)
+        assert limiter.limit == 2
+
+    asyncio.run(scenario())
+
+
+def test_simulated_overload_sheds_with_retry_after(monkeypatch):
+    """Excess load against a slow upstream gets fast 503s instead of unbounded queueing."""
+    monkeypatch.setenv("HTTPKIT_MAX_CONCURRENT_REQUESTS", "2")
+    monkeypatch.setenv("HTTPKIT_MAX_QUEUE_SIZE", "4")
+    monkeypatch.setenv("HTTPKIT_MAX_QUEUE_WAIT_SECONDS", "0.5")
+    monkeypatch.setenv("HTTPKIT_ADAPTIVE_CONCURRENCY", "1")
+    keep_proxy_state(monkeypatch)
+
+    async def load(base_url, target):
+        async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+            async def one():
+                started = time.monotonic()
+                response = await client.get(f"/proxy/{target}/")
+                return response, time.monotonic() - started
+
+            return await asyncio.gather(*(one() for _ in range(30)))
+
+    with run_server(slow_upstream) as upstream, run_server(proxy.app) as proxy_url:
+        results = asyncio.run(load(proxy_url, upstream.split("://", 1)[1]))
+        stats = httpx.get(f"{proxy_url}/upstreams").json()
+
+    ok = [elapsed for response, elapsed in results if response.status_code == 200]
+    shed = [(response, elapsed) for response, elapsed in results if response.status_code == 503]
+    assert len(ok) + len(shed) == len(results)
+
+    # Two run at once and a few more fit within the queue deadline; the rest are shed
+    assert 2 <= len(ok) <= 10
+    assert shed
+    for response, elapsed in shed:
+        assert response.headers["retry-after"] == "1"
+        assert "overloaded" in response.json()["detail"]
+        # Shed requests never wait much longer than the queue deadline
+        assert elapsed < 0.5 + 1.0
+    assert stats["shed_queue_full"] + stats["shed_timeout"] == len(shed)
+    assert stats["active"] == 0 and stats["queued"] == 0
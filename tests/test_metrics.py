@@ -0,0 +1,130 @@
+"""Tests for the Prometheus metrics."""
+
+import subprocess
+import sys
+import textwrap
+import tracemalloc
+
+from fastapi.testclient import TestClient
+
+import httpkit.tools.metrics as metrics_module
+import httpkit.tools.proxy as proxy
+from httpkit.tools.metrics import ProxyMetrics
+from httpkit.tools.proxy import app
+from tests.servers import run_server
+
+
+async def ok_upstream(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"hello world"})
+
+
+def sample(text: str, line_prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_prefix} not found in:\n{text}")
+
+
+def test_histogram_and_counter_exposition():
+    metrics = ProxyMetrics()
+    metrics.record_request("GET", 200, "http://a:80", 0.003, 100)
+    metrics.record_request("GET", 200, "http://a:80", 0.2, 50)
+    metrics.record_request("POST", 502, "http://b:80", 0.02, 0)
+    metrics.add_bytes_in(7)
+
+    text = metrics.render()
+    assert sample(text, 'httpkit_requests_total{method="GET",status="200",upstream="http://a:80"}') == 2
+    assert sample(text, 'httpkit_requests_total{method="POST",status="502",upstream="http://b:80"}') == 1
+    assert sample(text, 'httpkit_request_duration_seconds_bucket{upstream="http://a:80",le="0.005"}') == 1
+    assert sample(text, 'httpkit_request_duration_seconds_bucket{upstream="http://a:80",le="0.25"}') == 2
+    assert sample(text, 'httpkit_request_duration_seconds_bucket{upstream="http://a:80",le="+Inf"}') == 2
+    assert sample(text, 'httpkit_request_duration_seconds_count{upstream="http://a:80"}') == 2
+    assert abs(sample(text, 'httpkit_request_duration_seconds_sum{upstream="http://a:80"}') - 0.203) < 1e-9
+    assert sample(text, "httpkit_response_bytes_total") == 150
+    assert sample(text, "httpkit_request_bytes_total") == 7
+    assert "# TYPE httpkit_upstream_ttfb_seconds histogram" in text
+
+
+def test_recording_does_not_allocate():
+    metrics = ProxyMetrics()
+    metrics.record_request("GET", 200, "http://a:80", 0.01, 10)
+    metrics.record_upstream("http://a:80", 0.0, 0.01)
+    used = metrics.store.used
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(10000):
+            metrics.record_request("GET", 200, "http://a:80", 0.01, 10)
+            metrics.record_upstream("http://a:80", 0.0, 0.01)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    assert after - before < 1024
+    assert metrics.store.used == used
+
+
+def test_upstream_labels_are_capped(monkeypatch):
+    monkeypatch.setattr(metrics_module, "MAX_UPSTREAM_LABELS", 2)
+    metrics = ProxyMetrics()
+    for port in range(5):
+        metrics.record_request("GET", 200, f"http://host:{port}", 0.01, 0)
+
+    text = metrics.render()
+    assert sample(text, 'httpkit_requests_total{method="GET",status="200",upstream="other"}') == 3
+    assert len(metrics.upstreams) == 2
+
+
+def test_workers_are_aggregated_through_shared_directory(tmp_path):
+    """Each worker process writes its own slots; any worker's scrape sums all of them."""
+    worker = textwrap.dedent(f"""
+        from httpkit.tools.metrics import ProxyMetrics
+        metrics = ProxyMetrics({str(tmp_path)!r})
+        for _ in range(5):
+            metrics.record_request("GET", 200, "http://a:80", 0.01, 10)
+        metrics.set_gauges(limit=10, active=3, queued=0, shed=1, pool_active=2, pool_idle=1, pool_pending=0)
+        {{}}
+    """)
+    # One worker is still running (its gauges count), one has shut down cleanly
+    subprocess.run([sys.executable, "-c", worker.format("")], check=True)
+    subprocess.run([sys.executable, "-c", worker.format("metrics.close()")], check=True)
+
+    metrics = ProxyMetrics(str(tmp_path))
+    metrics.record_request("GET", 200, "http://a:80", 0.01, 10)
+    text = metrics.render()
+
+    assert sample(text, 'httpkit_requests_total{method="GET",status="200",upstream="http://a:80"}') == 11
+    assert sample(text, 'httpkit_request_duration_seconds_count{upstream="http://a:80"}') == 11
+    assert sample(text, "httpkit_response_bytes_total") == 110
+    assert sample(text, "httpkit_requests_shed_total") == 2
+    assert sample(text, "httpkit_concurrency_active") == 3
+    assert sample(text, 'httpkit_pool_connections{state="active"}') == 2
+    metrics.close()
+
+
+def test_metrics_endpoint_records_proxied_requests(monkeypatch):
+    monkeypatch.setattr(proxy, "request_metrics", None)
+    with run_server(ok_upstream) as upstream, TestClient(app) as client:
+        target = upstream.split("://", 1)[1]
+        for _ in range(3):
+            assert client.get(f"/proxy/{target}/").status_code == 200
+        assert client.post(f"/proxy/{target}/", content=b"abcd").status_code == 200
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        text = response.text
+
+    assert sample(text, f'httpkit_requests_total{{method="GET",status="200",upstream="{upstream}"}}') == 3
+    assert sample(text, f'httpkit_requests_total{{method="POST",status="200",upstream="{upstream}"}}') == 1
+    assert sample(text, f'httpkit_upstream_ttfb_seconds_count{{upstream="{upstream}"}}') == 4
+    assert sample(text, "httpkit_queue_wait_seconds_count") == 4
+    assert sample(text, "httpkit_request_bytes_total") == 4
+    assert sample(text, "httpkit_response_bytes_total") == 4 * len(b"hello world")
+    assert sample(text, "httpkit_concurrency_active") == 0
+    assert sample(text, "httpkit_concurrency_limit") == proxy.request_limiter.limit
+    assert sample(text, 'httpkit_pool_connections{state="idle"}') >= 1
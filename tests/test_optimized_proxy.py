@@ -27,12 +27,13 @@ def test_app_startup_initializes_globals(mock_client):
     loop.run_until_complete(startup_event())
     
     # Import after initialization to get the updated values
-    from httpkit.tools.proxy import http_client, request_semaphore
+    from httpkit.tools.proxy import http_client, request_limiter
     
     # Check that the global variables are initialized
     assert http_client is not None
-    assert request_semaphore is not None
-    assert request_semaphore._value == 100  # Default value
+    assert request_limiter is not None
+    assert request_limiter.limit == 100  # Default value
+    assert request_limiter.origin_limit == 100  # Defaults to the global limit
     
     # Clean up
     loop.run_until_complete(shutdown_event())
@@ -0,0 +1,140 @@
+"""Tests for priority classes and weighted fair sharing of the concurrency budget."""
+
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.balancer import load_groups
+from httpkit.tools.limits import ConcurrencyLimiter, Overloaded, PriorityClass
+from httpkit.tools.priority import load_priorities, parse_weights
+from tests.servers import keep_proxy_state, run_server
+
+
+async def header_echo(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    names = sorted(name.decode() for name, _ in scope["headers"])
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": json.dumps(names).encode()})
+
+
+def test_classes_share_slots_by_weight():
+    async def scenario():
+        limiter = ConcurrencyLimiter(
+            limit=1, priorities=[PriorityClass("interactive", 3), PriorityClass("batch", 1)]
+        )
+        await limiter.acquire("http://a:80", "batch")
+        order = []
+
+        async def request(priority):
+            await limiter.acquire("http://a:80", priority)
+            order.append(priority)
+            await asyncio.sleep(0)
+            limiter.release("http://a:80")
+
+        # The batch backlog is queued first and is much deeper
+        tasks = [asyncio.ensure_future(request("batch")) for _ in range(20)]
+        tasks += [asyncio.ensure_future(request("interactive")) for _ in range(6)]
+        await asyncio.sleep(0)
+        limiter.release("http://a:80")
+        await asyncio.gather(*tasks)
+        return order, limiter.stats()["priorities"]
+
+    order, stats = asyncio.run(scenario())
+    assert order[:8] == ["batch"] + ["interactive"] * 3 + ["batch"] + ["interactive"] * 3
+    assert stats["interactive"]["granted"] == 6 and stats["batch"]["granted"] == 21
+
+
+def test_classes_have_their_own_queue_limits_and_deadlines():
+    async def scenario():
+        limiter = ConcurrencyLimiter(
+            limit=1,
+            max_wait=5.0,
+            priorities=[PriorityClass("interactive"), PriorityClass("batch", max_queue=1, max_wait=0.05)],
+        )
+        await limiter.acquire("http://a:80")
+        waiting_batch = asyncio.ensure_future(limiter.acquire("http://a:80", "batch"))
+        waiting_interactive = [asyncio.ensure_future(limiter.acquire("http://a:80", "interactive")) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        # The batch queue is full, the interactive one is not
+        with pytest.raises(Overloaded):
+            await limiter.acquire("http://a:80", "batch")
+        with pytest.raises(Overloaded):
+            await waiting_batch
+        assert not any(task.done() for task in waiting_interactive)
+
+        for task in waiting_interactive:
+            task.cancel()
+        await asyncio.gather(*waiting_interactive, return_exceptions=True)
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["priorities"]["batch"]["shed_queue_full"] == 1
+    assert stats["priorities"]["batch"]["shed_timeout"] == 1
+    assert stats["priorities"]["interactive"]["shed_timeout"] == 0
+
+
+def test_classifier_uses_header_then_rules_then_default():
+    config = {
+        "priority_classes": {"interactive": {"weight": 8}, "batch": {"max_queue_size": 100}},
+        "priority_rules": [
+            {"path_prefix": "/v1/batches", "priority": "batch"},
+            {"group": "backfill", "priority": "batch"},
+        ],
+        "upstream_groups": {"backfill": {"members": ["http://10.0.0.9:8000"]}},
+    }
+    groups, _ = load_groups(config)
+    classes, classifier = load_priorities(config, groups)
+    assert [(cls.name, cls.weight, cls.max_queue) for cls in classes] == [
+        ("interactive", 8.0, 0), ("batch", 1.0, 100),
+    ]
+
+    assert classifier.classify([(b"accept", b"*/*")], "http://api:80/v1/chat") == ("interactive", [(b"accept", b"*/*")])
+    assert classifier.classify([], "http://api:80/v1/batches/1")[0] == "batch"
+    assert classifier.classify([], "http://10.0.0.9:8000/anything")[0] == "batch"
+    # A known class in the header wins; the header itself is not forwarded
+    assert classifier.classify([(b"x-httpkit-priority", b"interactive")], "http://api:80/v1/batches") == ("interactive", [])
+    assert classifier.classify([(b"x-httpkit-priority", b"urgent")], "http://api:80/v1/batches") == ("batch", [])
+
+    # Environment weights override the file and may add classes
+    classes, classifier = load_priorities(config, groups, parse_weights("batch=2,bulk=0.5"), default="bulk")
+    assert {cls.name: cls.weight for cls in classes} == {"interactive": 8.0, "batch": 2.0, "bulk": 0.5}
+    assert classifier.default == "bulk"
+
+    assert load_priorities({}, {}) == ([], None)
+    with pytest.raises(ValueError):
+        load_priorities({"priority_classes": {"a": {}}, "priority_rules": [{"priority": "b"}]}, {})
+
+
+def test_proxy_classifies_requests_and_reports_classes(tmp_path, monkeypatch):
+    with run_server(header_echo) as upstream:
+        config_file = tmp_path / "httpkit.json"
+        config_file.write_text(json.dumps({
+            "priority_classes": {
+                "interactive": {"weight": 4},
+                "batch": {"weight": 1, "max_queue_size": 10, "max_queue_wait_seconds": 30},
+            },
+            "priority_rules": [{"origin": upstream, "path_prefix": "/backfill", "priority": "batch"}],
+        }))
+        monkeypatch.setenv("HTTPKIT_CONFIG_FILE", str(config_file))
+        keep_proxy_state(monkeypatch)
+
+        with TestClient(proxy.app) as client:
+            target = upstream.split("://", 1)[1]
+            forwarded = client.get(f"/proxy/{target}/chat", headers={"X-HTTPKit-Priority": "batch"}).json()
+            assert "x-httpkit-priority" not in forwarded
+            client.get(f"/proxy/{target}/backfill/1")
+            client.get(f"/proxy/{target}/chat")
+
+            priorities = client.get("/upstreams").json()["priorities"]
+            assert priorities["batch"]["granted"] == 2
+            assert priorities["interactive"]["granted"] == 1
+            assert client.get("/").json()["configuration"]["priority_classes"] == {"interactive": 4.0, "batch": 1.0}
+
+            metrics = client.get("/metrics").text
+            assert 'httpkit_priority_requests_total{priority="batch"} 2' in metrics
+            assert 'httpkit_priority_queue_wait_seconds_count{priority="interactive"} 1' in metrics
@@ -5,7 +5,7 @@ from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock, AsyncMock
 import httpx
 import asyncio
-from httpkit.tools.proxy import app, startup_event, shutdown_event, http_client, request_semaphore
+from httpkit.tools.proxy import app, startup_event, shutdown_event, http_client, request_limiter
 
 
 @pytest.fixture(scope="module", autouse=True)
@@ -14,21 +14,23 @@ def setup_globals():
     # Create a mock client
     mock_client = MagicMock()
     
-    # Create a mock semaphore
-    mock_semaphore = MagicMock()
-    mock_semaphore.__aenter__ = AsyncMock()
-    mock_semaphore.__aexit__ = AsyncMock()
+    # Create a mock limiter whose slots are mock async context managers
+    mock_slot = MagicMock()
+    mock_slot.__aenter__ = AsyncMock()
+    mock_slot.__aexit__ = AsyncMock()
+    mock_limiter = MagicMock()
+    mock_limiter.slot.return_value = mock_slot
     
     # Set the global variables
     import httpkit.tools.proxy
     httpkit.tools.proxy.http_client = mock_client
-    httpkit.tools.proxy.request_semaphore = mock_semaphore
+    httpkit.tools.proxy.request_limiter = mock_limiter
     
     yield
     
     # Reset the global variables
     httpkit.tools.proxy.http_client = None
-    httpkit.tools.proxy.request_semaphore = None
+    httpkit.tools.proxy.request_limiter = None
 
 
 @pytest.fixture
@@ -51,7 +53,7 @@ def test_proxy_get_request(client):
     mock_response = MagicMock()
     mock_response.status_code = 200
     mock_response.content = b'{"status": "healthy"}'
-    mock_response.headers = {"Content-Type": "application/json"}
+    mock_response.headers = httpx.Headers({"Content-Type": "application/json"})
     
     # Setup mock aiter_bytes
     async def mock_aiter_bytes():
@@ -59,15 +61,22 @@ def test_proxy_get_request(client):
     
     mock_response.aiter_bytes.return_value = mock_aiter_bytes()
     
-    # Setup mock request
-    async def mock_request(**kwargs):
+    mock_response.aclose = AsyncMock()
+    
+    # Setup mock request building and sending
+    def mock_request(**kwargs):
         # Store the kwargs for later assertion
         mock_request.call_args = kwargs
+        return kwargs
+    
+    async def mock_send(upstream_request, stream=False):
+        assert stream is True
         return mock_response
     
-    # Set the mock request method
+    # Set the mock client methods
     import httpkit.tools.proxy
-    httpkit.tools.proxy.http_client.request = mock_request
+    httpkit.tools.proxy.http_client.build_request = mock_request
+    httpkit.tools.proxy.http_client.send = mock_send
     
     # Make request to proxy
     response = client.get("/proxy/example.com:80/api/health?param=value", 
@@ -87,9 +96,12 @@ def test_proxy_get_request(client):
     assert call_args["url"] == "http://example.com:80/api/health?param=value"
     
     # Check that headers are included in the request (case-insensitive)
-    headers_dict = {k.lower(): v for k, v in call_args["headers"].items()}
+    headers_dict = httpx.Headers(call_args["headers"])
     assert "x-custom-header" in headers_dict
     assert headers_dict["x-custom-header"] == "test"
+    
+    # The upstream response is closed once its body has been streamed
+    mock_response.aclose.assert_awaited_once()
 
 
 def test_proxy_post_request_with_body(client):
@@ -98,7 +110,7 @@ def test_proxy_post_request_with_body(client):
     mock_response = MagicMock()
     mock_response.status_code = 201
     mock_response.content = b'{"id": 123}'
-    mock_response.headers = {"Content-Type": "application/json"}
+    mock_response.headers = httpx.Headers({"Content-Type": "application/json"})
     
     # Setup mock aiter_bytes
     async def mock_aiter_bytes():
@@ -106,15 +118,22 @@ def test_proxy_post_request_with_body(client):
     
     mock_response.aiter_bytes.return_value = mock_aiter_bytes()
     
-    # Setup mock request
-    async def mock_request(**kwargs):
+    mock_response.aclose = AsyncMock()
+    
+    # Setup mock request building and sending
+    def mock_request(**kwargs):
         # Store the kwargs for later assertion
         mock_request.call_args = kwargs
+        return kwargs
+    
+    async def mock_send(upstream_request, stream=False):
+        assert stream is True
         return mock_response
     
-    # Set the mock request method
+    # Set the mock client methods
     import httpkit.tools.proxy
-    httpkit.tools.proxy.http_client.request = mock_request
+    httpkit.tools.proxy.http_client.build_request = mock_request
+    httpkit.tools.proxy.http_client.send = mock_send
     
     # Make request to proxy
     response = client.post(
@@ -133,7 +152,7 @@ def test_proxy_post_request_with_body(client):
     assert call_args["url"] == "http://example.com:80/api/users"
     
     # Check that headers are included in the request (case-insensitive)
-    headers_dict = {k.lower(): v for k, v in call_args["headers"].items()}
+    headers_dict = httpx.Headers(call_args["headers"])
     assert "content-type" in headers_dict
     assert headers_dict["content-type"] == "application/json"
     
@@ -165,7 +184,7 @@ def test_proxy_handles_different_http_methods(client):
         mock_response = MagicMock()
         mock_response.status_code = 200
         mock_response.content = b'{"success": true}'
-        mock_response.headers = {"Content-Type": "application/json"}
+        mock_response.headers = httpx.Headers({"Content-Type": "application/json"})
         
         # Setup mock aiter_bytes
         async def mock_aiter_bytes():
@@ -173,15 +192,21 @@ def test_proxy_handles_different_http_methods(client):
         
         mock_response.aiter_bytes.return_value = mock_aiter_bytes()
         
-        # Setup mock request with method capture
-        async def mock_request(**kwargs):
+        mock_response.aclose = AsyncMock()
+        
+        # Setup mock request building with method capture
+        def mock_request(**kwargs):
             # Store the kwargs for later assertion
             mock_request.call_args = kwargs
+            return kwargs
+        
+        async def mock_send(upstream_request, stream=False):
             return mock_response
         
-        # Set the mock request method
+        # Set the mock client methods
         import httpkit.tools.proxy
-        httpkit.tools.proxy.http_client.request = mock_request
+        httpkit.tools.proxy.http_client.build_request = mock_request
+        httpkit.tools.proxy.http_client.send = mock_send
         
         # Make request to proxy
         request_func = getattr(client, method.lower())
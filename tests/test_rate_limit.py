@@ -0,0 +1,106 @@
+"""Tests for token-bucket rate limiting by client, API key and upstream origin."""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.ratelimit import BucketTable, RateLimit, RateLimited, RateLimiter, load_rate_limits
+from tests.servers import keep_proxy_state, run_server
+
+
+async def hello(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"hello"})
+
+
+def test_buckets_refill_at_the_rate_up_to_the_burst():
+    table = BucketTable(slots=64)
+    limit = RateLimit(rate=2, burst=3)
+    assert [table.take("a", limit, now=100.0) for _ in range(3)] == [0, 0, 0]
+    assert table.take("a", limit, now=100.0) == pytest.approx(0.5)
+    # Half a second brings back one token, and a long pause no more than the burst
+    assert table.take("a", limit, now=100.5) == 0
+    assert table.take("a", limit, now=100.5) > 0
+    assert [table.take("a", limit, now=200.0) for _ in range(4)][-1] > 0
+    # Other keys have their own bucket
+    assert table.take("b", limit, now=200.0) == 0
+    assert RateLimit(5).burst == 5 and RateLimit(0.1).burst == 1
+
+
+def test_table_memory_is_bounded_by_evicting_idle_buckets():
+    table = BucketTable(slots=8, ways=4)
+    limit = RateLimit(rate=1, burst=1)
+    for i in range(1000):
+        assert table.take(f"client-{i}", limit, now=10.0 + i) == 0
+    # Every bucket but the last refilled before the next key arrived, so no bucket was in use when replaced
+    assert table.evictions == 0
+    assert len(table.buffer) == 8 * 32
+
+    for i in range(100):
+        table.take(f"burst-{i}", limit, now=5000.0)
+    assert table.evictions == 100 - 8
+
+
+def test_workers_share_buckets_through_a_file(tmp_path):
+    path = str(tmp_path / "buckets")
+    first, second = BucketTable(slots=64, path=path), BucketTable(slots=64, path=path)
+    try:
+        limit = RateLimit(rate=1, burst=2)
+        assert first.take("c:10.0.0.1", limit, now=50.0) == 0
+        assert second.take("c:10.0.0.1", limit, now=50.0) == 0
+        assert first.take("c:10.0.0.1", limit, now=50.0) == pytest.approx(1.0)
+        assert second.take("c:10.0.0.1", limit, now=50.0) == pytest.approx(1.0)
+    finally:
+        first.close()
+        second.close()
+
+
+def test_rejections_give_back_tokens_taken_by_other_limits():
+    limiter = RateLimiter(
+        BucketTable(slots=64),
+        client=RateLimit(100),
+        api_key=RateLimit(1, 1),
+        origin=RateLimit(100),
+        origin_overrides=load_rate_limits({"http://internal": {"rate_limit": 0}}, 100, 0)[1],
+    )
+    limiter.check("10.0.0.1", [(b"x-api-key", b"k1")], "http://api:80")
+    with pytest.raises(RateLimited) as raised:
+        limiter.check("10.0.0.1", [(b"x-api-key", b"k1")], "http://api:80")
+    assert raised.value.limit == "api_key" and raised.value.retry_after == 1
+    assert raised.value.reason == "rate limit exceeded for api key"
+
+    # Only the client bucket was charged for the rejected request, and it got its token back
+    names = [name for name, _, _ in limiter.limits("10.0.0.1", [(b"x-api-key", b"k1")], "http://api:80")]
+    assert names == ["client", "api_key", "origin"]
+    assert [name for name, _, _ in limiter.limits("10.0.0.1", [], "http://internal:80")] == ["client"]
+    assert limiter.stats()["allowed"] == 1
+    assert limiter.stats()["rejected"] == {"client": 0, "api_key": 1, "origin": 0}
+
+
+def test_proxy_answers_429_with_retry_after(tmp_path, monkeypatch):
+    with run_server(hello) as upstream:
+        config_file = tmp_path / "httpkit.json"
+        config_file.write_text(json.dumps({"origins": {upstream: {"rate_limit": 0.5, "rate_burst": 2}}}))
+        monkeypatch.setenv("HTTPKIT_CONFIG_FILE", str(config_file))
+        monkeypatch.setenv("HTTPKIT_RATE_LIMIT_FILE", str(tmp_path / "buckets"))
+        keep_proxy_state(monkeypatch)
+
+        with TestClient(proxy.app) as client:
+            target = upstream.split("://", 1)[1]
+            assert [client.get(f"/proxy/{target}/").status_code for _ in range(2)] == [200, 200]
+            response = client.get(f"/proxy/{target}/")
+            assert response.status_code == 429
+            assert response.headers["retry-after"] == "2"
+            assert "rate limit exceeded for origin" in response.json()["detail"]
+
+            stats = client.get("/").json()
+            assert stats["rate_limits"] == {
+                "allowed": 2, "rejected": {"client": 0, "api_key": 0, "origin": 1}, "evictions": 0, "shared": True,
+            }
+            metrics = client.get("/metrics").text
+            assert 'httpkit_rate_limited_total{limit="origin"} 1' in metrics
+            assert 'httpkit_requests_total{method="GET",status="429"' in metrics
@@ -0,0 +1,187 @@
+"""Tests for engine selection and the asyncio protocol upstream transport."""
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools import engine
+from httpkit.tools.rawhttp import RawTransport
+from tests.servers import keep_proxy_state, run_server
+
+
+async def upstream(scope, receive, send):
+    """Echo the request body on /echo; stream a chunked body with repeated headers elsewhere."""
+    if scope["type"] != "http":
+        return
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    if scope["path"] == "/echo":
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+        return
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"x-part", b"1"), (b"x-part", b"2")]})
+    for part in range(4):
+        await send({"type": "http.response.body", "body": bytes([part]) * 100000, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def test_engine_options(monkeypatch):
+    assert engine.server_options("asyncio") == {"loop": "asyncio", "http": "h11"}
+    monkeypatch.setattr(engine, "installed", lambda module: module == "uvloop")
+    assert engine.server_options("auto") == {"loop": "uvloop", "http": "h11"}
+    with pytest.raises(ValueError, match="httptools"):
+        engine.server_options("uvloop")
+    monkeypatch.setattr(engine, "installed", lambda module: True)
+    assert engine.server_options("uvloop") == {"loop": "uvloop", "http": "httptools"}
+    with pytest.raises(ValueError, match="Unknown engine"):
+        engine.server_options("trio")
+
+
+def test_raw_transport_reuses_connections_and_frames_bodies():
+    async def scenario(base):
+        transport = RawTransport(httpx.AsyncHTTPTransport())
+        async with httpx.AsyncClient(transport=transport) as client:
+            for _ in range(3):
+                assert (await client.post(f"{base}/echo", content=b"hello")).content == b"hello"
+
+            async def parts():
+                yield b"streamed "
+                yield b"body"
+
+            assert (await client.post(f"{base}/echo", content=parts())).content == b"streamed body"
+
+            async with client.stream("GET", f"{base}/chunked") as response:
+                chunks = [chunk async for chunk in response.aiter_raw()]
+            assert response.headers.get_list("x-part") == ["1", "2"]
+            assert b"".join(chunks) == b"".join(bytes([part]) * 100000 for part in range(4))
+            # Body chunks are views of the blocks the socket was read into
+            assert all(isinstance(chunk, memoryview) for chunk in chunks)
+
+            assert transport.stats()["connects"] == 1 and transport.stats()["reuses"] == 4
+            assert transport.connection_counts() == {f"http://127.0.0.1:{base.rsplit(':', 1)[1]}": {"active": 0, "idle": 1}}
+
+    with run_server(upstream) as base:
+        asyncio.run(scenario(base))
+
+
+def test_stale_kept_alive_connections_are_replaced():
+    async def scenario():
+        answered = []
+
+        async def handle(reader, writer):
+            # Answer one request, then close the connection when the next one arrives
+            await reader.readuntil(b"\r\n\r\n")
+            answered.append(writer)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await reader.readuntil(b"\r\n\r\n")
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+        transport = RawTransport(httpx.AsyncHTTPTransport())
+        async with server, httpx.AsyncClient(transport=transport) as client:
+            assert (await client.get(url)).content == b"ok"
+            # Sent on the kept-alive connection, then again on a new one
+            assert (await client.get(url)).content == b"ok"
+
+            async def body():
+                yield b"x"
+
+            # A streamed body cannot be sent twice
+            with pytest.raises(httpx.RemoteProtocolError):
+                await client.post(url, content=body())
+        assert len(answered) == 2 and transport.stats()["connects"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_only_unsent_or_idempotent_requests_are_replayed():
+    async def scenario():
+        bodies = []
+
+        async def handle(reader, writer):
+            # Answer one request, then close the connection
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.lower().split(b"content-length: ", 1)[1].split(b"\r\n", 1)[0]) if b"ength: " in head else 0
+            bodies.append(head.split(b" ", 1)[0] + b" " + await reader.readexactly(length))
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+            if len(bodies) == 1:
+                writer.close()
+            else:
+                # Read the next request, then close without answering it
+                await reader.read(65536)
+                writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+        transport = RawTransport(httpx.AsyncHTTPTransport())
+        async with server, httpx.AsyncClient(transport=transport) as client:
+            assert (await client.get(url)).content == b"ok"
+            await asyncio.sleep(0.05)
+            # The kept-alive connection is known to be closed, so nothing was written: sent again
+            assert (await client.post(url, content=b"first")).content == b"ok"
+            # Written to a connection the upstream then closes: not sent twice
+            with pytest.raises(httpx.RemoteProtocolError):
+                await client.post(url, content=b"second")
+        assert bodies == [b"GET ", b"POST first"]
+        assert transport.stats()["connects"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_connections_are_capped_and_requests_wait_for_one():
+    async def scenario(base):
+        transport = RawTransport(httpx.AsyncHTTPTransport(), max_connections=1)
+        async with httpx.AsyncClient(transport=transport) as client:
+            responses = await asyncio.gather(*(client.post(f"{base}/echo", content=b"%d" % i) for i in range(3)))
+            assert [response.content for response in responses] == [b"0", b"1", b"2"]
+            assert transport.stats()["connects"] == 1 and transport.stats()["pool_waits"] == 2
+
+            async with client.stream("GET", f"{base}/chunked"):
+                # The only connection is busy streaming, so no other request gets one in time
+                with pytest.raises(httpx.PoolTimeout):
+                    await client.get(f"{base}/echo", timeout=httpx.Timeout(5.0, pool=0.05))
+            # The stream was left unread, so its connection is closed rather than reused
+            assert transport.stats()["open"] == 0 and transport.stats()["active"] == 0
+
+    with run_server(upstream) as base:
+        asyncio.run(scenario(base))
+
+
+def test_https_requests_go_to_the_fallback():
+    seen = []
+
+    def handler(request):
+        seen.append(str(request.url))
+        return httpx.Response(200, content=b"from fallback")
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=RawTransport(httpx.MockTransport(handler))) as client:
+            return (await client.get("https://example.com/secure")).content
+
+    assert asyncio.run(scenario()) == b"from fallback"
+    assert seen == ["https://example.com/secure"]
+
+
+def test_proxy_reports_its_engine_and_uses_the_raw_transport(monkeypatch):
+    keep_proxy_state(monkeypatch)
+    monkeypatch.setenv("HTTPKIT_UPSTREAM_TRANSPORT", "raw")
+
+    with run_server(upstream) as base, TestClient(proxy.app) as client:
+        target = base.split("://", 1)[1]
+        response = client.get(f"/proxy/{target}/chunked")
+        assert response.status_code == 200 and len(response.content) == 400000
+        assert client.post(f"/proxy/{target}/echo", content=b"payload").content == b"payload"
+
+        configuration = client.get("/").json()["configuration"]
+        assert configuration["upstream_transport"] == "raw" and configuration["engine"] == "auto"
+        assert configuration["event_loop"] in ("asyncio", "uvloop")
+        assert client.get("/upstreams").json()["origins"][f"http://{target}"]["connections"]["idle"] == 1
@@ -0,0 +1,167 @@
+"""Tests for budgeted retries and hedged requests."""
+
+import asyncio
+import threading
+import time
+from contextlib import AsyncExitStack
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.retries import LatencyPercentile, ResilientSender, RetryBudget, close_result
+from tests.servers import closed_port, keep_proxy_state, run_server
+
+
+def opened(label: str, closed: list):
+    stack = AsyncExitStack()
+    stack.callback(closed.append, label)
+    return label, stack
+
+
+def test_retry_budget_is_a_fraction_of_traffic():
+    budget = RetryBudget(ratio=0.25, min_per_second=0.0)
+    assert not budget.withdraw()
+    for _ in range(4):
+        budget.deposit()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    assert budget.exhausted == 2
+
+    # The steady allowance refills an idle budget, up to its cap
+    budget = RetryBudget(ratio=0.0, min_per_second=1.0, max_balance=2.0)
+    budget.updated -= 60
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_latency_percentile():
+    tracker = LatencyPercentile(95, size=100, refresh=100)
+    for i in range(99):
+        tracker.add(i / 1000)
+    assert tracker.value() is None
+    tracker.add(0.099)
+    assert tracker.value() == pytest.approx(0.095)
+
+
+def test_transport_errors_are_retried_within_budget():
+    async def scenario(budget):
+        sender = ResilientSender(max_retries=3, budget=budget, backoff=0.001)
+        calls = []
+
+        async def opener():
+            calls.append(1)
+            if len(calls) < 3:
+                raise httpx.ConnectError("refused")
+            return opened("ok", [])
+
+        try:
+            result = await sender.send(opener, "http://a:80")
+        except httpx.ConnectError:
+            result = None
+        return result, len(calls), sender.retries
+
+    budget = RetryBudget()
+    budget.balance = 5.0
+    result, calls, retries = asyncio.run(scenario(budget))
+    assert result[0] == "ok" and calls == 3 and retries == 2
+
+    # An empty budget turns retries off entirely
+    result, calls, retries = asyncio.run(scenario(RetryBudget(ratio=0.0, min_per_second=0.0)))
+    assert result is None and calls == 1 and retries == 0
+
+
+def test_hedge_wins_and_loser_is_cancelled():
+    async def scenario():
+        sender = ResilientSender(hedge_percentile=50)
+        sender.budget.balance = 5.0
+        for _ in range(64):
+            sender.tracker("http://a:80").add(0.01)
+        closed, cancelled, calls = [], [], []
+
+        async def opener():
+            calls.append(1)
+            label = f"attempt-{len(calls)}"
+            if label == "attempt-1":
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(label)
+                    raise
+            return opened(label, closed)
+
+        label, _ = await sender.attempt(opener, "http://a:80")
+        return label, cancelled, sender.stats()
+
+    label, cancelled, stats = asyncio.run(scenario())
+    assert label == "attempt-2"
+    assert cancelled == ["attempt-1"]
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_losing_response_that_already_arrived_is_closed():
+    async def scenario():
+        closed = []
+
+        async def arrived():
+            return opened("late", closed)
+
+        task = asyncio.ensure_future(arrived())
+        await asyncio.sleep(0)
+        await close_result(task)
+        return closed
+
+    assert asyncio.run(scenario()) == ["late"]
+
+
+def test_hedged_request_through_proxy_cuts_tail_latency(monkeypatch):
+    """A stuck upstream request is hedged, and the losing connection is closed."""
+    state = {"requests": 0, "disconnected": threading.Event()}
+
+    async def upstream(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        await receive()
+        state["requests"] += 1
+        if scope["path"] == "/slow" and state["requests"] == 1:
+            # Hang until the proxy gives up on this attempt
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                state["disconnected"].set()
+            return
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    monkeypatch.setenv("HTTPKIT_HEDGE_PERCENTILE", "90")
+    monkeypatch.setenv("HTTPKIT_HEDGE_MIN_DELAY_SECONDS", "0.05")
+    keep_proxy_state(monkeypatch)
+
+    with run_server(upstream) as upstream_url, TestClient(proxy.app) as client:
+        target = upstream_url.split("://", 1)[1]
+        # The hedge delay comes from the origin's recent latencies
+        for _ in range(64):
+            proxy.request_retries.tracker(upstream_url).add(0.001)
+        proxy.request_retries.budget.balance = 5.0
+
+        started = time.monotonic()
+        response = client.get(f"/proxy/{target}/slow")
+        elapsed = time.monotonic() - started
+
+        assert response.status_code == 200 and response.text == "ok"
+        assert elapsed < 2
+        assert state["disconnected"].wait(5)
+        assert client.get("/").json()["retries"]["hedge_wins"] == 1
+
+
+def test_connection_errors_are_retried_through_proxy(monkeypatch):
+    monkeypatch.setenv("HTTPKIT_MAX_RETRIES", "2")
+    monkeypatch.setenv("HTTPKIT_RETRY_BACKOFF_SECONDS", "0.001")
+    keep_proxy_state(monkeypatch)
+
+    with TestClient(proxy.app) as client:
+        proxy.request_retries.budget.balance = 5.0
+        assert client.get(f"/proxy/127.0.0.1:{closed_port()}/").status_code == 502
+        # Requests with a body are never replayed
+        assert client.post(f"/proxy/127.0.0.1:{closed_port()}/", content=b"x").status_code == 502
+        assert client.get("/").json()["retries"]["retries"] == 2
@@ -0,0 +1,148 @@
+"""Tests for spooled request bodies and the budget of spooled bytes in flight."""
+
+import asyncio
+import os
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+import httpkit.tools.spool as spool
+from httpkit.tools.limits import Overloaded
+from httpkit.tools.spool import BodyBudget, BodyTooLarge, SpooledBody
+from tests.servers import keep_proxy_state, run_server
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def test_bodies_move_to_a_file_past_the_memory_threshold(monkeypatch, tmp_path):
+    writers = []
+
+    def write_all(fd, data):
+        writers.append(threading.current_thread())
+        os.write(fd, data)
+
+    monkeypatch.setattr(spool, "write_all", write_all)
+
+    async def scenario():
+        budget = BodyBudget(1000)
+        small = SpooledBody(100, 1000, budget, str(tmp_path))
+        await small.fill(chunks(b"ab", b"cd"))
+        assert not small.spilled and [chunk async for chunk in small] == [b"ab", b"cd"]
+
+        large = SpooledBody(100, 1000, budget, str(tmp_path), chunk_size=64)
+        await large.fill(chunks(b"x" * 60, b"y" * 60, b"z" * 60))
+        assert large.spilled and budget.stats()["in_use"] == 184
+        # The file is unlinked at once, and concurrent readers each see the whole body
+        assert os.listdir(tmp_path) == []
+        # The file is written off the event loop
+        assert len(writers) == 3 and threading.main_thread() not in writers
+
+        async def read():
+            return b"".join([chunk async for chunk in large])
+
+        first, second = await asyncio.gather(read(), read())
+        assert first == second == b"x" * 60 + b"y" * 60 + b"z" * 60
+
+        for body in (small, large):
+            body.close()
+        stats = budget.stats()
+        assert stats["in_use"] == 0 and stats["peak"] == 184 and stats["bodies"] == 2 and stats["spilled"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_budget_pushes_back_on_readers_and_sheds_them():
+    async def scenario():
+        budget = BodyBudget(100, max_wait=0.05)
+        first = SpooledBody(1000, 1000, budget)
+        await first.fill(chunks(b"a" * 80))
+
+        # An announced length is reserved whole, before any of the body is read
+        with pytest.raises(BodyTooLarge):
+            await SpooledBody(1000, 1000, budget).fill(chunks(b"b"), expected=101)
+        with pytest.raises(BodyTooLarge):
+            await SpooledBody(1000, 10, budget).fill(chunks(b"b" * 16))
+        with pytest.raises(Overloaded):
+            await SpooledBody(1000, 1000, budget).fill(chunks(b"c" * 30))
+
+        budget.max_wait = 5.0
+        second = SpooledBody(1000, 1000, budget)
+        waiter = asyncio.ensure_future(second.fill(chunks(b"d" * 30)))
+        await asyncio.sleep(0.02)
+        assert not waiter.done() and budget.stats()["waiting"] == 1
+        first.close()
+        await asyncio.wait_for(waiter, 1)
+        assert budget.in_use == 30
+        second.close()
+
+        stats = budget.stats()
+        assert stats["in_use"] == 0 and stats["waits"] == 2 and stats["shed"] == 1 and stats["refused"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_spooled_bodies_are_sent_again_by_hedged_requests(monkeypatch):
+    state = {"requests": 0, "bodies": [], "disconnected": threading.Event()}
+
+    async def upstream(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        state["requests"] += 1
+        state["bodies"].append(body)
+        if state["requests"] == 1:
+            # Hang until the hedged copy wins and this attempt is closed
+            if (await receive())["type"] == "http.disconnect":
+                state["disconnected"].set()
+            return
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": body})
+
+    keep_proxy_state(monkeypatch)
+    monkeypatch.setenv("HTTPKIT_HEDGE_PERCENTILE", "90")
+    monkeypatch.setenv("HTTPKIT_HEDGE_MIN_DELAY_SECONDS", "0.05")
+    monkeypatch.setenv("HTTPKIT_SPOOL_REQUEST_BODIES", "1")
+    monkeypatch.setenv("HTTPKIT_SPOOL_MEMORY_BYTES", "1024")
+
+    payload = os.urandom(200000)
+    with run_server(upstream) as upstream_url, TestClient(proxy.app) as client:
+        target = upstream_url.split("://", 1)[1]
+        for _ in range(64):
+            proxy.request_retries.tracker(upstream_url).add(0.001)
+        proxy.request_retries.budget.balance = 5.0
+
+        response = client.put(f"/proxy/{target}/upload", content=payload)
+        assert response.status_code == 200 and response.content == payload
+        assert state["bodies"] == [payload, payload] and state["disconnected"].wait(5)
+
+        stats = client.get("/").json()
+        assert stats["retries"]["hedge_wins"] == 1
+        assert stats["request_bodies"]["spilled"] == 1 and stats["request_bodies"]["in_use"] == 0
+
+        # Non-idempotent requests are streamed as before
+        client.post(f"/proxy/{target}/upload", content=b"once")
+        assert client.get("/").json()["request_bodies"]["bodies"] == 1
+
+
+def test_bodies_over_the_limit_are_refused(monkeypatch):
+    keep_proxy_state(monkeypatch)
+    monkeypatch.setenv("HTTPKIT_HEDGE_PERCENTILE", "90")
+    monkeypatch.setenv("HTTPKIT_SPOOL_REQUEST_BODIES", "1")
+    monkeypatch.setenv("HTTPKIT_SPOOL_MAX_BODY_BYTES", "1000")
+
+    with TestClient(proxy.app) as client:
+        response = client.put("/proxy/127.0.0.1:9/upload", content=b"x" * 1001)
+        assert response.status_code == 413
+        configuration = client.get("/").json()["configuration"]
+        assert configuration["spool_request_bodies"] and configuration["spool_max_body_bytes"] == 1000
+        assert client.get("/").json()["request_bodies"]["refused"] == 1
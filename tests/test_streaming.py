@@ -0,0 +1,176 @@
+"""End-to-end streaming tests for the proxy against a slow local upstream."""
+
+import asyncio
+import json
+import time
+import tracemalloc
+
+import httpx
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.proxy import app, stream_request_body
+from tests.servers import run_server
+
+CHUNK = b"x" * 65536
+
+
+async def slow_upstream(scope, receive, send):
+    """Minimal ASGI upstream that streams its body in timed chunks."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            else:
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    path = scope["path"]
+    if path == "/upload":
+        # Count the request body without keeping it and report how it was framed
+        received = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            received += len(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        headers = dict(scope["headers"])
+        body = json.dumps({
+            "received": received,
+            "content_length": headers.get(b"content-length", b"").decode(),
+            "transfer_encoding": headers.get(b"transfer-encoding", b"").decode(),
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/octet-stream")],
+    })
+    if path == "/slow":
+        # First chunk immediately, the rest trickles in over ~1 second
+        for _ in range(5):
+            await send({"type": "http.response.body", "body": CHUNK, "more_body": True})
+            await asyncio.sleep(0.2)
+    elif path == "/large":
+        # 48 MiB, far more than the proxy should ever hold in memory
+        for _ in range(768):
+            await send({"type": "http.response.body", "body": CHUNK, "more_body": True})
+    elif path == "/endless":
+        # Stream until the proxy closes the upstream connection
+        await receive()  # the (empty) request body
+        disconnected = asyncio.ensure_future(receive())
+        while not disconnected.done():
+            await send({"type": "http.response.body", "body": CHUNK, "more_body": True})
+            await asyncio.sleep(0.05)
+        return
+    await send({"type": "http.response.body", "body": b""})
+
+
+def _proxy_url(proxy_base, upstream_base, path):
+    return f"{proxy_base}/proxy/{upstream_base.split('://', 1)[1]}{path}"
+
+
+def test_first_byte_arrives_before_upstream_finishes():
+    """The first chunk should reach the client long before the upstream body completes."""
+    with run_server(slow_upstream) as upstream, run_server(app) as proxy_base:
+        start = time.monotonic()
+        with httpx.stream("GET", _proxy_url(proxy_base, upstream, "/slow"), timeout=10) as response:
+            chunks = response.iter_raw()
+            next(chunks)
+            first_byte = time.monotonic() - start
+            for _ in chunks:
+                pass
+        total = time.monotonic() - start
+
+    assert response.status_code == 200
+    assert total >= 0.8
+    assert first_byte < 0.5
+
+
+def test_large_body_memory_stays_bounded():
+    """Streaming a large body should never hold more than a few chunks in memory."""
+    with run_server(slow_upstream) as upstream, run_server(app) as proxy_base:
+        tracemalloc.start()
+        try:
+            received = 0
+            with httpx.stream("GET", _proxy_url(proxy_base, upstream, "/large"), timeout=30) as response:
+                for chunk in response.iter_raw():
+                    received += len(chunk)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    assert received == 768 * len(CHUNK)
+    assert peak < 16 * 1024 * 1024
+
+
+def test_slot_held_for_body_and_released_on_disconnect():
+    """The concurrency slot is held while streaming and freed when the client goes away."""
+    with run_server(slow_upstream) as upstream, run_server(app) as proxy_base:
+        with httpx.stream("GET", _proxy_url(proxy_base, upstream, "/endless"), timeout=10) as response:
+            chunks = response.iter_raw()
+            next(chunks)
+            assert proxy.request_limiter.active == 1
+
+        deadline = time.monotonic() + 5
+        while proxy.request_limiter.active != 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert proxy.request_limiter.active == 0
+
+
+def test_upload_with_content_length_is_preserved():
+    """A body sent with Content-Length reaches the upstream with the same length."""
+    body = b"y" * (4 * 1024 * 1024)
+    with run_server(slow_upstream) as upstream, run_server(app) as proxy_base:
+        response = httpx.post(_proxy_url(proxy_base, upstream, "/upload"), content=body, timeout=30)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "received": len(body),
+        "content_length": str(len(body)),
+        "transfer_encoding": "",
+    }
+
+
+def test_chunked_upload_memory_stays_bounded():
+    """A large chunked upload is forwarded chunked without being buffered."""
+    def generate():
+        for _ in range(768):
+            yield CHUNK
+
+    with run_server(slow_upstream) as upstream, run_server(app) as proxy_base:
+        tracemalloc.start()
+        try:
+            response = httpx.post(_proxy_url(proxy_base, upstream, "/upload"), content=generate(), timeout=30)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    assert response.status_code == 200
+    assert response.json()["received"] == 768 * len(CHUNK)
+    assert response.json()["transfer_encoding"] == "chunked"
+    assert peak < 16 * 1024 * 1024
+
+
+def test_stream_request_body_respects_chunk_size():
+    """Incoming chunks larger than the configured size are split before forwarding."""
+    messages = iter([
+        {"type": "http.request", "body": b"a" * 10, "more_body": True},
+        {"type": "http.request", "body": b"", "more_body": True},
+        {"type": "http.request", "body": b"b" * 3, "more_body": False},
+    ])
+
+    async def receive():
+        return next(messages)
+
+    async def collect():
+        return [chunk async for chunk in stream_request_body(receive, 4)]
+
+    assert asyncio.run(collect()) == [b"aaaa", b"aaaa", b"aa", b"bbb"]
@@ -0,0 +1,105 @@
+"""Tests for per-request phase timing, the Server-Timing header and /debug/slow."""
+
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import httpkit.tools.proxy as proxy
+from httpkit.tools.timing import RequestTimer, SlowRequests
+from tests.servers import keep_proxy_state, run_server
+
+
+async def sleepy(scope, receive, send):
+    """Answer after the number of milliseconds in the path."""
+    if scope["type"] != "http":
+        return
+    await asyncio.sleep(int(scope["path"].strip("/") or 0) / 1000)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"done"})
+
+
+def server_timing(header: str):
+    """Parse a Server-Timing header into {name: milliseconds}."""
+    metrics = {}
+    for item in header.split(","):
+        name, _, duration = item.strip().partition(";dur=")
+        metrics[name] = float(duration)
+    return metrics
+
+
+def test_phases_from_timestamps_and_trace_events():
+    timer = RequestTimer(started=10.0)
+    timer.begin(queued=10.0, acquired=10.5)
+
+    async def connect():
+        for event in ["connection.connect_tcp.started", "connection.connect_tcp.complete",
+                      "connection.start_tls.started", "connection.start_tls.complete",
+                      "http11.send_request_headers.started"]:
+            await timer.trace(event, {})
+
+    asyncio.run(connect())
+    assert 0 < timer.connect_start <= timer.connect_end <= timer.tls_start <= timer.tls_end <= timer.request_start
+
+    timer.connect_start, timer.connect_end = 10.6, 10.7
+    timer.tls_start, timer.tls_end = 10.7, 10.9
+    timer.request_start, timer.headers, timer.finished = 11.0, 12.0, 12.5
+    phases = {name: round(seconds, 6) for name, seconds in timer.phases().items()}
+    assert phases == {"queue": 0.5, "connect": 0.1, "tls": 0.2, "pool": 0.2, "upstream": 1.0, "body": 0.5, "total": 2.5}
+    assert timer.queue_wait() == 0.5 and timer.ttfb() == 1.5
+
+    # A new attempt forgets the connection of the previous one
+    timer.begin(queued=13.0, acquired=13.0)
+    assert "connect" not in timer.phases(now=14.0) and timer.ttfb() is None
+
+
+def test_slow_requests_keep_the_slowest_of_recent_windows():
+    slow = SlowRequests(size=3, window=10.0)
+    start = slow.rotated
+    for i, duration in enumerate([0.1, 0.5, 0.2, 0.9, 0.05, 0.3]):
+        if slow.admits(duration, start + i):
+            slow.add(duration, {"id": i})
+    assert [entry["id"] for entry in slow.slowest()] == [3, 1, 5]
+    assert not slow.admits(0.2, start + 6)
+
+    # The previous window is still reported, then ages out
+    assert slow.admits(0.01, start + 11)
+    slow.add(0.01, {"id": "new"})
+    assert [entry["id"] for entry in slow.slowest(2)] == [3, 1]
+    slow.admits(0.01, start + 22)
+    assert [entry["id"] for entry in slow.slowest()] == ["new"]
+    slow.admits(0.01, start + 50)
+    assert slow.slowest() == []
+
+
+def test_server_timing_header_and_slow_request_log(monkeypatch):
+    monkeypatch.setenv("HTTPKIT_SERVER_TIMING", "1")
+    monkeypatch.setenv("HTTPKIT_SLOW_REQUESTS", "2")
+    keep_proxy_state(monkeypatch)
+
+    with run_server(sleepy) as upstream:
+        with TestClient(proxy.app) as client:
+            target = upstream.split("://", 1)[1]
+            first = server_timing(client.get(f"/proxy/{target}/50").headers["server-timing"])
+            assert set(first) == {"queue", "connect", "pool", "upstream", "total"}
+            assert first["upstream"] >= 50 and first["total"] >= first["upstream"]
+
+            # The pooled connection is reused
+            second = server_timing(client.get(f"/proxy/{target}/0").headers["server-timing"])
+            assert "connect" not in second
+            client.get(f"/proxy/{target}/150")
+
+            slow = client.get("/debug/slow").json()
+            assert [entry["target"] for entry in slow["requests"]] == [f"{upstream}/150", f"{upstream}/50"]
+            phases = slow["requests"][0]["phases"]
+            assert phases["upstream"] >= 0.15 and "body" in phases and phases["total"] >= phases["upstream"]
+            assert len(client.get("/debug/slow?limit=1").json()["requests"]) == 1
+
+
+def test_timing_is_off_by_default(monkeypatch):
+    keep_proxy_state(monkeypatch)
+
+    with run_server(sleepy) as upstream:
+        with TestClient(proxy.app) as client:
+            response = client.get(f"/proxy/{upstream.split('://', 1)[1]}/0")
+            assert "server-timing" not in response.headers
+            assert client.get("/debug/slow").status_code == 404
@@ -0,0 +1,111 @@
+"""Tests for Unix domain socket upstreams and listeners."""
+
+import asyncio
+import json
+from urllib.parse import quote
+
+import pytest
+from fastapi.testclient import TestClient
+
+import httpkit.tools.asgi_proxy as asgi_proxy
+import httpkit.tools.proxy as proxy
+from benchmarks.loadgen import run_load
+from httpkit.tools.unixsocket import match_socket, unix_origin
+from tests.servers import keep_proxy_state, run_server
+
+
+async def upstream(scope, receive, send):
+    """Answer with the request's path, query and Host header."""
+    if scope["type"] != "http":
+        return
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    host = dict(scope["headers"]).get(b"host", b"")
+    reply = b"%s %s?%s host=%s body=%s" % (
+        scope["method"].encode(), scope["path"].encode(), scope["query_string"], host, body,
+    )
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-length", str(len(reply)).encode())]})
+    await send({"type": "http.response.body", "body": reply})
+
+
+@pytest.fixture
+def socket_dir(tmp_path_factory):
+    # Socket paths are limited to about 100 bytes, so keep them short
+    return tmp_path_factory.mktemp("uds")
+
+
+def test_targets_are_matched_against_configured_sockets():
+    sockets = ["/run/app.sock", "/run/app.sock.d/api.sock"]
+    assert match_socket("/run/app.sock/v1/items", sockets) == ("/run/app.sock", "v1/items")
+    assert match_socket("/run/app.sock.d/api.sock/v1", sockets) == ("/run/app.sock.d/api.sock", "v1")
+    assert match_socket("/run/app.sock", sockets) == ("/run/app.sock", "")
+    assert match_socket("/run/app.socket/v1", sockets) is None
+    assert match_socket("/var/run/docker.sock/containers/json", sockets) is None
+    assert unix_origin("/run/app.sock") == "http+unix://%2Frun%2Fapp.sock"
+
+
+def test_requests_are_forwarded_over_configured_sockets(monkeypatch, socket_dir):
+    keep_proxy_state(monkeypatch)
+    path = str(socket_dir / "app.sock")
+    monkeypatch.setenv("HTTPKIT_UNIX_SOCKETS", path)
+
+    with run_server(upstream, uds=path), TestClient(proxy.app) as client:
+        response = client.post(f"/proxy/unix:{quote(path, safe='')}/v1/items?page=2", content=b"data")
+        assert response.status_code == 200
+        assert response.content == b"POST /v1/items?page=2 host=localhost body=data"
+        # The socket path may also be given unencoded
+        assert client.get(f"/proxy/unix:{path}/health").content == b"GET /health? host=localhost body="
+
+        assert client.get("/").json()["configuration"]["unix_sockets"] == [path]
+        origin = client.get("/upstreams").json()["origins"][unix_origin(path)]
+        assert origin["connections"]["idle"] == 1
+
+
+def test_socket_origins_can_be_configured(tmp_path, monkeypatch, socket_dir):
+    keep_proxy_state(monkeypatch)
+    path = str(socket_dir / "app.sock")
+    config_file = tmp_path / "httpkit.json"
+    config_file.write_text(json.dumps({
+        "origins": {unix_origin(path): {"rate_limit": 0.5, "rate_burst": 2, "min_idle_connections": 1}},
+        "priority_classes": {"interactive": {"weight": 4}, "batch": {"weight": 1}},
+        # Socket origins may also be written with an unencoded path
+        "priority_rules": [{"origin": f"http+unix://{path}", "priority": "batch"}],
+    }))
+    monkeypatch.setenv("HTTPKIT_CONFIG_FILE", str(config_file))
+    monkeypatch.setenv("HTTPKIT_UNIX_SOCKETS", path)
+    monkeypatch.setenv("HTTPKIT_RATE_LIMIT_FILE", str(tmp_path / "buckets"))
+
+    with run_server(upstream, uds=path), TestClient(proxy.app) as client:
+        target = f"/proxy/unix:{quote(path, safe='')}/"
+        assert [client.get(target).status_code for _ in range(3)] == [200, 200, 429]
+        assert client.get("/upstreams").json()["priorities"]["batch"]["granted"] == 2
+        assert unix_origin(path) in client.get("/").json()["warmup"]["origins"]
+
+
+def test_unconfigured_sockets_are_forbidden(monkeypatch, socket_dir):
+    keep_proxy_state(monkeypatch)
+    monkeypatch.setenv("HTTPKIT_UNIX_SOCKETS", str(socket_dir / "app.sock"))
+
+    with TestClient(proxy.app) as client:
+        response = client.get(f"/proxy/unix:{quote('/var/run/docker.sock', safe='')}/containers/json")
+        assert response.status_code == 403
+    with TestClient(asgi_proxy.app) as client:
+        assert client.get("/proxy/unix:/var/run/docker.sock/containers/json").status_code == 403
+
+
+def test_fast_path_forwards_over_sockets_and_load_runs_over_them(monkeypatch, socket_dir):
+    keep_proxy_state(monkeypatch)
+    upstream_path = str(socket_dir / "app.sock")
+    monkeypatch.setenv("HTTPKIT_UNIX_SOCKETS", upstream_path)
+
+    with run_server(upstream, uds=upstream_path), TestClient(asgi_proxy.app) as client:
+        response = client.get(f"/proxy/unix:{quote(upstream_path, safe='')}/fast?x=1")
+        assert response.status_code == 200 and response.content == b"GET /fast?x=1 host=localhost body="
+
+    with run_server(upstream, uds=str(socket_dir / "bench.sock")) as bench_path:
+        result = asyncio.run(run_load("127.0.0.1", 0, "/bench", 4, 0.3, uds=bench_path))
+        assert result.requests > 0 and result.errors == 0
@@ -0,0 +1,232 @@
+"""Tests for supervised worker processes and the node-wide concurrency budget."""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+
+from httpkit.tools.limits import ConcurrencyLimiter
+from httpkit.tools.metrics import ProxyMetrics
+from httpkit.tools.workers import NodeBudget, reuseport_socket
+
+
+async def pid_app(scope, receive, send):
+    """Answer every request with the pid of the worker serving it."""
+    if scope["type"] != "http":
+        return
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": json.dumps({"pid": os.getpid()}).encode()})
+
+
+async def metrics_app(scope, receive, send):
+    """Record a request and one active request in HTTPKIT_METRICS_DIR, then answer with the pid."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                metrics = ProxyMetrics(os.environ["HTTPKIT_METRICS_DIR"])
+                metrics.record_request("GET", 200, "http://a:80", 0.01, 10)
+                metrics.set_gauges(limit=10, active=1, queued=0, shed=0, pool_active=0, pool_idle=0, pool_pending=0)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    await pid_app(scope, receive, send)
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_budget_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "state")
+    first, second = NodeBudget(path, limit=3), NodeBudget(path)
+    try:
+        first.attach(pid=os.getpid())
+        second.attach(pid=os.getppid())
+        assert first.row != second.row and second.limit == 3
+
+        assert first.take() and first.take() and second.take()
+        assert not second.take() and not first.take()
+        first.give()
+        assert second.take()
+
+        stats = first.stats()
+        assert stats["limit"] == 3 and stats["active"] == 3 and stats["acquired"] == 4
+        assert sorted((worker["active"], worker["acquired"]) for worker in stats["workers"]) == [(1, 2), (2, 2)]
+    finally:
+        second.close()
+        assert first.stats()["active"] == 1
+        first.close()
+
+
+def test_budget_held_by_dead_workers_is_returned(tmp_path):
+    path = str(tmp_path / "state")
+    crashed = NodeBudget(path, limit=3)
+    crashed.attach(pid=dead_pid())
+    assert crashed.take() and crashed.take() and crashed.take()
+
+    # A new worker claims the dead worker's row and the budget it held
+    worker = NodeBudget(path)
+    assert worker.attach() == crashed.row
+    assert worker.stats()["active"] == 0 and worker.take()
+
+    # The supervisor reaps workers it saw exit, and sweeps rows left by a previous run
+    exited, leftover = NodeBudget(path), NodeBudget(path)
+    running = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    exited.attach(pid=running.pid)
+    leftover.attach(pid=dead_pid())
+    exited.take()
+    leftover.take()
+    supervisor = NodeBudget(path)
+    assert supervisor.stats()["active"] == 3
+    running.kill()
+    running.wait()
+    supervisor.reap(running.pid)
+    assert supervisor.stats()["active"] == 2
+    supervisor.sweep()
+    assert supervisor.stats()["active"] == 1
+    assert [entry["pid"] for entry in supervisor.stats()["workers"]] == [os.getpid()]
+
+    for budget in (crashed, exited, leftover):
+        budget.row = None
+    for budget in (crashed, exited, leftover, supervisor, worker):
+        budget.close()
+
+
+def test_limiters_of_different_workers_share_the_node_budget(tmp_path):
+    path = str(tmp_path / "state")
+
+    async def scenario():
+        budgets = [NodeBudget(path, limit=2), NodeBudget(path)]
+        budgets[0].attach(pid=os.getpid())
+        budgets[1].attach(pid=os.getppid())
+        first, second = (ConcurrencyLimiter(10, node=budget) for budget in budgets)
+        try:
+            await first.acquire("http://a:80")
+            await first.acquire("http://a:80")
+            # The second worker's own limit has room, but the node is full
+            waiter = asyncio.ensure_future(second.acquire("http://b:80"))
+            await asyncio.sleep(0.05)
+            assert not waiter.done() and second.active == 0 and second.queued() == 1
+
+            first.release("http://a:80")
+            await asyncio.wait_for(waiter, 1)
+            assert second.active == 1 and budgets[0].stats()["active"] == 2
+            second.release("http://b:80")
+            first.release("http://a:80")
+            assert budgets[0].stats()["active"] == 0
+        finally:
+            for budget in budgets:
+                budget.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.skipif(not hasattr(socket, "SO_REUSEPORT") or not hasattr(signal, "SIGHUP"), reason="needs SO_REUSEPORT")
+def test_supervisor_restarts_crashed_workers_and_reloads(tmp_path):
+    # Workers of one port each bind their own socket
+    probe = reuseport_socket("127.0.0.1", 0)
+    port = probe.getsockname()[1]
+    reuseport_socket("127.0.0.1", port).close()
+    probe.close()
+
+    script = (
+        "from httpkit.tools.workers import Supervisor\n"
+        f"Supervisor('tests.test_workers:pid_app', '127.0.0.1', {port}, 2, graceful_timeout=5,"
+        f" node_state={str(tmp_path / 'state')!r}, restart_delay=0.1).run()\n"
+    )
+    supervisor = subprocess.Popen([sys.executable, "-c", script], cwd=os.path.dirname(os.path.dirname(__file__)))
+
+    def worker_pids(count, exclude=()):
+        pids = set()
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                # A fresh connection each time, so the kernel picks a worker anew
+                pid = httpx.get(f"http://127.0.0.1:{port}/", timeout=1).json()["pid"]
+            except httpx.HTTPError:
+                time.sleep(0.05)
+                continue
+            if pid not in exclude:
+                pids.add(pid)
+            if len(pids) == count:
+                return pids
+        raise AssertionError(f"Expected {count} workers, saw {pids}")
+
+    try:
+        first = worker_pids(2)
+        crashed = first.pop()
+        os.kill(crashed, signal.SIGKILL)
+        restarted = worker_pids(2, exclude={crashed})
+        assert first < restarted
+
+        supervisor.send_signal(signal.SIGHUP)
+        reloaded = worker_pids(2, exclude=restarted)
+        assert not reloaded & restarted
+
+        supervisor.send_signal(signal.SIGTERM)
+        assert supervisor.wait(timeout=30) == 0
+        for pid in reloaded | restarted:
+            with pytest.raises(ProcessLookupError):
+                os.kill(pid, 0)
+    finally:
+        if supervisor.poll() is None:
+            supervisor.kill()
+            supervisor.wait()
+
+
+def test_metrics_of_exited_workers_are_retired(tmp_path):
+    probe = reuseport_socket("127.0.0.1", 0)
+    port = probe.getsockname()[1]
+    probe.close()
+    metrics_dir = tmp_path / "metrics"
+    metrics_dir.mkdir()
+
+    script = (
+        "from httpkit.tools.workers import Supervisor\n"
+        "if __name__ == '__main__':\n"
+        f"    Supervisor('tests.test_workers:metrics_app', '127.0.0.1', {port}, 2, graceful_timeout=5,"
+        f" restart_delay=0.1, metrics_dir={str(metrics_dir)!r}).run()\n"
+    )
+    env = {**os.environ, "HTTPKIT_METRICS_DIR": str(metrics_dir)}
+    supervisor = subprocess.Popen([sys.executable, "-c", script], cwd=os.path.dirname(os.path.dirname(__file__)), env=env)
+
+    def worker_files():
+        return sorted(name for name in os.listdir(metrics_dir) if name.startswith("worker-") and name.endswith(".json"))
+
+    def wait_for(condition):
+        deadline = time.monotonic() + 30
+        while not condition():
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+
+    try:
+        wait_for(lambda: len(worker_files()) == 2)
+        crashed = int(worker_files()[0][7:-5])
+        os.kill(crashed, signal.SIGKILL)
+        wait_for(lambda: len(worker_files()) == 2 and f"worker-{crashed}.json" not in worker_files())
+        assert not os.path.exists(metrics_dir / f"worker-{crashed}.db")
+
+        metrics = ProxyMetrics(str(metrics_dir))
+        text = metrics.render()
+        metrics.close()
+        # The crashed worker's request is kept, its active request is not
+        assert 'httpkit_requests_total{method="GET",status="200",upstream="http://a:80"} 3' in text
+        assert "httpkit_concurrency_active 2" in text
+    finally:
+        supervisor.send_signal(signal.SIGTERM)
+        try:
+            supervisor.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            supervisor.kill()
+            supervisor.wait()